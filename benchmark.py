@@ -0,0 +1,510 @@
+import os
+import io
+import re
+import json
+import time
+import math
+import random
+import argparse
+import asyncio
+import tempfile
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from pydantic import BaseModel
+
+from llm_runner import (
+    MetricsRecorder,
+    RetryPolicy,
+    create_player,
+    percentile,
+    process_game_file,
+    process_game_file_async,
+)
+
+
+# --- 1. Mock Server ---
+
+class MockProfile(BaseModel):
+    """Behaviour of the mock endpoints."""
+    # Log-normal response time
+    latency_median: float = 0.3
+    latency_sigma: float = 0.5
+    # Share of the response time spent before the first streamed chunk
+    ttft_fraction: float = 0.3
+    # Chance that a request starts a run of `burst_length` consecutive 429 responses
+    burst_probability: float = 0.0
+    burst_length: int = 5
+    # Answer wrapped in a ```json fence
+    fenced_rate: float = 0.0
+    # Prose around the JSON, or JSON with a missing brace
+    malformed_rate: float = 0.0
+    # Output cut off in the middle (finish reason "length")
+    truncated_rate: float = 0.0
+    # Hidden reasoning tokens generated before every answer; they count as completion tokens and against max_tokens
+    reasoning_tokens: int = 0
+    seed: Optional[int] = None
+
+
+PROFILES = {
+    "clean": MockProfile(),
+    "realistic": MockProfile(burst_probability=0.01, fenced_rate=0.1, malformed_rate=0.03, truncated_rate=0.02),
+    "hostile": MockProfile(latency_sigma=1.0, burst_probability=0.05, fenced_rate=0.2, malformed_rate=0.1, truncated_rate=0.1),
+}
+
+
+class MockStats:
+    """Request counters of a mock server run."""
+    FIELDS = ("requests", "answered", "rate_limited", "streamed", "fenced", "malformed", "truncated", "over_budget", "cache_created", "cache_deleted")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {field: 0 for field in self.FIELDS}
+
+    def add(self, field: str, n: int = 1):
+        with self._lock:
+            self.counts[field] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+_CASE_RE = re.compile(r"--- CASE (\S+) ---\n(.*?)(?=\n--- CASE |\n---------------)", re.S)
+_STATE_RE = re.compile(r"--- GAME STATE ---\n(.*?)\n------------------", re.S)
+_MOVE_FORMAT_RE = re.compile(r"\*\*Move Format:\*\*\n.*?\n(.*?)\n", re.S)
+
+
+def mock_answer(prompt: str) -> dict:
+    """A schema-valid answer for whichever experiment the prompt belongs to. The content echoes the input state."""
+    if '"results"' in prompt:
+        field = "llm_legal_moves" if "llm_legal_moves" in prompt else "llm_state"
+        results = []
+        for sample_id, body in _CASE_RE.findall(prompt):
+            state = body.split("GAME STATE:\n", 1)[-1].split("\nMOVE:\n", 1)[0].strip()
+            results.append({"sample_id": sample_id, field: state})
+        return {"results": results}
+    state_match = _STATE_RE.search(prompt)
+    state = state_match.group(1).strip() if state_match else "(step 1)"
+    if "llm_legal_moves" in prompt:
+        return {"llm_legal_moves": "(xplayer noop)\n(oplayer noop)"}
+    if '"moves"' in prompt:
+        move_match = _MOVE_FORMAT_RE.search(prompt)
+        example = move_match.group(1).strip() if move_match else "(xplayer noop) (oplayer noop)"
+        return {"moves": [{"step": "0", "joint_move": example}], "llm_state": state}
+    return {"llm_state": state}
+
+
+class MockLLMServer:
+    """
+    Local HTTP server speaking the OpenAI-compatible chat completions API (NVIDIA, Cerebras) and the
+    Gemini generateContent / streamGenerateContent / cachedContents API, with injected latency and faults.
+    """
+    def __init__(self, profile: MockProfile, host: str = "127.0.0.1", port: int = 0):
+        self.profile = profile
+        self.stats = MockStats()
+        self._random = random.Random(profile.seed)
+        self._lock = threading.Lock()
+        self._burst_remaining = 0
+        self._ids = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def base_url(self, provider: str) -> str:
+        """Endpoint to configure a player with; the SDKs differ in whether /v1 is part of the base URL."""
+        if provider in ("nvidia", "local"):
+            return self.url + "/v1"
+        return self.url + ("/" if provider == "gemini" else "")
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # -- Behaviour --
+
+    def _draw(self) -> dict:
+        """Decides the fate of one request: rate limited, latency and output fault."""
+        p = self.profile
+        with self._lock:
+            self._ids += 1
+            if self._burst_remaining == 0 and self._random.random() < p.burst_probability:
+                self._burst_remaining = p.burst_length
+            if self._burst_remaining > 0:
+                self._burst_remaining -= 1
+                return dict(id=self._ids, rate_limited=True)
+            latency = self._random.lognormvariate(math.log(max(p.latency_median, 1e-6)), p.latency_sigma)
+            roll = self._random.random()
+        fault = None
+        for name, rate in (("truncated", p.truncated_rate), ("malformed", p.malformed_rate), ("fenced", p.fenced_rate)):
+            if roll < rate:
+                fault = name
+                break
+            roll -= rate
+        return dict(id=self._ids, rate_limited=False, latency=latency, fault=fault)
+
+    def _render(self, prompt: str, fault: Optional[str], max_tokens: Optional[int] = None) -> tuple:
+        """(text, finish reason, completion tokens) of the answer, with the fault applied and cut off at max_tokens."""
+        text, finish = self._answer(prompt, fault)
+        reasoning = self.profile.reasoning_tokens
+        if max_tokens is not None and reasoning + len(text) // 4 > max_tokens:
+            self.stats.add("over_budget")
+            text, finish = text[:max(0, max_tokens - reasoning) * 4], "length"
+        return text, finish, min(reasoning, max_tokens or reasoning) + len(text) // 4
+
+    def _answer(self, prompt: str, fault: Optional[str]) -> tuple:
+        text = json.dumps(mock_answer(prompt))
+        if fault == "fenced":
+            return f"```json\n{text}\n```", "stop"
+        if fault == "malformed":
+            return (f"Sure! Here is the answer: {text}" if len(text) % 2 else text[:-1]), "stop"
+        if fault == "truncated":
+            return text[:len(text) // 2], "length"
+        return text, "stop"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _sse(self, events: List[str], delays: List[float]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                try:
+                    for event, delay in zip(events, delays):
+                        time.sleep(delay)
+                        self.wfile.write(f"data: {event}\n\n".encode())
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client aborted the stream
+                    pass
+
+            def _body(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_DELETE(self):
+                server.stats.add("cache_deleted")
+                self._json(200, {})
+
+            def do_POST(self):
+                body = self._body()
+                path = self.path.split("?")[0]
+                if path.endswith("/cachedContents"):
+                    server.stats.add("cache_created")
+                    return self._json(200, {"name": f"cachedContents/mock{random.randrange(10**9)}", "model": body.get("model", "")})
+                if path.endswith("/chat/completions"):
+                    return self._chat(body)
+                if ":generateContent" in path or ":streamGenerateContent" in path:
+                    return self._gemini(body, stream=":streamGenerateContent" in path)
+                self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def _start(self) -> Optional[dict]:
+                server.stats.add("requests")
+                fate = server._draw()
+                if fate["rate_limited"]:
+                    server.stats.add("rate_limited")
+                    return None
+                if fate["fault"]:
+                    server.stats.add(fate["fault"])
+                server.stats.add("answered")
+                return fate
+
+            def _stream_timing(self, fate: dict, pieces: int) -> List[float]:
+                first = fate["latency"] * server.profile.ttft_fraction
+                rest = fate["latency"] - first
+                return [first] + [rest / max(1, pieces - 1)] * (pieces - 1)
+
+            def _chat(self, body: dict):
+                fate = self._start()
+                if fate is None:
+                    return self._json(429, {"error": {"message": "Rate limit exceeded: too many requests", "type": "rate_limit_error", "code": "429"}})
+                prompt = "\n".join(m.get("content") or "" for m in body.get("messages", []))
+                text, finish, completion_tokens = server._render(prompt, fate["fault"], body.get("max_tokens") or body.get("max_completion_tokens"))
+                usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": completion_tokens, "total_tokens": len(prompt) // 4 + completion_tokens}
+                base = {"id": f"mock-{fate['id']}", "created": int(time.time()), "model": body.get("model", ""), "system_fingerprint": "mock"}
+
+                if not body.get("stream"):
+                    time.sleep(fate["latency"])
+                    return self._json(200, dict(
+                        base, object="chat.completion",
+                        choices=[{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish}],
+                        usage=usage
+                    ))
+
+                server.stats.add("streamed")
+                pieces = [text[i:i + 24] for i in range(0, len(text), 24)] or [""]
+                events = [json.dumps(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+                          for piece in pieces]
+                events.append(json.dumps(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {}, "finish_reason": finish}], usage=usage)))
+                events.append("[DONE]")
+                self._sse(events, self._stream_timing(fate, len(pieces)) + [0.0, 0.0])
+
+            def _gemini(self, body: dict, stream: bool):
+                fate = self._start()
+                if fate is None:
+                    return self._json(429, {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}})
+                prompt = "\n".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+                text, finish, completion_tokens = server._render(prompt, fate["fault"], (body.get("generationConfig") or {}).get("maxOutputTokens"))
+                usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": completion_tokens, "totalTokenCount": len(prompt) // 4 + completion_tokens}
+                if body.get("cachedContent"):
+                    usage["cachedContentTokenCount"] = 1024
+                finish_reason = "MAX_TOKENS" if finish == "length" else "STOP"
+
+                def response(piece: str, last: bool) -> dict:
+                    candidate = {"content": {"parts": [{"text": piece}], "role": "model"}, "index": 0}
+                    if last:
+                        candidate["finishReason"] = finish_reason
+                    return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": "mock"}
+
+                if not stream:
+                    time.sleep(fate["latency"])
+                    return self._json(200, response(text, True))
+
+                server.stats.add("streamed")
+                pieces = [text[i:i + 24] for i in range(0, len(text), 24)] or [""]
+                events = [json.dumps(response(piece, i == len(pieces) - 1)) for i, piece in enumerate(pieces)]
+                self._sse(events, self._stream_timing(fate, len(pieces)))
+
+        return Handler
+
+
+# --- 2. Synthetic Inputs ---
+
+def synthetic_gdl(board: int) -> str:
+    """A tic-tac-toe style rule sheet on a board x board grid, long enough to resemble real prompts."""
+    lines = ["(role xplayer)", "(role oplayer)", "(init (control xplayer))"]
+    lines += [f"(init (cell {r} {c} b))" for r in range(1, board + 1) for c in range(1, board + 1)]
+    lines += [f"(index {i})" for i in range(1, board + 1)]
+    lines += [
+        "(<= (legal ?w (mark ?x ?y)) (true (cell ?x ?y b)) (true (control ?w)))",
+        "(<= (legal xplayer noop) (true (control oplayer)))",
+        "(<= (legal oplayer noop) (true (control xplayer)))",
+        "(<= (next (cell ?m ?n x)) (does xplayer (mark ?m ?n)) (true (cell ?m ?n b)))",
+        "(<= (next (cell ?m ?n o)) (does oplayer (mark ?m ?n)) (true (cell ?m ?n b)))",
+        "(<= (next (cell ?m ?n ?w)) (true (cell ?m ?n ?w)) (distinct ?w b))",
+        "(<= (next (cell ?m ?n b)) (does ?w (mark ?j ?k)) (true (cell ?m ?n b)) (or (distinct ?m ?j) (distinct ?n ?k)))",
+        "(<= (next (control xplayer)) (true (control oplayer)))",
+        "(<= (next (control oplayer)) (true (control xplayer)))",
+        "(<= open (true (cell ?m ?n b)))",
+        "(<= terminal (not open))",
+        "(<= (goal xplayer 50) (not open))",
+        "(<= (goal oplayer 50) (not open))",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_synthetic_inputs(work_dir: str, experiment: str, n_samples: int, board: int, seed: int = 0) -> tuple:
+    """Writes bench.kif and an EvalData samples file. Returns (gdl_path, samples_path)."""
+    rng = random.Random(seed)
+    gdl_path = os.path.join(work_dir, "gdl", "bench.kif")
+    samples_path = os.path.join(work_dir, "samples", experiment, "bench.json")
+    os.makedirs(os.path.dirname(gdl_path), exist_ok=True)
+    os.makedirs(os.path.dirname(samples_path), exist_ok=True)
+    with open(gdl_path, 'w') as f:
+        f.write(synthetic_gdl(board))
+
+    samples = []
+    for _ in range(n_samples):
+        cells = [f"(cell {r} {c} {rng.choice('xob')})" for r in range(1, board + 1) for c in range(1, board + 1)]
+        state = "\n".join(cells + ["(control xplayer)"])
+        move = f"(xplayer (mark {rng.randint(1, board)} {rng.randint(1, board)})) (oplayer noop)"
+        if "multi_step" in experiment:
+            samples.append({"moves": [{"step": str(i), "joint_move": move} for i in range(5)]})
+        elif experiment == "legal_moves":
+            samples.append({"game_state": state, "legal_moves": "(xplayer noop)\n(oplayer noop)"})
+        else:
+            samples.append({"game_state": state, "move": move, "next_state": state})
+    with open(samples_path, 'w') as f:
+        json.dump({"game_name": "bench", "samples": samples}, f)
+    return gdl_path, samples_path
+
+
+# --- 3. Harness ---
+
+class BenchmarkResult(BaseModel):
+    provider: str
+    mode: str
+    streaming: bool
+    pack_size: int
+    samples_ok: int
+    samples_failed: int
+    wall_seconds: float
+    samples_per_second: float
+    server_requests: int
+    # Provider calls whose answer was not used: 429s, SDK retries, unparsable or truncated outputs
+    wasted_calls: int
+    latency_p50: float
+    latency_p95: float
+    latency_p99: float
+    parse_failures: int
+    # Malformed or truncated answers salvaged by repair_json instead of being retried
+    repaired: int
+    aborted_streams: int
+    # Completion tokens requested and generated under adaptive budgets, and answers sent again after being cut off
+    budget_reserved: int
+    budget_used: int
+    truncations: int
+    server: dict
+
+
+def _journal_counts(output_dir: str) -> tuple:
+    ok, failed = set(), set()
+    path = os.path.join(output_dir, "journal_bench.jsonl")
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                entry = json.loads(line)
+                (ok if entry["status"] == "ok" else failed).add(entry["index"])
+    return len(ok), len(failed - ok)
+
+
+def run_scenario(server: MockLLMServer, provider: str, work_dir: str, args) -> BenchmarkResult:
+    """Drives one full process_game_file run against the mock server and collects the numbers."""
+    gdl_path, samples_path = write_synthetic_inputs(work_dir, args.experiment, args.samples, args.board, args.seed)
+    player = create_player(
+        provider, "mock-model", ",".join(f"mock-key-{i}" for i in range(args.keys)),
+        max_concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm, base_url=server.base_url(provider)
+    )
+    player.streaming = args.stream
+    player.compact_gdl = args.compact_gdl
+    player.retry_policy = RetryPolicy(attempt_timeout=args.attempt_timeout, hedge_quantile=args.hedge_quantile)
+    player.adaptive_budgets = args.completion_budget == "adaptive"
+    player.escalate_truncated = args.escalate_truncated
+    player.metrics = MetricsRecorder()
+    if args.cooldown is not None:
+        player.rate_limit_cooldown = args.cooldown
+
+    output_dir = os.path.join(work_dir, "out", f"{provider}_{args.mode}")
+    job = dict(
+        gdl_file_path=gdl_path, samples_file_path=samples_path, output_dir=output_dir, max_samples=args.samples,
+        experiment_type=args.experiment, n_moves=args.n_moves, pack_size=args.pack_size
+    )
+
+    server.stats.reset()
+    started = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()) if args.quiet else contextlib.nullcontext():
+        if args.mode == "async":
+            asyncio.run(process_game_file_async(player=player, **job))
+        else:
+            process_game_file(player=player, **job)
+    wall = time.monotonic() - started
+
+    ok, failed = _journal_counts(output_dir)
+    counts = server.stats.snapshot()
+    useful = sum(r.outcome == "ok" for r in player.metrics.records)
+    latencies = sorted(r.latency for r in player.metrics.records if r.outcome != "cache_hit")
+    return BenchmarkResult(
+        provider=provider,
+        mode=args.mode,
+        streaming=args.stream,
+        pack_size=args.pack_size,
+        samples_ok=ok,
+        samples_failed=failed,
+        wall_seconds=wall,
+        samples_per_second=ok / wall if wall else 0.0,
+        server_requests=counts["requests"],
+        wasted_calls=counts["requests"] - useful,
+        latency_p50=percentile(latencies, 50),
+        latency_p95=percentile(latencies, 95),
+        latency_p99=percentile(latencies, 99),
+        parse_failures=player.usage.parse_failures,
+        repaired=player.usage.repaired,
+        aborted_streams=player.usage.aborted_streams,
+        budget_reserved=player.usage.budget_reserved,
+        budget_used=player.usage.budget_used,
+        truncations=player.usage.truncations,
+        server=counts
+    )
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    header = f"{'provider':<10} {'mode':<6} {'ok':>5} {'fail':>5} {'wall s':>8} {'samples/s':>10} {'calls':>6} {'wasted':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'repaired':>9} {'budget use':>11}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        budget_use = f"{r.budget_used / r.budget_reserved:.1%}" if r.budget_reserved else "fixed"
+        lines.append(
+            f"{r.provider:<10} {r.mode:<6} {r.samples_ok:>5} {r.samples_failed:>5} {r.wall_seconds:>8.2f} {r.samples_per_second:>10.2f} "
+            f"{r.server_requests:>6} {r.wasted_calls:>7} {r.latency_p50:>7.2f} {r.latency_p95:>7.2f} {r.latency_p99:>7.2f} {r.repaired:>9} {budget_use:>11}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the runner end to end against local mock LLM endpoints")
+    parser.add_argument("--providers", type=str, default="nvidia,cerebras,gemini", help="Comma-separated players to benchmark")
+    parser.add_argument("--profile", type=str, choices=sorted(PROFILES), default="realistic", help="Mock latency and fault profile")
+    parser.add_argument("--profile_json", type=str, help="JSON object overriding fields of the profile")
+    parser.add_argument("--experiment", type=str, default="next_state")
+    parser.add_argument("--n_moves", type=int, default=5, help="Steps for the multi-step experiments")
+    parser.add_argument("--samples", type=int, default=50, help="Synthetic samples per run")
+    parser.add_argument("--board", type=int, default=8, help="Board size of the synthetic game (controls prompt length)")
+    parser.add_argument("--mode", type=str, choices=["sync", "async"], default="async")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--keys", type=int, default=2, help="Mock API keys in the pool")
+    parser.add_argument("--rpm", type=float, default=1e9, help="Per-key request budget (effectively unlimited by default)")
+    parser.add_argument("--tpm", type=float, default=1e12, help="Per-key token budget (effectively unlimited by default)")
+    parser.add_argument("--cooldown", type=float, help="Override the players' cooldown after a 429")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--pack_size", type=int, default=1)
+    parser.add_argument("--compact_gdl", type=str, choices=["whitespace", "symbols"])
+    parser.add_argument("--attempt_timeout", type=float, default=120.0)
+    parser.add_argument("--completion_budget", type=str, choices=["adaptive", "fixed"], default="adaptive")
+    parser.add_argument("--escalate_truncated", action="store_true")
+    parser.add_argument("--hedge_quantile", type=float, help="Percentile of recent latencies after which requests are hedged")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="Show the runner's own output")
+    parser.add_argument("--json_out", type=str, help="Write the results as JSON (for comparing runs)")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile].model_copy(update=json.loads(args.profile_json) if args.profile_json else {})
+    if profile.seed is None:
+        profile.seed = args.seed
+    server = MockLLMServer(profile).start()
+    print(f"🧪 Mock server at {server.url} ({args.profile}: {profile.model_dump_json()})")
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="ggp_bench_") as work_dir:
+            for provider in [p.strip() for p in args.providers.split(",") if p.strip()]:
+                print(f"⏱️ {provider} ({args.mode}, {args.samples} samples)...")
+                results.append(run_scenario(server, provider, os.path.join(work_dir, provider), args))
+    finally:
+        server.stop()
+
+    print(format_results(results))
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump([r.model_dump() for r in results], f, indent=4)
+        print(f"💾 Results saved to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
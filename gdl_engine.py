@@ -0,0 +1,597 @@
+import re
+import itertools
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# A term is either an atom ("cell", "1", "?x") or a compound tuple ("cell", "1", "1", "b").
+Term = Union[str, tuple]
+
+# Relations supplied from outside instead of being derived by rules
+BASE_RELATIONS = ("true", "does")
+
+# Reserved words of GDL; they keep their names when symbols are shortened
+KEYWORDS = frozenset(["role", "init", "true", "next", "legal", "does", "goal", "terminal", "distinct", "or", "and", "not", "<=", "base", "input"])
+
+
+class GDLError(Exception):
+    """Raised for rule sheets the engine cannot compile."""
+    pass
+
+
+class IllegalMoveError(Exception):
+    """Raised when a joint move contains a move that is not legal in the current state."""
+    def __init__(self, step: int, role: str, move: Term):
+        super().__init__(f"Step {step}: {format_term(move)} is not a legal move for {role}")
+        self.step = step
+        self.role = role
+        self.move = move
+
+
+# --- 1. Parsing ---
+
+_TOKEN_RE = re.compile(r"\(|\)|[^\s()]+")
+
+
+def _normalize(term: Term) -> Term:
+    """(xturn) and xturn denote the same fluent, so zero-argument compounds collapse to atoms."""
+    if isinstance(term, tuple):
+        if len(term) == 1:
+            return term[0]
+        return tuple(_normalize(t) for t in term)
+    return term
+
+
+def parse_terms(text: str) -> List[Term]:
+    """Parses KIF s-expressions into terms. Comments (;) are dropped and everything is lowercased."""
+    text = re.sub(r";[^\n]*", "", text).lower()
+    stack = [[]]
+    for token in _TOKEN_RE.findall(text):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) == 1:
+                raise GDLError("Unbalanced ')'")
+            closed = tuple(stack.pop())
+            stack[-1].append(closed)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1:
+        raise GDLError("Unbalanced '('")
+    return [_normalize(t) for t in stack[0]]
+
+
+def format_term(term: Term) -> str:
+    if isinstance(term, tuple):
+        return "(" + " ".join(format_term(t) for t in term) + ")"
+    return term
+
+
+def is_variable(term: Term) -> bool:
+    return isinstance(term, str) and term.startswith("?")
+
+
+def _variables(term: Term, found: Optional[set] = None) -> set:
+    found = set() if found is None else found
+    if isinstance(term, tuple):
+        for t in term:
+            _variables(t, found)
+    elif is_variable(term):
+        found.add(term)
+    return found
+
+
+def _substitute(term: Term, bindings: dict) -> Term:
+    if isinstance(term, tuple):
+        return tuple(_substitute(t, bindings) for t in term)
+    if is_variable(term):
+        return bindings.get(term, term)
+    return term
+
+
+def _match(pattern: Term, fact: Term, bindings: dict) -> Optional[dict]:
+    """One-way unification of a rule pattern against a ground fact. Returns extended bindings or None."""
+    if isinstance(pattern, str):
+        if pattern.startswith("?"):
+            bound = bindings.get(pattern)
+            if bound is None:
+                extended = dict(bindings)
+                extended[pattern] = fact
+                return extended
+            return bindings if bound == fact else None
+        return bindings if pattern == fact else None
+    if not isinstance(fact, tuple) or len(pattern) != len(fact):
+        return None
+    for p, f in zip(pattern, fact):
+        bindings = _match(p, f, bindings)
+        if bindings is None:
+            return None
+    return bindings
+
+
+# --- 2. Compilation ---
+
+def _as_atom(literal: Term) -> tuple:
+    """Relation form of a literal: terminal -> ("terminal",)."""
+    return literal if isinstance(literal, tuple) else (literal,)
+
+
+class Rule:
+    """A rule with its body ordered so that every literal is evaluated as late as its variables require."""
+    def __init__(self, head: tuple, body: List[tuple]):
+        self.head = head
+        self.body = self._order(body)
+
+    @staticmethod
+    def _order(body: List[tuple]) -> List[tuple]:
+        # Positive literals are joined greedily, most-bound first; negations and
+        # distinct are checked as soon as all of their variables are bound.
+        positives = [lit for lit in body if lit[0] == "pos"]
+        filters = [lit for lit in body if lit[0] != "pos"]
+        ordered, bound = [], set()
+
+        def flush_filters():
+            for lit in list(filters):
+                if _variables(lit[1:]) <= bound:
+                    ordered.append(lit)
+                    filters.remove(lit)
+
+        flush_filters()
+        while positives:
+            best = max(positives, key=lambda lit: (len(_variables(lit[1]) & bound), -len(_variables(lit[1]))))
+            positives.remove(best)
+            ordered.append(best)
+            bound |= _variables(best[1])
+            flush_filters()
+        return ordered + filters
+
+    @property
+    def predicate(self) -> str:
+        return self.head[0]
+
+    def dependencies(self) -> Iterator[Tuple[str, bool]]:
+        """(predicate, negated) for every relation the body reads."""
+        for lit in self.body:
+            if lit[0] == "pos":
+                yield lit[1][0], False
+            elif lit[0] == "not":
+                yield lit[1][0], True
+
+
+def _expand_body(literals: List[Term]) -> List[List[tuple]]:
+    """Compiles body literals into ("pos"|"not"|"distinct", ...) form; (or ...) is expanded into alternative bodies."""
+    bodies = [[]]
+    for literal in literals:
+        if isinstance(literal, tuple) and literal[0] == "or":
+            alternatives = [b for option in literal[1:] for b in _expand_body([option])]
+            bodies = [body + alt for body in bodies for alt in alternatives]
+        elif isinstance(literal, tuple) and literal[0] == "distinct":
+            bodies = [body + [("distinct", literal[1], literal[2])] for body in bodies]
+        elif isinstance(literal, tuple) and literal[0] == "not":
+            inner = literal[1]
+            if isinstance(inner, tuple) and inner[0] in ("or", "and"):
+                raise GDLError(f"Unsupported negated connective: {format_term(literal)}")
+            bodies = [body + [("not", _as_atom(inner))] for body in bodies]
+        elif isinstance(literal, tuple) and literal[0] == "and":
+            expanded = _expand_body(list(literal[1:]))
+            bodies = [body + alt for body in bodies for alt in expanded]
+        else:
+            bodies = [body + [("pos", _as_atom(literal))] for body in bodies]
+    return bodies
+
+
+class Relation:
+    """Ground facts of one predicate, indexed by (argument position, value)."""
+    def __init__(self):
+        self.facts = set()
+        self.rows = []
+        self.index = defaultdict(list)
+
+    def add(self, fact: tuple) -> bool:
+        if fact in self.facts:
+            return False
+        self.facts.add(fact)
+        self.rows.append(fact)
+        for position, value in enumerate(fact[1:]):
+            self.index[(position, value)].append(fact)
+        return True
+
+    def candidates(self, pattern: tuple, bindings: dict) -> list:
+        """Facts that can match the pattern: the index bucket of the first bound argument, else all rows."""
+        for position, arg in enumerate(pattern[1:]):
+            value = _substitute(arg, bindings)
+            if not _variables(value):
+                return self.index.get((position, value), [])
+        return self.rows
+
+
+class _FactStore:
+    """Derived facts of one evaluation layered over the facts that hold in every state."""
+    def __init__(self, static: Dict[str, Relation]):
+        self.static = static
+        self.dynamic = {}
+
+    def get(self, predicate: str) -> Optional[Relation]:
+        relation = self.dynamic.get(predicate)
+        return relation if relation is not None else self.static.get(predicate)
+
+    def relation(self, predicate: str) -> Relation:
+        if predicate not in self.dynamic:
+            relation = Relation()
+            # Ground facts given for a relation that also has rules
+            for fact in self.static[predicate].rows if predicate in self.static else ():
+                relation.add(fact)
+            self.dynamic[predicate] = relation
+        return self.dynamic[predicate]
+
+
+def _strongly_connected(nodes: List[str], edges: Dict[str, set]) -> List[List[str]]:
+    """Tarjan's algorithm. Components come out dependencies first."""
+    index, low, on_stack, stack, components = {}, {}, set(), [], []
+    counter = [0]
+
+    def visit(node):
+        index[node] = low[node] = counter[0]
+        counter[0] += 1
+        stack.append(node)
+        on_stack.add(node)
+        for succ in edges.get(node, ()):
+            if succ not in index:
+                visit(succ)
+                low[node] = min(low[node], low[succ])
+            elif succ in on_stack:
+                low[node] = min(low[node], index[succ])
+        if low[node] == index[node]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == node:
+                    break
+            components.append(component)
+
+    for node in nodes:
+        if node not in index:
+            visit(node)
+    return components
+
+
+def _fire(rule: Rule, store: _FactStore, delta_position: int = -1, delta: Optional[Relation] = None) -> Iterator[tuple]:
+    """Yields the head instances of a rule. With a delta, body literal `delta_position` only reads new facts."""
+    body = rule.body
+
+    def solve(i: int, bindings: dict):
+        if i == len(body):
+            yield _substitute(rule.head, bindings)
+            return
+        kind = body[i][0]
+        if kind == "pos":
+            pattern = body[i][1]
+            relation = delta if i == delta_position else store.get(pattern[0])
+            if relation is None:
+                return
+            for fact in relation.candidates(pattern, bindings):
+                extended = _match(pattern, fact, bindings)
+                if extended is not None:
+                    yield from solve(i + 1, extended)
+        elif kind == "not":
+            pattern = body[i][1]
+            relation = store.get(pattern[0])
+            if relation is not None and any(
+                _match(pattern, fact, bindings) is not None for fact in relation.candidates(pattern, bindings)
+            ):
+                return
+            yield from solve(i + 1, bindings)
+        else:
+            if _substitute(body[i][1], bindings) != _substitute(body[i][2], bindings):
+                yield from solve(i + 1, bindings)
+
+    return solve(0, {})
+
+
+def _evaluate_stratum(rules: List[Rule], recursive: bool, store: _FactStore):
+    """Forward-chains one stratum to its fixpoint; recursive strata are evaluated semi-naively."""
+    delta = defaultdict(Relation)
+    for rule in rules:
+        for fact in _fire(rule, store):
+            if store.relation(rule.predicate).add(fact):
+                delta[rule.predicate].add(fact)
+    if not recursive:
+        return
+
+    while delta:
+        new_delta = defaultdict(Relation)
+        for rule in rules:
+            for position, lit in enumerate(rule.body):
+                if lit[0] != "pos" or lit[1][0] not in delta:
+                    continue
+                for fact in _fire(rule, store, position, delta[lit[1][0]]):
+                    if store.relation(rule.predicate).add(fact):
+                        new_delta[rule.predicate].add(fact)
+        delta = new_delta
+
+
+class GDLGame:
+    """
+    A rule sheet compiled for repeated queries. Rules are split into strongly connected strata once;
+    everything that does not depend on `true`/`does` (roles, init, static board geometry) is derived
+    at compile time, so a query only forward-chains the strata its target relations need.
+    """
+    def __init__(self, rule_sheet: str):
+        self.rules = defaultdict(list)
+        static_facts = []
+        for term in parse_terms(rule_sheet):
+            if isinstance(term, tuple) and term[0] == "<=":
+                head = _as_atom(term[1])
+                for body in _expand_body(list(term[2:])):
+                    self.rules[head[0]].append(Rule(head, body))
+            else:
+                static_facts.append(_as_atom(term))
+
+        self._stratify()
+
+        # Facts and rules that hold in every state
+        self.static = defaultdict(Relation)
+        for fact in static_facts:
+            self.static[fact[0]].add(fact)
+        store = _FactStore(self.static)
+        for component in self.strata:
+            if not self.dynamic.intersection(component):
+                self._run_component(component, store)
+        for predicate, relation in store.dynamic.items():
+            for fact in relation.rows:
+                self.static[predicate].add(fact)
+        self.static = dict(self.static)
+
+        self.roles = [fact[1] for fact in self.static.get("role", Relation()).rows]
+        if not self.roles:
+            raise GDLError("No roles defined")
+        self._plans = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> "GDLGame":
+        with open(path, 'r') as f:
+            return cls(f.read())
+
+    def _stratify(self):
+        edges = defaultdict(set)
+        negative = set()
+        for predicate, rules in self.rules.items():
+            for rule in rules:
+                for dependency, negated in rule.dependencies():
+                    edges[predicate].add(dependency)
+                    if negated:
+                        negative.add((predicate, dependency))
+        self.edges = edges
+
+        self.strata = _strongly_connected(list(self.rules), edges)
+        for component in self.strata:
+            members = set(component)
+            if any(head in members and dep in members for head, dep in negative):
+                raise GDLError(f"Rules are not stratified: negation inside the recursion of {sorted(members)}")
+
+        # Relations that change from state to state
+        self.dynamic = set(BASE_RELATIONS)
+        for component in self.strata:
+            if any(dep in self.dynamic for member in component for dep in edges.get(member, ())):
+                self.dynamic.update(component)
+
+    def _run_component(self, component: List[str], store: _FactStore):
+        rules = [rule for predicate in component for rule in self.rules.get(predicate, [])]
+        members = set(component)
+        recursive = len(component) > 1 or any(dep in members for dep in self.edges.get(component[0], ()))
+        _evaluate_stratum(rules, recursive, store)
+
+    def _plan(self, targets: tuple) -> List[List[str]]:
+        """Dynamic strata the target relations depend on, in evaluation order."""
+        if targets not in self._plans:
+            needed, frontier = set(), list(targets)
+            while frontier:
+                predicate = frontier.pop()
+                if predicate in needed:
+                    continue
+                needed.add(predicate)
+                frontier.extend(self.edges.get(predicate, ()))
+            self._plans[targets] = [
+                component for component in self.strata
+                if needed.intersection(component) and self.dynamic.intersection(component)
+            ]
+        return self._plans[targets]
+
+    def _query(self, state: frozenset, targets: tuple, joint_move: Optional[Dict[str, Term]] = None) -> _FactStore:
+        store = _FactStore(self.static)
+        true = store.relation("true")
+        for fact in state:
+            true.add(("true", fact))
+        does = store.relation("does")
+        for role, move in (joint_move or {}).items():
+            does.add(("does", role, move))
+        for component in self._plan(targets):
+            self._run_component(component, store)
+        return store
+
+    # -- Game queries --
+
+    def initial_state(self) -> frozenset:
+        return frozenset(fact[1] for fact in self.static.get("init", Relation()).rows)
+
+    def legal_moves(self, state: frozenset) -> Dict[str, List[Term]]:
+        moves = {role: [] for role in self.roles}
+        relation = self._query(state, ("legal",)).get("legal")
+        for fact in relation.rows if relation else ():
+            if fact[1] in moves:
+                moves[fact[1]].append(fact[2])
+        return moves
+
+    def next_state(self, state: frozenset, joint_move: Dict[str, Term]) -> frozenset:
+        relation = self._query(state, ("next",), joint_move).get("next")
+        return frozenset(fact[1] for fact in relation.rows) if relation else frozenset()
+
+    def is_terminal(self, state: frozenset) -> bool:
+        relation = self._query(state, ("terminal",)).get("terminal")
+        return bool(relation and relation.rows)
+
+    def goals(self, state: frozenset) -> Dict[str, int]:
+        relation = self._query(state, ("goal",)).get("goal")
+        return {fact[1]: int(fact[2]) for fact in (relation.rows if relation else ())}
+
+    def play(self, joint_moves: List[Dict[str, Term]], state: Optional[frozenset] = None) -> frozenset:
+        """Applies joint moves from the initial (or given) state. Raises IllegalMoveError on the first illegal move."""
+        state = self.initial_state() if state is None else state
+        for step, joint_move in enumerate(joint_moves):
+            legal = self.legal_moves(state)
+            for role in self.roles:
+                if joint_move.get(role) not in legal[role]:
+                    raise IllegalMoveError(step, role, joint_move.get(role, "<missing>"))
+            state = self.next_state(state, joint_move)
+        return state
+
+
+# --- 3. Text Formats ---
+# States and moves as they appear in sample and output files.
+
+def parse_state(text: str) -> frozenset:
+    """
+    Parses a state: facts separated by new lines or spaces, optionally wrapped in (true ...).
+    Square brackets are treated as parentheses and bare lines such as `cell 1 1 b` as single facts.
+    """
+    text = text.replace("[", "(").replace("]", ")")
+    try:
+        terms = []
+        for line in text.splitlines():
+            if "(" in line or ")" in line:
+                terms.extend(parse_terms(line))
+            elif line.strip():
+                terms.append(_normalize(tuple(line.lower().split())))
+    except GDLError:
+        # A fact spread over several lines
+        terms = parse_terms(text)
+    return frozenset(t[1] if isinstance(t, tuple) and t[0] == "true" and len(t) == 2 else t for t in terms)
+
+
+def format_state(state: frozenset) -> str:
+    return "\n".join(sorted(format_term(fact) for fact in state))
+
+
+def _split_move(term: tuple) -> Tuple[str, Term]:
+    action = term[1:]
+    return term[0], action[0] if len(action) == 1 else action
+
+
+def parse_moves(text: str) -> set:
+    """Parses a list of (role action) moves, optionally wrapped in legal/does, into (role, action) pairs."""
+    moves = set()
+    for term in parse_terms(text.replace("[", "(").replace("]", ")")):
+        if isinstance(term, tuple) and term[0] in ("legal", "does"):
+            term = term[1:]
+        if isinstance(term, tuple) and len(term) >= 2:
+            moves.add(_split_move(term))
+    return moves
+
+
+def parse_joint_move(text: str, roles: List[str]) -> Dict[str, Term]:
+    """
+    Parses a joint move such as `(does white (mark 1 1)) (does black noop)`.
+    As in the C# tokenizer, a role name switches the player the following action belongs to.
+    """
+    joint, active = {}, None
+    for term in parse_terms(text.replace("), ", ") ")):
+        if isinstance(term, tuple) and term[0] in ("legal", "does"):
+            term = term[1:] if len(term) > 2 else term[1]
+        if term in roles:
+            active = term
+        elif isinstance(term, tuple) and term[0] in roles and len(term) >= 2:
+            role, action = _split_move(term)
+            joint[role] = action
+            active = None
+        elif active is not None:
+            joint[active] = term
+            active = None
+        else:
+            raise GDLError(f"Cannot assign '{format_term(term)}' to a role in joint move: {text}")
+    return joint
+
+
+def jaccard(predicted: frozenset, truth: frozenset) -> float:
+    """Same similarity as TextState.CalculateDifference in the C# verifier: 1.0 for two empty sets."""
+    if not predicted and not truth:
+        return 1.0
+    common = len(predicted & truth)
+    return common / (len(predicted) + len(truth) - common)
+
+
+# --- 4. Compaction ---
+# Smaller rule sheets for prompts. Both transformations keep the rules equivalent.
+
+def compact_gdl(text: str) -> str:
+    """Rule sheet without comments and redundant whitespace: one top-level sentence per line, single spaces between tokens."""
+    lines, parts, depth = [], [], 0
+    for token in _TOKEN_RE.findall(re.sub(r";[^\n]*", "", text)):
+        if token == ")":
+            depth -= 1
+            if depth < 0:
+                raise GDLError("Unbalanced ')'")
+        elif parts and parts[-1] != "(":
+            parts.append(" ")
+        parts.append(token)
+        if token == "(":
+            depth += 1
+        if depth == 0:
+            lines.append("".join(parts))
+            parts = []
+    if depth != 0:
+        raise GDLError("Unbalanced '('")
+    return "\n".join(lines)
+
+
+def _short_names() -> Iterator[str]:
+    """a, b, ..., z, a0, a1, ..., zz, a00, ..."""
+    first = "abcdefghijklmnopqrstuvwxyz"
+    rest = first + "0123456789"
+    yield from first
+    for length in itertools.count(1):
+        for head in first:
+            for tail in itertools.product(rest, repeat=length):
+                yield head + "".join(tail)
+
+
+class SymbolMap:
+    """
+    Reversible renaming of relation, function, constant and variable names to short ones, like NameChanger in
+    ObfuscatorGDL. Keywords and numbers keep their names, and new names never collide with a symbol of the rules.
+    States and moves are translated token by token, so their layout is preserved.
+    """
+    _SYMBOL_RE = re.compile(r"[^\s()\[\]]+")
+
+    def __init__(self, encoder: Dict[str, str]):
+        self.encoder = encoder
+        self.decoder = {short: name for name, short in encoder.items()}
+
+    @classmethod
+    def for_rules(cls, text: str) -> "SymbolMap":
+        """Assigns the shortest names to the symbols that occur most often in the rule sheet."""
+        counts = Counter(t for t in _TOKEN_RE.findall(re.sub(r";[^\n]*", "", text)) if t not in "()")
+        taken = {t.lower() for t in counts} | KEYWORDS
+        renamable = [t for t in counts if t.lower() not in KEYWORDS and not t.lstrip("?").isdigit()]
+        renamable.sort(key=lambda t: (-counts[t] * len(t), t))
+
+        encoder = {}
+        names = {"": _short_names(), "?": _short_names()}
+        # Next free name per namespace, kept until a symbol long enough to benefit from it comes along
+        pending = {}
+        for symbol in renamable:
+            prefix = "?" if is_variable(symbol) else ""
+            if prefix not in pending:
+                pending[prefix] = prefix + next(n for n in names[prefix] if prefix + n not in taken)
+            if len(pending[prefix]) < len(symbol):
+                encoder[symbol] = pending.pop(prefix)
+        return cls(encoder)
+
+    def _translate(self, text: str, table: Dict[str, str]) -> str:
+        return self._SYMBOL_RE.sub(lambda m: table.get(m.group(0), m.group(0)), text)
+
+    def encode_text(self, text: str) -> str:
+        return self._translate(text, self.encoder)
+
+    def decode_text(self, text: str) -> str:
+        return self._translate(text, self.decoder)
@@ -1,18 +1,35 @@
 import os
 import json
+import hashlib
 import glob
 import time
 import re
+import math
+import random
+import functools
+import itertools
 import argparse
-from typing import List, Optional, Union, Type, TypeVar
-from pydantic import BaseModel, Field, ValidationError
+import asyncio
+import threading
+import sqlite3
+import contextvars
+import contextlib
+import collections
+import concurrent.futures
+import importlib.metadata
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union, Type, TypeVar
+from pydantic import BaseModel, Field, PrivateAttr, TypeAdapter, ValidationError
 from dotenv import load_dotenv
 
-# Third-party libraries
-from google import genai
-from openai import OpenAI
-from google.genai.types import GenerateContentConfig, HttpOptions
-from cerebras.cloud.sdk import Cerebras
+# Optional: exact local token counts
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from gdl_engine import GDLGame, IllegalMoveError, SymbolMap, compact_gdl, format_state, jaccard, parse_joint_move, parse_moves, parse_state
+from result_store import ResultPartition, partition_path
+from tracing import instant as trace_instant, set_tags as set_trace_tags, span, tags as trace_tags, traced, tracing_session
 
 # --- 1. Prompts ---
 
@@ -85,6 +102,27 @@ Do not add any explanations, comments, or markdown formatting.
 Your response must start with {{.
 """
 
+PROMPT_EVAL_MULTI_STEP_INCREMENTAL = """
+You are a game logic expert. Your task is to track the game state while a sequence of moves is played, one step at a time.
+
+Here is the game definition in GDL (Game Description Language).
+The game starts from the initial state defined in this GDL (look for 'init' relations).
+--- GAME DEFINITION ---
+{game_definition}
+-----------------------
+
+The moves follow one step per message. After each step, give the **exact** game state after all moves so far.
+Respond **only** in JSON format using the following fields:
+- "llm_state": string, the complete new game state in GDL format, each fact separated by new line symbol.
+
+Do not add any explanations, comments, or markdown formatting.
+Your response must start with {{.
+"""
+
+PROMPT_INCREMENTAL_STEP = """Step {step}:
+{joint_move}
+"""
+
 PROMPT_EVAL_MULTI_STEP_GEN = """
 You are a game logic expert. Your task is to play the game for {n} steps and predict the resulting state.
 
@@ -116,6 +154,150 @@ Do not add any explanations, comments, or markdown formatting.
 Your response must start with {{.
 """
 
+
+PROMPT_EVAL_NEXT_STATE_PACKED = """
+You are a game logic expert. Your task is to predict the next game state for several independent cases.
+
+Here is the game definition in GDL (Game Description Language). GDL was used in General Game Playing competition. Ignore the Init part; the current states will be provided later:
+--- GAME DEFINITION ---
+{game_definition}
+-----------------------
+
+Each case below gives a current game state and the move being executed in it. The cases are independent of each other.
+{cases}
+
+For every case, what will be the **exact** game state after its move?
+Respond **only** in JSON format using the following structure:
+{{
+    "results": [
+        {{ "sample_id": "...", "llm_state": "..." }}
+    ]
+}}
+- "sample_id": string, the id of the case
+- "llm_state": string, the complete new game state in the same format as the input state, each fact separated by new line symbol
+
+Include exactly one entry per case. Do not add any explanations, comments, or markdown formatting.
+Your response must start with {{.
+"""
+
+PROMPT_EVAL_LEGAL_MOVES_PACKED = """
+You are a game logic expert. Your task is to determine all legal moves available for all players in several independent game states.
+
+Here is the game definition in GDL (Game Description Language):
+--- GAME DEFINITION ---
+{game_definition}
+-----------------------
+
+Each case below gives a game state. The cases are independent of each other.
+{cases}
+
+For every case, list **all** legal moves for its state based on the GDL rules.
+Respond **only** in JSON format using the following structure:
+{{
+    "results": [
+        {{ "sample_id": "...", "llm_legal_moves": "..." }}
+    ]
+}}
+- "sample_id": string, the id of the case
+- "llm_legal_moves": string which contains all possible valid GDL moves (role + action) separated by new line symbol, each move should be in round brackets
+
+Include exactly one entry per case. Do not add any explanations, comments, or markdown formatting. Don't put GDL syntactic elements like "legal", "does" in the moves.
+Your response must start with {{.
+"""
+
+
+# Every template ends its stable part with the game definition block; everything after it is per-sample
+GAME_DEFINITION_BLOCK_END = "{game_definition}\n-----------------------\n"
+
+
+class GamePrompt(str):
+    """
+    A full prompt string that also remembers its split into a stable prefix (instructions + game definition)
+    and a per-sample suffix, so providers can cache the prefix once per game.
+    """
+    def __new__(cls, prefix: str, suffix: str, game_key: str):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        prompt.game_key = game_key
+        return prompt
+
+
+def game_key(game_definition: str) -> str:
+    """Short stable identifier of a game definition."""
+    return hashlib.sha256(game_definition.encode("utf-8")).hexdigest()[:16]
+
+
+def format_game_prompt(template: str, game_definition: str, **fields) -> GamePrompt:
+    cut = template.index(GAME_DEFINITION_BLOCK_END) + len(GAME_DEFINITION_BLOCK_END)
+    return GamePrompt(
+        template[:cut].format(game_definition=game_definition, **fields),
+        template[cut:].format(game_definition=game_definition, **fields),
+        game_key(game_definition)
+    )
+
+
+class ConversationPrompt(GamePrompt):
+    """
+    A GamePrompt continued by alternating user / assistant turns. Chat APIs receive the turns as messages;
+    as a string it is the whole transcript, so caching, token counting and logging work unchanged.
+    Every turn only extends the previous prompt, which keeps provider-side prefix caches hot.
+    """
+    def __new__(cls, base: GamePrompt, turns: List[tuple]):
+        transcript = "".join(f"\n[{role}]\n{text}" for role, text in turns)
+        prompt = super().__new__(cls, base.prefix, base.suffix + transcript, base.game_key)
+        prompt.instructions = str(base)
+        prompt.instructions_suffix = base.suffix
+        # (role, text) with role "user" or "assistant"
+        prompt.turns = list(turns)
+        return prompt
+
+
+def chat_messages(prompt: str) -> List[dict]:
+    """Chat completion messages of a prompt: the instructions as system message, then the conversation turns."""
+    if isinstance(prompt, ConversationPrompt):
+        return [{"role": "system", "content": prompt.instructions}] + [{"role": role, "content": text} for role, text in prompt.turns]
+    return [{"role": "system", "content": str(prompt)}]
+
+
+def build_next_state_prompt(game_definition: str, game_state: str, move: str) -> GamePrompt:
+    return format_game_prompt(
+        PROMPT_EVAL_NEXT_STATE,
+        game_definition=game_definition,
+        game_state=game_state,
+        move=move
+    )
+
+def build_legal_moves_prompt(game_definition: str, game_state: str) -> GamePrompt:
+    return format_game_prompt(
+        PROMPT_EVAL_LEGAL_MOVES,
+        game_definition=game_definition,
+        game_state=game_state
+    )
+
+def build_multi_step_prompt(game_definition: str, moves: List["MoveStep"]) -> GamePrompt:
+    move_sequence_str = ""
+    for m in moves:
+        move_sequence_str += f"Step {m.step}:\n{m.joint_move}\n\n"
+
+    return format_game_prompt(
+        PROMPT_EVAL_MULTI_STEP,
+        game_definition=game_definition,
+        n=len(moves),
+        move_sequence=move_sequence_str.strip()
+    )
+
+def build_multi_step_generation_prompt(game_definition: str, n: int, example_move: str) -> GamePrompt:
+    return format_game_prompt(
+        PROMPT_EVAL_MULTI_STEP_GEN,
+        game_definition=game_definition,
+        n=n,
+        move_example=example_move
+    )
+
+def build_incremental_prompt(game_definition: str, turns: List[tuple]) -> ConversationPrompt:
+    return ConversationPrompt(format_game_prompt(PROMPT_EVAL_MULTI_STEP_INCREMENTAL, game_definition=game_definition), turns)
+
 # --- 2. Data Structures ---
 
 # Generic TypeVar for response parsing
@@ -145,8 +327,13 @@ class EvalData(BaseModel):
     # Polymorphic list: parses based on structure
     samples: List[Union[EvalSample, MultiStepInputSample]]
 
+class LLMResponse(BaseModel):
+    """Base of the models the LLM answers with. Remembers what repair_json had to fix for the answer to parse, and which routed backend answered."""
+    _repairs: Optional[str] = PrivateAttr(default=None)
+    _backend: Optional[str] = PrivateAttr(default=None)
+
 # -- Experiment 1 Output Models (Next State) --
-class LLMNextStateResponse(BaseModel):
+class LLMNextStateResponse(LLMResponse):
     llm_state: str = Field(..., description="The predicted next game state.")
 
 class OutputSampleNextState(BaseModel):
@@ -154,29 +341,171 @@ class OutputSampleNextState(BaseModel):
     move: str
     next_state: str
     llm_state: str
+    # Repairs applied to a malformed or truncated answer; omitted when it parsed as is
+    repaired: Optional[str] = None
+    # "provider/model" that answered when the model is routed over several backends
+    backend: Optional[str] = None
 
 # -- Experiment 2 Output Models (Legal Moves) --
-class LLMLegalMovesResponse(BaseModel):
+class LLMLegalMovesResponse(LLMResponse):
     llm_legal_moves: str = Field(..., description="List of available moves in a given state separated by new line symbol.")
 
 class OutputSampleLegalMoves(BaseModel):
     game_state: str
     legal_moves: str  # Ground truth
     llm_legal_moves: str # Prediction
+    repaired: Optional[str] = None
+    backend: Optional[str] = None
 
 # -- Experiment 3 Output Models (Multi Step Prediction) --
 class OutputSampleMultiStep(BaseModel):
     moves: List[MoveStep]
     llm_state: str
+    repaired: Optional[str] = None
+    backend: Optional[str] = None
 
 # -- Experiment 4 Output Models (Multi Step Generation) --
-class LLMMultiStepGenResponse(BaseModel):
+class LLMMultiStepGenResponse(LLMResponse):
     moves: List[MoveStep] = Field(..., description="The sequence of moves generated by LLM.")
     llm_state: str = Field(..., description="The predicted game state after the generated moves.")
 
 class OutputSampleMultiStepGen(BaseModel):
     moves: List[MoveStep] 
     llm_state: str
+    repaired: Optional[str] = None
+    backend: Optional[str] = None
+
+# -- Provider Responses --
+class Completion(BaseModel):
+    """Raw completion text together with the token usage reported by the provider."""
+    text: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens served from a provider-side cache
+    cached_tokens: int = 0
+    # Seconds until the first streamed token arrived (streaming mode only)
+    ttft: Optional[float] = None
+    # Generation stopped at the completion token limit (finish reason "length" / MAX_TOKENS)
+    truncated: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+class TokenUsage(BaseModel):
+    """Running token totals of one player."""
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    streamed: int = 0
+    parsed: int = 0
+    parse_failures: int = 0
+    # Completions that only parsed after repair_json fixed them
+    repaired: int = 0
+    ttft_total: float = 0.0
+    aborted_streams: int = 0
+    # Generation time cut short by aborting unusable streams early
+    aborted_seconds: float = 0.0
+    # Duplicate requests sent after the hedging delay, and how many of them answered first
+    hedged: int = 0
+    hedge_wins: int = 0
+    # Completion tokens requested through adaptive budgets and actually generated under them
+    budget_reserved: int = 0
+    budget_used: int = 0
+    # Answers cut off at their budget and sent again with a larger one, and the tokens they had generated
+    truncations: int = 0
+    truncated_tokens: int = 0
+
+    def add(self, completion: Completion):
+        self.requests += 1
+        self.prompt_tokens += completion.prompt_tokens
+        self.completion_tokens += completion.completion_tokens
+        self.cached_tokens += completion.cached_tokens
+        if completion.ttft is not None:
+            self.streamed += 1
+            self.ttft_total += completion.ttft
+
+    def summary(self, label: str = "") -> str:
+        saved = f"{self.cached_tokens / self.prompt_tokens:.1%}" if self.prompt_tokens else "n/a"
+        label = f"[{label}] " if label else ""
+        text = (f"📊 {label}Requests: {self.requests}, prompt tokens: {self.prompt_tokens}, completion tokens: {self.completion_tokens}, "
+                f"cached input tokens saved: {self.cached_tokens} ({saved})")
+        if self.parsed:
+            text += (f"\n🧩 Parse failures: {self.parse_failures}/{self.parsed} completions ({self.parse_failures / self.parsed:.1%}), "
+                     f"{self.repaired} repaired")
+        if self.streamed or self.aborted_streams:
+            mean_ttft = f"{self.ttft_total / self.streamed:.2f}s" if self.streamed else "n/a"
+            text += (f"\n📡 Streaming: mean time to first token {mean_ttft}, "
+                     f"{self.aborted_streams} streams aborted early after {self.aborted_seconds:.1f}s in total")
+        if self.hedged:
+            text += f"\n🏎️ Hedging: {self.hedged} duplicate requests, {self.hedge_wins} answered first"
+        if self.budget_reserved:
+            text += (f"\n🎚️ Completion budgets: {self.budget_reserved} tokens reserved, {self.budget_used} used "
+                     f"({self.budget_used / self.budget_reserved:.1%}), {self.budget_reserved - self.budget_used} unused; "
+                     f"{self.truncations} answers cut off and escalated, wasting {self.truncated_tokens} tokens")
+        return text
+
+class RequestMetrics(BaseModel):
+    """Telemetry of one _generate_json call across all of its attempts: one line of the metrics file."""
+    time: float = Field(default_factory=time.time)
+    provider: str
+    model: str
+    game: Optional[str] = None
+    experiment: Optional[str] = None
+    # "ok", "failed" or "cache_hit"
+    outcome: str = "ok"
+    latency: float = 0.0
+    ttft: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    attempts: int = 0
+    rate_limited: int = 0
+    hedges: int = 0
+    # Class of the last failure, also set when a later attempt succeeded
+    failure_class: Optional[str] = None
+    key_index: Optional[int] = None
+    # Logical model when the request was sent by a backend of a RoutedGamePlayer
+    route: Optional[str] = None
+    # Completion token limit of the last attempt (adaptive budgets only) and how often it was raised after a cut-off answer
+    completion_budget: Optional[int] = None
+    truncations: int = 0
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempts - 1)
+
+    def add(self, completion: Completion):
+        self.prompt_tokens += completion.prompt_tokens
+        self.completion_tokens += completion.completion_tokens
+        self.cached_tokens += completion.cached_tokens
+        if completion.ttft is not None:
+            self.ttft = completion.ttft
+
+    def fork(self) -> "RequestMetrics":
+        """Metrics of one leg of a hedged attempt: the budget carries over, attempts and tokens start at zero."""
+        return self.model_copy(update=dict(attempts=0, prompt_tokens=0, completion_tokens=0, cached_tokens=0, ttft=None, key_index=None))
+
+    def merge(self, leg: "RequestMetrics"):
+        """Takes over the attempts, tokens, key and budget of the leg whose outcome the request uses."""
+        self.attempts += leg.attempts
+        self.prompt_tokens += leg.prompt_tokens
+        self.completion_tokens += leg.completion_tokens
+        self.cached_tokens += leg.cached_tokens
+        if leg.ttft is not None:
+            self.ttft = leg.ttft
+        if leg.key_index is not None:
+            self.key_index = leg.key_index
+        self.completion_budget = leg.completion_budget
+
+# -- Packed Responses (several samples per request) --
+class LLMPackedResponse(LLMResponse):
+    """Items are validated one by one against the single-sample model, so one malformed item does not sink the rest."""
+    results: List[dict] = Field(..., description="One answer per case, each with its sample_id.")
+
+# Answer models by name, as batch lines name them in their response_format
+RESPONSE_MODELS = {model.__name__: model for model in (LLMNextStateResponse, LLMLegalMovesResponse, LLMMultiStepGenResponse, LLMPackedResponse)}
 
 # -- Final Output Wrapper --
 class OutputData(BaseModel):
@@ -188,461 +517,4422 @@ class OutputData(BaseModel):
 
 # --- 3. Player Implementations ---
 
-class BaseGamePlayer:
-    """Base interface for game players with shared parsing logic."""
-    def __init__(self, model_name: str, api_key: str):
-        self.model_name = model_name
-        self.api_key = api_key
+# -- Rate Limiting --
 
-    def _clean_response(self, text: str) -> str:
-        """Removes markdown code fences and whitespace."""
-        result = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE).strip()
-        return re.sub(r'\}(\s*)\}(\s*)$', r'}\1', result, flags=re.DOTALL)
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used to reserve budget before a request is sent."""
+    return len(text) // 4 + 1
 
-    def _generate_json(self, prompt: str, response_model: Type[T]) -> T:
-        """Abstract method to generate and parse JSON. To be implemented by subclasses."""
-        raise NotImplementedError
 
-    # -- Specific Experiment Methods --
+def is_rate_limit_error(error: Exception) -> bool:
+    """Recognizes quota / rate limit (429) errors across the provider SDKs."""
+    error_str = str(error).lower()
+    return "429" in error_str or "quota" in error_str or "too many tokens" in error_str or "resource_exhausted" in error_str
 
-    def evaluate_next_state(self, game_definition: str, game_state: str, move: str) -> LLMNextStateResponse:
-        prompt = PROMPT_EVAL_NEXT_STATE.format(
-            game_definition=game_definition,
-            game_state=game_state,
-            move=move
-        )
-        return self._generate_json(prompt, LLMNextStateResponse)
 
-    def evaluate_legal_moves(self, game_definition: str, game_state: str) -> LLMLegalMovesResponse:
-        prompt = PROMPT_EVAL_LEGAL_MOVES.format(
-            game_definition=game_definition,
-            game_state=game_state
-        )
-        return self._generate_json(prompt, LLMLegalMovesResponse)
-    
-    def evaluate_multi_step(self, game_definition: str, moves: List[MoveStep]) -> LLMNextStateResponse:
-        move_sequence_str = ""
-        for m in moves:
-            move_sequence_str += f"Step {m.step}:\n{m.joint_move}\n\n"
-        
-        prompt = PROMPT_EVAL_MULTI_STEP.format(
-            game_definition=game_definition,
-            n=len(moves),
-            move_sequence=move_sequence_str.strip()
-        )
-        return self._generate_json(prompt, LLMNextStateResponse)
+class TokenBucket:
+    """Budget that refills continuously up to its per-minute capacity. A capacity of None means unlimited."""
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = per_minute
+        self.level = per_minute or 0.0
+        self.updated = time.monotonic()
 
-    def evaluate_multi_step_generation(self, game_definition: str, n: int, example_move: str) -> LLMMultiStepGenResponse:
-        prompt = PROMPT_EVAL_MULTI_STEP_GEN.format(
-            game_definition=game_definition,
-            n=n,
-            move_example=example_move
-        )
-        return self._generate_json(prompt, LLMMultiStepGenResponse)
+    def _refill(self, now: float):
+        if self.capacity is None:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
 
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be drawn. Amounts above capacity only wait for a full bucket."""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        deficit = min(amount, self.capacity) - self.level
+        return max(0.0, deficit * 60.0 / self.capacity)
 
-class GeminiGamePlayer(BaseGamePlayer):
-    """Implementation using Google Gemini API."""
-    def __init__(self, model_name: str, api_key: str):
-        super().__init__(model_name, api_key)
-        self.client = genai.Client(api_key=self.api_key, http_options=HttpOptions(timeout=60*2*1000))
+    def consume(self, amount: float, now: float):
+        """Draws `amount`; the level may go negative, which pushes back later reservations."""
+        if self.capacity is None:
+            return
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
 
-    def _generate_json(self, prompt: str, response_model: Type[T]) -> T:
-        for attempt in range(5):
+    def refund(self, amount: float):
+        if self.capacity is None:
+            return
+        self.level = min(self.capacity, self.level + amount)
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens locally with a tiktoken encoding (exact for OpenAI tokenizers, close for the others).
+    Falls back to estimate_tokens when tiktoken or the encoding is not available.
+    """
+    def __init__(self, encoding: str = "o200k_base"):
+        self.encoding = None
+        if tiktoken is not None:
             try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=prompt,
-                    config=GenerateContentConfig(temperature=0.2)
-                )
-                clean_text = self._clean_response(response.text)
-                return response_model.model_validate_json(clean_text)
+                self.encoding = tiktoken.get_encoding(encoding)
             except Exception as e:
-                print(f"❌ Gemini attempt {attempt+1} failed: {e}")
-                time.sleep(1)
-        return ""
+                # The encoding file is downloaded on first use
+                print(f"⚠️ tiktoken encoding {encoding} unavailable, estimating token counts: {e}")
+        self.name = encoding if self.encoding is not None else "~4 chars/token"
 
+    def count(self, text: str) -> int:
+        if self.encoding is None:
+            return estimate_tokens(text)
+        return len(self.encoding.encode(text, disallowed_special=()))
 
-class CerebrasGamePlayer(BaseGamePlayer):
-    """Implementation using Cerebras API with automatic key rotation on quota limits."""
-    def __init__(self, model_name: str, api_keys: List[str]):
-        # Base class expects a single key, we pass the first one, but we manage the list here
-        super().__init__(model_name, api_keys[0])
-        self.api_keys = api_keys
-        self.current_key_index = 0
-        self._init_client()
-
-    def _init_client(self):
-        """Initializes the Cerebras client with the current active key."""
-        current_key = self.api_keys[self.current_key_index]
-        print(f"🔑 [Cerebras] Using API Key index: {self.current_key_index}/{len(self.api_keys) - 1}")
-        self.client = Cerebras(api_key=current_key)
-
-    def _rotate_key(self):
-        """Switches to the next API key in the list."""
-        if len(self.api_keys) <= 1:
-            print("⚠️ Only one API key provided. Cannot rotate.")
-            return
 
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-        print(f"🔄 [Cerebras] Quota limit reached. Switching to key index {self.current_key_index}...")
-        self._init_client()
+class ContextWindowExceeded(ValueError):
+    """Raised instead of sending a prompt that cannot fit the model's context window together with the completion."""
+    pass
 
-    def _generate_json(self, prompt: str, response_model: Type[T]) -> T:
-        attempt = 0
-        max_attempts = 3
-        
-        while attempt < max_attempts:
-            try:
-                response = self.client.chat.completions.create(
-                    messages=[{"role": "system", "content": prompt}],
-                    model=self.model_name,
-                    stream=False,
-                    max_completion_tokens=28192,
-                    temperature=0.2,
-                    top_p=0.95
-                )
-                clean_text = self._clean_response(response.choices[0].message.content)
-                if not clean_text:
-                    attempt += 1
-                    continue
-                return response_model.model_validate_json(clean_text)
-            
-            except Exception as e:
-                error_str = str(e).lower()
-                
-                # Check for Quota/Rate Limit Error (429)
-                if "429" in str(e) or "quota" in error_str or "too many tokens" in error_str:
-                    print(f"🛑 Quota exceeded on current key. Error: {e}")
-                    self._rotate_key()
-                    # We do NOT increment 'attempt' here, so we try again immediately with the new key
-                    time.sleep(1) 
-                    continue
-                
-                print(f"❌ Cerebras attempt {attempt+1} failed: {e}")
-                attempt += 1
-                time.sleep(1)
-                
-        return ""
 
+class QuotaWaitExceeded(Exception):
+    """Raised instead of waiting longer than the current request allows for a key with quota."""
+    pass
 
-class NvidiaGamePlayer(BaseGamePlayer):
-    """Implementation using NVIDIA API (via OpenAI client)."""
-    def __init__(self, model_name: str, api_key: str):
-        super().__init__(model_name, api_key)
-        self.client = OpenAI(
-            base_url="https://integrate.api.nvidia.com/v1",
-            api_key=self.api_key
-        )
 
-    def _generate_json(self, prompt: str, response_model: Type[T]) -> T:
-        for attempt in range(5):
-            try:
-                response = self.client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": prompt}
-                    ],
-                    model="openai/" + self.model_name,
-                    stream=False,
-                    max_tokens=4096,
-                    temperature=0.2,
-                    top_p=0.8
-                )
-                raw_text = response.choices[0].message.content
-                clean_text = self._clean_response(raw_text)
-                return response_model.model_validate_json(clean_text)
-            except Exception as e:
-                print(f"❌ Nvidia attempt {attempt+1} failed: {e}")
-                time.sleep(1)
-        return ""
+# Longest wait for a key with quota the current request accepts (None = as long as needed). Set by RoutedGamePlayer,
+# which can send the request to another backend instead.
+MAX_QUOTA_WAIT = contextvars.ContextVar("max_quota_wait", default=None)
 
-# --- 4. Core Logic ---
 
-def process_game_file(
-    gdl_file_path: str,
-    samples_file_path: str,
-    player: BaseGamePlayer,
-    output_dir: str,
-    max_samples: int,
-    experiment_type: str,
-    n_moves: int = None
-):
+class KeyPool:
     """
-    Runs the LLM evaluation for a single game file based on experiment type.
+    Paces requests over several API keys at once. Every key has its own requests-per-minute and
+    tokens-per-minute bucket; each request is assigned to the key that can serve it soonest.
     """
-    print(f"🔬 Starting data collection ({experiment_type}) for: {os.path.basename(samples_file_path)}")
-    experiment_id = time.strftime("%Y-%m-%d_%H%M%S")
+    def __init__(self, api_keys: List[str], rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.api_keys = api_keys
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_buckets = [TokenBucket(rpm) for _ in api_keys]
+        self.token_buckets = [TokenBucket(tpm) for _ in api_keys]
+        self.blocked_until = [0.0 for _ in api_keys]
+        self._next_index = 0
+        self._lock = threading.Lock()
 
-    # Load GDL Definition
-    with open(gdl_file_path, 'r') as f:
-        gdl_game_definition = f.read()
+    def _delay(self, i: int, tokens: int, now: float) -> float:
+        return max(
+            self.blocked_until[i] - now,
+            self.request_buckets[i].wait_time(1, now),
+            self.token_buckets[i].wait_time(tokens, now),
+            0.0
+        )
 
-    # Load Samples
-    try:
-        with open(samples_file_path, 'r') as f:
-            samples_data_raw = json.load(f)
-        eval_data = EvalData.model_validate(samples_data_raw)
-    except Exception as e:
-        print(f"❌ Error parsing samples file {samples_file_path}: {e}")
-        return
+    def wait_time(self, tokens: int) -> float:
+        """Seconds until some key could serve a request of `tokens`, without booking it."""
+        with self._lock:
+            now = time.monotonic()
+            return min(self._delay(i, tokens, now) for i in range(len(self.api_keys)))
 
-    print(f"Found {len(eval_data.samples)} samples. Processing max {max_samples}...")
+    def reserve(self, tokens: int) -> tuple:
+        """Books one request of `tokens` on the best key. Returns (key_index, seconds_to_wait)."""
+        with self._lock:
+            now = time.monotonic()
+            best_index, best_delay = 0, None
+            # Start from the key after the last one used so that ties spread round-robin over the pool
+            for offset in range(len(self.api_keys)):
+                i = (self._next_index + offset) % len(self.api_keys)
+                delay = self._delay(i, tokens, now)
+                if best_delay is None or delay < best_delay:
+                    best_index, best_delay = i, delay
+            self._next_index = (best_index + 1) % len(self.api_keys)
+            self.request_buckets[best_index].consume(1, now)
+            self.token_buckets[best_index].consume(tokens, now)
+            return best_index, best_delay
 
-    output_samples_list = []
-    
-    # Processing Loop
-    for i, sample in enumerate(eval_data.samples):
-        if len(output_samples_list) >= max_samples:
-            break
-            
-        print(f"\n--- Processing Sample {i + 1} / {min(len(eval_data.samples), max_samples)} ---")
-        try:
-            # --- EXPERIMENT 1: NEXT STATE ---
-            if "next_state" in experiment_type:
-                if not isinstance(sample, EvalSample): 
-                    print("Skipping sample: format mismatch for next_state")
-                    continue
-                    
-                llm_response = player.evaluate_next_state(
-                    game_definition=gdl_game_definition,
-                    game_state=sample.game_state,
-                    move=sample.move
-                )
-                output_sample = OutputSampleNextState(
-                    game_state=sample.game_state,
-                    move=sample.move,
-                    next_state=sample.next_state,
-                    llm_state=llm_response.llm_state
-                )
-
-            # --- EXPERIMENT 2: LEGAL MOVES ---
-            elif "legal_moves" in experiment_type:
-                if not isinstance(sample, EvalSample): 
-                    print("Skipping sample: format mismatch for legal_moves")
-                    continue
-                
-                if not sample.legal_moves:
-                    raise ValueError("Input sample missing 'legal_moves' field.")
-                    
-                llm_response = player.evaluate_legal_moves(
-                    game_definition=gdl_game_definition,
-                    game_state=sample.game_state
-                )
-                output_sample = OutputSampleLegalMoves(
-                    game_state=sample.game_state,
-                    legal_moves=sample.legal_moves,
-                    llm_legal_moves=llm_response.llm_legal_moves
-                )
-
-            # --- EXPERIMENT 3: MULTI STEP PREDICTION ---
-            elif "multi_step_prediction" in experiment_type:
-                if not isinstance(sample, MultiStepInputSample):
-                    print("Skipping sample: format mismatch for multi_step_prediction")
-                    continue
-                
-                if not n_moves:
-                    raise ValueError("n_moves parameter is required for multi_step_prediction")
-
-                current_moves = sample.moves[:n_moves]
-                if len(current_moves) < n_moves:
-                    print(f"⚠️ Warning: Sample has fewer moves ({len(current_moves)}) than requested N={n_moves}. Using available.")
-
-                llm_response = player.evaluate_multi_step(
-                    game_definition=gdl_game_definition,
-                    moves=current_moves
-                )
-                output_sample = OutputSampleMultiStep(
-                    moves=current_moves,
-                    llm_state=llm_response.llm_state
-                )
-            
-            # --- EXPERIMENT 4: MULTI STEP GENERATION ---
-            elif "multi_step_generation" in experiment_type:
-                if not isinstance(sample, MultiStepInputSample):
-                    print("Skipping sample: format mismatch for multi_step_generation")
-                    continue
+    def cancel(self, key_index: int, tokens: int):
+        """Returns a booking that is not going to be used."""
+        with self._lock:
+            self.request_buckets[key_index].refund(1)
+            self.token_buckets[key_index].refund(tokens)
 
-                if not n_moves:
-                    raise ValueError("n_moves parameter is required for multi_step_generation")
+    def _reserve_within_limit(self, tokens: int) -> tuple:
+        key_index, delay = self.reserve(tokens)
+        max_wait = MAX_QUOTA_WAIT.get()
+        if max_wait is not None and delay > max_wait:
+            self.cancel(key_index, tokens)
+            raise QuotaWaitExceeded(f"No key has quota for another {delay:.1f}s, the request waits at most {max_wait:.1f}s")
+        return key_index, delay
 
-                if not sample.moves:
-                    print("Skipping sample: No moves available to use as template.")
-                    continue
-                    
-                example_joint_move = sample.moves[0].joint_move
+    def acquire(self, tokens: int) -> int:
+        key_index, delay = self._reserve_within_limit(tokens)
+        if delay > 0:
+            with span("quota_wait", key=key_index):
+                time.sleep(delay)
+        return key_index
 
-                llm_response = player.evaluate_multi_step_generation(
-                    game_definition=gdl_game_definition,
-                    n=n_moves,
-                    example_move=example_joint_move
-                )
+    async def aacquire(self, tokens: int) -> int:
+        key_index, delay = self._reserve_within_limit(tokens)
+        if delay > 0:
+            with span("quota_wait", key=key_index):
+                await asyncio.sleep(delay)
+        return key_index
 
-                output_sample = OutputSampleMultiStepGen(
-                    moves=llm_response.moves,
-                    llm_state=llm_response.llm_state
-                )
+    def settle(self, key_index: int, reserved_tokens: int, used_tokens: int):
+        """Corrects the token bucket once the provider reports the real usage."""
+        if used_tokens:
+            with self._lock:
+                self.token_buckets[key_index].refund(reserved_tokens - used_tokens)
 
-            else:
-                print(f"Unknown experiment type: {experiment_type}")
-                return
+    def block(self, key_index: int, seconds: float):
+        """Takes a key out of rotation after the provider rejected it despite pacing."""
+        with self._lock:
+            self.blocked_until[key_index] = max(self.blocked_until[key_index], time.monotonic() + seconds)
 
-            output_samples_list.append(output_sample)
-            print(f"✅ Sample {i + 1} processed.")
-            time.sleep(0.1) # Rate limit safety
+    def describe(self) -> str:
+        return f"{len(self.api_keys)} key(s), rpm={self.rpm or 'unlimited'}, tpm={self.tpm or 'unlimited'} per key"
 
-        except Exception as e:
-            print(f"❌ Sample {i + 1} failed: {e}")
-            continue
 
-    # Save Results
-    print(f"\nSuccessfully processed: {len(output_samples_list)} samples.")
-    
-    if len(output_samples_list) < max_samples:
-        print("⚠️ No samples collected. Skipping save.")
-        return
+# -- Response Cache --
 
-    output_data = OutputData(
-        game_name=eval_data.game_name,
-        llm_model=player.model_name,
-        experiment_type=experiment_type,
-        samples=output_samples_list
-    )
+class CacheMissError(Exception):
+    """Raised in replay mode when a prompt has no stored response."""
 
-    os.makedirs(output_dir, exist_ok=True)
-    output_filename = os.path.join(output_dir, f"output_{eval_data.game_name}_{experiment_id}.json")
-    
-    try:
-        with open(output_filename, 'w') as f:
-            f.write(output_data.model_dump_json(indent=4))
-        print(f"💾 Saved to {output_filename}")
-    except Exception as e:
-        print(f"❌ Failed to save JSON: {e}")
 
+class ResponseCache:
+    """
+    Disk-backed (SQLite) store of raw completions, keyed by provider, model, sampling parameters and prompt hash.
+    Entries older than max_age_days are dropped, and the least recently used ones go once max_bytes is exceeded.
+    In "replay" mode the cache is opened read-only and never calls through to the provider.
+    """
+    # Evict every N writes rather than on each one
+    evict_interval = 100
 
-# --- 5. Main Execution ---
+    def __init__(self, path: str, mode: str = "readwrite", max_bytes: Optional[int] = None, max_age_days: Optional[float] = None):
+        if mode not in ("readwrite", "replay"):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.path = path
+        self.read_only = mode == "replay"
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
 
-def main():
-    load_dotenv()
-    
-    parser = argparse.ArgumentParser(description="Run GDL Game State Evaluation with LLMs")
-    
-    parser.add_argument("--experiment", type=str, 
-                        choices=["next_state", "legal_moves", "multi_step_prediction", "multi_step_generation"], 
-                        default="next_state", 
-                        help="Choose experiment variant")
-    
-    parser.add_argument("--provider", type=str, choices=["gemini", "cerebras", "nvidia"], default="cerebras", help="LLM Provider")
-    parser.add_argument("--model", type=str, required=True, help="Model name")
-    parser.add_argument("--api_key", type=str, help="API Key (optional if set in env vars)")
-    
-    parser.add_argument("--samples_dir", type=str, required=True, help="Directory containing input JSON samples")
-    parser.add_argument("--gdl_dir", type=str, required=True, help="Directory containing GDL (.kif/.gdl) files")
-    
-    parser.add_argument("--max_samples", type=int, default=25, help="Max samples to process per game")
-    parser.add_argument("--reverse_order", action="store_true", help="Process files in reverse alphabetical order")
-    parser.add_argument("--n_moves", type=int, help="Number of moves to predict/generate")
+        if self.read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Replay cache not found: {path}")
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, provider TEXT, model TEXT, text TEXT, "
+                "prompt_tokens INTEGER, completion_tokens INTEGER, size INTEGER, created REAL, accessed REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self.conn.commit()
+            self.evict()
 
-    args = parser.parse_args()
+    @staticmethod
+    def make_key(provider: str, model: str, sampling_params: dict, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        material = json.dumps([provider, model, sampling_params, prompt_hash], sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
 
-    # Validation
-    if "multi_step" in args.experiment and not args.n_moves:
-        parser.error(f"--n_moves is required when experiment is '{args.experiment}'")
+    def get(self, key: str) -> Optional[Completion]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT text, prompt_tokens, completion_tokens FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+        return Completion(text=row[0], prompt_tokens=row[1], completion_tokens=row[2])
 
-    TARGET_GAMES = {
-        "mummymaze2p", "wallmaze", "platformJumpers", "pacman3p", "snake_2009_big",
-        "bomberman2p_InvertedRoles", "bomberman2p", "battlebrushes", "checkers",
-        "checkers-mustjump", "cittaceot", "rubikscube", "god", "beatMania", "farmers",
-        "qyshinsu", "snakeAssemblit", "rendezvous_asteroids", "ticTacToeLargeSuicide",
-        "ticTacToeLarge", "dotsAndBoxesSuicide", "buttons", "dotsAndBoxes",
-        "chineseCheckers3", "pawnWhopping", "connectfour",
-        "connectFourSuicide", "checkersTiny", "othello-comp2007", "othellosuicide",
-        "chess", "checkersSmall", "fighter", "1reversi2", "checkers-newgoals"
-    }
+    def put(self, key: str, completion: Completion, provider: str = "", model: str = ""):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, completion.text, completion.prompt_tokens, completion.completion_tokens,
+                 len(completion.text.encode("utf-8")), now, now)
+            )
+            self.conn.commit()
+            self._writes += 1
+        if self._writes % self.evict_interval == 0:
+            self.evict()
 
-    # 2. Setup Player
-    player = None
-    
-    if args.provider == "gemini":
-        api_key = args.api_key or os.getenv("GOOGLE_API_KEY")
-        if not api_key: raise EnvironmentError("Missing GOOGLE_API_KEY")
-        player = GeminiGamePlayer(model_name=args.model, api_key=api_key)
-        
-    elif args.provider == "cerebras":
-        # Check for Multiple Keys First
-        api_keys_str = os.getenv("CEREBRAS_API_KEYS")
-        if api_keys_str:
-            api_keys = [k.strip() for k in api_keys_str.split(",") if k.strip()]
-        else:
-            # Fallback to single key
-            single_key = args.api_key or os.getenv("CEREBRAS_API_KEY")
-            if single_key:
-                api_keys = [single_key]
+    def discard(self, key: str):
+        if self.read_only:
+            return
+        with self._lock:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def evict(self):
+        """Applies the age limit, then drops least recently used entries until the size limit holds."""
+        if self.read_only:
+            return
+        with self._lock:
+            removed = 0
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self.conn.execute("DELETE FROM responses WHERE created < ?", (cutoff,)).rowcount
+            if self.max_bytes is not None:
+                total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    stale = []
+                    for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self.conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    removed += len(stale)
+            self.conn.commit()
+        if removed:
+            print(f"🧹 [Cache] Evicted {removed} entries from {self.path}")
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = f"{self.hits / lookups:.1%}" if lookups else "n/a"
+        return f"🗃️ Response cache: {self.hits} hits, {self.misses} misses ({rate} hit rate)"
+
+
+# -- Streaming --
+
+class StreamAborted(Exception):
+    """Raised when a streamed completion can no longer match the target response model."""
+
+
+def _expected_opening(annotation) -> Optional[str]:
+    """First JSON character a value of this type must start with, if it is fixed."""
+    if annotation is str:
+        return '"'
+    if getattr(annotation, "__origin__", None) in (list, List) or annotation is list:
+        return '['
+    return None
+
+
+class IncrementalJSONValidator:
+    """
+    Follows a JSON completion chunk by chunk and reports the first point at which it can no longer parse into
+    the response model: prose before the opening brace, an unknown top-level key or a value of the wrong kind.
+    Markdown fences are tolerated, as _clean_response strips them, and so is text after the closing brace,
+    which repair_json drops.
+    """
+    def __init__(self, response_model: Type[BaseModel]):
+        self.fields = {name: _expected_opening(field.annotation) for name, field in response_model.model_fields.items()}
+        self.prelude = ""
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.current = ""
+        # Top-level parser state: "key", "colon", "value", "after_value"
+        self.state = "key"
+        self.key = None
+
+    def feed(self, text: str):
+        """Consumes the next chunk. Raises StreamAborted as soon as the output is known to be unusable."""
+        for ch in text:
+            if self.finished:
+                return
+            if not self.started:
+                self._feed_prelude(ch)
             else:
-                raise EnvironmentError("Missing CEREBRAS_API_KEYS or CEREBRAS_API_KEY")
-        
-        player = CerebrasGamePlayer(model_name=args.model, api_keys=api_keys)
-        
-    elif args.provider == "nvidia":
-        api_key = args.api_key or os.getenv("NVIDIA_API_KEY") # Assuming env var name
-        if not api_key: raise EnvironmentError("Missing NVIDIA_API_KEY")
-        player = NvidiaGamePlayer(model_name=args.model, api_key=api_key)
+                self._feed_body(ch)
 
-    # 3. File Discovery
-    if not os.path.exists(args.samples_dir):
-        raise FileNotFoundError(f"Samples directory not found: {args.samples_dir}")
-    
-    sample_files = [f for f in os.listdir(args.samples_dir) if f.endswith('.json')]
-    sample_files.sort(reverse=args.reverse_order)
-    
-    print(f"🔥 Starting Evaluation: {args.experiment.upper()}")
-    if "multi_step" in args.experiment:
-        print(f"   Steps (N): {args.n_moves}")
-    print(f"   Provider: {args.provider.upper()}, Model: {args.model}")
-    print(f"📂 Found {len(sample_files)} sample files in {args.samples_dir}")
+    def _feed_prelude(self, ch: str):
+        if ch == "{":
+            self.started = True
+            self.depth = 1
+            return
+        self.prelude += ch
+        stripped = self.prelude.strip()
+        if stripped and not "```json".startswith(stripped):
+            raise StreamAborted(f"Prose before the opening brace: {stripped[:40]!r}")
 
-    # 4. Processing Loop
-    for filename in sample_files:
-        samples_full_path = os.path.join(args.samples_dir, filename)
+    def _feed_body(self, ch: str):
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.depth == 1 and self.state == "key":
+                    self._check_key(self.current)
+                    self.state = "colon"
+                    return
+            if self.depth == 1 and self.state == "key":
+                self.current += ch
+            return
 
-        try:
-            with open(samples_full_path, 'r') as f:
-                content = json.load(f)
-                game_name = content.get("game_name")
-            
-            if not game_name or (TARGET_GAMES and game_name not in TARGET_GAMES):
-                continue
-        except Exception as e:
-            print(f"⚠️ Skipping {filename}: Read error ({e})")
-            continue
+        if self.depth == 1 and self.state == "value" and not ch.isspace():
+            expected = self.fields.get(self.key)
+            if expected is not None and ch != expected:
+                raise StreamAborted(f"Field '{self.key}' should start with {expected} but starts with {ch!r}")
+            self.state = "after_value"
 
-        suffix = f"_n{args.n_moves}" if args.n_moves else ""
-        output_dir = f"{'/'.join(args.samples_dir.split('/')[:-2])}/{args.experiment}{suffix}/{args.model}/"
-        existing_pattern = os.path.join(output_dir, f"output_{game_name}_2025*.json")
-        
-        if glob.glob(existing_pattern):
-            print(f"⏩ Skipping {game_name}: Output file already exists.")
-            continue
+        if ch == '"':
+            self.in_string = True
+            self.current = ""
+        elif ch in "{[":
+            self.depth += 1
+        elif ch in "}]":
+            self.depth -= 1
+            if self.depth == 0:
+                self.finished = True
+        elif self.depth == 1:
+            if ch == ":" and self.state == "colon":
+                self.state = "value"
+            elif ch == "," and self.state == "after_value":
+                self.state = "key"
+            elif not ch.isspace() and self.state in ("key", "colon"):
+                raise StreamAborted(f"Unexpected {ch!r} where a key was expected")
 
-        # Find matching GDL file
-        gdl_path = os.path.join(args.gdl_dir, f"{game_name}.kif")
-        if not os.path.exists(gdl_path):
-            gdl_path = os.path.join(args.gdl_dir, f"{game_name}.gdl")
-        
-        if not os.path.exists(gdl_path):
-            print(f"⚠️ Skipping {game_name}: GDL file not found.")
-            continue
+    def _check_key(self, key: str):
+        if key not in self.fields:
+            raise StreamAborted(f"Unknown key '{key}'")
+        self.key = key
 
-        process_game_file(
-            gdl_file_path=gdl_path,
-            samples_file_path=samples_full_path,
-            player=player,
-            output_dir=output_dir,
-            max_samples=args.max_samples,
-            experiment_type=args.experiment,
-            n_moves=args.n_moves
-        )
-        
-        time.sleep(2)
+
+# -- JSON Repair --
+
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+# The scanner skips whole runs of string content and of text between brackets instead of stepping through characters
+_STRING_RUN_RE = re.compile(r'(?:[^"\\\n\r\t]|\\[\s\S])*')
+_STRUCTURE_RE = re.compile(r'["{}\[\]]')
+# A key (with or without its colon) left dangling at the end of a cut-off object
+_DANGLING_KEY_RE = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?$')
+
+
+def _trim_partial_fact(value: str) -> str:
+    """Cuts a truncated string value back to the end of its last complete fact, i.e. where all parentheses are closed."""
+    if value.count("(") <= value.count(")"):
+        return value
+    end = len(value)
+    while True:
+        end = value.rfind(")", 0, end)
+        if end < 0 or value.count("(", 0, end + 1) <= value.count(")", 0, end + 1):
+            return value[:end + 1]
+
+
+def repair_json(text: str) -> Tuple[str, List[str]]:
+    """
+    Best-effort fix of a malformed JSON object in one pass: takes the first object out of surrounding prose,
+    escapes raw control characters in strings, drops trailing commas, stray brackets and anything after the
+    closing brace. A cut-off answer keeps its complete facts: the half-written last fact and any dangling key
+    are dropped, then open strings, arrays and objects are closed.
+    Returns the repaired text and the repairs made, which is empty if there was nothing to fix.
+    """
+    start = text.find("{")
+    if start < 0:
+        return text, []
+    repairs = []
+    def note(repair: str):
+        if repair not in repairs:
+            repairs.append(repair)
+
+    if text[:start].strip() not in ("", "```", "```json"):
+        note("extracted from surrounding text")
+    out, stack = [], []
+    in_string = False
+    string_start = 0
+    end = None
+    i, n = start, len(text)
+    while i < n:
+        if in_string:
+            run = _STRING_RUN_RE.match(text, i)
+            out.append(run.group())
+            i = run.end() + 1
+            if i > n:
+                break
+            ch = text[i - 1]
+            if ch == '"':
+                in_string = False
+                out.append(ch)
+            elif ch in _CONTROL_ESCAPES:
+                out.append(_CONTROL_ESCAPES[ch])
+                note("escaped control characters")
+            # Otherwise a backslash cut off at the very end, which is dropped
+            continue
+        match = _STRUCTURE_RE.search(text, i)
+        if match is None:
+            out.append(text[i:])
+            break
+        out.append(text[i:match.start()])
+        ch, i = match.group(), match.end()
+        if ch == '"':
+            in_string = True
+            string_start = len(out) + 1
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if ch not in stack:
+                note("dropped stray bracket")
+                continue
+            _drop_trailing_comma(out, note)
+            while stack[-1] != ch:
+                out.append(stack.pop())
+                note("closed mismatched bracket")
+            stack.pop()
+            if not stack:
+                out.append(ch)
+                end = i
+                break
+        out.append(ch)
+
+    if end is not None:
+        if text[end:].strip().strip("`"):
+            note("dropped text after the object")
+        return "".join(out), repairs
+
+    # Cut off: keep what is complete and close the rest
+    note("closed truncated output")
+    if in_string:
+        value = "".join(out[string_start:])
+        trimmed = _trim_partial_fact(value)
+        if trimmed != value:
+            note("dropped a partial fact")
+        # A value with no complete fact left is dropped along with its key
+        out[string_start - 1:] = ['"', trimmed, '"'] if trimmed.strip() else []
+    result = "".join(out)
+    while True:
+        result = result.rstrip()
+        if result.endswith(","):
+            result = result[:-1]
+        elif stack and stack[-1] == "}" and _DANGLING_KEY_RE.search(result):
+            result = result[:_DANGLING_KEY_RE.search(result).start(1) + 1]
+        else:
+            break
+    return result + "".join(reversed(stack)), repairs
+
+
+def _drop_trailing_comma(out: List[str], note: Callable[[str], None]):
+    while out and not out[-1].strip():
+        out.pop()
+    if out and out[-1].rstrip().endswith(","):
+        out[-1] = out[-1].rstrip()[:-1]
+        note("removed trailing comma")
+
+
+# -- Structured Output --
+
+@functools.lru_cache(maxsize=None)
+def structured_output_schema(response_model: Type[BaseModel]) -> tuple:
+    """
+    JSON schema of a response model for provider-side structured output, and whether it can be enforced strictly.
+    Objects with declared properties are closed (additionalProperties: false); free-form objects rule out strict mode.
+    """
+    schema = response_model.model_json_schema()
+    strict = True
+
+    def close(node):
+        nonlocal strict
+        if isinstance(node, dict):
+            if node.get("type") == "object":
+                if node.get("properties"):
+                    node.setdefault("additionalProperties", False)
+                else:
+                    strict = False
+            for value in node.values():
+                close(value)
+        elif isinstance(node, list):
+            for value in node:
+                close(value)
+
+    close(schema)
+    return schema, strict
+
+
+def is_structured_output_rejected(error: Exception) -> bool:
+    """Recognizes a 400 caused by an unsupported response_format / response schema."""
+    error_str = str(error).lower()
+    return ("400" in error_str or "invalid" in error_str or "unsupported" in error_str) and \
+        ("response_format" in error_str or "json_schema" in error_str or "response_schema" in error_str or "response_mime_type" in error_str)
+
+
+def is_cache_rejected_error(error: Exception) -> bool:
+    """Recognizes a request refused because its context cache expired, was deleted or is not accessible with the key."""
+    error_str = str(error).lower()
+    return ("cachedcontent" in error_str or "cached content" in error_str or "cached_content" in error_str) and \
+        ("not found" in error_str or "expired" in error_str or "permission" in error_str or "invalid" in error_str)
+
+
+# -- Telemetry --
+
+# Game and experiment of the requests issued in the current task, set by the game processing functions
+REQUEST_CONTEXT = contextvars.ContextVar("request_context", default={})
+
+
+def set_request_context(game: str, experiment: str):
+    REQUEST_CONTEXT.set(dict(game=game, experiment=experiment))
+    set_trace_tags(game=game, experiment=experiment)
+
+
+def classify_failure(error: Exception) -> str:
+    """Coarse failure class for telemetry."""
+    if is_rate_limit_error(error):
+        return "rate_limit"
+    if isinstance(error, StreamAborted):
+        return "stream_aborted"
+    if isinstance(error, ContextWindowExceeded):
+        return "context_window"
+    if isinstance(error, CompletionTruncated):
+        return "truncated"
+    if is_structured_output_rejected(error):
+        return "schema_rejected"
+    if isinstance(error, (ValidationError, json.JSONDecodeError, ValueError)):
+        return "parse"
+    if "timeout" in type(error).__name__.lower() or "timed out" in str(error).lower():
+        return "timeout"
+    return type(error).__name__
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _prometheus_labels(labels: dict) -> str:
+    escaped = {k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+class MetricsRecorder:
+    """
+    Collects RequestMetrics of all players. Each record is appended to a JSONL file as it is made;
+    the run summary and the Prometheus text exposition are computed from the records of this run.
+    """
+    QUANTILES = (50, 95, 99)
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def record(self, metrics: RequestMetrics):
+        with self._lock:
+            self.records.append(metrics)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(metrics.model_dump_json() + "\n")
+
+    @staticmethod
+    def _groups(records: List[RequestMetrics], key: Callable[[RequestMetrics], tuple]) -> dict:
+        groups = {}
+        for r in records:
+            groups.setdefault(key(r), []).append(r)
+        return groups
+
+    def _describe(self, records: List[RequestMetrics]) -> str:
+        answered = [r for r in records if r.outcome != "cache_hit"]
+        latencies = sorted(r.latency for r in answered)
+        busy = sum(r.latency for r in answered if r.outcome == "ok")
+        completion_tokens = sum(r.completion_tokens for r in answered if r.outcome == "ok")
+        rate = f"{completion_tokens / busy:.0f} tok/s" if busy else "n/a tok/s"
+        quantiles = " / ".join(f"{percentile(latencies, q):.2f}s" for q in self.QUANTILES)
+        failed = sum(r.outcome == "failed" for r in records)
+        retries = sum(r.retries for r in records)
+        rate_limited = sum(r.rate_limited for r in records)
+        hits = len(records) - len(answered)
+        return (f"{len(records)} requests, p50/p95/p99 {quantiles}, {rate}, "
+                f"{failed} failed, {retries} retries, {rate_limited} rate limited, {hits} cache hits")
+
+    def summary(self) -> str:
+        if not self.records:
+            return "⏱️ No requests recorded"
+        lines = ["⏱️ Request latency and throughput:"]
+        for (provider,), records in sorted(self._groups(self.records, lambda r: (r.provider,)).items()):
+            lines.append(f"   {provider}: {self._describe(records)}")
+            for (game,), game_records in sorted(self._groups(records, lambda r: (r.game or "-",)).items()):
+                lines.append(f"      {game}: {self._describe(game_records)}")
+        failures = self._groups([r for r in self.records if r.failure_class], lambda r: (r.failure_class,))
+        if failures:
+            lines.append("   Failure classes: " + ", ".join(f"{c}={len(rs)}" for (c,), rs in sorted(failures.items())))
+        return "\n".join(lines)
+
+    def prometheus_text(self) -> str:
+        """Counters and latency summaries in the Prometheus text format (e.g. for a node_exporter textfile collector)."""
+        out = []
+
+        def header(name: str, kind: str, help_text: str):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        base = lambda r: dict(provider=r.provider, model=r.model, game=r.game or "", experiment=r.experiment or "")
+        by_config = self._groups(self.records, lambda r: tuple(base(r).items()))
+
+        header("llm_requests_total", "counter", "Generation calls by outcome.")
+        for labels, records in sorted(by_config.items()):
+            for (outcome,), rs in sorted(self._groups(records, lambda r: (r.outcome,)).items()):
+                out.append(f"llm_requests_total{_prometheus_labels(dict(labels, outcome=outcome))} {len(rs)}")
+
+        header("llm_tokens_total", "counter", "Tokens reported by the provider.")
+        for labels, records in sorted(by_config.items()):
+            for kind in ("prompt", "completion", "cached"):
+                total = sum(getattr(r, f"{kind}_tokens") for r in records)
+                out.append(f"llm_tokens_total{_prometheus_labels(dict(labels, kind=kind))} {total}")
+
+        header("llm_retries_total", "counter", "Attempts beyond the first one.")
+        for labels, records in sorted(by_config.items()):
+            out.append(f"llm_retries_total{_prometheus_labels(dict(labels))} {sum(r.retries for r in records)}")
+
+        header("llm_failures_total", "counter", "Last failure class of calls that needed a retry or failed.")
+        for labels, records in sorted(by_config.items()):
+            for (failure,), rs in sorted(self._groups([r for r in records if r.failure_class], lambda r: (r.failure_class,)).items()):
+                out.append(f"llm_failures_total{_prometheus_labels(dict(labels, failure_class=failure))} {len(rs)}")
+
+        for name, field, help_text in (
+            ("llm_request_latency_seconds", "latency", "Wall time of generation calls including retries."),
+            ("llm_time_to_first_token_seconds", "ttft", "Time to the first streamed token."),
+        ):
+            header(name, "summary", help_text)
+            for labels, records in sorted(by_config.items()):
+                values = sorted(getattr(r, field) for r in records if r.outcome != "cache_hit" and getattr(r, field) is not None)
+                if not values:
+                    continue
+                for q in self.QUANTILES:
+                    out.append(f"{name}{_prometheus_labels(dict(labels, quantile=q / 100))} {percentile(values, q):.4f}")
+                out.append(f"{name}_sum{_prometheus_labels(dict(labels))} {sum(values):.4f}")
+                out.append(f"{name}_count{_prometheus_labels(dict(labels))} {len(values)}")
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+# -- Retry Policy --
+
+class RetryPolicy(BaseModel):
+    """Backoff, per-attempt deadline, hedging and circuit breaker settings of a player."""
+    # Exponential backoff with full jitter between failed attempts
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    # Seconds one attempt may take before it is abandoned (None = the SDK default)
+    attempt_timeout: Optional[float] = 120.0
+    # Percentile of recent attempt latencies after which a duplicate request is sent (None = no hedging)
+    hedge_quantile: Optional[float] = None
+    max_hedges: int = 1
+    # Successful attempts observed before hedging starts, and how many recent ones are kept
+    hedge_min_samples: int = 20
+    latency_window: int = 200
+    # Consecutive endpoint failures that open the circuit, and seconds until a probe request is let through
+    breaker_threshold: int = 5
+    breaker_cooldown: float = 30.0
+
+    def backoff(self, attempt: int) -> float:
+        """Seconds to wait after the given failed attempt (0-based): uniform in [0, min(max_delay, base_delay * 2^attempt)]."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to an endpoint whose circuit breaker is open."""
+    pass
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Timeouts, connection and server errors: failures of the endpoint rather than of the request or the answer."""
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and 400 <= status < 500:
+        return False
+    return classify_failure(error) not in ("rate_limit", "stream_aborted", "schema_rejected", "parse", "context_window", "truncated")
+
+
+class CircuitBreaker:
+    """
+    Shared by all players of one endpoint. After `threshold` consecutive endpoint failures, requests fail fast for
+    `cooldown` seconds; then a single probe is let through. Success closes the circuit, failure opens it again
+    for twice as long (up to MAX_COOLDOWN). A probe that is never sent gives its turn back with abandon_probe(),
+    and one that has not reported back within a cooldown is given up, so a lost probe cannot keep the circuit shut.
+    """
+    MAX_COOLDOWN = 600.0
+
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def _probe_pending(self, now: float) -> bool:
+        return self.probing and now - self.probe_started < self.cooldown
+
+    def check(self) -> bool:
+        """Raises CircuitOpenError unless a request may be sent now. Returns True if the request is the probe."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            now = time.monotonic()
+            remaining = self.opened_at + self.cooldown - now
+            if remaining > 0 or self._probe_pending(now):
+                raise CircuitOpenError(f"Circuit open for {self.name} after {self.failures} consecutive failures, "
+                                       f"next probe in {max(0.0, remaining):.0f}s")
+            self.probing = True
+            self.probe_started = now
+            print(f"🔌 [{self.name}] Circuit half-open, sending a probe request")
+            return True
+
+    def abandon_probe(self):
+        """Lets the next request probe instead of this one, which ended without an answer from the endpoint."""
+        with self._lock:
+            self.probing = False
+
+    def is_open(self) -> bool:
+        """True while check() would fail fast, without claiming the probe."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            now = time.monotonic()
+            return self._probe_pending(now) or now < self.opened_at + self.cooldown
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"🔌 [{self.name}] Circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing:
+                self.cooldown = min(self.MAX_COOLDOWN, self.cooldown * 2)
+            elif self.opened_at is not None or self.failures < self.threshold:
+                return
+            self.opened_at = time.monotonic()
+            self.probing = False
+            trace_instant("circuit_open", circuit=self.name, cooldown=self.cooldown)
+            print(f"🔌 [{self.name}] Circuit open for {self.cooldown:.0f}s after {self.failures} consecutive failures")
+
+
+_CIRCUIT_BREAKERS = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+def circuit_breaker(endpoint: str, policy: RetryPolicy) -> CircuitBreaker:
+    with _CIRCUIT_BREAKERS_LOCK:
+        if endpoint not in _CIRCUIT_BREAKERS:
+            _CIRCUIT_BREAKERS[endpoint] = CircuitBreaker(endpoint, policy.breaker_threshold, policy.breaker_cooldown)
+        return _CIRCUIT_BREAKERS[endpoint]
+
+
+# -- Completion Budgets --
+
+class CompletionTruncated(Exception):
+    """The answer was cut off at the completion budget of the request and is retried with a larger one."""
+    def __init__(self, budget: int, escalated: int, completion_tokens: int):
+        super().__init__(f"Answer cut off at the {budget} token completion budget")
+        self.budget = budget
+        self.escalated = escalated
+        self.completion_tokens = completion_tokens
+
+
+# Completion token limit of the attempt being sent, read when its request parameters are built
+COMPLETION_BUDGET = contextvars.ContextVar("completion_budget", default=None)
+# Expected answer length in characters of the request being made, e.g. the size of the sample's next state
+ANSWER_SIZE = contextvars.ContextVar("answer_size", default=None)
+# Sampling parameters the request being made is sent with in place of the player's own, e.g. those of a batch line
+SAMPLING_PARAMS = contextvars.ContextVar("sampling_params", default=None)
+
+
+@contextlib.contextmanager
+def expected_answer_size(chars: Optional[int]):
+    """Lets the requests made inside the block size their completion budget from an expected answer length."""
+    token = ANSWER_SIZE.set(chars)
+    try:
+        yield
+    finally:
+        ANSWER_SIZE.reset(token)
+
+
+class CompletionBudgets:
+    """
+    Sizes the completion token limit of each request from the tokens earlier answers of the same game and experiment
+    actually used, so reasoning overhead is learned along with the answer. Where samples come with an expected answer
+    size, tokens are fitted linearly against it and the budget follows the sample; the fit is shifted up until every
+    observed answer lies under it. Until a few answers were seen, the expected answer size is taken at about
+    four characters per token; requests without one get the ceiling, as a cut-off answer costs more than a generous limit.
+    """
+    chars_per_token = 4
+    def __init__(self, margin: float = 1.3, floor: int = 256, window: int = 50, min_history: int = 3):
+        self.margin = margin
+        self.floor = floor
+        self.min_history = min_history
+        self.window = window
+        # (game, experiment) -> recent (completion tokens, expected answer characters or None)
+        self._history = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: tuple, completion_tokens: int, answer_size: Optional[int]):
+        with self._lock:
+            self._history.setdefault(key, collections.deque(maxlen=self.window)).append((completion_tokens, answer_size))
+
+    def estimate(self, key: tuple, answer_size: Optional[int], ceiling: int) -> int:
+        with self._lock:
+            history = list(self._history.get(key, ()))
+        sized = [(size, tokens) for tokens, size in history if size]
+        if len(history) < self.min_history:
+            if not answer_size:
+                return ceiling
+            expected = answer_size / self.chars_per_token
+        elif answer_size and len(sized) >= self.min_history:
+            expected = self._fit(sized, answer_size)
+        else:
+            expected = max(tokens for tokens, _ in history)
+        return max(1, min(ceiling, max(self.floor, math.ceil(expected * self.margin))))
+
+    @staticmethod
+    def _fit(sized: List[tuple], answer_size: int) -> float:
+        """Upper envelope of a least squares line through (answer size, tokens)."""
+        mean_size = sum(size for size, _ in sized) / len(sized)
+        mean_tokens = sum(tokens for _, tokens in sized) / len(sized)
+        spread = sum((size - mean_size) ** 2 for size, _ in sized)
+        if spread == 0:
+            # All answers so far had the same expected size: scale the largest
+            return answer_size * max(tokens for _, tokens in sized) / mean_size
+        slope = max(0.0, sum((size - mean_size) * (tokens - mean_tokens) for size, tokens in sized) / spread)
+        offset = max(tokens - slope * size for size, tokens in sized)
+        return offset + slope * answer_size
+
+
+# -- Players --
+
+class BaseGamePlayer:
+    """Base interface for game players with shared parsing logic."""
+    provider_name = "base"
+    max_attempts = 5
+    # Generation settings sent with every request; also part of the response cache key
+    sampling_params = {}
+    # Per-key budgets used when none are given explicitly (None = unknown, not paced)
+    default_rpm = None
+    default_tpm = None
+    # Tokens reserved for the completion until the provider reports real usage
+    completion_token_reserve = 1024
+    # Request parameter limiting the completion; None leaves the provider's limit alone and adaptive budgets off
+    completion_limit_param = None
+    # Most completion tokens an escalating budget may ask for (with escalate_truncated); None stays within the limit in sampling_params
+    max_completion_tokens = None
+    # Seconds a key is kept out of rotation after a 429
+    rate_limit_cooldown = 30
+    max_rate_limit_retries = 10
+    # API endpoint; None uses the SDK default
+    base_url = None
+    # Context window in tokens (prompt + completion); None disables the preflight check
+    context_window = None
+    # Environment variables searched for the keys to pool: comma-separated lists first, then single keys
+    api_key_env = ()
+    # Keyless endpoints such as local servers get a placeholder when no key is configured
+    api_key_required = True
+    # The endpoint has an asynchronous batch API (see make_batch_backend); others need --batch_backend local
+    supports_batch = False
+
+    def __init__(
+        self,
+        model_name: str,
+        api_keys: Union[str, List[str]],
+        max_concurrency: int = 1,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        base_url: Optional[str] = None
+    ):
+        self.model_name = model_name
+        # Endpoint override, e.g. a proxy or a local mock server
+        self.base_url = base_url or self.base_url
+        self.api_keys = [api_keys] if isinstance(api_keys, str) else list(api_keys)
+        self.api_key = self.api_keys[0] if self.api_keys else None
+        # Upper bound on in-flight requests for this provider in async mode
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = None
+        self.key_pool = KeyPool(self.api_keys, rpm or self.default_rpm, tpm or self.default_tpm)
+        self.usage = TokenUsage()
+        # Optional persistent ResponseCache consulted before any request is sent
+        self.response_cache = None
+        # Stream completions and abort those that cannot match the response model
+        self.streaming = False
+        # Send the response model's JSON schema through the provider's structured output / JSON mode
+        self.structured_output = True
+        # Size the completion limit of every request from the expected answer instead of sending the fixed one
+        self.adaptive_budgets = True
+        # Retry answers cut off at the fixed limit with a larger budget, up to max_completion_tokens, instead of keeping
+        # their repaired prefix. Budgets sized below the fixed limit are always raised back to it
+        self.escalate_truncated = False
+        self._budgets = CompletionBudgets()
+        # Optional VerificationStats: answers are checked against the game rules as they arrive
+        self.verification = None
+        # "store": samples are appended to a ResultPartition per game; "json": output_<game>_<id>.json files
+        self.output_format = "store"
+        # Optional MetricsRecorder receiving one RequestMetrics per generation call
+        self.metrics = None
+        # Logical model served when this player is a backend of a RoutedGamePlayer
+        self.route = None
+        self.retry_policy = RetryPolicy()
+        # Latencies of recent successful attempts, for the hedging delay
+        self._latencies = collections.deque(maxlen=self.retry_policy.latency_window)
+        self._circuit = None
+        self._hedge_pool = None
+        # GDL compaction before prompting: None, "whitespace" (comments, spacing) or "symbols" (also shortens names)
+        self.compact_gdl = None
+        self.token_counter = TokenCounter()
+        # game key -> tokens of the prompt prefix, which is the same for every sample of a game
+        self._prefix_tokens = {}
+        if self.api_keys:
+            print(f"🔑 [{self.provider_name.capitalize()}] Pooling {self.key_pool.describe()}")
+
+    def _clean_response(self, text: str) -> str:
+        """Removes markdown code fences and whitespace."""
+        return re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE).strip()
+
+    def _complete(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Completion:
+        """Sends the prompt to the provider using the given key. To be implemented by subclasses."""
+        raise NotImplementedError
+
+    async def _acomplete(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Completion:
+        """Async variant of _complete. To be implemented by subclasses."""
+        raise NotImplementedError
+
+    def _stream_chunks(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Iterator[Completion]:
+        """Yields completion deltas; usage usually comes with the last one. To be implemented by subclasses."""
+        raise NotImplementedError
+
+    async def _astream_chunks(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> AsyncIterator[Completion]:
+        """Async variant of _stream_chunks. To be implemented by subclasses."""
+        raise NotImplementedError
+        yield
+
+    def _collect_stream(self, parts: List[str], usage: Completion, chunk: Completion, validator: IncrementalJSONValidator, started: float):
+        if chunk.text:
+            if usage.ttft is None:
+                usage.ttft = time.monotonic() - started
+            parts.append(chunk.text)
+            validator.feed(chunk.text)
+        usage.truncated = usage.truncated or chunk.truncated
+        # Usage is cumulative; keep the latest reported numbers
+        if chunk.prompt_tokens or chunk.completion_tokens:
+            usage.prompt_tokens = chunk.prompt_tokens
+            usage.completion_tokens = chunk.completion_tokens
+            usage.cached_tokens = chunk.cached_tokens
+
+    def _on_stream_aborted(self, started: float, error: StreamAborted):
+        self.usage.aborted_streams += 1
+        self.usage.aborted_seconds += time.monotonic() - started
+        print(f"✂️ [{self.provider_name.capitalize()}] Aborted stream after {time.monotonic() - started:.1f}s: {error}")
+
+    def _complete_stream(self, prompt: str, key_index: int, response_model: Type[BaseModel]) -> Completion:
+        """Streams the completion, validating it on the fly and stopping generation once it cannot succeed."""
+        validator = IncrementalJSONValidator(response_model)
+        started = time.monotonic()
+        parts, usage = [], Completion()
+        chunks = self._stream_chunks(prompt, key_index, response_model)
+        deadline = self.retry_policy.attempt_timeout
+        try:
+            for chunk in chunks:
+                self._collect_stream(parts, usage, chunk, validator, started)
+                if deadline and time.monotonic() - started > deadline:
+                    raise TimeoutError(f"Stream exceeded the {deadline:g}s attempt deadline")
+        except StreamAborted as e:
+            self._on_stream_aborted(started, e)
+            raise
+        finally:
+            chunks.close()
+        usage.text = "".join(parts)
+        return usage
+
+    async def _acomplete_stream(self, prompt: str, key_index: int, response_model: Type[BaseModel]) -> Completion:
+        validator = IncrementalJSONValidator(response_model)
+        started = time.monotonic()
+        parts, usage = [], Completion()
+        chunks = self._astream_chunks(prompt, key_index, response_model)
+        try:
+            async for chunk in chunks:
+                self._collect_stream(parts, usage, chunk, validator, started)
+        except StreamAborted as e:
+            self._on_stream_aborted(started, e)
+            raise
+        finally:
+            await chunks.aclose()
+        usage.text = "".join(parts)
+        return usage
+
+    def batch_body(self, prompt: str, response_model: Optional[Type[BaseModel]] = None) -> dict:
+        """Request body for one line of an OpenAI-style batch file."""
+        body = dict(model=self.model_name, messages=chat_messages(prompt), **self.sampling_params)
+        if self.structured_output and response_model is not None:
+            body["response_format"] = self._response_format(response_model)
+        return body
+
+    def _response_format(self, response_model: Type[BaseModel]) -> dict:
+        """The response model as an OpenAI-style json_schema response format."""
+        schema, strict = structured_output_schema(response_model)
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": response_model.__name__, "schema": schema, "strict": strict}
+        }
+
+    def release_prefix_caches(self, game_definition: str):
+        """Frees provider-side caches created for a game. Providers without explicit caching have nothing to release."""
+        pass
+
+    def _parse(self, raw_text: str, response_model: Type[T]) -> T:
+        """Parses the answer, falling back to repair_json when it is malformed. Repaired answers carry their repairs."""
+        with span("clean_response"):
+            clean_text = self._clean_response(raw_text or "")
+        if not clean_text:
+            raise ValueError("Empty response")
+        try:
+            with span("validate", model=response_model.__name__):
+                return response_model.model_validate_json(clean_text)
+        except ValidationError as error:
+            with span("repair", model=response_model.__name__):
+                repaired_text, repairs = repair_json(clean_text)
+                if not repairs:
+                    raise
+                try:
+                    response = response_model.model_validate_json(repaired_text)
+                except ValidationError:
+                    raise error
+        response._repairs = ", ".join(repairs)
+        return response
+
+    def _parse_completion(self, completion: Completion, response_model: Type[T]) -> T:
+        """Parses a completion, counting failures so the cost of malformed output shows in the run summary."""
+        self.usage.parsed += 1
+        try:
+            response = self._parse(completion.text, response_model)
+        except Exception:
+            self.usage.parse_failures += 1
+            raise
+        if getattr(response, "_repairs", None):
+            self.usage.repaired += 1
+        return response
+
+    def _on_structured_output_rejected(self, error: Exception) -> bool:
+        """Falls back to plain prompting when the endpoint does not accept a response schema."""
+        if not self.structured_output or not is_structured_output_rejected(error):
+            return False
+        print(f"⚠️ [{self.provider_name.capitalize()}] Structured output not supported, falling back to prompt-only JSON: {error}")
+        self.structured_output = False
+        return True
+
+    def _on_rate_limited(self, key_index: int, error: Exception):
+        print(f"🛑 [{self.provider_name.capitalize()}] Quota exceeded on key index {key_index}. Error: {error}")
+        self.key_pool.block(key_index, self.rate_limit_cooldown)
+
+    def _cache_key(self, prompt: str) -> str:
+        return ResponseCache.make_key(self.provider_name, self.model_name, self.sampling_params, prompt)
+
+    def _cached_response(self, prompt: str, response_model: Type[T]) -> Optional[T]:
+        """Returns the parsed cached answer for the prompt, if any. Raises CacheMissError in replay mode."""
+        if self.response_cache is None:
+            return None
+        key = self._cache_key(prompt)
+        completion = self.response_cache.get(key)
+        if completion is not None:
+            try:
+                return self._parse(completion.text, response_model)
+            except Exception:
+                # Stored under a different response model or cleaning rule; treat as a miss
+                self.response_cache.discard(key)
+        if self.response_cache.read_only:
+            raise CacheMissError(f"No cached response for {self.provider_name}/{self.model_name} prompt {key[:12]}")
+        return None
+
+    def _store_response(self, prompt: str, completion: Completion):
+        if self.response_cache is not None and not self.response_cache.read_only:
+            self.response_cache.put(self._cache_key(prompt), completion, self.provider_name, self.model_name)
+
+    def _start_metrics(self) -> RequestMetrics:
+        return RequestMetrics(provider=self.provider_name, model=self.model_name, route=self.route, **REQUEST_CONTEXT.get())
+
+    def _finish_metrics(self, metrics: RequestMetrics, outcome: str, started: float):
+        if self.metrics is None:
+            return
+        metrics.outcome = outcome
+        metrics.latency = time.monotonic() - started
+        self.metrics.record(metrics)
+
+    def completion_budget(self) -> int:
+        """Most completion tokens a request may produce."""
+        return self.sampling_params.get("max_tokens") or self.sampling_params.get("max_completion_tokens") or self.completion_token_reserve
+
+    def completion_ceiling(self, prompt: str) -> int:
+        """Largest budget a request may escalate to: the provider's output cap, within the context window the prompt leaves."""
+        ceiling = self.max_completion_tokens or self.completion_budget()
+        if self.context_window:
+            ceiling = min(ceiling, self.context_window - self.count_prompt_tokens(prompt))
+        return max(ceiling, 1)
+
+    def _plan_completion_budget(self, prompt: str, metrics: RequestMetrics) -> Optional[int]:
+        """Completion budget of a new request, or None to send the fixed limit of sampling_params."""
+        if not self.adaptive_budgets or not self.completion_limit_param:
+            return None
+        return self._budgets.estimate((metrics.game, metrics.experiment), ANSWER_SIZE.get(), self.escalation_ceiling(prompt))
+
+    def _sent_budget(self, prompt: str, metrics: RequestMetrics) -> Optional[int]:
+        """
+        Budget of an attempt going out now. It is planned again with the answers that arrived while the request waited
+        for quota or a concurrency slot, unless it was escalated after a cut-off answer.
+        """
+        if metrics.completion_budget is not None and not metrics.truncations:
+            metrics.completion_budget = self._plan_completion_budget(prompt, metrics)
+        return metrics.completion_budget
+
+    def _request_sampling_params(self) -> dict:
+        """sampling_params (or SAMPLING_PARAMS) with the budget of the attempt being sent. The cache key keeps using sampling_params."""
+        params = SAMPLING_PARAMS.get()
+        if params is None:
+            params = self.sampling_params
+        budget = COMPLETION_BUDGET.get()
+        if budget is None or not self.completion_limit_param:
+            return params
+        return {**params, self.completion_limit_param: budget}
+
+    def escalation_ceiling(self, prompt: str) -> int:
+        """Largest budget a cut-off answer is retried with; above it the answer is repaired and flagged like any other."""
+        if self.escalate_truncated:
+            return self.completion_ceiling(prompt)
+        return min(self.completion_budget(), self.completion_ceiling(prompt))
+
+    def _check_truncated(self, prompt: str, completion: Completion, metrics: RequestMetrics):
+        """Raises CompletionTruncated for an answer cut off at a budget that can still grow."""
+        budget = metrics.completion_budget
+        if not completion.truncated or budget is None:
+            return
+        ceiling = self.escalation_ceiling(prompt)
+        if budget < ceiling:
+            raise CompletionTruncated(budget, min(ceiling, 2 * budget), completion.completion_tokens)
+
+    def _escalate_budget(self, error: Exception, metrics: RequestMetrics) -> bool:
+        """Sends a cut-off answer again with twice the budget. Does not use up an attempt: budgets only grow up to the ceiling."""
+        if not isinstance(error, CompletionTruncated):
+            return False
+        self.usage.truncations += 1
+        self.usage.truncated_tokens += error.completion_tokens
+        metrics.truncations += 1
+        metrics.completion_budget = max(metrics.completion_budget or 0, error.escalated)
+        print(f"📏 [{self.provider_name.capitalize()}] Answer cut off at {error.budget} completion tokens, retrying with {error.escalated}")
+        return True
+
+    def count_prompt_tokens(self, prompt: str) -> int:
+        if not isinstance(prompt, GamePrompt):
+            return self.token_counter.count(prompt)
+        if prompt.game_key not in self._prefix_tokens:
+            self._prefix_tokens[prompt.game_key] = self.token_counter.count(prompt.prefix)
+        return self._prefix_tokens[prompt.game_key] + self.token_counter.count(prompt.suffix)
+
+    def check_context_window(self, prompt: str):
+        """Raises ContextWindowExceeded if the prompt and the completion budget do not fit the context window."""
+        if not self.context_window:
+            return
+        tokens = self.count_prompt_tokens(prompt)
+        if tokens + self.completion_budget() > self.context_window:
+            raise ContextWindowExceeded(
+                f"Prompt of {tokens} tokens + {self.completion_budget()} completion tokens exceeds "
+                f"the {self.context_window} token context window of {self.model_name}"
+            )
+
+    def _preflight(self, prompt: str, metrics: RequestMetrics, started: float):
+        try:
+            self.check_context_window(prompt)
+        except ContextWindowExceeded as e:
+            metrics.failure_class = classify_failure(e)
+            self._finish_metrics(metrics, "failed", started)
+            raise
+
+    def _circuit_breaker(self) -> CircuitBreaker:
+        if self._circuit is None:
+            self._circuit = circuit_breaker(f"{self.provider_name.capitalize()} {self.base_url or 'default endpoint'}", self.retry_policy)
+        return self._circuit
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds after which a duplicate request is sent, or None while hedging is off or latencies are still being learned."""
+        policy = self.retry_policy
+        if policy.hedge_quantile is None or len(self._latencies) < policy.hedge_min_samples:
+            return None
+        return percentile(sorted(self._latencies), policy.hedge_quantile)
+
+    def _attempt_succeeded(self, key_index: int, reserved: int, completion: Completion, metrics: RequestMetrics, started: float):
+        self._circuit_breaker().record_success()
+        self._latencies.append(time.monotonic() - started)
+        self.key_pool.settle(key_index, reserved, completion.total_tokens)
+        self.usage.add(completion)
+        metrics.add(completion)
+        if metrics.completion_budget is not None:
+            self.usage.budget_reserved += metrics.completion_budget
+            self.usage.budget_used += completion.completion_tokens
+            if completion.completion_tokens and not completion.truncated:
+                self._budgets.record((metrics.game, metrics.experiment), completion.completion_tokens, ANSWER_SIZE.get())
+
+    def _attempt_failed(self, key_index: int, error: Exception):
+        if is_endpoint_failure(error):
+            self._circuit_breaker().record_failure()
+        else:
+            # The endpoint answered, even if with an error
+            self._circuit_breaker().record_success()
+        if is_rate_limit_error(error):
+            self._on_rate_limited(key_index, error)
+
+    def _reserved_tokens(self, prompt: str, completion_budget: Optional[int]) -> int:
+        """Tokens an attempt books on its key: the prompt estimate plus the completion budget it is sent with."""
+        return estimate_tokens(prompt) + (completion_budget or self.completion_token_reserve)
+
+    def planned_reservation(self, prompt: str) -> int:
+        """Tokens a new request for the prompt would book on a key, with the completion budget it would be planned with."""
+        return self._reserved_tokens(prompt, self._plan_completion_budget(prompt, self._start_metrics()))
+
+    def _reserve_attempt(self, prompt: str, metrics: RequestMetrics) -> tuple:
+        """Circuit check and key assignment for one attempt. Returns (key_index, reserved tokens, whether it is the circuit's probe)."""
+        probe = self._circuit_breaker().check()
+        reserved = self._reserved_tokens(prompt, metrics.completion_budget)
+        try:
+            key_index = self.key_pool.acquire(reserved)
+        except BaseException:
+            self._abandon_probe(probe)
+            raise
+        metrics.attempts += 1
+        metrics.key_index = key_index
+        return key_index, reserved, probe
+
+    async def _areserve_attempt(self, prompt: str, metrics: RequestMetrics) -> tuple:
+        probe = self._circuit_breaker().check()
+        reserved = self._reserved_tokens(prompt, metrics.completion_budget)
+        try:
+            key_index = await self.key_pool.aacquire(reserved)
+        except BaseException:
+            # Also on cancellation, which `except Exception` does not see
+            self._abandon_probe(probe)
+            raise
+        metrics.attempts += 1
+        metrics.key_index = key_index
+        return key_index, reserved, probe
+
+    def _abandon_probe(self, probe: bool):
+        """Gives the circuit's probe back when the attempt holding it ends without an answer or an endpoint error."""
+        if probe:
+            self._circuit_breaker().abandon_probe()
+
+    def _send(self, prompt: str, response_model: Type[T], metrics: RequestMetrics, key_index: int, reserved: int, probe: bool = False) -> tuple:
+        """One attempt on the reserved key. Returns (completion, parsed answer)."""
+        started = time.monotonic()
+        budget = COMPLETION_BUDGET.set(self._sent_budget(prompt, metrics))
+        try:
+            with span("request", provider=self.provider_name, model=self.model_name, key=key_index):
+                if self.streaming:
+                    completion = self._complete_stream(prompt, key_index, response_model)
+                else:
+                    completion = self._complete(prompt, key_index, response_model)
+        except Exception as e:
+            self._attempt_failed(key_index, e)
+            raise
+        except BaseException:
+            self._abandon_probe(probe)
+            raise
+        finally:
+            COMPLETION_BUDGET.reset(budget)
+        self._attempt_succeeded(key_index, reserved, completion, metrics, started)
+        self._check_truncated(prompt, completion, metrics)
+        return completion, self._parse_completion(completion, response_model)
+
+    async def _asend(
+        self,
+        prompt: str,
+        response_model: Type[T],
+        metrics: RequestMetrics,
+        key_index: int,
+        reserved: int,
+        probe: bool = False,
+        sent: Optional[asyncio.Event] = None,
+        hedge: bool = False
+    ) -> tuple:
+        """
+        Async variant of _send. `sent` is set once the request holds a concurrency slot and goes out.
+        Hedges skip the concurrency limit: they are bounded by max_hedges per request already in flight.
+        """
+        try:
+            async with self._request_slot(hedge):
+                if sent is not None:
+                    sent.set()
+                # Runs as a task of its own, so the budget set here is not seen by other attempts
+                COMPLETION_BUDGET.set(self._sent_budget(prompt, metrics))
+                started = time.monotonic()
+                if self.streaming:
+                    call = self._acomplete_stream(prompt, key_index, response_model)
+                else:
+                    call = self._acomplete(prompt, key_index, response_model)
+                with span("request", provider=self.provider_name, model=self.model_name, key=key_index, hedge=hedge):
+                    completion = await asyncio.wait_for(call, self.retry_policy.attempt_timeout)
+        except asyncio.TimeoutError as e:
+            error = TimeoutError(f"Attempt exceeded the {self.retry_policy.attempt_timeout:g}s deadline")
+            self._attempt_failed(key_index, error)
+            raise error from e
+        except Exception as e:
+            self._attempt_failed(key_index, e)
+            raise
+        except BaseException:
+            # Cancelled, e.g. a hedge leg that lost: the endpoint gave no verdict
+            self._abandon_probe(probe)
+            raise
+        self._attempt_succeeded(key_index, reserved, completion, metrics, started)
+        self._check_truncated(prompt, completion, metrics)
+        return completion, self._parse_completion(completion, response_model)
+
+    @contextlib.asynccontextmanager
+    async def _request_slot(self, hedge: bool):
+        """Holds one of the max_concurrency slots for the duration of the block; hedges do not take one."""
+        if hedge:
+            yield
+            return
+        with span("slot_wait"):
+            await self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    def _on_hedge(self, metrics: RequestMetrics):
+        metrics.hedges += 1
+        self.usage.hedged += 1
+
+    def _send_hedge(self, prompt: str, response_model: Type[T], metrics: RequestMetrics) -> tuple:
+        """A duplicate attempt. It waits for its key on its own thread, so the hedging loop keeps watching the other legs."""
+        return self._send(prompt, response_model, metrics, *self._reserve_attempt(prompt, metrics))
+
+    async def _asend_hedge(self, prompt: str, response_model: Type[T], metrics: RequestMetrics) -> tuple:
+        return await self._asend(prompt, response_model, metrics, *await self._areserve_attempt(prompt, metrics), hedge=True)
+
+    def _hedged_call(self, prompt: str, response_model: Type[T], metrics: RequestMetrics) -> tuple:
+        """
+        One attempt, duplicated on another key once the hedging delay passes without an answer; the first valid answer wins.
+        Sync requests cannot be interrupted, so a losing request finishes in a background thread and is discarded.
+        Each leg counts its attempt and tokens in metrics of its own; only those of the leg whose outcome is used are merged.
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._send(prompt, response_model, metrics, *self._reserve_attempt(prompt, metrics))
+        if self._hedge_pool is None:
+            self._hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4 * (self.retry_policy.max_hedges + 1))
+        # Legs run in pool threads; each gets a copy of the caller's context so its spans keep the game / sample tags
+        first = metrics.fork()
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._send, prompt, response_model, first, *self._reserve_attempt(prompt, first))
+        legs = {primary: first}
+        pending = {primary}
+        while pending:
+            can_hedge = len(legs) <= self.retry_policy.max_hedges
+            done, pending = concurrent.futures.wait(pending, timeout=delay if can_hedge else None, return_when=concurrent.futures.FIRST_COMPLETED)
+            for leg in (leg for leg in legs if leg in done):
+                if leg.exception() is None:
+                    if leg is not primary:
+                        self.usage.hedge_wins += 1
+                    metrics.merge(legs[leg])
+                    return leg.result()
+                if isinstance(leg.exception(), (CircuitOpenError, QuotaWaitExceeded)):
+                    # A hedge found no key to send on: leave the request to the legs already out
+                    delay = None
+            if not done and can_hedge:
+                self._on_hedge(metrics)
+                hedge = metrics.fork()
+                leg = self._hedge_pool.submit(contextvars.copy_context().run, self._send_hedge, prompt, response_model, hedge)
+                legs[leg] = hedge
+                pending.add(leg)
+        # Every leg failed; the request goes on with the outcome of its own attempt
+        metrics.merge(first)
+        raise primary.exception()
+
+    async def _ahedged_call(self, prompt: str, response_model: Type[T], metrics: RequestMetrics) -> tuple:
+        """Async variant of _hedged_call; losing requests are cancelled."""
+        if self.retry_policy.hedge_quantile is None:
+            return await self._asend(prompt, response_model, metrics, *await self._areserve_attempt(prompt, metrics))
+        sent = asyncio.Event()
+        first = metrics.fork()
+        primary = asyncio.ensure_future(self._asend(prompt, response_model, first, *await self._areserve_attempt(prompt, first), sent=sent))
+        legs = {primary: first}
+        pending = {primary}
+        try:
+            # The delay counts from when the request goes out, not from when it queued for a concurrency slot,
+            # and uses the latencies observed up to then
+            waiter = asyncio.ensure_future(sent.wait())
+            await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            delay = self._hedge_delay()
+            if delay is None:
+                try:
+                    return await primary
+                finally:
+                    metrics.merge(first)
+            while pending:
+                can_hedge = len(legs) <= self.retry_policy.max_hedges
+                done, pending = await asyncio.wait(pending, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+                for leg in (leg for leg in legs if leg in done):
+                    if leg.exception() is None:
+                        if leg is not primary:
+                            self.usage.hedge_wins += 1
+                        metrics.merge(legs[leg])
+                        return leg.result()
+                    if isinstance(leg.exception(), (CircuitOpenError, QuotaWaitExceeded)):
+                        delay = None
+                if not done and can_hedge:
+                    self._on_hedge(metrics)
+                    hedge = metrics.fork()
+                    leg = asyncio.ensure_future(self._asend_hedge(prompt, response_model, hedge))
+                    legs[leg] = hedge
+                    pending.add(leg)
+            metrics.merge(first)
+            raise primary.exception()
+        finally:
+            for leg in pending:
+                leg.cancel()
+
+    def _generate_json(self, prompt: str, response_model: Type[T]) -> T:
+        """Generates a completion and parses it into response_model, retrying on failures."""
+        started = time.monotonic()
+        metrics = self._start_metrics()
+        self._preflight(prompt, metrics, started)
+        cached = self._cached_response(prompt, response_model)
+        if cached is not None:
+            self._finish_metrics(metrics, "cache_hit", started)
+            return cached
+        metrics.completion_budget = self._plan_completion_budget(prompt, metrics)
+        attempt = 0
+        rate_limited = 0
+        while attempt < self.max_attempts:
+            try:
+                completion, parsed = self._hedged_call(prompt, response_model, metrics)
+                self._store_response(prompt, completion)
+                self._finish_metrics(metrics, "ok", started)
+                return parsed
+            except (CircuitOpenError, QuotaWaitExceeded) as e:
+                # Fail fast; the sample can be resumed once the endpoint recovers, or the router sends it elsewhere
+                metrics.failure_class = classify_failure(e)
+                self._finish_metrics(metrics, "failed", started)
+                raise
+            except Exception as e:
+                metrics.failure_class = classify_failure(e)
+                # Rate limits do not use up an attempt; the pool moves on to another key
+                if is_rate_limit_error(e) and rate_limited < self.max_rate_limit_retries:
+                    rate_limited += 1
+                    metrics.rate_limited += 1
+                    continue
+                if self._on_structured_output_rejected(e):
+                    continue
+                if self._escalate_budget(e, metrics):
+                    continue
+                print(f"❌ {self.provider_name.capitalize()} attempt {attempt+1} failed: {e}")
+                attempt += 1
+                if attempt < self.max_attempts:
+                    with span("retry_sleep", attempt=attempt):
+                        time.sleep(self.retry_policy.backoff(attempt - 1))
+        self._finish_metrics(metrics, "failed", started)
+        return ""
+
+    async def _agenerate_json(self, prompt: str, response_model: Type[T]) -> T:
+        """Async variant of _generate_json. At most max_concurrency calls are in flight per player."""
+        started = time.monotonic()
+        metrics = self._start_metrics()
+        self._preflight(prompt, metrics, started)
+        cached = self._cached_response(prompt, response_model)
+        if cached is not None:
+            self._finish_metrics(metrics, "cache_hit", started)
+            return cached
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        metrics.completion_budget = self._plan_completion_budget(prompt, metrics)
+        attempt = 0
+        rate_limited = 0
+        while attempt < self.max_attempts:
+            try:
+                completion, parsed = await self._ahedged_call(prompt, response_model, metrics)
+                self._store_response(prompt, completion)
+                self._finish_metrics(metrics, "ok", started)
+                return parsed
+            except (CircuitOpenError, QuotaWaitExceeded) as e:
+                metrics.failure_class = classify_failure(e)
+                self._finish_metrics(metrics, "failed", started)
+                raise
+            except Exception as e:
+                metrics.failure_class = classify_failure(e)
+                if is_rate_limit_error(e) and rate_limited < self.max_rate_limit_retries:
+                    rate_limited += 1
+                    metrics.rate_limited += 1
+                    continue
+                if self._on_structured_output_rejected(e):
+                    continue
+                if self._escalate_budget(e, metrics):
+                    continue
+                print(f"❌ {self.provider_name.capitalize()} attempt {attempt+1} failed: {e}")
+                attempt += 1
+                if attempt < self.max_attempts:
+                    with span("retry_sleep", attempt=attempt):
+                        await asyncio.sleep(self.retry_policy.backoff(attempt - 1))
+        self._finish_metrics(metrics, "failed", started)
+        return ""
+
+    # -- Specific Experiment Methods --
+
+    def evaluate_next_state(self, game_definition: str, game_state: str, move: str) -> LLMNextStateResponse:
+        prompt = build_next_state_prompt(game_definition, game_state, move)
+        return self._generate_json(prompt, LLMNextStateResponse)
+
+    def evaluate_legal_moves(self, game_definition: str, game_state: str) -> LLMLegalMovesResponse:
+        prompt = build_legal_moves_prompt(game_definition, game_state)
+        return self._generate_json(prompt, LLMLegalMovesResponse)
+
+    def evaluate_multi_step(self, game_definition: str, moves: List[MoveStep]) -> LLMNextStateResponse:
+        prompt = build_multi_step_prompt(game_definition, moves)
+        return self._generate_json(prompt, LLMNextStateResponse)
+
+    def evaluate_multi_step_generation(self, game_definition: str, n: int, example_move: str) -> LLMMultiStepGenResponse:
+        prompt = build_multi_step_generation_prompt(game_definition, n, example_move)
+        return self._generate_json(prompt, LLMMultiStepGenResponse)
+
+    # -- Async Experiment Methods --
+
+    async def aevaluate_next_state(self, game_definition: str, game_state: str, move: str) -> LLMNextStateResponse:
+        prompt = build_next_state_prompt(game_definition, game_state, move)
+        return await self._agenerate_json(prompt, LLMNextStateResponse)
+
+    async def aevaluate_legal_moves(self, game_definition: str, game_state: str) -> LLMLegalMovesResponse:
+        prompt = build_legal_moves_prompt(game_definition, game_state)
+        return await self._agenerate_json(prompt, LLMLegalMovesResponse)
+
+    async def aevaluate_multi_step(self, game_definition: str, moves: List[MoveStep]) -> LLMNextStateResponse:
+        prompt = build_multi_step_prompt(game_definition, moves)
+        return await self._agenerate_json(prompt, LLMNextStateResponse)
+
+    async def aevaluate_multi_step_generation(self, game_definition: str, n: int, example_move: str) -> LLMMultiStepGenResponse:
+        prompt = build_multi_step_generation_prompt(game_definition, n, example_move)
+        return await self._agenerate_json(prompt, LLMMultiStepGenResponse)
+
+
+class GeminiGamePlayer(BaseGamePlayer):
+    """Implementation using Google Gemini API. The game definition prefix is kept in an explicit context cache."""
+    provider_name = "gemini"
+    max_attempts = 5
+    sampling_params = dict(temperature=0.2)
+    supports_batch = True
+    context_window = 1_048_576
+    api_key_env = ("GOOGLE_API_KEYS", "GOOGLE_API_KEY")
+    # Explicit caches below this size are rejected by the API
+    min_cache_tokens = 1024
+    # Seconds a context cache lives; one used with less than cache_refresh_margin left is extended by another cache_ttl
+    cache_ttl = 3600
+    cache_refresh_margin = 600
+
+    def __init__(
+        self,
+        model_name: str,
+        api_key: Union[str, List[str]],
+        max_concurrency: int = 1,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        base_url: Optional[str] = None
+    ):
+        super().__init__(model_name, api_key, max_concurrency, rpm, tpm, base_url)
+        from google import genai
+        from google.genai.types import HttpOptions
+        http_options = HttpOptions(timeout=60*2*1000, base_url=self.base_url)
+        self.clients = [genai.Client(api_key=key, http_options=http_options) for key in self.api_keys]
+        self.client = self.clients[0]
+        # (key_index, prefix hash) -> (game_key, cache name or None when the prefix cannot be cached, monotonic expiry)
+        self._prefix_caches = {}
+        self._cache_lock = threading.Lock()
+        self._async_cache_lock = None
+
+    def _cache_slot(self, prompt: str, key_index: int) -> Optional[tuple]:
+        """Cache lookup key for a prompt, or None if the prompt has no cacheable prefix."""
+        if not isinstance(prompt, GamePrompt) or estimate_tokens(prompt.prefix) < self.min_cache_tokens:
+            return None
+        return key_index, hashlib.sha256(prompt.prefix.encode("utf-8")).hexdigest()
+
+    def _cache_config(self, prompt: GamePrompt):
+        from google.genai.types import CreateCachedContentConfig
+        return CreateCachedContentConfig(
+            contents=[prompt.prefix],
+            ttl=f"{self.cache_ttl}s",
+            display_name=f"ggp-{prompt.game_key}"
+        )
+
+    def _ttl_config(self):
+        from google.genai.types import UpdateCachedContentConfig
+        return UpdateCachedContentConfig(ttl=f"{self.cache_ttl}s")
+
+    def _cache_entry(self, slot: tuple) -> Optional[tuple]:
+        """The slot's entry, or None when its cache has to be created (first use, or expired while the game was running)."""
+        entry = self._prefix_caches.get(slot)
+        if entry is not None and entry[1] is not None and entry[2] <= time.monotonic():
+            return None
+        return entry
+
+    def _needs_refresh(self, entry: Optional[tuple]) -> bool:
+        return entry is not None and entry[1] is not None and entry[2] - time.monotonic() < self.cache_refresh_margin
+
+    def _cache_created(self, slot: tuple, prompt: GamePrompt, cache) -> tuple:
+        self._prefix_caches[slot] = (prompt.game_key, cache.name, time.monotonic() + self.cache_ttl)
+        print(f"🗄️ [Gemini] Cached game definition prefix as {cache.name}")
+        return self._prefix_caches[slot]
+
+    def _cache_unavailable(self, slot: tuple, prompt: GamePrompt, error: Exception) -> tuple:
+        print(f"⚠️ [Gemini] Context cache unavailable, sending full prompts: {error}")
+        self._prefix_caches[slot] = (prompt.game_key, None, math.inf)
+        return self._prefix_caches[slot]
+
+    def _cache_refreshed(self, slot: tuple, entry: tuple, error: Optional[Exception]) -> Optional[tuple]:
+        """Books a TTL extension. A cache that could not be extended is created anew."""
+        if error is not None:
+            print(f"⚠️ [Gemini] Failed to extend context cache {entry[1]}, creating it anew: {error}")
+            del self._prefix_caches[slot]
+            return None
+        self._prefix_caches[slot] = (entry[0], entry[1], time.monotonic() + self.cache_ttl)
+        return self._prefix_caches[slot]
+
+    def _get_prefix_cache(self, prompt: str, key_index: int) -> Optional[str]:
+        """Returns the cache name holding the prompt prefix, creating it on first use for this game and key."""
+        slot = self._cache_slot(prompt, key_index)
+        if slot is None:
+            return None
+        caches = self.clients[key_index].caches
+        with self._cache_lock:
+            entry = self._cache_entry(slot)
+            if self._needs_refresh(entry):
+                try:
+                    caches.update(name=entry[1], config=self._ttl_config())
+                    entry = self._cache_refreshed(slot, entry, None)
+                except Exception as e:
+                    entry = self._cache_refreshed(slot, entry, e)
+            if entry is None:
+                try:
+                    entry = self._cache_created(slot, prompt, caches.create(model=self.model_name, config=self._cache_config(prompt)))
+                except Exception as e:
+                    entry = self._cache_unavailable(slot, prompt, e)
+            return entry[1]
+
+    async def _aget_prefix_cache(self, prompt: str, key_index: int) -> Optional[str]:
+        slot = self._cache_slot(prompt, key_index)
+        if slot is None:
+            return None
+        if self._async_cache_lock is None:
+            self._async_cache_lock = asyncio.Lock()
+        caches = self.clients[key_index].aio.caches
+        # Held while creating so concurrent samples of the same game do not create duplicates
+        async with self._async_cache_lock:
+            entry = self._cache_entry(slot)
+            if self._needs_refresh(entry):
+                try:
+                    await caches.update(name=entry[1], config=self._ttl_config())
+                    entry = self._cache_refreshed(slot, entry, None)
+                except Exception as e:
+                    entry = self._cache_refreshed(slot, entry, e)
+            if entry is None:
+                try:
+                    entry = self._cache_created(slot, prompt, await caches.create(model=self.model_name, config=self._cache_config(prompt)))
+                except Exception as e:
+                    entry = self._cache_unavailable(slot, prompt, e)
+            return entry[1]
+
+    def _cache_rejected(self, prompt: str, key_index: int, cache_name: Optional[str], error: Exception) -> bool:
+        """
+        True if a request failed because its context cache is gone (expired, deleted or otherwise refused). The slot
+        is dropped so the next request of the game creates the cache again; the failed one is resent with the full prompt.
+        """
+        if cache_name is None or not is_cache_rejected_error(error):
+            return False
+        slot = self._cache_slot(prompt, key_index)
+        with self._cache_lock:
+            if self._prefix_caches.get(slot, (None, None))[1] == cache_name:
+                del self._prefix_caches[slot]
+        print(f"⚠️ [Gemini] Context cache {cache_name} rejected, resending the full prompt: {error}")
+        return True
+
+    def release_prefix_caches(self, game_definition: str):
+        key = game_key(game_definition)
+        with self._cache_lock:
+            slots = [slot for slot, entry in self._prefix_caches.items() if entry[0] == key]
+            for slot in slots:
+                name = self._prefix_caches.pop(slot)[1]
+                if name is None:
+                    continue
+                try:
+                    self.clients[slot[0]].caches.delete(name=name)
+                    print(f"🧹 [Gemini] Released context cache {name}")
+                except Exception as e:
+                    print(f"⚠️ [Gemini] Failed to release context cache {name}: {e}")
+
+    def generation_config(self, response_model: Optional[Type[BaseModel]] = None) -> dict:
+        """Sampling parameters plus the response schema; also the config of inlined batch requests."""
+        config = dict(self._request_sampling_params())
+        if self.structured_output and response_model is not None:
+            schema, strict = structured_output_schema(response_model)
+            config["response_mime_type"] = "application/json"
+            if strict:
+                config["response_json_schema"] = schema
+        return config
+
+    def _request(self, prompt: str, cache_name: Optional[str], response_model: Optional[Type[BaseModel]] = None) -> dict:
+        from google.genai.types import GenerateContentConfig, HttpOptions
+        config = self.generation_config(response_model)
+        if self.retry_policy.attempt_timeout:
+            config["http_options"] = HttpOptions(timeout=int(self.retry_policy.attempt_timeout * 1000))
+        if cache_name:
+            return dict(
+                model=self.model_name,
+                contents=self._contents(prompt, cached=True),
+                config=GenerateContentConfig(cached_content=cache_name, **config)
+            )
+        return dict(
+            model=self.model_name,
+            contents=self._contents(prompt, cached=False),
+            config=GenerateContentConfig(**config)
+        )
+
+    @staticmethod
+    def _contents(prompt: str, cached: bool):
+        """Request contents; a cached prefix is left out. Conversation turns become alternating user / model contents."""
+        if not isinstance(prompt, ConversationPrompt):
+            return prompt.suffix if cached else str(prompt)
+        head = prompt.instructions_suffix if cached else prompt.instructions
+        contents = [{"role": "user", "parts": [{"text": head}]}]
+        for role, text in prompt.turns:
+            role = "model" if role == "assistant" else "user"
+            if contents[-1]["role"] == role:
+                contents[-1]["parts"].append({"text": text})
+            else:
+                contents.append({"role": role, "parts": [{"text": text}]})
+        return contents
+
+    def _to_completion(self, response) -> Completion:
+        usage = response.usage_metadata
+        candidate = response.candidates[0] if response.candidates else None
+        finish_reason = getattr(candidate, "finish_reason", None) if candidate else None
+        return Completion(
+            text=response.text or "",
+            prompt_tokens=(usage.prompt_token_count or 0) if usage else 0,
+            completion_tokens=(usage.candidates_token_count or 0) if usage else 0,
+            cached_tokens=(usage.cached_content_token_count or 0) if usage else 0,
+            truncated=getattr(finish_reason, "name", finish_reason) == "MAX_TOKENS"
+        )
+
+    def _complete(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Completion:
+        cache_name = self._get_prefix_cache(prompt, key_index)
+        models = self.clients[key_index].models
+        try:
+            response = models.generate_content(**self._request(prompt, cache_name, response_model))
+        except Exception as e:
+            if not self._cache_rejected(prompt, key_index, cache_name, e):
+                raise
+            response = models.generate_content(**self._request(prompt, None, response_model))
+        return self._to_completion(response)
+
+    async def _acomplete(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Completion:
+        cache_name = await self._aget_prefix_cache(prompt, key_index)
+        models = self.clients[key_index].aio.models
+        try:
+            response = await models.generate_content(**self._request(prompt, cache_name, response_model))
+        except Exception as e:
+            if not self._cache_rejected(prompt, key_index, cache_name, e):
+                raise
+            response = await models.generate_content(**self._request(prompt, None, response_model))
+        return self._to_completion(response)
+
+    def _stream_responses(self, key_index: int, request: dict) -> Iterator[Completion]:
+        stream = self.clients[key_index].models.generate_content_stream(**request)
+        try:
+            for response in stream:
+                yield self._to_completion(response)
+        finally:
+            stream.close()
+
+    async def _astream_responses(self, key_index: int, request: dict) -> AsyncIterator[Completion]:
+        stream = await self.clients[key_index].aio.models.generate_content_stream(**request)
+        try:
+            async for response in stream:
+                yield self._to_completion(response)
+        finally:
+            await stream.aclose()
+
+    def _stream_chunks(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Iterator[Completion]:
+        cache_name = self._get_prefix_cache(prompt, key_index)
+        started = False
+        try:
+            for chunk in self._stream_responses(key_index, self._request(prompt, cache_name, response_model)):
+                started = True
+                yield chunk
+        except Exception as e:
+            # A stream already under way cannot be resent
+            if started or not self._cache_rejected(prompt, key_index, cache_name, e):
+                raise
+            yield from self._stream_responses(key_index, self._request(prompt, None, response_model))
+
+    async def _astream_chunks(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> AsyncIterator[Completion]:
+        cache_name = await self._aget_prefix_cache(prompt, key_index)
+        started = False
+        try:
+            async for chunk in self._astream_responses(key_index, self._request(prompt, cache_name, response_model)):
+                started = True
+                yield chunk
+        except Exception as e:
+            if started or not self._cache_rejected(prompt, key_index, cache_name, e):
+                raise
+            async for chunk in self._astream_responses(key_index, self._request(prompt, None, response_model)):
+                yield chunk
+
+
+def _chat_completion(response) -> Completion:
+    """Converts an OpenAI-compatible chat completion into a Completion."""
+    usage = response.usage
+    # These endpoints cache stable prompt prefixes automatically and report the hits here
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return Completion(
+        text=response.choices[0].message.content or "",
+        prompt_tokens=(usage.prompt_tokens or 0) if usage else 0,
+        completion_tokens=(usage.completion_tokens or 0) if usage else 0,
+        cached_tokens=(getattr(details, "cached_tokens", None) or 0) if details else 0,
+        truncated=response.choices[0].finish_reason == "length"
+    )
+
+
+def _chat_chunk(chunk) -> Completion:
+    """Converts one streamed chat completion chunk into a Completion delta."""
+    text = (chunk.choices[0].delta.content or "") if chunk.choices else ""
+    truncated = bool(chunk.choices) and chunk.choices[0].finish_reason == "length"
+    usage = getattr(chunk, "usage", None)
+    if not usage:
+        return Completion(text=text, truncated=truncated)
+    details = getattr(usage, "prompt_tokens_details", None)
+    return Completion(
+        text=text,
+        prompt_tokens=usage.prompt_tokens or 0,
+        completion_tokens=usage.completion_tokens or 0,
+        cached_tokens=(getattr(details, "cached_tokens", None) or 0) if details else 0,
+        truncated=truncated
+    )
+
+
+class ChatCompletionsGamePlayer(BaseGamePlayer):
+    """Shared request handling for OpenAI-compatible chat completion APIs. Subclasses create the clients."""
+    # Extra options for streamed requests, e.g. to get usage in the last chunk
+    stream_options = None
+
+    def _model_id(self) -> str:
+        return self.model_name
+
+    def _request_params(self, prompt: str, stream: bool = False, response_model: Optional[Type[BaseModel]] = None) -> dict:
+        params = dict(
+            messages=chat_messages(prompt),
+            model=self._model_id(),
+            stream=stream,
+            **self._request_sampling_params()
+        )
+        if stream and self.stream_options:
+            params["stream_options"] = self.stream_options
+        if self.retry_policy.attempt_timeout:
+            params["timeout"] = self.retry_policy.attempt_timeout
+        if self.structured_output and response_model is not None:
+            params["response_format"] = self._response_format(response_model)
+        return params
+
+    def _complete(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Completion:
+        response = self.clients[key_index].chat.completions.create(**self._request_params(prompt, response_model=response_model))
+        return _chat_completion(response)
+
+    async def _acomplete(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Completion:
+        response = await self.async_clients[key_index].chat.completions.create(**self._request_params(prompt, response_model=response_model))
+        return _chat_completion(response)
+
+    def _stream_chunks(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> Iterator[Completion]:
+        stream = self.clients[key_index].chat.completions.create(**self._request_params(prompt, stream=True, response_model=response_model))
+        try:
+            for chunk in stream:
+                yield _chat_chunk(chunk)
+        finally:
+            # Closing the connection stops the generation on the server
+            stream.close()
+
+    async def _astream_chunks(self, prompt: str, key_index: int, response_model: Optional[Type[BaseModel]] = None) -> AsyncIterator[Completion]:
+        stream = await self.async_clients[key_index].chat.completions.create(**self._request_params(prompt, stream=True, response_model=response_model))
+        try:
+            async for chunk in stream:
+                yield _chat_chunk(chunk)
+        finally:
+            await stream.close()
+
+    def batch_body(self, prompt: str, response_model: Optional[Type[BaseModel]] = None) -> dict:
+        body = super().batch_body(prompt, response_model)
+        body["model"] = self._model_id()
+        return body
+
+
+class CerebrasGamePlayer(ChatCompletionsGamePlayer):
+    """Implementation using Cerebras API. All keys are used concurrently through the key pool."""
+    provider_name = "cerebras"
+    max_attempts = 3
+    sampling_params = dict(max_completion_tokens=28192, temperature=0.2, top_p=0.95)
+    completion_limit_param = "max_completion_tokens"
+    context_window = 65_536
+    api_key_env = ("CEREBRAS_API_KEYS", "CEREBRAS_API_KEY")
+    # Free tier limits per key
+    default_rpm = 30
+    default_tpm = 60000
+
+    def __init__(
+        self,
+        model_name: str,
+        api_keys: List[str],
+        max_concurrency: int = 1,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        base_url: Optional[str] = None
+    ):
+        super().__init__(model_name, api_keys, max_concurrency, rpm, tpm, base_url)
+        from cerebras.cloud.sdk import Cerebras, AsyncCerebras
+        # Retries are left to the player's RetryPolicy
+        self.clients = [Cerebras(api_key=key, base_url=self.base_url, max_retries=0) for key in self.api_keys]
+        self.async_clients = [AsyncCerebras(api_key=key, base_url=self.base_url, max_retries=0) for key in self.api_keys]
+
+
+class NvidiaGamePlayer(ChatCompletionsGamePlayer):
+    """Implementation using NVIDIA API (via OpenAI client)."""
+    provider_name = "nvidia"
+    max_attempts = 5
+    base_url = "https://integrate.api.nvidia.com/v1"
+    default_rpm = 40
+    sampling_params = dict(max_tokens=4096, temperature=0.2, top_p=0.8)
+    completion_limit_param = "max_tokens"
+    # Answers for the large games (chess, rubikscube) can outgrow the default limit; budgets escalate up to this
+    max_completion_tokens = 16384
+    context_window = 131_072
+    stream_options = {"include_usage": True}
+    api_key_env = ("NVIDIA_API_KEYS", "NVIDIA_API_KEY")
+
+    def __init__(
+        self,
+        model_name: str,
+        api_key: Union[str, List[str]],
+        max_concurrency: int = 1,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        base_url: Optional[str] = None
+    ):
+        super().__init__(model_name, api_key, max_concurrency, rpm, tpm, base_url)
+        from openai import OpenAI, AsyncOpenAI
+        # Retries are left to the player's RetryPolicy
+        self.clients = [OpenAI(base_url=self.base_url, api_key=key, max_retries=0) for key in self.api_keys]
+        self.async_clients = [AsyncOpenAI(base_url=self.base_url, api_key=key, max_retries=0) for key in self.api_keys]
+
+    def _model_id(self) -> str:
+        # Bare names are the gpt-oss models; names with an organisation (meta/llama-3.3-70b-instruct) are sent as they are
+        return self.model_name if "/" in self.model_name else "openai/" + self.model_name
+
+
+class OpenAICompatibleGamePlayer(ChatCompletionsGamePlayer):
+    """
+    Any server speaking the OpenAI chat completions API, e.g. a local llama.cpp or vLLM server (point --base_url at it).
+    No key, rate limit or context window is assumed; set --context_window to enable the preflight check.
+    """
+    provider_name = "local"
+    max_attempts = 3
+    base_url = "http://localhost:8000/v1"
+    sampling_params = dict(temperature=0.2)
+    # Files + batches API of OpenAI itself (--base_url https://api.openai.com/v1); plain inference servers lack it
+    supports_batch = True
+    stream_options = {"include_usage": True}
+    api_key_env = ("LOCAL_API_KEYS", "LOCAL_API_KEY")
+    api_key_required = False
+
+    def __init__(
+        self,
+        model_name: str,
+        api_keys: Union[str, List[str]],
+        max_concurrency: int = 1,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        base_url: Optional[str] = None
+    ):
+        super().__init__(model_name, api_keys, max_concurrency, rpm, tpm, base_url)
+        from openai import OpenAI, AsyncOpenAI
+        # Retries are left to the player's RetryPolicy
+        self.clients = [OpenAI(base_url=self.base_url, api_key=key, max_retries=0) for key in self.api_keys]
+        self.async_clients = [AsyncOpenAI(base_url=self.base_url, api_key=key, max_retries=0) for key in self.api_keys]
+
+
+# -- Provider Registry --
+
+# Installed packages add players through this entry point group, e.g. in their pyproject.toml:
+#   [project.entry-points."llm_runner.providers"]
+#   myprovider = "my_package.players:MyGamePlayer"
+PROVIDER_ENTRY_POINT_GROUP = "llm_runner.providers"
+# Built-in players by provider name. Each imports its SDK only when it is instantiated.
+PLAYERS = {player.provider_name: player for player in (GeminiGamePlayer, CerebrasGamePlayer, NvidiaGamePlayer, OpenAICompatibleGamePlayer)}
+
+
+@functools.lru_cache(maxsize=None)
+def _plugin_entry_points() -> dict:
+    """Provider plugins by name. Only package metadata is read; nothing is imported."""
+    return {entry_point.name: entry_point for entry_point in importlib.metadata.entry_points(group=PROVIDER_ENTRY_POINT_GROUP)}
+
+
+def available_providers() -> List[str]:
+    return list(PLAYERS) + sorted(set(_plugin_entry_points()) - set(PLAYERS))
+
+
+def player_class(provider: str) -> Type[BaseGamePlayer]:
+    """Player class of a provider. A plugin is imported the first time it is selected. Raises ValueError for unknown providers and plugins that are not players."""
+    if provider in PLAYERS:
+        return PLAYERS[provider]
+    entry_point = _plugin_entry_points().get(provider)
+    if entry_point is None:
+        raise ValueError(f"Unknown provider: {provider}")
+    player = entry_point.load()
+    if not (isinstance(player, type) and issubclass(player, BaseGamePlayer)):
+        raise ValueError(f"Provider plugin '{provider}' ({entry_point.value}) is not a BaseGamePlayer subclass")
+    return player
+
+
+# -- Routing --
+
+# Provider name of players that serve one logical model from several provider backends
+ROUTED_PROVIDER = "routed"
+
+
+class BackendStats:
+    """Routing view of one backend: recent outcomes, requests in flight and how its requests ended."""
+    def __init__(self, window: int):
+        self.outcomes = collections.deque(maxlen=window)
+        self.in_flight = 0
+        self.answered = 0
+        self.failed = 0
+        # Requests answered after an earlier attempt, here or on another backend, had failed
+        self.rerouted = 0
+
+    def success_rate(self) -> float:
+        """Share of recent requests answered, smoothed so that an untried backend starts at 50%."""
+        return (sum(self.outcomes) + 1) / (len(self.outcomes) + 2)
+
+
+class RoutedGamePlayer(BaseGamePlayer):
+    """
+    Serves one logical model from several provider backends. Each request goes to the backend expected to answer
+    soonest, judging by its recent latency, its requests in flight, the wait until one of its keys has quota and its
+    recent error rate; backends with an open circuit or too small a context window are skipped. Retries happen here
+    rather than in the backends: every failed attempt is routed anew, so it goes to another backend unless the one
+    that failed is still the best. The answer remembers which backend produced it.
+    """
+    provider_name = ROUTED_PROVIDER
+    # Backend calls per request, across all backends
+    max_attempts = 5
+    # Seconds a backend may wait for quota beyond the wait it showed when the request was routed to it;
+    # keys blocked in the meantime make the request go elsewhere instead
+    quota_wait_slack = 1.0
+    # Requests routed anew for lack of quota this often are then sent without a cap on the wait
+    max_quota_reroutes = 10
+    # Recent requests per backend that make up its error rate
+    outcome_window = 50
+    # Run-level settings assigned to the router that every backend must follow
+    shared_settings = (
+        "streaming", "structured_output", "adaptive_budgets", "escalate_truncated", "max_completion_tokens", "response_cache", "retry_policy", "metrics"
+    )
+
+    def __init__(self, model_name: str, backends: List[BaseGamePlayer]):
+        if not backends:
+            raise ValueError(f"No backends to route {model_name} to")
+        # Set first: the base initializer assigns the shared settings, which are passed on to the backends
+        self.backends = backends
+        # No keys or endpoint of its own: requests are paced and sent by the backends. Requests wait here rather than
+        # in a backend, so each one is routed when it can actually be sent
+        super().__init__(model_name, [], max_concurrency=sum(backend.max_concurrency for backend in backends))
+        self.stats = {self.backend_label(backend): BackendStats(self.outcome_window) for backend in backends}
+        for backend in backends:
+            backend.route = model_name
+            # One running total for the run; the split by backend is in routing_summary()
+            backend.usage = self.usage
+            # A 429 or an error is routed anew instead of waiting for the backend's key or backoff
+            backend.max_attempts = 1
+            backend.max_rate_limit_retries = 0
+        print(f"🔀 [{model_name}] Routing over {', '.join(self.stats)}")
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self.shared_settings:
+            for backend in self.backends:
+                setattr(backend, name, value)
+
+    @staticmethod
+    def backend_label(backend: BaseGamePlayer) -> str:
+        return f"{backend.provider_name}/{backend.model_name}"
+
+    @property
+    def context_window(self) -> Optional[int]:
+        """The largest window of any backend; None if one of them is not checked."""
+        windows = [backend.context_window for backend in self.backends]
+        return None if None in windows or 0 in windows else max(windows)
+
+    @context_window.setter
+    def context_window(self, value: Optional[int]):
+        for backend in self.backends:
+            backend.context_window = value
+
+    def completion_budget(self) -> int:
+        return max(backend.completion_budget() for backend in self.backends)
+
+    def check_context_window(self, prompt: str):
+        """Raises ContextWindowExceeded unless at least one backend can take the prompt."""
+        for backend in self.backends:
+            try:
+                backend.check_context_window(prompt)
+                return
+            except ContextWindowExceeded as e:
+                error = e
+        raise error
+
+    def release_prefix_caches(self, game_definition: str):
+        for backend in self.backends:
+            backend.release_prefix_caches(game_definition)
+
+    def _median_latency(self, backend: BaseGamePlayer) -> float:
+        if backend._latencies:
+            return percentile(sorted(backend._latencies), 50)
+        # Untried backends are assumed as fast as the fastest known one, so each of them gets tried early
+        known = [percentile(sorted(other._latencies), 50) for other in self.backends if other._latencies]
+        return min(known) if known else 1.0
+
+    @staticmethod
+    def _quota_wait(backend: BaseGamePlayer, prompt: str) -> float:
+        return backend.key_pool.wait_time(backend.planned_reservation(prompt))
+
+    def _soonest_quota(self, prompt: str) -> float:
+        """Seconds until some backend with a closed circuit has quota for the prompt."""
+        waits = [self._quota_wait(backend, prompt) for backend in self.backends if not backend._circuit_breaker().is_open()]
+        return min(waits, default=0.0)
+
+    def _expected_seconds(self, backend: BaseGamePlayer, prompt: str) -> float:
+        """Seconds until the backend is expected to answer, inflated by its recent error rate."""
+        stats = self.stats[self.backend_label(backend)]
+        # Requests beyond the backend's concurrency wait for the ones in flight
+        queued = stats.in_flight // backend.max_concurrency
+        return (self._quota_wait(backend, prompt) + self._median_latency(backend) * (1 + queued)) / stats.success_rate()
+
+    def _best_backend(self, prompt: str) -> BaseGamePlayer:
+        """The backend expected to answer soonest among those that can take the prompt now. Raises if there are none."""
+        self.check_context_window(prompt)
+        ranked = []
+        for position, backend in enumerate(self.backends):
+            if backend._circuit_breaker().is_open():
+                continue
+            try:
+                backend.check_context_window(prompt)
+            except ContextWindowExceeded:
+                continue
+            # Ties keep the configured order
+            ranked.append((self._expected_seconds(backend, prompt), position, backend))
+        if not ranked:
+            raise CircuitOpenError(f"Every backend of {self.model_name} that fits the prompt has an open circuit")
+        return min(ranked)[-1]
+
+    def _start_route(self, backend: BaseGamePlayer, prompt: str, quota_reroutes: int) -> contextvars.Token:
+        """
+        Counts the request in flight on the backend and caps how long it may wait there for quota. A request that has
+        been routed anew for lack of quota max_quota_reroutes times waits at the backend for as long as it takes.
+        """
+        self.stats[self.backend_label(backend)].in_flight += 1
+        if quota_reroutes >= self.max_quota_reroutes:
+            return MAX_QUOTA_WAIT.set(None)
+        return MAX_QUOTA_WAIT.set(self._quota_wait(backend, prompt) + self.quota_wait_slack)
+
+    def _finish_route(self, backend: BaseGamePlayer, response, error: Optional[Exception], attempt: int, token: contextvars.Token) -> bool:
+        """Books the outcome of one backend call. Returns True if the backend answered."""
+        MAX_QUOTA_WAIT.reset(token)
+        label = self.backend_label(backend)
+        stats = self.stats[label]
+        stats.in_flight -= 1
+        if isinstance(error, QuotaWaitExceeded):
+            # Its keys ran out of quota between routing and sending; not held against the backend
+            return False
+        answered = isinstance(response, LLMResponse)
+        stats.outcomes.append(answered)
+        if answered:
+            stats.answered += 1
+            stats.rerouted += attempt > 0
+            response._backend = label
+        else:
+            stats.failed += 1
+            trace_instant("backend_failed", route=self.model_name, backend=label, attempt=attempt + 1)
+            if attempt + 1 < self.max_attempts:
+                print(f"🔀 [{self.model_name}] {label} failed attempt {attempt + 1}/{self.max_attempts}, routing it anew")
+        return answered
+
+    def _generate_json(self, prompt: str, response_model: Type[T]) -> T:
+        """Sends the request to the best backend, routing it anew after every failed attempt."""
+        attempt = quota_reroutes = 0
+        failed, error = None, None
+        while attempt < self.max_attempts:
+            backend = self._best_backend(prompt)
+            if backend is failed:
+                # Nowhere better to go: back off, then route again as things may have changed meanwhile
+                with span("retry_sleep", attempt=attempt):
+                    time.sleep(self.retry_policy.backoff(attempt - 1))
+                backend = self._best_backend(prompt)
+            token = self._start_route(backend, prompt, quota_reroutes)
+            try:
+                response, error = backend._generate_json(prompt, response_model), None
+            except Exception as e:
+                response, error = "", e
+            if self._finish_route(backend, response, error, attempt, token):
+                return response
+            if isinstance(error, QuotaWaitExceeded):
+                # Other requests took the quota first: wait until some backend has it again before routing anew
+                quota_reroutes += 1
+                with span("quota_wait", route=self.model_name):
+                    time.sleep(self._soonest_quota(prompt))
+            else:
+                failed = backend
+                attempt += 1
+        # A last attempt that raised (e.g. an open circuit or a replay cache miss) keeps its error
+        if error is not None:
+            raise error
+        return ""
+
+    async def _agenerate_json(self, prompt: str, response_model: Type[T]) -> T:
+        """Async variant of _generate_json. At most as many requests as all backends together allow are being routed at once."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            attempt = quota_reroutes = 0
+            failed, error = None, None
+            while attempt < self.max_attempts:
+                backend = self._best_backend(prompt)
+                if backend is failed:
+                    with span("retry_sleep", attempt=attempt):
+                        await asyncio.sleep(self.retry_policy.backoff(attempt - 1))
+                    backend = self._best_backend(prompt)
+                token = self._start_route(backend, prompt, quota_reroutes)
+                try:
+                    response, error = await backend._agenerate_json(prompt, response_model), None
+                except Exception as e:
+                    response, error = "", e
+                if self._finish_route(backend, response, error, attempt, token):
+                    return response
+                if isinstance(error, QuotaWaitExceeded):
+                    quota_reroutes += 1
+                    with span("quota_wait", route=self.model_name):
+                        await asyncio.sleep(self._soonest_quota(prompt))
+                else:
+                    failed = backend
+                    attempt += 1
+            if error is not None:
+                raise error
+            return ""
+
+    def routing_summary(self) -> str:
+        lines = [f"🔀 [{self.model_name}] Routing:"]
+        for backend in self.backends:
+            label = self.backend_label(backend)
+            stats = self.stats[label]
+            latency = f"{percentile(sorted(backend._latencies), 50):.2f}s" if backend._latencies else "n/a"
+            circuit = "open" if backend._circuit_breaker().is_open() else "closed"
+            lines.append(f"   {label}: {stats.answered} answered ({stats.rerouted} after a failed attempt), {stats.failed} failed, "
+                         f"median latency {latency}, circuit {circuit}")
+        return "\n".join(lines)
+
+# --- 4. Core Logic ---
+
+EXPERIMENT_TYPES = ["next_state", "legal_moves", "multi_step_prediction", "multi_step_generation"]
+
+
+class SampleTask:
+    """A prepared LLM request for one input sample, together with the mapping of its answer to an output record."""
+    def __init__(
+        self,
+        index: int,
+        prompt: str,
+        response_model: Type[BaseModel],
+        build_output: Callable[[BaseModel], BaseModel],
+        case_fields: Optional[dict] = None,
+        answer_size: Optional[int] = None
+    ):
+        self.index = index
+        self.prompt = prompt
+        self.response_model = response_model
+        self.build_output = build_output
+        # Per-sample inputs (state, move) used when several samples are packed into one prompt
+        self.case_fields = case_fields
+        # Expected length of the answer in characters, which sizes the completion budget
+        self.answer_size = answer_size
+
+    @property
+    def sample_id(self) -> str:
+        return f"s{self.index}"
+
+    def output(self, response: BaseModel) -> BaseModel:
+        """Output record of the answer, flagged if the answer had to be repaired and tagged with the backend that gave it."""
+        output = self.build_output(response)
+        output.repaired = getattr(response, "_repairs", None)
+        output.backend = getattr(response, "_backend", None)
+        return output
+
+    def run(self, player: BaseGamePlayer) -> BaseModel:
+        with expected_answer_size(self.answer_size):
+            return self.output(player._generate_json(self.prompt, self.response_model))
+
+    async def arun(self, player: BaseGamePlayer) -> BaseModel:
+        with expected_answer_size(self.answer_size):
+            return self.output(await player._agenerate_json(self.prompt, self.response_model))
+
+
+@traced("format_prompt")
+def prepare_sample_task(
+    index: int,
+    sample: Union[EvalSample, MultiStepInputSample],
+    gdl_game_definition: str,
+    experiment_type: str,
+    n_moves: int = None,
+    symbols: Optional[SymbolMap] = None
+) -> Optional[SampleTask]:
+    """
+    Builds the request for a single sample. Returns None if the sample does not fit the experiment.
+    Raises ValueError for samples that fit but cannot be evaluated.
+    With a SymbolMap, the prompt uses the shortened names and the answer is translated back.
+    """
+    if symbols is not None:
+        task = prepare_sample_task.__wrapped__(index, map_sample_text(sample, symbols.encode_text), gdl_game_definition, experiment_type, n_moves)
+        if task is not None:
+            build_output = task.build_output
+            task.build_output = lambda r: map_sample_text(build_output(r), symbols.decode_text)
+        return task
+
+    # --- EXPERIMENT 1: NEXT STATE ---
+    if "next_state" in experiment_type:
+        if not isinstance(sample, EvalSample):
+            print("Skipping sample: format mismatch for next_state")
+            return None
+
+        return SampleTask(
+            index,
+            build_next_state_prompt(gdl_game_definition, sample.game_state, sample.move),
+            LLMNextStateResponse,
+            lambda r: OutputSampleNextState(
+                game_state=sample.game_state,
+                move=sample.move,
+                next_state=sample.next_state,
+                llm_state=r.llm_state
+            ),
+            case_fields={"GAME STATE": sample.game_state, "MOVE": sample.move},
+            answer_size=len(sample.next_state or sample.game_state)
+        )
+
+    # --- EXPERIMENT 2: LEGAL MOVES ---
+    if "legal_moves" in experiment_type:
+        if not isinstance(sample, EvalSample):
+            print("Skipping sample: format mismatch for legal_moves")
+            return None
+
+        if not sample.legal_moves:
+            raise ValueError("Input sample missing 'legal_moves' field.")
+
+        return SampleTask(
+            index,
+            build_legal_moves_prompt(gdl_game_definition, sample.game_state),
+            LLMLegalMovesResponse,
+            lambda r: OutputSampleLegalMoves(
+                game_state=sample.game_state,
+                legal_moves=sample.legal_moves,
+                llm_legal_moves=r.llm_legal_moves
+            ),
+            case_fields={"GAME STATE": sample.game_state},
+            answer_size=len(sample.legal_moves)
+        )
+
+    # --- EXPERIMENT 3: MULTI STEP PREDICTION ---
+    if "multi_step_prediction" in experiment_type:
+        if not isinstance(sample, MultiStepInputSample):
+            print("Skipping sample: format mismatch for multi_step_prediction")
+            return None
+
+        if not n_moves:
+            raise ValueError("n_moves parameter is required for multi_step_prediction")
+
+        current_moves = sample.moves[:n_moves]
+        if len(current_moves) < n_moves:
+            print(f"⚠️ Warning: Sample has fewer moves ({len(current_moves)}) than requested N={n_moves}. Using available.")
+
+        return SampleTask(
+            index,
+            build_multi_step_prompt(gdl_game_definition, current_moves),
+            LLMNextStateResponse,
+            lambda r: OutputSampleMultiStep(
+                moves=current_moves,
+                llm_state=r.llm_state
+            ),
+            answer_size=initial_state_size(gdl_game_definition)
+        )
+
+    # --- EXPERIMENT 4: MULTI STEP GENERATION ---
+    if "multi_step_generation" in experiment_type:
+        if not isinstance(sample, MultiStepInputSample):
+            print("Skipping sample: format mismatch for multi_step_generation")
+            return None
+
+        if not n_moves:
+            raise ValueError("n_moves parameter is required for multi_step_generation")
+
+        if not sample.moves:
+            print("Skipping sample: No moves available to use as template.")
+            return None
+
+        example_joint_move = sample.moves[0].joint_move
+        state_size = initial_state_size(gdl_game_definition)
+
+        return SampleTask(
+            index,
+            build_multi_step_generation_prompt(gdl_game_definition, n_moves, example_joint_move),
+            LLMMultiStepGenResponse,
+            lambda r: OutputSampleMultiStepGen(
+                moves=r.moves,
+                llm_state=r.llm_state
+            ),
+            # The final state plus n moves written like the example, with their step keys
+            answer_size=state_size + n_moves * (len(example_joint_move) + 32) if state_size else None
+        )
+
+    raise ValueError(f"Unknown experiment type: {experiment_type}")
+
+
+# -- Prompt Compaction --
+
+def map_sample_text(sample: BaseModel, convert: Callable[[str], str]) -> BaseModel:
+    """Copy of an input or output sample with convert applied to every text field (states, moves)."""
+    def walk(value):
+        if isinstance(value, str):
+            return convert(value)
+        if isinstance(value, list):
+            return [walk(v) for v in value]
+        if isinstance(value, dict):
+            return {k: walk(v) for k, v in value.items()}
+        return value
+    return type(sample).model_validate(walk(sample.model_dump()))
+
+
+@traced("prepare_definition")
+def prepare_game_definition(player: BaseGamePlayer, gdl_game_definition: str, game_name: str) -> Optional[tuple]:
+    """
+    Applies the player's GDL compaction and reports the token counts before and after.
+    Returns (game definition for prompts, SymbolMap or None), or None if the definition alone does not fit the context window.
+    """
+    text, symbols = gdl_game_definition, None
+    if player.compact_gdl:
+        text = compact_gdl(gdl_game_definition)
+        if player.compact_gdl == "symbols":
+            symbols = SymbolMap.for_rules(text)
+            text = symbols.encode_text(text)
+        before, after = player.token_counter.count(gdl_game_definition), player.token_counter.count(text)
+        print(f"🗜️ [{game_name}] GDL compacted ({player.compact_gdl}): {before} → {after} tokens "
+              f"({(after - before) / max(before, 1):+.1%}, {player.token_counter.name})")
+
+    if player.context_window:
+        tokens = player.token_counter.count(text)
+        if tokens + player.completion_budget() > player.context_window:
+            print(f"❌ [{game_name}] Skipping game: the definition alone takes {tokens} tokens, "
+                  f"{player.completion_budget()} are reserved for the answer and the context window is {player.context_window}")
+            return None
+    return text, symbols
+
+
+# -- Multi-Sample Packing --
+
+PACKED_TEMPLATES = {
+    "next_state": PROMPT_EVAL_NEXT_STATE_PACKED,
+    "legal_moves": PROMPT_EVAL_LEGAL_MOVES_PACKED,
+}
+
+
+def supports_packing(experiment_type: str) -> bool:
+    return any(e in experiment_type for e in PACKED_TEMPLATES)
+
+
+def build_packed_prompt(game_definition: str, experiment_type: str, tasks: List[SampleTask]) -> GamePrompt:
+    template = next(t for e, t in PACKED_TEMPLATES.items() if e in experiment_type)
+    cases = ""
+    for task in tasks:
+        cases += f"\n--- CASE {task.sample_id} ---\n"
+        for label, value in task.case_fields.items():
+            cases += f"{label}:\n{value}\n"
+    return format_game_prompt(template, game_definition=game_definition, cases=cases.strip("\n") + "\n---------------")
+
+
+def packed_answer_size(tasks: List[SampleTask]) -> Optional[int]:
+    """Expected length of the packed answer: the items plus their sample_id keys, if every item has an expected size."""
+    if any(task.answer_size is None for task in tasks):
+        return None
+    return sum(task.answer_size + 32 for task in tasks)
+
+
+def unpack_response(tasks: List[SampleTask], response: LLMPackedResponse) -> tuple:
+    """Returns ({task index: output sample}, [tasks whose item is missing or malformed])."""
+    by_id = {}
+    for item in getattr(response, "results", None) or []:
+        if isinstance(item, dict) and "sample_id" in item:
+            by_id.setdefault(str(item["sample_id"]), item)
+
+    outputs, leftovers = {}, []
+    for task in tasks:
+        try:
+            item = task.response_model.model_validate(by_id[task.sample_id])
+            item._repairs, item._backend = response._repairs, response._backend
+            outputs[task.index] = task.output(item)
+        except (KeyError, ValidationError):
+            leftovers.append(task)
+    return outputs, leftovers
+
+
+def run_packed_tasks(player: BaseGamePlayer, game_definition: str, experiment_type: str, tasks: List[SampleTask], journal):
+    """Evaluates several samples with one request; missing or malformed items are retried one at a time."""
+    try:
+        with expected_answer_size(packed_answer_size(tasks)):
+            response = player._generate_json(build_packed_prompt(game_definition, experiment_type, tasks), LLMPackedResponse)
+        outputs, leftovers = unpack_response(tasks, response)
+    except Exception as e:
+        print(f"❌ Packed request for {len(tasks)} samples failed: {e}")
+        outputs, leftovers = {}, tasks
+
+    for index, output_sample in outputs.items():
+        journal.record_success(index, output_sample)
+        print(f"✅ Sample {index + 1} processed (packed).")
+
+    for task in leftovers:
+        print(f"🔁 Sample {task.index + 1} missing from packed answer, retrying alone.")
+        try:
+            journal.record_success(task.index, task.run(player))
+            print(f"✅ Sample {task.index + 1} processed.")
+        except Exception as e:
+            print(f"❌ Sample {task.index + 1} failed: {e}")
+            journal.record_failure(task.index, e)
+
+
+async def arun_packed_tasks(player: BaseGamePlayer, game_definition: str, experiment_type: str, tasks: List[SampleTask], journal):
+    """Async variant of run_packed_tasks; the single-sample retries run concurrently."""
+    try:
+        with expected_answer_size(packed_answer_size(tasks)):
+            response = await player._agenerate_json(build_packed_prompt(game_definition, experiment_type, tasks), LLMPackedResponse)
+        outputs, leftovers = unpack_response(tasks, response)
+    except Exception as e:
+        print(f"❌ Packed request for {len(tasks)} samples failed: {e}")
+        outputs, leftovers = {}, tasks
+
+    for index, output_sample in outputs.items():
+        journal.record_success(index, output_sample)
+        print(f"✅ Sample {index + 1} processed (packed).")
+
+    async def retry(task: SampleTask):
+        print(f"🔁 Sample {task.index + 1} missing from packed answer, retrying alone.")
+        try:
+            journal.record_success(task.index, await task.arun(player))
+            print(f"✅ Sample {task.index + 1} processed.")
+        except Exception as e:
+            print(f"❌ Sample {task.index + 1} failed: {e}")
+            journal.record_failure(task.index, e)
+
+    await asyncio.gather(*(retry(task) for task in leftovers))
+
+
+# -- Sample Files --
+
+class JSONStream:
+    """
+    Incremental reader of one JSON document. Values are decoded one at a time with raw_decode from a
+    buffer refilled in chunks, so walking a large samples array never holds more than one sample.
+    """
+    def __init__(self, f, chunk_size: int = 1 << 16, on_chunk: Optional[Callable[[str], None]] = None):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size: int) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.on_chunk:
+            self.on_chunk(chunk)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at the end of the file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill(self.chunk_size):
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {self.pos}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+                # A number cut at the end of the buffer decodes without error, so read on before trusting it
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            size *= 2
+            self._fill(size)
+
+    def object_items(self) -> Iterator[tuple]:
+        """(key, stream) pairs of the top-level object. The caller must consume each value before the next item."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key, self
+            if self.expect(",}") == "}":
+                return
+
+    def array_values(self) -> Iterator:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def drain(self):
+        """Reads the rest of the file (so that on_chunk sees all of it)."""
+        while self._fill(self.chunk_size):
+            self.pos = len(self.buffer)
+
+
+def iter_raw_samples(samples_file_path: str) -> Iterator[dict]:
+    """Streams the entries of the "samples" array of an input file without loading the whole document."""
+    with open(samples_file_path, 'r') as f:
+        for key, stream in JSONStream(f).object_items():
+            if key == "samples":
+                yield from stream.array_values()
+                return
+            stream.value()
+
+
+class SampleFileInfo(BaseModel):
+    """Index entry of one samples file."""
+    game_name: Optional[str] = None
+    sample_count: int = 0
+    # "standard" (next_state / legal_moves), "multi_step" or "empty"
+    sample_kind: str = "empty"
+    sha256: str = ""
+    size: int = 0
+    mtime_ns: int = 0
+    error: Optional[str] = None
+
+
+def scan_samples_file(samples_file_path: str) -> SampleFileInfo:
+    """Single streaming pass over a samples file: header fields, sample count and content hash."""
+    digest = hashlib.sha256()
+    stat = os.stat(samples_file_path)
+    info = SampleFileInfo(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    try:
+        with open(samples_file_path, 'r') as f:
+            stream = JSONStream(f, on_chunk=lambda chunk: digest.update(chunk.encode()))
+            for key, _ in stream.object_items():
+                if key == "samples":
+                    for sample in stream.array_values():
+                        if info.sample_count == 0:
+                            info.sample_kind = "multi_step" if isinstance(sample, dict) and "moves" in sample else "standard"
+                        info.sample_count += 1
+                else:
+                    value = stream.value()
+                    if key == "game_name":
+                        info.game_name = value
+            stream.drain()
+    except (ValueError, UnicodeDecodeError) as e:
+        info.error = str(e)
+    info.sha256 = digest.hexdigest()
+    return info
+
+
+class SampleFileIndex:
+    """
+    .samples_index.json in a samples directory: game name, sample count, sample kind and content hash of each
+    samples file. An entry is rescanned only when the file's size or mtime changes; a file that was merely
+    touched (same hash) keeps its entry.
+    """
+    FILE_NAME = ".samples_index.json"
+    # Absolute samples directory -> the index kept in memory by this process (see shared())
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, samples_dir: str):
+        self.samples_dir = samples_dir
+        self.path = os.path.join(samples_dir, self.FILE_NAME)
+        self.entries = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = {name: SampleFileInfo.model_validate(raw) for name, raw in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Rebuilding unreadable sample index {self.path}: {e}")
+
+    @classmethod
+    def shared(cls, samples_dir: str) -> "SampleFileIndex":
+        """The index of a directory as kept by this process: read from disk once, then kept current in memory."""
+        key = os.path.abspath(samples_dir)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(samples_dir)
+            return cls._shared[key]
+
+    def info(self, filename: str) -> SampleFileInfo:
+        with self._lock:
+            path = os.path.join(self.samples_dir, filename)
+            stat = os.stat(path)
+            entry = self.entries.get(filename)
+            if entry is not None and (entry.size, entry.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                return entry
+
+            scanned = scan_samples_file(path)
+            if entry is not None and entry.sha256 == scanned.sha256:
+                entry.mtime_ns = scanned.mtime_ns
+                scanned = entry
+            self.entries[filename] = scanned
+            self._dirty = True
+            return scanned
+
+    def refresh(self, filenames: List[str]) -> dict:
+        """Brings the entries of the given files up to date and drops entries of files that are gone."""
+        with self._lock:
+            for filename in list(self.entries):
+                if filename not in filenames:
+                    del self.entries[filename]
+                    self._dirty = True
+            result = {filename: self.info(filename) for filename in filenames}
+            self.save()
+            return result
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump({name: entry.model_dump() for name, entry in self.entries.items()}, f, indent=1)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"⚠️ Could not write sample index {self.path}: {e}")
+
+
+_SAMPLE_ADAPTER = TypeAdapter(Union[EvalSample, MultiStepInputSample])
+
+
+class LazyEvalData:
+    """
+    Input samples of one game, parsed from disk as they are consumed. Iteration stops reading the
+    file as soon as the caller stops asking, so only the samples actually used are ever loaded.
+    """
+    def __init__(self, samples_file_path: str, info: SampleFileInfo):
+        self.samples_file_path = samples_file_path
+        self.game_name = info.game_name
+        self.sample_count = info.sample_count
+
+    def indexed_samples(self) -> Iterator[tuple]:
+        """(index, sample) pairs. Samples that fail validation are reported and skipped; indices stay those of the file."""
+        raw_samples = enumerate(iter_raw_samples(self.samples_file_path))
+        while True:
+            # Timed apart from the caller's work on the sample, which runs between the yields
+            with span("load_sample"):
+                i, raw = next(raw_samples, (None, None))
+                if i is None:
+                    return
+                try:
+                    sample = _SAMPLE_ADAPTER.validate_python(raw)
+                except ValidationError as e:
+                    print(f"⚠️ [{self.game_name}] Skipping invalid sample {i + 1}: {e}")
+                    continue
+            yield i, sample
+
+
+@functools.lru_cache(maxsize=64)
+def _read_text(path: str, mtime_ns: int, size: int) -> str:
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def read_game_definition(gdl_file_path: str) -> str:
+    """GDL rule sheet of a game, kept in memory until the file changes so a long-lived process reads each game once."""
+    stat = os.stat(gdl_file_path)
+    return _read_text(gdl_file_path, stat.st_mtime_ns, stat.st_size)
+
+
+@traced("load_inputs")
+def load_game_inputs(gdl_file_path: str, samples_file_path: str) -> Optional[tuple]:
+    """Reads the GDL definition and indexes the samples file. Returns (gdl_game_definition, eval_data) or None on error."""
+    gdl_game_definition = read_game_definition(gdl_file_path)
+
+    index = SampleFileIndex.shared(os.path.dirname(samples_file_path) or ".")
+    info = index.info(os.path.basename(samples_file_path))
+    index.save()
+    if info.error or not info.game_name:
+        print(f"❌ Error parsing samples file {samples_file_path}: {info.error or 'missing game_name'}")
+        return None
+
+    return gdl_game_definition, LazyEvalData(samples_file_path, info)
+
+
+# -- Inline Verification --
+
+class Verdict(BaseModel):
+    """Outcome of checking one answer against the game rules."""
+    jaccard: float
+    exact: bool
+    # multi_step_generation: whether every generated joint move was legal
+    legal: Optional[bool] = None
+    detail: str = ""
+
+
+class VerificationStats(BaseModel):
+    """Running accuracy per game of the answers checked by the GDL engine."""
+    # game -> {"checked", "exact", "jaccard", "illegal", "errors"}
+    games: dict = Field(default_factory=dict)
+
+    def game(self, game_name: str) -> dict:
+        return self.games.setdefault(game_name, dict(checked=0, exact=0, jaccard=0.0, illegal=0, errors=0))
+
+    def add(self, game_name: str, verdict: Verdict):
+        counts = self.game(game_name)
+        counts["checked"] += 1
+        counts["exact"] += int(verdict.exact)
+        counts["jaccard"] += verdict.jaccard
+        counts["illegal"] += int(verdict.legal is False)
+
+    def add_error(self, game_name: str):
+        self.game(game_name)["errors"] += 1
+
+    def describe(self, game_name: str) -> str:
+        counts = self.game(game_name)
+        if not counts["checked"]:
+            return f"no answers checked, {counts['errors']} not checkable"
+        text = (f"exact {counts['exact']}/{counts['checked']}, "
+                f"mean Jaccard {counts['jaccard'] / counts['checked']:.3f}")
+        if counts["illegal"]:
+            text += f", {counts['illegal']} with illegal moves"
+        if counts["errors"]:
+            text += f", {counts['errors']} not checkable"
+        return text
+
+    def summary(self) -> str:
+        lines = ["🎯 Verified accuracy:"]
+        lines += [f"   {game_name}: {self.describe(game_name)}" for game_name in sorted(self.games)]
+        return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=16)
+def compile_game(gdl_game_definition: str) -> GDLGame:
+    """Rules are compiled once per game definition and reused across runs and experiments."""
+    return GDLGame(gdl_game_definition)
+
+
+@functools.lru_cache(maxsize=16)
+def initial_state_size(gdl_game_definition: str) -> Optional[int]:
+    """Length of the initial state as answers write it, which sizes the budget of the multi-step experiments. None if the rules do not compile."""
+    try:
+        return len(format_state(compile_game(gdl_game_definition).initial_state())) or None
+    except Exception:
+        return None
+
+
+class GameVerifier:
+    """
+    Recomputes the ground truth of output samples with the GDL engine: the successor state for next_state,
+    the legal move set for legal_moves, and the state after replaying the moves for the multi-step experiments.
+    Generated moves (multi_step_generation) are checked for legality step by step.
+    """
+    def __init__(self, game: GDLGame, game_name: str, experiment_type: str, stats: VerificationStats):
+        self.game = game
+        self.game_name = game_name
+        self.experiment_type = experiment_type
+        self.stats = stats
+
+    def _joint_moves(self, moves: List[MoveStep]) -> list:
+        return [parse_joint_move(move.joint_move, self.game.roles) for move in moves]
+
+    def _compare(self, predicted: frozenset, truth: frozenset) -> Verdict:
+        return Verdict(jaccard=jaccard(predicted, truth), exact=predicted == truth)
+
+    def verify(self, output_sample: BaseModel) -> Verdict:
+        if "next_state" in self.experiment_type:
+            truth = self.game.next_state(
+                parse_state(output_sample.game_state),
+                parse_joint_move(output_sample.move, self.game.roles)
+            )
+            return self._compare(parse_state(output_sample.llm_state), truth)
+
+        if "legal_moves" in self.experiment_type:
+            legal = self.game.legal_moves(parse_state(output_sample.game_state))
+            truth = {(role, move) for role, moves in legal.items() for move in moves}
+            return self._compare(frozenset(parse_moves(output_sample.llm_legal_moves)), frozenset(truth))
+
+        if "multi_step_prediction" in self.experiment_type:
+            truth = self.game.play(self._joint_moves(output_sample.moves))
+            return self._compare(parse_state(output_sample.llm_state), truth)
+
+        try:
+            truth = self.game.play(self._joint_moves(output_sample.moves))
+        except IllegalMoveError as e:
+            return Verdict(jaccard=0.0, exact=False, legal=False, detail=str(e))
+        verdict = self._compare(parse_state(output_sample.llm_state), truth)
+        verdict.legal = True
+        return verdict
+
+    @traced("verify")
+    def check(self, index: int, output_sample: BaseModel) -> Optional[Verdict]:
+        """Verifies one answer and reports it with the running accuracy of the game. Never raises."""
+        try:
+            verdict = self.verify(output_sample)
+        except Exception as e:
+            print(f"⚠️ [{self.game_name}] Sample {index + 1} could not be verified: {e}")
+            self.stats.add_error(self.game_name)
+            return None
+
+        self.stats.add(self.game_name, verdict)
+        status = "✔️ exact" if verdict.exact else f"✖️ Jaccard {verdict.jaccard:.3f}"
+        detail = f" ({verdict.detail})" if verdict.detail else ""
+        print(f"🎯 [{self.game_name}] Sample {index + 1}: {status}{detail} | {self.stats.describe(self.game_name)}")
+        return verdict
+
+
+def make_game_verifier(player: BaseGamePlayer, gdl_game_definition: str, game_name: str, experiment_type: str) -> Optional[GameVerifier]:
+    """GameVerifier for a game if the player collects verification stats and the rules compile, otherwise None."""
+    if player.verification is None:
+        return None
+    try:
+        game = compile_game(gdl_game_definition)
+    except Exception as e:
+        print(f"⚠️ [{game_name}] GDL engine cannot compile the rules, answers are not verified: {e}")
+        return None
+    return GameVerifier(game, game_name, experiment_type, player.verification)
+
+
+# -- Checkpointing --
+
+def output_sample_model(experiment_type: str) -> Type[BaseModel]:
+    """Output record class produced by an experiment."""
+    if "next_state" in experiment_type:
+        return OutputSampleNextState
+    if "legal_moves" in experiment_type:
+        return OutputSampleLegalMoves
+    if "multi_step_prediction" in experiment_type:
+        return OutputSampleMultiStep
+    return OutputSampleMultiStepGen
+
+
+def output_columns(sample_model: Type[BaseModel]) -> Dict[str, str]:
+    """Result store columns of an output record class; move lists are stored one move per line."""
+    return {
+        name: "list" if getattr(field.annotation, "__origin__", None) is list else "str"
+        for name, field in sample_model.model_fields.items()
+    }
+
+
+def open_result_partition(player: BaseGamePlayer, output_dir: str, game_name: str, experiment_type: str, resume: bool = False) -> Optional[ResultPartition]:
+    """Result store partition of a game, or None if the run writes JSON output files."""
+    if player.output_format != "store":
+        return None
+    columns = output_columns(output_sample_model(experiment_type))
+    return ResultPartition.create(partition_path(output_dir, game_name), game_name, player.model_name, experiment_type, columns, resume)
+
+
+class JournalEntry(BaseModel):
+    """One line of a game journal: the outcome of a single input sample."""
+    index: int
+    status: str  # "ok" or "failed"
+    sample: Optional[dict] = None
+    error: Optional[str] = None
+    time: float = Field(default_factory=time.time)
+
+
+# Called with a dict (game, experiment, index, status, ...) for every sample a GameJournal records, e.g. to stream progress
+SAMPLE_LISTENER = contextvars.ContextVar("sample_listener", default=None)
+
+
+class GameJournal:
+    """
+    Append-only JSONL file (journal_<game>.jsonl) with every finished sample of one game, written as soon as
+    the sample completes. When resuming, successful samples are loaded back and only the rest are re-issued.
+    New successes are passed to the optional GameVerifier.
+    With a ResultPartition the samples themselves go to the store and the journal only keeps their status.
+    """
+    def __init__(
+        self,
+        output_dir: str,
+        game_name: str,
+        experiment_type: str,
+        resume: bool = False,
+        verifier: Optional[GameVerifier] = None,
+        store: Optional[ResultPartition] = None
+    ):
+        self.path = os.path.join(output_dir, f"journal_{game_name}.jsonl")
+        self.game_name = game_name
+        self.experiment_type = experiment_type
+        self.sample_model = output_sample_model(experiment_type)
+        self.verifier = verifier
+        self.store = store
+        # index -> output sample
+        self.completed = {}
+        self.failed = set()
+
+        os.makedirs(output_dir, exist_ok=True)
+        if resume and os.path.exists(self.path):
+            self._load()
+            print(f"♻️ Resuming from {self.path}: {len(self.completed)} done, {len(self.failed)} failed")
+        else:
+            open(self.path, 'w').close()
+
+    def _load(self):
+        stored = dict(self.store.samples()) if self.store is not None else {}
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = JournalEntry.model_validate_json(line)
+                except ValidationError:
+                    # A line cut off by an interruption
+                    continue
+                if entry.status == "ok":
+                    sample = entry.sample if entry.sample is not None else stored.get(entry.index)
+                    if sample is None:
+                        # Journaled, but the stored sample was lost; the sample is re-issued
+                        continue
+                    self.completed[entry.index] = self.sample_model.model_validate(sample)
+                    self.failed.discard(entry.index)
+                elif entry.index not in self.completed:
+                    self.failed.add(entry.index)
+        # Samples journaled by a run that wrote JSON output files
+        for index in sorted(set(self.completed) - set(stored)):
+            if self.store is not None:
+                self.store.append(index, self.completed[index].model_dump())
+
+    @traced("journal")
+    def _append(self, entry: JournalEntry):
+        with open(self.path, 'a') as f:
+            f.write(entry.model_dump_json() + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_success(self, index: int, output_sample: BaseModel):
+        self.completed[index] = output_sample
+        self.failed.discard(index)
+        sample = output_sample.model_dump()
+        if self.store is not None:
+            with span("store_append"):
+                self.store.append(index, sample)
+            sample = None
+        self._append(JournalEntry(index=index, status="ok", sample=sample))
+        verdict = self.verifier.check(index, output_sample) if self.verifier is not None else None
+        self._notify(index, "ok", **(dict(exact=verdict.exact, jaccard=verdict.jaccard) if verdict is not None else {}))
+
+    def record_failure(self, index: int, error: Exception):
+        self.failed.add(index)
+        self._append(JournalEntry(index=index, status="failed", error=str(error)))
+        self._notify(index, "failed", error=str(error))
+
+    def _notify(self, index: int, status: str, **details):
+        listener = SAMPLE_LISTENER.get()
+        if listener is not None:
+            listener(dict(game=self.game_name, experiment=self.experiment_type, index=index, status=status, **details))
+
+    def ordered_samples(self, max_samples: int) -> list:
+        return [self.completed[i] for i in sorted(self.completed)][:max_samples]
+
+
+class ManifestEntry(BaseModel):
+    samples_file: str
+    journal: str
+    samples_ok: int = 0
+    failed_indices: List[int] = Field(default_factory=list)
+    output_file: Optional[str] = None
+    complete: bool = False
+    updated: float = Field(default_factory=time.time)
+
+
+class RunManifestData(BaseModel):
+    llm_model: str
+    experiment_type: str
+    n_moves: Optional[int] = None
+    games: dict = Field(default_factory=dict)
+
+
+@contextlib.contextmanager
+def exclusive_file_lock(path: str, stale: float = 30.0, poll: float = 0.05):
+    """
+    Holds the lock file `path`, created with O_EXCL, for the duration of the block, so processes sharing a directory
+    (also over a network share, like the work queue) take turns. A lock older than `stale` seconds was left by a crashed
+    process and is broken.
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class RunManifest:
+    """
+    run_manifest.json in an output directory: per-game progress of a (model, experiment, n_moves) run.
+    Workers of several processes may finish games of the same run, so an update re-reads the file under a lock
+    and only replaces the entry of its own game.
+    """
+    def __init__(self, output_dir: str, llm_model: str, experiment_type: str, n_moves: Optional[int] = None):
+        self.path = os.path.join(output_dir, "run_manifest.json")
+        self.data = self._read() or RunManifestData(llm_model=llm_model, experiment_type=experiment_type, n_moves=n_moves)
+
+    def _read(self) -> Optional[RunManifestData]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r') as f:
+                return RunManifestData.model_validate_json(f.read())
+        except (OSError, ValidationError) as e:
+            print(f"⚠️ Ignoring unreadable manifest {self.path}: {e}")
+            return None
+
+    def entry(self, game_name: str) -> Optional[ManifestEntry]:
+        raw = self.data.games.get(game_name)
+        return ManifestEntry.model_validate(raw) if raw is not None else None
+
+    def is_complete(self, game_name: str) -> bool:
+        entry = self.entry(game_name)
+        return bool(entry and entry.complete and entry.output_file and os.path.exists(entry.output_file))
+
+    def update(self, game_name: str, journal: GameJournal, samples_file: str, max_samples: int, output_file: Optional[str] = None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with exclusive_file_lock(self.path + ".lock"):
+            # Entries other workers wrote since this manifest was read are kept
+            self.data = self._read() or self.data
+            previous = self.entry(game_name)
+            self.data.games[game_name] = ManifestEntry(
+                samples_file=samples_file,
+                journal=journal.path,
+                samples_ok=len(journal.completed),
+                failed_indices=sorted(journal.failed),
+                output_file=output_file or (previous.output_file if previous else None),
+                complete=output_file is not None or len(journal.completed) >= max_samples
+            ).model_dump()
+            self._write()
+
+    def _write(self):
+        tmp_path = f"{self.path}.{os.getpid()}.{os.urandom(4).hex()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.data.model_dump_json(indent=4))
+        os.replace(tmp_path, self.path)
+
+
+@traced("save_output")
+def save_output(
+    eval_data: LazyEvalData,
+    player: BaseGamePlayer,
+    output_dir: str,
+    experiment_type: str,
+    experiment_id: str,
+    output_samples_list: list,
+    max_samples: int,
+    store: Optional[ResultPartition] = None
+) -> Optional[str]:
+    """
+    Writes collected samples to output_<game>_<experiment_id>.json if the batch is complete. Returns the file path.
+    A batch that ended short goes to partial_<game>_<experiment_id>.json instead, which neither counts as output
+    for skipping the game nor is scored, and None is returned.
+    With a result store the samples are already written and the partition is marked complete instead.
+    """
+    print(f"\nSuccessfully processed: {len(output_samples_list)} samples.")
+
+    complete = len(output_samples_list) >= max_samples
+    if not complete:
+        print(f"⚠️ Only {len(output_samples_list)}/{max_samples} samples collected. Progress is kept in the journal, rerun with --resume.")
+        if store is not None:
+            print(f"💾 Partial results are in {store.path}")
+            return None
+        if not output_samples_list:
+            return None
+
+    if store is not None:
+        store.mark_complete(len(output_samples_list))
+        print(f"💾 Saved to {store.path} (export JSON with result_store.py)")
+        return store.path
+
+    output_data = OutputData(
+        game_name=eval_data.game_name,
+        llm_model=player.model_name,
+        experiment_type=experiment_type,
+        samples=output_samples_list
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Partial files of earlier runs are superseded by this one
+    stale = glob.glob(os.path.join(output_dir, f"partial_{eval_data.game_name}_[0-9]*.json"))
+    prefix = "output" if complete else "partial"
+    output_filename = os.path.join(output_dir, f"{prefix}_{eval_data.game_name}_{experiment_id}.json")
+
+    try:
+        with open(output_filename, 'w') as f:
+            f.write(output_data.model_dump_json(indent=4, exclude_none=True))
+    except Exception as e:
+        print(f"❌ Failed to save JSON: {e}")
+        return None
+    for path in stale:
+        if path != output_filename:
+            os.remove(path)
+    if not complete:
+        print(f"💾 Saved partial results to {output_filename}")
+        return None
+    print(f"💾 Saved to {output_filename}")
+    return output_filename
+
+
+def finish_game(
+    eval_data: LazyEvalData,
+    player: BaseGamePlayer,
+    journal: GameJournal,
+    samples_file_path: str,
+    output_dir: str,
+    experiment_type: str,
+    experiment_id: str,
+    max_samples: int,
+    n_moves: int = None
+):
+    """Writes the final output file from the journal and records the game in the run manifest."""
+    output_file = save_output(
+        eval_data, player, output_dir, experiment_type, experiment_id, journal.ordered_samples(max_samples), max_samples, journal.store
+    )
+    with span("manifest"):
+        manifest = RunManifest(output_dir, player.model_name, experiment_type, n_moves)
+        manifest.update(eval_data.game_name, journal, samples_file_path, max_samples, output_file)
+
+
+def process_game_file(
+    gdl_file_path: str,
+    samples_file_path: str,
+    player: BaseGamePlayer,
+    output_dir: str,
+    max_samples: int,
+    experiment_type: str,
+    n_moves: int = None,
+    resume: bool = False,
+    pack_size: int = 1
+):
+    """
+    Runs the LLM evaluation for a single game file based on experiment type.
+    Every finished sample is journaled immediately; with resume=True journaled successes are not re-issued.
+    With pack_size > 1, next_state / legal_moves samples are sent pack_size at a time in one prompt.
+    """
+    print(f"🔬 Starting data collection ({experiment_type}) for: {os.path.basename(samples_file_path)}")
+    experiment_id = time.strftime("%Y-%m-%d_%H%M%S")
+
+    if not any(e in experiment_type for e in EXPERIMENT_TYPES):
+        print(f"Unknown experiment type: {experiment_type}")
+        return
+
+    inputs = load_game_inputs(gdl_file_path, samples_file_path)
+    if inputs is None:
+        return
+    gdl_game_definition, eval_data = inputs
+    set_request_context(eval_data.game_name, experiment_type)
+    prepared = prepare_game_definition(player, gdl_game_definition, eval_data.game_name)
+    if prepared is None:
+        return
+    prompt_definition, symbols = prepared
+
+    print(f"Found {eval_data.sample_count} samples. Processing max {max_samples}...")
+
+    verifier = make_game_verifier(player, gdl_game_definition, eval_data.game_name, experiment_type)
+    store = open_result_partition(player, output_dir, eval_data.game_name, experiment_type, resume)
+    journal = GameJournal(output_dir, eval_data.game_name, experiment_type, resume, verifier, store)
+    pack_size = pack_size if supports_packing(experiment_type) else 1
+    pack = []
+
+    try:
+        # Processing Loop
+        for i, sample in eval_data.indexed_samples():
+            if len(journal.completed) >= max_samples:
+                break
+            if i in journal.completed:
+                continue
+
+            print(f"\n--- Processing Sample {i + 1} / {min(eval_data.sample_count, max_samples)} ---")
+            with trace_tags(sample=i):
+                try:
+                    task = prepare_sample_task(i, sample, prompt_definition, experiment_type, n_moves, symbols)
+                    if task is None:
+                        continue
+
+                    if pack_size > 1:
+                        pack.append(task)
+                        if len(pack) >= min(pack_size, max_samples - len(journal.completed)):
+                            run_packed_tasks(player, prompt_definition, experiment_type, pack, journal)
+                            pack = []
+                        continue
+
+                    journal.record_success(i, task.run(player))
+                    print(f"✅ Sample {i + 1} processed.")
+                    time.sleep(0.1) # Rate limit safety
+
+                except Exception as e:
+                    print(f"❌ Sample {i + 1} failed: {e}")
+                    journal.record_failure(i, e)
+                    continue
+
+        if pack:
+            run_packed_tasks(player, prompt_definition, experiment_type, pack, journal)
+    finally:
+        # The game definition prefix is not needed by any later game
+        player.release_prefix_caches(prompt_definition)
+
+    finish_game(eval_data, player, journal, samples_file_path, output_dir, experiment_type, experiment_id, max_samples, n_moves)
+
+
+async def process_game_file_async(
+    gdl_file_path: str,
+    samples_file_path: str,
+    player: BaseGamePlayer,
+    output_dir: str,
+    max_samples: int,
+    experiment_type: str,
+    n_moves: int = None,
+    resume: bool = False,
+    pack_size: int = 1
+):
+    """
+    Async variant of process_game_file. Samples are dispatched concurrently in waves sized to the
+    number of results still missing; the output keeps the original sample order.
+    """
+    print(f"🔬 Starting async data collection ({experiment_type}) for: {os.path.basename(samples_file_path)}")
+    experiment_id = time.strftime("%Y-%m-%d_%H%M%S")
+
+    if not any(e in experiment_type for e in EXPERIMENT_TYPES):
+        print(f"Unknown experiment type: {experiment_type}")
+        return
+
+    inputs = load_game_inputs(gdl_file_path, samples_file_path)
+    if inputs is None:
+        return
+    gdl_game_definition, eval_data = inputs
+    set_request_context(eval_data.game_name, experiment_type)
+    prepared = prepare_game_definition(player, gdl_game_definition, eval_data.game_name)
+    if prepared is None:
+        return
+    prompt_definition, symbols = prepared
+
+    print(f"Found {eval_data.sample_count} samples. Processing max {max_samples}...")
+
+    verifier = make_game_verifier(player, gdl_game_definition, eval_data.game_name, experiment_type)
+    store = open_result_partition(player, output_dir, eval_data.game_name, experiment_type, resume)
+    journal = GameJournal(output_dir, eval_data.game_name, experiment_type, resume, verifier, store)
+
+    async def run_task(task: SampleTask):
+        with trace_tags(sample=task.index):
+            try:
+                journal.record_success(task.index, await task.arun(player))
+                print(f"✅ [{eval_data.game_name}] Sample {task.index + 1} processed.")
+            except Exception as e:
+                print(f"❌ [{eval_data.game_name}] Sample {task.index + 1} failed: {e}")
+                journal.record_failure(task.index, e)
+
+    # Samples are read from the file only as waves need them
+    pending = ((i, sample) for i, sample in eval_data.indexed_samples() if i not in journal.completed)
+    exhausted = False
+    pack_size = pack_size if supports_packing(experiment_type) else 1
+
+    try:
+        while not exhausted and len(journal.completed) < max_samples:
+            # Only dispatch as many samples as are still missing, failures are replaced in the next wave
+            wave = []
+            while len(wave) < max_samples - len(journal.completed):
+                item = next(pending, None)
+                if item is None:
+                    exhausted = True
+                    break
+                i, sample = item
+                try:
+                    with trace_tags(sample=i):
+                        task = prepare_sample_task(i, sample, prompt_definition, experiment_type, n_moves, symbols)
+                except Exception as e:
+                    print(f"❌ [{eval_data.game_name}] Sample {i + 1} failed: {e}")
+                    journal.record_failure(i, e)
+                    continue
+                if task is not None:
+                    wave.append(task)
+
+            if pack_size > 1:
+                packs = [wave[k:k + pack_size] for k in range(0, len(wave), pack_size)]
+                await asyncio.gather(*(arun_packed_tasks(player, prompt_definition, experiment_type, p, journal) for p in packs))
+            else:
+                await asyncio.gather(*(run_task(task) for task in wave))
+    finally:
+        player.release_prefix_caches(prompt_definition)
+
+    finish_game(eval_data, player, journal, samples_file_path, output_dir, experiment_type, experiment_id, max_samples, n_moves)
+
+
+async def run_games_async(jobs: List[dict], player: BaseGamePlayer, game_concurrency: int, process: Callable = None):
+    """Processes several games at once. Sample-level concurrency is bounded by the player."""
+    process = process or process_game_file_async
+    game_semaphore = asyncio.Semaphore(max(1, game_concurrency))
+
+    async def run_job(job: dict):
+        async with game_semaphore:
+            await process(player=player, **job)
+
+    await asyncio.gather(*(run_job(job) for job in jobs))
+
+
+# -- Incremental Multi-Step --
+
+class IncrementalSequence:
+    """
+    One multi-step sample evaluated as a growing conversation, one move per turn. The answer after step n is the
+    multi_step_prediction result for N = n. When resuming, journaled answers of the leading steps are replayed into the conversation.
+    """
+    def __init__(
+        self,
+        index: int,
+        sample: MultiStepInputSample,
+        game_definition: str,
+        journals: Dict[int, GameJournal],
+        symbols: Optional[SymbolMap] = None
+    ):
+        self.index = index
+        self.sample = sample
+        self.game_definition = game_definition
+        self.journals = journals
+        self.symbols = symbols
+        self.n_max = max(journals)
+        # N beyond the sample's moves get the answer for all available moves, as in the non-incremental mode
+        self.steps = min(self.n_max, len(sample.moves))
+        self.turns = []
+        self.step = 0
+
+        for n in range(1, self.steps + 1):
+            done = journals[n].completed.get(index)
+            if done is None:
+                break
+            self._append_turns(n, LLMNextStateResponse(llm_state=self._encode(done.llm_state)))
+        if self.done:
+            self._record_beyond_moves(journals[self.steps].completed[index])
+
+    @property
+    def done(self) -> bool:
+        return self.step >= self.steps
+
+    def _encode(self, text: str) -> str:
+        return self.symbols.encode_text(text) if self.symbols else text
+
+    def _user_turn(self, n: int) -> tuple:
+        move = self.sample.moves[n - 1]
+        return "user", PROMPT_INCREMENTAL_STEP.format(step=move.step, joint_move=self._encode(move.joint_move))
+
+    def _append_turns(self, n: int, response: LLMNextStateResponse):
+        self.turns += [self._user_turn(n), ("assistant", response.model_dump_json())]
+        self.step = n
+
+    def _record_beyond_moves(self, output: OutputSampleMultiStep):
+        for n in range(self.steps + 1, self.n_max + 1):
+            if self.index not in self.journals[n].completed:
+                self.journals[n].record_success(self.index, output)
+
+    def next_prompt(self) -> ConversationPrompt:
+        return build_incremental_prompt(self.game_definition, self.turns + [self._user_turn(self.step + 1)])
+
+    def record(self, response: LLMNextStateResponse):
+        """Adds the answer for the next step to the conversation and journals it as the result for that N."""
+        if not isinstance(response, LLMNextStateResponse):
+            raise ValueError(f"No valid answer for step {self.step + 1}")
+        self._append_turns(self.step + 1, response)
+        llm_state = self.symbols.decode_text(response.llm_state) if self.symbols else response.llm_state
+        output = OutputSampleMultiStep(moves=self.sample.moves[:self.step], llm_state=llm_state,
+                                       repaired=response._repairs, backend=response._backend)
+        self.journals[self.step].record_success(self.index, output)
+        if self.done:
+            self._record_beyond_moves(output)
+
+    def fail(self, error: Exception):
+        for n in range(self.step + 1, self.n_max + 1):
+            self.journals[n].record_failure(self.index, error)
+
+
+def incremental_sequences(
+    eval_data: LazyEvalData,
+    journals: Dict[int, GameJournal],
+    game_definition: str,
+    symbols: Optional[SymbolMap] = None
+) -> Iterator[IncrementalSequence]:
+    """Sequences of the samples that still miss the answer for at least one N."""
+    for i, sample in eval_data.indexed_samples():
+        if not isinstance(sample, MultiStepInputSample) or not sample.moves:
+            print(f"Skipping sample {i + 1}: no moves for multi_step_prediction")
+            continue
+        sequence = IncrementalSequence(i, sample, game_definition, journals, symbols)
+        if not sequence.done:
+            yield sequence
+
+
+def incremental_job(job: dict, output_dirs: Dict[int, str]) -> dict:
+    """Turns a process_game_file job into one for process_game_file_incremental."""
+    return dict(
+        gdl_file_path=job["gdl_file_path"],
+        samples_file_path=job["samples_file_path"],
+        output_dirs=output_dirs,
+        max_samples=job["max_samples"],
+        experiment_type=job["experiment_type"],
+        resume=job["resume"]
+    )
+
+
+def _start_incremental_game(gdl_file_path: str, samples_file_path: str, player: BaseGamePlayer, output_dirs: Dict[int, str],
+                            experiment_type: str, resume: bool) -> Optional[tuple]:
+    """Loads the inputs and opens one journal per N. Returns (eval_data, journals, prompt definition, symbols) or None."""
+    inputs = load_game_inputs(gdl_file_path, samples_file_path)
+    if inputs is None:
+        return None
+    gdl_game_definition, eval_data = inputs
+    set_request_context(eval_data.game_name, experiment_type)
+    prepared = prepare_game_definition(player, gdl_game_definition, eval_data.game_name)
+    if prepared is None:
+        return None
+    prompt_definition, symbols = prepared
+
+    print(f"Found {eval_data.sample_count} samples. Evaluating N = {min(output_dirs)}..{max(output_dirs)} incrementally.")
+    verifier = make_game_verifier(player, gdl_game_definition, eval_data.game_name, experiment_type)
+    journals = {
+        n: GameJournal(
+            output_dirs[n], eval_data.game_name, experiment_type, resume, verifier,
+            open_result_partition(player, output_dirs[n], eval_data.game_name, experiment_type, resume)
+        )
+        for n in sorted(output_dirs)
+    }
+    return eval_data, journals, prompt_definition, symbols
+
+
+def process_game_file_incremental(
+    gdl_file_path: str,
+    samples_file_path: str,
+    player: BaseGamePlayer,
+    output_dirs: Dict[int, str],
+    max_samples: int,
+    experiment_type: str = "multi_step_prediction",
+    resume: bool = False
+):
+    """
+    multi_step_prediction for every N in output_dirs (1..K) in a single pass: each sample is one conversation and the
+    answer after step n is written to the output of N = n. A sweep costs K turns per sample, each extending the
+    previous prompt, instead of K prompts that replay the game definition and all earlier steps.
+    """
+    print(f"🔬 Starting incremental data collection ({experiment_type}) for: {os.path.basename(samples_file_path)}")
+    experiment_id = time.strftime("%Y-%m-%d_%H%M%S")
+
+    started = _start_incremental_game(gdl_file_path, samples_file_path, player, output_dirs, experiment_type, resume)
+    if started is None:
+        return
+    eval_data, journals, prompt_definition, symbols = started
+    final = journals[max(journals)]
+    # Every turn is answered with a full state
+    answer_size = initial_state_size(prompt_definition)
+
+    try:
+        for sequence in incremental_sequences(eval_data, journals, prompt_definition, symbols):
+            if len(final.completed) >= max_samples:
+                break
+            print(f"\n--- Processing Sample {sequence.index + 1} from step {sequence.step + 1} / {sequence.steps} ---")
+            with trace_tags(sample=sequence.index), expected_answer_size(answer_size):
+                try:
+                    while not sequence.done:
+                        sequence.record(player._generate_json(sequence.next_prompt(), LLMNextStateResponse))
+                    print(f"✅ Sample {sequence.index + 1} processed.")
+                except Exception as e:
+                    print(f"❌ Sample {sequence.index + 1} failed at step {sequence.step + 1}: {e}")
+                    sequence.fail(e)
+    finally:
+        player.release_prefix_caches(prompt_definition)
+
+    for n, journal in journals.items():
+        finish_game(eval_data, player, journal, samples_file_path, output_dirs[n], experiment_type, experiment_id, max_samples, n)
+
+
+async def process_game_file_incremental_async(
+    gdl_file_path: str,
+    samples_file_path: str,
+    player: BaseGamePlayer,
+    output_dirs: Dict[int, str],
+    max_samples: int,
+    experiment_type: str = "multi_step_prediction",
+    resume: bool = False
+):
+    """Async variant of process_game_file_incremental. Samples run concurrently in waves; the steps of one sample stay sequential."""
+    print(f"🔬 Starting async incremental data collection ({experiment_type}) for: {os.path.basename(samples_file_path)}")
+    experiment_id = time.strftime("%Y-%m-%d_%H%M%S")
+
+    started = _start_incremental_game(gdl_file_path, samples_file_path, player, output_dirs, experiment_type, resume)
+    if started is None:
+        return
+    eval_data, journals, prompt_definition, symbols = started
+    final = journals[max(journals)]
+    # Every turn is answered with a full state
+    answer_size = initial_state_size(prompt_definition)
+
+    async def run_sequence(sequence: IncrementalSequence):
+        with trace_tags(sample=sequence.index), expected_answer_size(answer_size):
+            try:
+                while not sequence.done:
+                    sequence.record(await player._agenerate_json(sequence.next_prompt(), LLMNextStateResponse))
+                print(f"✅ [{eval_data.game_name}] Sample {sequence.index + 1} processed.")
+            except Exception as e:
+                print(f"❌ [{eval_data.game_name}] Sample {sequence.index + 1} failed at step {sequence.step + 1}: {e}")
+                sequence.fail(e)
+
+    pending = incremental_sequences(eval_data, journals, prompt_definition, symbols)
+    try:
+        while len(final.completed) < max_samples:
+            wave = list(itertools.islice(pending, max_samples - len(final.completed)))
+            if not wave:
+                break
+            await asyncio.gather(*(run_sequence(sequence) for sequence in wave))
+    finally:
+        player.release_prefix_caches(prompt_definition)
+
+    for n, journal in journals.items():
+        finish_game(eval_data, player, journal, samples_file_path, output_dirs[n], experiment_type, experiment_id, max_samples, n)
+
+
+# -- Batch Mode --
+
+class BatchState(BaseModel):
+    """batch_state.json: the submitted job of a batch run, so an interrupted run re-attaches instead of resubmitting."""
+    backend: str
+    job_id: str
+    custom_ids: List[str]
+    submitted: float = Field(default_factory=time.time)
+
+
+def _openai_batch_line(custom_id: str, body: dict) -> str:
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+
+
+def _parse_openai_batch_output(lines: List[str]) -> dict:
+    """Maps custom_id -> Completion (or Exception) from OpenAI batch output lines."""
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        custom_id = record.get("custom_id")
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code", 200) != 200:
+            results[custom_id] = RuntimeError(str(record.get("error") or response.get("body")))
+            continue
+        body = response.get("body") or {}
+        usage = body.get("usage") or {}
+        results[custom_id] = Completion(
+            text=body["choices"][0]["message"]["content"] or "",
+            prompt_tokens=usage.get("prompt_tokens") or 0,
+            completion_tokens=usage.get("completion_tokens") or 0
+        )
+    return results
+
+
+class BatchJobFailed(RuntimeError):
+    """Raised when a batch job ended without results (failed, expired or cancelled)."""
+    pass
+
+
+class BatchBackend:
+    """Submits a list of (custom_id, prompt, response_model) requests as one asynchronous batch job and fetches the results."""
+    name = "base"
+    # How often the job status is checked
+    poll_interval = 30
+
+    def submit(self, requests: List[tuple], player: BaseGamePlayer, batch_file: str) -> str:
+        raise NotImplementedError
+
+    def status(self, job_id: str) -> str:
+        """Returns 'running', 'completed' or 'failed'."""
+        raise NotImplementedError
+
+    def results(self, job_id: str, custom_ids: List[str]) -> dict:
+        raise NotImplementedError
+
+    def wait(self, job_id: str):
+        while True:
+            status = self.status(job_id)
+            if status != "running":
+                print(f"📬 [Batch] Job {job_id} {status}")
+                if status == "failed":
+                    raise BatchJobFailed(f"Batch job {job_id} failed")
+                return
+            print(f"⏳ [Batch] Job {job_id} still running, checking again in {self.poll_interval}s")
+            time.sleep(self.poll_interval)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a batch service. Each job is a directory <batch_dir>/<job_id>/ with input.jsonl and
+    status.json; fulfil_local_batch_jobs (or anything else) writes output.jsonl in the OpenAI batch output format.
+    """
+    name = "local"
+    poll_interval = 2
+
+    def __init__(self, batch_dir: str):
+        self.batch_dir = batch_dir
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.batch_dir, job_id)
+
+    def submit(self, requests: List[tuple], player: BaseGamePlayer, batch_file: str) -> str:
+        stamp = f"batch_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        # A job resubmitted within the same second gets a directory of its own
+        for n in itertools.count():
+            job_id = f"{stamp}_{n}" if n else stamp
+            try:
+                os.makedirs(self._job_dir(job_id))
+                break
+            except FileExistsError:
+                continue
+        with open(os.path.join(self._job_dir(job_id), "input.jsonl"), 'w') as dst, open(batch_file, 'r') as src:
+            dst.write(src.read())
+        _write_job_status(self._job_dir(job_id), "queued")
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        with open(os.path.join(self._job_dir(job_id), "status.json"), 'r') as f:
+            status = json.load(f)["status"]
+        return {"queued": "running", "in_progress": "running"}.get(status, status)
+
+    def results(self, job_id: str, custom_ids: List[str]) -> dict:
+        with open(os.path.join(self._job_dir(job_id), "output.jsonl"), 'r') as f:
+            return _parse_openai_batch_output(f.readlines())
+
+
+def _write_job_status(job_dir: str, status: str):
+    tmp_path = os.path.join(job_dir, "status.json.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump({"status": status, "updated": time.time()}, f)
+    os.replace(tmp_path, os.path.join(job_dir, "status.json"))
+
+
+# Fields of a batch line body that are not sampling parameters
+BATCH_BODY_FIELDS = ("model", "messages", "response_format")
+
+
+def batch_line_request(body: dict) -> tuple:
+    """(prompt, response model or None, sampling parameters) of a batch line body."""
+    schema_name = (body.get("response_format") or {}).get("json_schema", {}).get("name")
+    sampling_params = {name: value for name, value in body.items() if name not in BATCH_BODY_FIELDS}
+    return body["messages"][0]["content"], RESPONSE_MODELS.get(schema_name), sampling_params
+
+
+def fulfil_local_batch_jobs(batch_dir: str, player: BaseGamePlayer):
+    """
+    Processes queued local batch jobs one request at a time with the given player (offline batch service).
+    Each request is sent with the response schema and sampling parameters of its batch line.
+    """
+    for job_id in sorted(os.listdir(batch_dir)):
+        job_dir = os.path.join(batch_dir, job_id)
+        status_path = os.path.join(job_dir, "status.json")
+        if not os.path.exists(status_path):
+            continue
+        with open(status_path, 'r') as f:
+            if json.load(f)["status"] != "queued":
+                continue
+
+        print(f"🏭 [Batch worker] Processing {job_id}")
+        _write_job_status(job_dir, "in_progress")
+        with open(os.path.join(job_dir, "input.jsonl"), 'r') as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+
+        with open(os.path.join(job_dir, "output.jsonl"), 'w') as out:
+            for line in lines:
+                prompt, response_model, sampling_params = batch_line_request(line["body"])
+                params = SAMPLING_PARAMS.set(sampling_params)
+                try:
+                    completion = player._complete(prompt, player.key_pool.acquire(estimate_tokens(prompt)), response_model)
+                    body = {
+                        "choices": [{"message": {"role": "assistant", "content": completion.text}}],
+                        "usage": {"prompt_tokens": completion.prompt_tokens, "completion_tokens": completion.completion_tokens}
+                    }
+                    record = {"custom_id": line["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}
+                except Exception as e:
+                    record = {"custom_id": line["custom_id"], "response": None, "error": {"message": str(e)}}
+                finally:
+                    SAMPLING_PARAMS.reset(params)
+                out.write(json.dumps(record) + "\n")
+        _write_job_status(job_dir, "completed")
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Batch API of OpenAI-compatible endpoints (files + batches, 24h completion window)."""
+    name = "openai"
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, requests: List[tuple], player: BaseGamePlayer, batch_file: str) -> str:
+        with open(batch_file, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        status = self.client.batches.retrieve(job_id).status
+        if status == "completed":
+            return "completed"
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "running"
+
+    def results(self, job_id: str, custom_ids: List[str]) -> dict:
+        batch = self.client.batches.retrieve(job_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                results.update(_parse_openai_batch_output(self.client.files.content(file_id).text.splitlines()))
+        return results
+
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini batch jobs with inlined requests; responses come back in request order."""
+    name = "gemini"
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, requests: List[tuple], player: BaseGamePlayer, batch_file: str) -> str:
+        inlined = [
+            {"contents": [{"role": "user", "parts": [{"text": str(prompt)}]}], "config": player.generation_config(response_model)}
+            for _, prompt, response_model in requests
+        ]
+        job = self.client.batches.create(
+            model=player.model_name,
+            src=inlined,
+            config={"display_name": os.path.basename(batch_file)}
+        )
+        return job.name
+
+    def status(self, job_id: str) -> str:
+        state = self.client.batches.get(name=job_id).state.name
+        if state == "JOB_STATE_SUCCEEDED":
+            return "completed"
+        if state in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+            return "failed"
+        return "running"
+
+    def results(self, job_id: str, custom_ids: List[str]) -> dict:
+        job = self.client.batches.get(name=job_id)
+        results = {}
+        for custom_id, inlined in zip(custom_ids, job.dest.inlined_responses or []):
+            if inlined.error or inlined.response is None:
+                results[custom_id] = RuntimeError(str(inlined.error))
+                continue
+            usage = inlined.response.usage_metadata
+            results[custom_id] = Completion(
+                text=inlined.response.text or "",
+                prompt_tokens=(usage.prompt_token_count or 0) if usage else 0,
+                completion_tokens=(usage.candidates_token_count or 0) if usage else 0
+            )
+        return results
+
+
+def make_batch_backend(kind: str, player: BaseGamePlayer, batch_dir: str) -> BatchBackend:
+    if kind == "local":
+        return LocalBatchBackend(batch_dir)
+    if not player.supports_batch:
+        raise ValueError(f"{player.provider_name} has no batch API; use --batch_backend local")
+    if isinstance(player, GeminiGamePlayer):
+        return GeminiBatchBackend(player.clients[0])
+    return OpenAIBatchBackend(player.clients[0])
+
+
+def run_batch_experiment(
+    jobs: List[dict],
+    player: BaseGamePlayer,
+    backend: BatchBackend,
+    output_dir: str,
+    resume: bool = False,
+    spare: float = 0.2
+):
+    """
+    Compiles the prompts of every game job into a single batch file, submits it, waits for the job and maps
+    the answers back into the game journals and output files. Failed answers are journaled, not retried;
+    `spare` extra samples per game (as a fraction of the missing ones) absorb failures without a second batch,
+    and a later --resume run submits whatever is still missing.
+    """
+    experiment_id = time.strftime("%Y-%m-%d_%H%M%S")
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, "batch_state.json")
+
+    # 1. Compile requests
+    games = {}
+    requests = []
+    for job in jobs:
+        inputs = load_game_inputs(job["gdl_file_path"], job["samples_file_path"])
+        if inputs is None:
+            continue
+        gdl_game_definition, eval_data = inputs
+        prepared = prepare_game_definition(player, gdl_game_definition, eval_data.game_name)
+        if prepared is None:
+            continue
+        prompt_definition, symbols = prepared
+        verifier = make_game_verifier(player, gdl_game_definition, eval_data.game_name, job["experiment_type"])
+        game_resume = job.get("resume", resume)
+        store = open_result_partition(player, output_dir, eval_data.game_name, job["experiment_type"], game_resume)
+        journal = GameJournal(output_dir, eval_data.game_name, job["experiment_type"], game_resume, verifier, store)
+        tasks = {}
+        missing = job["max_samples"] - len(journal.completed)
+        wanted = missing + math.ceil(missing * spare) if missing > 0 else 0
+        for i, sample in eval_data.indexed_samples():
+            if len(tasks) >= wanted:
+                break
+            if i in journal.completed:
+                continue
+            try:
+                task = prepare_sample_task(i, sample, prompt_definition, job["experiment_type"], job.get("n_moves"), symbols)
+                if task is not None:
+                    player.check_context_window(task.prompt)
+            except Exception as e:
+                print(f"❌ [{eval_data.game_name}] Sample {i + 1} failed: {e}")
+                journal.record_failure(i, e)
+                continue
+            if task is not None:
+                tasks[f"{eval_data.game_name}:{i}"] = task
+                requests.append((f"{eval_data.game_name}:{i}", task.prompt, task.response_model))
+        games[eval_data.game_name] = (job, eval_data, journal, tasks)
+
+    # 2. Submit, or re-attach to the job of an interrupted run unless that job has failed
+    state = None
+    if resume and os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            state = BatchState.model_validate_json(f.read())
+        if backend.status(state.job_id) == "failed":
+            print(f"♻️ [Batch] Job {state.job_id} of the interrupted run failed, submitting anew")
+            os.remove(state_path)
+            state = None
+        else:
+            print(f"♻️ [Batch] Re-attaching to job {state.job_id}")
+    if state is None and requests:
+        batch_file = os.path.join(output_dir, f"batch_{experiment_id}.jsonl")
+        with open(batch_file, 'w') as f:
+            for custom_id, prompt, response_model in requests:
+                f.write(_openai_batch_line(custom_id, player.batch_body(prompt, response_model)) + "\n")
+        job_id = backend.submit(requests, player, batch_file)
+        state = BatchState(backend=backend.name, job_id=job_id, custom_ids=[custom_id for custom_id, _, _ in requests])
+        with open(state_path, 'w') as f:
+            f.write(state.model_dump_json(indent=4))
+        print(f"📤 [Batch] Submitted {len(requests)} requests as job {job_id} ({backend.name})")
+
+    # 3. Wait and map results back
+    if state is not None:
+        try:
+            backend.wait(state.job_id)
+        except BatchJobFailed:
+            # Nothing to re-attach to: --resume submits the missing samples again
+            os.remove(state_path)
+            raise
+        results = backend.results(state.job_id, state.custom_ids)
+        for custom_id, outcome in results.items():
+            game_name, index = custom_id.rsplit(":", 1)
+            if game_name not in games or custom_id not in games[game_name][3]:
+                continue
+            job, eval_data, journal, tasks = games[game_name]
+            task = tasks[custom_id]
+            try:
+                if isinstance(outcome, Exception):
+                    raise outcome
+                player.usage.add(outcome)
+                output_sample = task.output(player._parse(outcome.text, task.response_model))
+                player._store_response(task.prompt, outcome)
+                journal.record_success(task.index, output_sample)
+            except Exception as e:
+                print(f"❌ [{game_name}] Sample {task.index + 1} failed: {e}")
+                journal.record_failure(task.index, e)
+        os.remove(state_path)
+
+    for job, eval_data, journal, tasks in games.values():
+        finish_game(
+            eval_data, player, journal, job["samples_file_path"], output_dir,
+            job["experiment_type"], experiment_id, job["max_samples"], job.get("n_moves")
+        )
+
+
+# --- 5. Main Execution ---
+
+def load_api_keys(explicit_key: Optional[str], env_vars: tuple, required: bool = True) -> List[str]:
+    """Resolves the API keys to pool: --api_key, then the first of the environment variables that is set (comma-separated)."""
+    api_keys_str = explicit_key or next((os.getenv(name) for name in env_vars if os.getenv(name)), None)
+    api_keys = [k.strip() for k in (api_keys_str or "").split(",") if k.strip()]
+    if not api_keys:
+        if not required:
+            # Replay runs never reach the provider and local servers ignore the key; the clients only need a placeholder
+            return ["none"]
+        raise EnvironmentError(f"Missing {' or '.join(env_vars) or '--api_key'}")
+    return api_keys
+
+
+TARGET_GAMES = {
+    "mummymaze2p", "wallmaze", "platformJumpers", "pacman3p", "snake_2009_big",
+    "bomberman2p_InvertedRoles", "bomberman2p", "battlebrushes", "checkers",
+    "checkers-mustjump", "cittaceot", "rubikscube", "god", "beatMania", "farmers",
+    "qyshinsu", "snakeAssemblit", "rendezvous_asteroids", "ticTacToeLargeSuicide",
+    "ticTacToeLarge", "dotsAndBoxesSuicide", "buttons", "dotsAndBoxes",
+    "chineseCheckers3", "pawnWhopping", "connectfour",
+    "connectFourSuicide", "checkersTiny", "othello-comp2007", "othellosuicide",
+    "chess", "checkersSmall", "fighter", "1reversi2", "checkers-newgoals"
+}
+
+def create_player(
+    provider: str,
+    model: str,
+    api_key: Optional[str] = None,
+    replay: bool = False,
+    max_concurrency: int = 1,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    base_url: Optional[str] = None
+) -> BaseGamePlayer:
+    """Builds the player of a provider with its pooled API keys and rate limits. Only that provider's SDK is imported."""
+    player = player_class(provider)
+    api_keys = load_api_keys(api_key, player.api_key_env, required=player.api_key_required and not replay)
+    return player(model, api_keys, max_concurrency=max_concurrency, rpm=rpm, tpm=tpm, base_url=base_url)
+
+
+def parse_route(spec: str, model: str) -> tuple:
+    """'provider[:model]' -> (provider, backend model); the backend model defaults to the logical one."""
+    provider, _, backend_model = spec.partition(":")
+    return provider, backend_model or model
+
+
+def create_routed_player(
+    model: str,
+    routes: List[str],
+    replay: bool = False,
+    backend_options: Optional[Callable[[str], dict]] = None
+) -> RoutedGamePlayer:
+    """Builds a player routing the logical model over 'provider[:model]' backends. backend_options(provider) gives create_player keywords."""
+    backends = []
+    for spec in routes:
+        provider, backend_model = parse_route(spec, model)
+        backends.append(create_player(provider, backend_model, replay=replay, **(backend_options(provider) if backend_options else {})))
+    return RoutedGamePlayer(model, backends)
+
+
+def experiment_output_dir(samples_dir: str, experiment: str, model: str, n_moves: Optional[int] = None) -> str:
+    """<samples root>/<experiment>[_n<N>]/<model>/, next to the samples tree."""
+    suffix = f"_n{n_moves}" if n_moves else ""
+    return f"{'/'.join(samples_dir.split('/')[:-2])}/{experiment}{suffix}/{model}/"
+
+
+def find_gdl_file(gdl_dir: str, game_name: str) -> Optional[str]:
+    for extension in (".kif", ".gdl"):
+        gdl_path = os.path.join(gdl_dir, f"{game_name}{extension}")
+        if os.path.exists(gdl_path):
+            return gdl_path
+    return None
+
+
+def discover_game_jobs(
+    samples_dir: str,
+    gdl_dir: str,
+    model: str,
+    experiment: str,
+    n_moves: Optional[int] = None,
+    max_samples: int = 25,
+    resume: bool = False,
+    pack_size: int = 1,
+    reverse_order: bool = False,
+    games: Optional[set] = None
+) -> List[dict]:
+    """
+    One job (keyword arguments of process_game_file) per samples file whose game is in `games`
+    (TARGET_GAMES by default) and has a GDL file. Games with a finished output are skipped.
+    """
+    games = TARGET_GAMES if games is None else games
+    if not os.path.exists(samples_dir):
+        raise FileNotFoundError(f"Samples directory not found: {samples_dir}")
+
+    sample_files = [f for f in os.listdir(samples_dir) if f.endswith('.json') and not f.startswith('.')]
+    sample_files.sort(reverse=reverse_order)
+    sample_index = SampleFileIndex.shared(samples_dir).refresh(sample_files)
+    print(f"📂 Found {len(sample_files)} sample files in {samples_dir}")
+
+    output_dir = experiment_output_dir(samples_dir, experiment, model, n_moves)
+    manifest = RunManifest(output_dir, model, experiment, n_moves)
+
+    jobs = []
+    for filename in sample_files:
+        samples_full_path = os.path.join(samples_dir, filename)
+
+        info = sample_index[filename]
+        if info.error:
+            print(f"⚠️ Skipping {filename}: Read error ({info.error})")
+            continue
+        game_name = info.game_name
+        if not game_name or (games and game_name not in games):
+            continue
+
+        existing_pattern = os.path.join(output_dir, f"output_{game_name}_[0-9]*.json")
+        if manifest.is_complete(game_name) or glob.glob(existing_pattern):
+            print(f"⏩ Skipping {game_name}: Output file already exists.")
+            continue
+
+        # Find matching GDL file
+        gdl_path = find_gdl_file(gdl_dir, game_name)
+        if gdl_path is None:
+            print(f"⚠️ Skipping {game_name}: GDL file not found.")
+            continue
+
+        jobs.append(dict(
+            gdl_file_path=gdl_path,
+            samples_file_path=samples_full_path,
+            output_dir=output_dir,
+            max_samples=max_samples,
+            experiment_type=experiment,
+            n_moves=n_moves,
+            resume=resume,
+            pack_size=pack_size
+        ))
+    return jobs
+
+
+def main():
+    load_dotenv()
+    
+    parser = argparse.ArgumentParser(description="Run GDL Game State Evaluation with LLMs")
+    
+    parser.add_argument("--experiment", type=str, 
+                        choices=EXPERIMENT_TYPES, 
+                        default="next_state", 
+                        help="Choose experiment variant")
+    
+    parser.add_argument("--provider", type=str, choices=available_providers(), default="cerebras",
+                        help="LLM Provider ('local' for an OpenAI-compatible server, plugins via the llm_runner.providers entry points)")
+    parser.add_argument("--model", type=str, required=True, help="Model name")
+    parser.add_argument("--api_key", type=str, help="API Key, or comma-separated keys to pool (optional if set in env vars)")
+    parser.add_argument("--base_url", type=str, help="Override the provider's API endpoint (proxy, mock server)")
+    parser.add_argument("--route", type=str, action="append",
+                        help="Serve --model from several backends, 'provider[:model]' per flag (e.g. --route cerebras --route nvidia:meta/llama-3.3-70b-instruct); "
+                             "each request goes to the backend expected to answer first and fails over to the others. Keys come from each provider's env vars")
+    
+    parser.add_argument("--samples_dir", type=str, required=True, help="Directory containing input JSON samples")
+    parser.add_argument("--gdl_dir", type=str, required=True, help="Directory containing GDL (.kif/.gdl) files")
+    
+    parser.add_argument("--max_samples", type=int, default=25, help="Max samples to process per game")
+    parser.add_argument("--reverse_order", action="store_true", help="Process files in reverse alphabetical order")
+    parser.add_argument("--n_moves", type=int, help="Number of moves to predict/generate")
+    parser.add_argument("--incremental", action="store_true",
+                        help="multi_step_prediction only: evaluate N = 1..n_moves in one pass, one growing conversation per sample")
+
+    parser.add_argument("--no_structured_output", action="store_true", help="Do not send the response JSON schema to the provider (prompt-only JSON)")
+    parser.add_argument("--stream", action="store_true", help="Stream completions, validate JSON as it arrives and abort unusable outputs early")
+    parser.add_argument("--pack_size", type=int, default=1, help="Samples packed into one prompt (next_state and legal_moves only)")
+    parser.add_argument("--compact_gdl", type=str, choices=["whitespace", "symbols"],
+                        help="Strip comments and spacing from the game definition; 'symbols' also shortens names (reversibly, states and moves included)")
+    parser.add_argument("--completion_budget", type=str, choices=["adaptive", "fixed"], default="adaptive",
+                        help="'adaptive' sizes each request's completion limit from the expected answer and raises it, up to the provider default, "
+                             "when an answer is cut off; 'fixed' always sends the provider default")
+    parser.add_argument("--escalate_truncated", action="store_true",
+                        help="Retry answers cut off at the provider default with a larger limit (up to --max_completion_tokens) instead of keeping the repaired answer")
+    parser.add_argument("--max_completion_tokens", type=int, help="Ceiling adaptive completion budgets may escalate to (overrides provider default)")
+    parser.add_argument("--context_window", type=int, help="Model context window in tokens (overrides provider default); larger prompts are rejected before sending")
+    parser.add_argument("--resume", action="store_true", help="Continue unfinished games from their journals, re-issuing only missing or failed samples")
+    parser.add_argument("--verify", action="store_true", help="Check every answer against the GDL rules as it arrives and report live accuracy")
+    parser.add_argument("--output_format", type=str, choices=["store", "json"], default="store",
+                        help="'store': compact per-game result store (export JSON with result_store.py), 'json': output_<game>_<id>.json files")
+    parser.add_argument("--metrics_path", type=str, help="Append per-request telemetry (latency, tokens, retries, failures) to this JSONL file")
+    parser.add_argument("--prometheus_path", type=str, help="Write request metrics in the Prometheus text format to this file at the end of the run")
+
+    parser.add_argument("--mode", type=str, choices=["sync", "async", "batch", "batch_worker"], default="sync",
+                        help="Sequential or concurrent sample dispatch, offline batch submission, or the local batch service")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max in-flight requests to the provider (async mode)")
+    parser.add_argument("--game_concurrency", type=int, default=1, help="Max games processed at the same time (async mode)")
+    parser.add_argument("--batch_backend", type=str, choices=["provider", "local"], default="provider",
+                        help="Batch mode: the provider's batch API or a file-based stand-in in --batch_dir")
+    parser.add_argument("--batch_dir", type=str, default="batch_jobs", help="Job directory of the local batch service")
+    parser.add_argument("--batch_spare", type=float, default=0.2, help="Extra samples submitted per game, as a fraction of the missing ones")
+    parser.add_argument("--batch_poll_interval", type=float, help="Seconds between batch job status checks")
+    parser.add_argument("--rpm", type=float, help="Requests per minute allowed per API key (overrides provider default)")
+    parser.add_argument("--tpm", type=float, help="Tokens per minute allowed per API key (overrides provider default)")
+    parser.add_argument("--attempt_timeout", type=float, default=120.0, help="Seconds one request attempt may take before it is abandoned and retried")
+    parser.add_argument("--hedge_quantile", type=float,
+                        help="Send a duplicate request once an attempt is slower than this percentile of recent latencies (e.g. 95); first answer wins")
+
+    parser.add_argument("--cache_path", type=str, help="SQLite file for the persistent response cache (disabled if omitted)")
+    parser.add_argument("--cache_mode", type=str, choices=["readwrite", "replay"], default="readwrite",
+                        help="'replay' only reads cached responses and never calls the provider")
+    parser.add_argument("--cache_max_mb", type=float, help="Evict least recently used responses above this size")
+    parser.add_argument("--cache_max_age_days", type=float, help="Evict responses older than this")
+    parser.add_argument("--trace", type=str,
+                        help="Write a Chrome / Perfetto trace of the run phases (loading, prompts, requests, parsing, retries, output) to this JSON file")
+    parser.add_argument("--profile", type=str, help="Attach a sampling profiler and write its folded stacks (speedscope, flamegraph.pl) to this file")
+    parser.add_argument("--profile_interval", type=float, default=0.005, help="Seconds between profiler samples")
+
+    args = parser.parse_args()
+
+    # Validation
+    if "multi_step" in args.experiment and not args.n_moves:
+        parser.error(f"--n_moves is required when experiment is '{args.experiment}'")
+    if args.cache_mode == "replay" and not args.cache_path:
+        parser.error("--cache_path is required when --cache_mode is 'replay'")
+    if args.incremental and (args.experiment != "multi_step_prediction" or args.mode not in ("sync", "async")):
+        parser.error("--incremental requires --experiment multi_step_prediction in sync or async mode")
+    if args.route and (args.mode in ("batch", "batch_worker") or args.api_key or args.base_url):
+        parser.error("--route works in sync and async mode only, with the keys and endpoints of the backend providers")
+    if args.mode == "batch" and args.batch_backend == "provider" and not player_class(args.provider).supports_batch:
+        parser.error(f"{args.provider} has no batch API; use --batch_backend local and serve the jobs with --mode batch_worker")
+
+    # 2. Setup Player
+    if args.route:
+        player = create_routed_player(
+            args.model, args.route,
+            replay=args.cache_mode == "replay",
+            backend_options=lambda provider: dict(max_concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm)
+        )
+    else:
+        player = create_player(
+            args.provider, args.model, args.api_key,
+            replay=args.cache_mode == "replay",
+            max_concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm, base_url=args.base_url
+        )
+
+    player.streaming = args.stream
+    player.structured_output = not args.no_structured_output
+    player.compact_gdl = args.compact_gdl
+    player.retry_policy = RetryPolicy(attempt_timeout=args.attempt_timeout, hedge_quantile=args.hedge_quantile)
+    player.adaptive_budgets = args.completion_budget == "adaptive"
+    player.escalate_truncated = args.escalate_truncated
+    if args.max_completion_tokens:
+        player.max_completion_tokens = args.max_completion_tokens
+    if args.context_window:
+        player.context_window = args.context_window
+    if args.verify:
+        player.verification = VerificationStats()
+    player.output_format = args.output_format
+    player.metrics = MetricsRecorder(args.metrics_path)
+
+    if args.cache_path:
+        player.response_cache = ResponseCache(
+            args.cache_path,
+            mode=args.cache_mode,
+            max_bytes=int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None,
+            max_age_days=args.cache_max_age_days
+        )
+
+    if args.mode == "batch_worker":
+        fulfil_local_batch_jobs(args.batch_dir, player)
+        return
+
+    # 3. File Discovery
+    print(f"🔥 Starting Evaluation: {args.experiment.upper()}")
+    if "multi_step" in args.experiment:
+        print(f"   Steps (N): {f'1..{args.n_moves} (incremental)' if args.incremental else args.n_moves}")
+    print(f"   Provider: {(ROUTED_PROVIDER if args.route else args.provider).upper()}, Model: {args.model}")
+    if args.mode == "async":
+        print(f"   Concurrency: {args.concurrency} requests, {args.game_concurrency} games")
+
+    # 4. Processing Loop
+    with tracing_session(args.trace, args.profile, args.profile_interval):
+        output_dir = experiment_output_dir(args.samples_dir, args.experiment, args.model, args.n_moves)
+        with span("discover_games"):
+            jobs = discover_game_jobs(
+                args.samples_dir, args.gdl_dir, args.model, args.experiment, args.n_moves,
+                max_samples=args.max_samples, resume=args.resume, pack_size=args.pack_size, reverse_order=args.reverse_order
+            )
+
+        if args.incremental:
+            # A game is finished once its largest N is; the answers for every smaller N come from the same conversations
+            output_dirs = {n: experiment_output_dir(args.samples_dir, args.experiment, args.model, n) for n in range(1, args.n_moves + 1)}
+            jobs = [incremental_job(job, output_dirs) for job in jobs]
+            if args.mode == "async":
+                asyncio.run(run_games_async(jobs, player, args.game_concurrency, process_game_file_incremental_async))
+            else:
+                for job in jobs:
+                    process_game_file_incremental(player=player, **job)
+        elif args.mode == "async":
+            asyncio.run(run_games_async(jobs, player, args.game_concurrency))
+        elif args.mode == "batch":
+            backend = make_batch_backend(args.batch_backend, player, args.batch_dir)
+            if args.batch_poll_interval:
+                backend.poll_interval = args.batch_poll_interval
+            run_batch_experiment(jobs, player, backend, output_dir, resume=args.resume, spare=args.batch_spare)
+        else:
+            for job in jobs:
+                process_game_file(player=player, **job)
+                time.sleep(2)
+
+    print(player.usage.summary(player.provider_name.capitalize()))
+    if isinstance(player, RoutedGamePlayer):
+        print(player.routing_summary())
+    if player.response_cache is not None:
+        print(player.response_cache.summary())
+    if player.verification is not None:
+        print(player.verification.summary())
+    print(player.metrics.summary())
+    if args.prometheus_path:
+        player.metrics.write_prometheus(args.prometheus_path)
+        print(f"📈 Prometheus metrics written to {args.prometheus_path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,370 @@
+import os
+import sys
+import json
+import time
+import array
+import shutil
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Files of a partition. All of them are append-only; integers are little-endian.
+META_FILE = "meta.json"
+# UTF-8 text of every distinct line, back to back, and the uint64 end offset of each
+LINES_FILE = "lines.bin"
+LINE_ENDS_FILE = "lines.idx"
+# Every distinct text (a state, a move list, ...) as uint32 line IDs, and the uint64 end offset of each in line IDs
+TEXTS_FILE = "texts.bin"
+TEXT_ENDS_FILE = "texts.idx"
+# int32 records: the sample index, then one text ID per column (-1 for a missing value)
+ROWS_FILE = "rows.bin"
+
+FORMAT_VERSION = 1
+PARTITION_PREFIX = "store_"
+# Column kinds: plain strings, or JSON lists stored one element per line so repeated elements share lines
+COLUMN_KINDS = ("str", "list")
+
+
+# --- 1. Encoding ---
+
+def _read_bytes(path: str) -> bytes:
+    """Contents of a partition file; files are created by the first append that needs them."""
+    if not os.path.exists(path):
+        return b""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read_array(path: str, typecode: str) -> array.array:
+    """Whole records of a little-endian array file; a record cut off by an interruption is ignored."""
+    values = array.array(typecode)
+    data = _read_bytes(path)
+    values.frombytes(data[:len(data) - len(data) % values.itemsize])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _to_bytes(values: array.array) -> bytes:
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_value(value, kind: str) -> Optional[List[str]]:
+    """Lines of a column value, or None for a missing value."""
+    if value is None:
+        return None
+    if kind == "list":
+        return [json.dumps(item, ensure_ascii=False, separators=(",", ":")) for item in value]
+    return value.split("\n")
+
+
+def decode_value(lines: List[str], kind: str):
+    if kind == "list":
+        return [json.loads(line) for line in lines]
+    return "\n".join(lines)
+
+
+# --- 2. Partitions ---
+
+def partition_path(output_dir: str, game_name: str) -> str:
+    """store_<game>/ next to the journal and output files of a (model, experiment) run."""
+    return os.path.join(output_dir, PARTITION_PREFIX + game_name)
+
+
+def is_partition(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+class ResultPartition:
+    """
+    Output samples of one (model, experiment, game) run as flat arrays instead of a pretty-printed JSON document.
+    Texts are split into lines and every distinct line and text is stored once: a correct prediction, a state
+    that reappears as the next sample's input or a move shared by many sequences costs a few integers.
+    Samples are appended as they finish; after an interruption the partial record at the end is ignored.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported result store format {self.meta.get('format_version')}")
+        self.columns = self.meta["columns"]
+        # Writer state, loaded on the first append: line -> ID, tuple of line IDs -> text ID
+        self._line_ids = None
+        self._text_ids = None
+        self._line_ends = None
+        self._text_ends = None
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        game_name: str,
+        llm_model: str,
+        experiment_type: str,
+        columns: Dict[str, str],
+        resume: bool = False
+    ) -> "ResultPartition":
+        """Opens the partition for appending. Without resume, or if columns were dropped or changed kind, it starts empty."""
+        if resume and is_partition(path):
+            partition = cls(path)
+            if partition.columns == columns:
+                return partition
+            if all(columns.get(name) == kind for name, kind in partition.columns.items()):
+                partition.add_columns(columns)
+                return partition
+            print(f"⚠️ {path} has different columns, starting over")
+        if any(kind not in COLUMN_KINDS for kind in columns.values()):
+            raise ValueError(f"Column kinds must be one of {COLUMN_KINDS}: {columns}")
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        meta = dict(
+            format_version=FORMAT_VERSION,
+            game_name=game_name,
+            llm_model=llm_model,
+            experiment_type=experiment_type,
+            # Names the exported JSON file like the runner's own output files
+            experiment_id=time.strftime("%Y-%m-%d_%H%M%S"),
+            columns=columns,
+            complete=False,
+            samples=0
+        )
+        with open(os.path.join(path, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=4)
+        return cls(path)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @property
+    def record_size(self) -> int:
+        return 4 * (1 + len(self.columns))
+
+    # -- Writing --
+
+    def _load_writer_state(self):
+        """Rebuilds the intern tables and drops entries whose data was cut off, so appends continue cleanly."""
+        self._line_ends = _read_array(self._file(LINE_ENDS_FILE), "Q")
+        blob = _read_bytes(self._file(LINES_FILE))
+        while self._line_ends and self._line_ends[-1] > len(blob):
+            self._line_ends.pop()
+        self._text_ends = _read_array(self._file(TEXT_ENDS_FILE), "Q")
+        text_ids = _read_array(self._file(TEXTS_FILE), "I")
+        while self._text_ends and self._text_ends[-1] > len(text_ids):
+            self._text_ends.pop()
+
+        line_count, text_count = len(self._line_ends), len(self._text_ends)
+        self._truncate(LINES_FILE, self._line_ends[-1] if line_count else 0)
+        self._truncate(LINE_ENDS_FILE, 8 * line_count)
+        self._truncate(TEXTS_FILE, 4 * (self._text_ends[-1] if text_count else 0))
+        self._truncate(TEXT_ENDS_FILE, 8 * text_count)
+        rows_size = os.path.getsize(self._file(ROWS_FILE)) if os.path.exists(self._file(ROWS_FILE)) else 0
+        self._truncate(ROWS_FILE, rows_size - rows_size % self.record_size)
+
+        starts = [0] + list(self._line_ends[:-1])
+        self._line_ids = {blob[s:e].decode("utf-8"): i for i, (s, e) in enumerate(zip(starts, self._line_ends))}
+        starts = [0] + list(self._text_ends[:-1])
+        self._text_ids = {tuple(text_ids[s:e]): i for i, (s, e) in enumerate(zip(starts, self._text_ends))}
+
+    def _truncate(self, name: str, size: int):
+        with open(self._file(name), 'ab') as f:
+            if f.tell() > size:
+                f.truncate(size)
+
+    def _intern(self, lines: List[str], new_lines: list, new_texts: list) -> int:
+        ids = []
+        for line in lines:
+            line_id = self._line_ids.get(line)
+            if line_id is None:
+                line_id = self._line_ids[line] = len(self._line_ids)
+                new_lines.append(line.encode("utf-8"))
+            ids.append(line_id)
+        key = tuple(ids)
+        text_id = self._text_ids.get(key)
+        if text_id is None:
+            text_id = self._text_ids[key] = len(self._text_ids)
+            new_texts.append(key)
+        return text_id
+
+    def append(self, index: int, sample: dict):
+        """Adds one output sample. A later record with the same index replaces an earlier one."""
+        if self._line_ids is None:
+            self._load_writer_state()
+        new_lines, new_texts = [], []
+        record = array.array("i", [index])
+        for name, kind in self.columns.items():
+            lines = encode_value(sample.get(name), kind)
+            record.append(-1 if lines is None else self._intern(lines, new_lines, new_texts))
+
+        # Data before the offsets that make it visible, rows last
+        if new_lines:
+            with open(self._file(LINES_FILE), 'ab') as f:
+                f.write(b"".join(new_lines))
+            end = self._line_ends[-1] if self._line_ends else 0
+            ends = array.array("Q")
+            for line in new_lines:
+                end += len(line)
+                ends.append(end)
+            self._line_ends.extend(ends)
+            with open(self._file(LINE_ENDS_FILE), 'ab') as f:
+                f.write(_to_bytes(ends))
+        if new_texts:
+            ids = array.array("I", [line_id for text in new_texts for line_id in text])
+            with open(self._file(TEXTS_FILE), 'ab') as f:
+                f.write(_to_bytes(ids))
+            end = self._text_ends[-1] if self._text_ends else 0
+            ends = array.array("Q")
+            for text in new_texts:
+                end += len(text)
+                ends.append(end)
+            self._text_ends.extend(ends)
+            with open(self._file(TEXT_ENDS_FILE), 'ab') as f:
+                f.write(_to_bytes(ends))
+        with open(self._file(ROWS_FILE), 'ab') as f:
+            f.write(_to_bytes(record))
+
+    def add_columns(self, columns: Dict[str, str]):
+        """Widens the rows to `columns`, a superset of the partition's own; stored samples get missing values for the new ones."""
+        records = array.array("i")
+        for row in self.rows():
+            values = dict(zip(self.columns, row[1:]))
+            records.append(row[0])
+            records.extend(values.get(name, -1) for name in columns)
+        tmp_path = self._file(ROWS_FILE + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(_to_bytes(records))
+        os.replace(tmp_path, self._file(ROWS_FILE))
+        self.columns = self.meta["columns"] = columns
+        self._write_meta()
+
+    def mark_complete(self, samples: int):
+        self.meta.update(complete=True, samples=samples)
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp_path = self._file(META_FILE + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f, indent=4)
+        os.replace(tmp_path, self._file(META_FILE))
+
+    # -- Reading --
+
+    def lines(self) -> List[str]:
+        """Every distinct line, by line ID."""
+        ends = _read_array(self._file(LINE_ENDS_FILE), "Q")
+        blob = _read_bytes(self._file(LINES_FILE))
+        starts = [0] + list(ends[:-1])
+        return [blob[s:e].decode("utf-8") for s, e in zip(starts, ends) if e <= len(blob)]
+
+    def texts(self) -> List[Tuple[int, ...]]:
+        """Line IDs of every distinct text, by text ID."""
+        ends = _read_array(self._file(TEXT_ENDS_FILE), "Q")
+        ids = _read_array(self._file(TEXTS_FILE), "I")
+        starts = [0] + list(ends[:-1])
+        return [tuple(ids[s:e]) for s, e in zip(starts, ends) if e <= len(ids)]
+
+    def rows(self) -> List[Tuple[int, ...]]:
+        """(index, text ID per column) of the latest record of every sample, by index."""
+        flat = _read_array(self._file(ROWS_FILE), "i")
+        width = 1 + len(self.columns)
+        latest = {}
+        for start in range(0, len(flat) - len(flat) % width, width):
+            latest[flat[start]] = tuple(flat[start:start + width])
+        return [latest[index] for index in sorted(latest)]
+
+    def samples(self) -> Iterator[Tuple[int, dict]]:
+        """(index, sample dict) by index. Missing values are left out, as in the JSON output."""
+        lines, texts = self.lines(), self.texts()
+        for row in self.rows():
+            sample = {}
+            for (name, kind), text_id in zip(self.columns.items(), row[1:]):
+                if 0 <= text_id < len(texts):
+                    sample[name] = decode_value([lines[i] for i in texts[text_id]], kind)
+            yield row[0], sample
+
+    def arrays(self) -> dict:
+        """
+        Memory-mapped numpy views for analysis without decoding: `rows` (structured, one field per column),
+        `texts` and `text_ends` (line IDs of each text), `lines` and `line_ends` (UTF-8 bytes of each line).
+        `rows` is the raw record log, superseded records of a re-run sample included; `latest` holds the positions
+        in `rows` of the records that rows() returns, so `rows[latest]` is the deduplicated view.
+        """
+        import numpy as np
+
+        def mapped(name: str, dtype) -> "np.ndarray":
+            path = self._file(name)
+            count = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+            if count == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+        row_dtype = np.dtype([("index", "<i4")] + [(name, "<i4") for name in self.columns])
+        rows = mapped(ROWS_FILE, row_dtype)
+        # Last occurrence of every index, in index order
+        indices, first_from_end = np.unique(rows["index"][::-1], return_index=True)
+        return dict(
+            rows=rows,
+            latest=(len(rows) - 1 - first_from_end).astype(np.int64),
+            texts=mapped(TEXTS_FILE, "<u4"),
+            text_ends=mapped(TEXT_ENDS_FILE, "<u8"),
+            lines=mapped(LINES_FILE, "u1"),
+            line_ends=mapped(LINE_ENDS_FILE, "<u8")
+        )
+
+    def to_output_data(self) -> dict:
+        """The output_<game>_<experiment_id>.json document read by Verifier.cs."""
+        return dict(
+            game_name=self.meta["game_name"],
+            llm_model=self.meta["llm_model"],
+            experiment_type=self.meta["experiment_type"],
+            samples=[sample for _, sample in self.samples()]
+        )
+
+    def export_json(self, output_dir: Optional[str] = None) -> str:
+        """Writes the JSON output file (by default next to the partition). Returns its path."""
+        output_dir = output_dir or os.path.dirname(os.path.normpath(self.path))
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"output_{self.meta['game_name']}_{self.meta['experiment_id']}.json")
+        with open(path, 'w') as f:
+            json.dump(self.to_output_data(), f, indent=4, ensure_ascii=False)
+        return path
+
+    def size(self) -> int:
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
+
+
+def find_partitions(results_dir: str) -> List[str]:
+    found = []
+    for root, dirs, _ in os.walk(results_dir):
+        found.extend(os.path.join(root, d) for d in dirs if d.startswith(PARTITION_PREFIX) and is_partition(os.path.join(root, d)))
+    return sorted(found)
+
+
+# --- 3. Main Execution ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Export result store partitions as output_<game>_<id>.json files (Verifier.cs layout)")
+    parser.add_argument("results_dir", type=str, help="Directory searched recursively for store_<game> partitions")
+    parser.add_argument("--out", type=str, help="Write every file to this directory instead of next to its partition")
+    parser.add_argument("--include_incomplete", action="store_true", help="Also export partitions of unfinished games")
+    args = parser.parse_args()
+
+    exported, stored, written = 0, 0, 0
+    for path in find_partitions(args.results_dir):
+        partition = ResultPartition(path)
+        if not partition.meta.get("complete") and not args.include_incomplete:
+            print(f"⏩ Skipping {path}: game not finished")
+            continue
+        output_file = partition.export_json(args.out)
+        exported += 1
+        stored += partition.size()
+        written += os.path.getsize(output_file)
+        print(f"💾 {output_file}")
+    ratio = f", {written / stored:.1f}x the size of the store" if stored else ""
+    print(f"📦 Exported {exported} partitions ({stored / 1e6:.2f} MB stored, {written / 1e6:.2f} MB as JSON{ratio})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+import os
+import re
+import json
+import time
+import socket
+import argparse
+import asyncio
+from typing import Callable, Dict, List, Optional, Union
+from pydantic import BaseModel, Field, ValidationError
+from dotenv import load_dotenv
+from tracing import tracing_session
+
+from llm_runner import (
+    EXPERIMENT_TYPES,
+    ROUTED_PROVIDER,
+    MetricsRecorder,
+    RetryPolicy,
+    RoutedGamePlayer,
+    RunManifest,
+    VerificationStats,
+    available_providers,
+    create_player,
+    create_routed_player,
+    discover_game_jobs,
+    process_game_file_async,
+)
+
+
+# --- 1. Run Matrix ---
+
+class ProviderLimits(BaseModel):
+    """Limits shared by every model of one provider inside a scheduler process."""
+    # In-flight requests per model
+    concurrency: int = 4
+    # Games of this provider processed at the same time
+    max_games: int = 2
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+    api_key: Optional[str] = None
+    # Endpoint override, e.g. the server of the "local" provider
+    base_url: Optional[str] = None
+
+
+class MatrixRun(BaseModel):
+    """Every combination of models x experiments x n_moves for one provider."""
+    provider: str
+    models: List[str]
+    experiments: List[str]
+    # Used by the multi-step experiments only
+    n_moves: List[int] = Field(default_factory=list)
+    # A directory, or one directory per experiment
+    samples_dir: Optional[Union[str, Dict[str, str]]] = None
+
+
+class RunMatrix(BaseModel):
+    """
+    Declarative sweep, e.g.
+    {"gdl_dir": "gdl", "samples_dir": {"next_state": "data/next_state/samples", ...},
+     "providers": {"cerebras": {"concurrency": 4, "max_games": 2}},
+     "runs": [{"provider": "cerebras", "models": ["qwen-3-32b"], "experiments": ["multi_step_prediction"], "n_moves": [1, 5]}]}
+    Runs of provider "routed" serve each model from the backends listed in `routes`, e.g.
+    "routes": {"llama-3.3-70b": ["cerebras", "nvidia:meta/llama-3.3-70b-instruct"]} (see --route).
+    """
+    gdl_dir: str
+    samples_dir: Optional[Union[str, Dict[str, str]]] = None
+    max_samples: int = 25
+    pack_size: int = 1
+    stream: bool = False
+    verify: bool = False
+    # None, "whitespace" or "symbols" (see --compact_gdl)
+    compact_gdl: Optional[str] = None
+    # "store" (per-game result store partitions) or "json" (see --output_format)
+    output_format: str = "store"
+    # "adaptive" or "fixed" completion token limits (see --completion_budget)
+    completion_budget: str = "adaptive"
+    # Retry answers cut off at the provider default with a larger budget (see --escalate_truncated)
+    escalate_truncated: bool = False
+    retry: RetryPolicy = Field(default_factory=RetryPolicy)
+    # Per-request telemetry JSONL shared by all workers of this process, and its Prometheus export
+    metrics_path: Optional[str] = None
+    prometheus_path: Optional[str] = None
+    # Defaults to TARGET_GAMES
+    games: Optional[List[str]] = None
+    providers: Dict[str, ProviderLimits] = Field(default_factory=dict)
+    # Logical model -> "provider[:model]" backends, for runs of the "routed" provider
+    routes: Dict[str, List[str]] = Field(default_factory=dict)
+    runs: List[MatrixRun]
+
+    def samples_dir_for(self, run: MatrixRun, experiment: str) -> str:
+        samples_dir = run.samples_dir or self.samples_dir
+        if isinstance(samples_dir, dict):
+            samples_dir = samples_dir.get(experiment)
+        if not samples_dir:
+            raise ValueError(f"No samples_dir configured for {run.provider}/{experiment}")
+        return samples_dir
+
+    def limits(self, provider: str) -> ProviderLimits:
+        return self.providers.get(provider) or ProviderLimits()
+
+
+class WorkUnit(BaseModel):
+    """One game for one (provider, model, experiment, n_moves) configuration."""
+    unit_id: str
+    provider: str
+    model: str
+    experiment: str
+    n_moves: Optional[int] = None
+    game: str
+    # Keyword arguments of process_game_file
+    job: dict
+
+
+def _safe(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", text)
+
+
+def expand_matrix(matrix: RunMatrix) -> List[WorkUnit]:
+    """Expands the matrix into work units, skipping games whose output already exists."""
+    units = []
+    games = set(matrix.games) if matrix.games else None
+    for run in matrix.runs:
+        if run.provider == ROUTED_PROVIDER:
+            unrouted = [model for model in run.models if not matrix.routes.get(model)]
+            if unrouted:
+                raise ValueError(f"No routes configured for {', '.join(unrouted)}")
+        elif run.provider not in available_providers():
+            raise ValueError(f"Unknown provider: {run.provider}")
+        for experiment in run.experiments:
+            if experiment not in EXPERIMENT_TYPES:
+                raise ValueError(f"Unknown experiment type: {experiment}")
+            if "multi_step" in experiment and not run.n_moves:
+                raise ValueError(f"n_moves is required for '{experiment}' ({run.provider})")
+            steps = run.n_moves if "multi_step" in experiment else [None]
+            samples_dir = matrix.samples_dir_for(run, experiment)
+
+            for model in run.models:
+                for n_moves in steps:
+                    jobs = discover_game_jobs(
+                        samples_dir, matrix.gdl_dir, model, experiment, n_moves,
+                        max_samples=matrix.max_samples, resume=True, pack_size=matrix.pack_size, games=games
+                    )
+                    for job in jobs:
+                        game = os.path.splitext(os.path.basename(job["gdl_file_path"]))[0]
+                        suffix = f"_n{n_moves}" if n_moves else ""
+                        units.append(WorkUnit(
+                            unit_id=_safe(f"{run.provider}__{model}__{experiment}{suffix}__{game}"),
+                            provider=run.provider,
+                            model=model,
+                            experiment=experiment,
+                            n_moves=n_moves,
+                            game=game,
+                            job=job
+                        ))
+    return units
+
+
+# --- 2. Work Queue ---
+
+class WorkQueue:
+    """
+    Work units in a shared directory, claimable from several processes or machines:
+      units/<id>.json   - the unit, written once (O_EXCL) by whoever expands the matrix first
+      claims/<id>.lock  - created with O_EXCL by the worker that runs it; its mtime is the heartbeat
+      done/<id>.json    - completion record
+    A claim whose heartbeat is older than `lease` seconds is considered abandoned and can be taken over; the owner
+    it was taken from no longer touches it.
+    """
+    def __init__(self, queue_dir: str, lease: float = 900):
+        self.queue_dir = queue_dir
+        self.lease = lease
+        for sub in ("units", "claims", "done"):
+            os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+
+    def _path(self, sub: str, unit_id: str, extension: str) -> str:
+        return os.path.join(self.queue_dir, sub, unit_id + extension)
+
+    @staticmethod
+    def _create_exclusive(path: str, content: str) -> bool:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        return True
+
+    def enqueue(self, units: List[WorkUnit]) -> int:
+        """Adds units that are not queued yet. Returns how many were added."""
+        added = 0
+        for unit in units:
+            if os.path.exists(self._path("done", unit.unit_id, ".json")):
+                continue
+            added += self._create_exclusive(self._path("units", unit.unit_id, ".json"), unit.model_dump_json(indent=2))
+        return added
+
+    def _unit_ids(self) -> List[str]:
+        return sorted(f[:-len(".json")] for f in os.listdir(os.path.join(self.queue_dir, "units")) if f.endswith(".json"))
+
+    def is_done(self, unit_id: str) -> bool:
+        return os.path.exists(self._path("done", unit_id, ".json"))
+
+    def _claim_age(self, unit_id: str) -> Optional[float]:
+        try:
+            return time.time() - os.path.getmtime(self._path("claims", unit_id, ".lock"))
+        except FileNotFoundError:
+            return None
+
+    def _load(self, unit_id: str) -> Optional[WorkUnit]:
+        try:
+            with open(self._path("units", unit_id, ".json"), 'r') as f:
+                return WorkUnit.model_validate_json(f.read())
+        except FileNotFoundError:
+            # Withdrawn since the directory was listed
+            return None
+        except (OSError, ValidationError) as e:
+            print(f"⚠️ Unreadable work unit {unit_id}: {e}")
+            return None
+
+    def open_units(self, eligible: Callable[[WorkUnit], bool] = lambda unit: True) -> List[WorkUnit]:
+        """Units that are neither done nor held by a live claim."""
+        units = []
+        for unit_id in self._unit_ids():
+            if self.is_done(unit_id):
+                continue
+            age = self._claim_age(unit_id)
+            if age is not None and age < self.lease:
+                continue
+            unit = self._load(unit_id)
+            if unit is not None and eligible(unit):
+                units.append(unit)
+        return units
+
+    def claim(self, owner: str, eligible: Callable[[WorkUnit], bool] = lambda unit: True) -> Optional[WorkUnit]:
+        """Claims the first open unit accepted by `eligible`, taking over abandoned claims."""
+        for unit in self.open_units(eligible):
+            lock_path = self._path("claims", unit.unit_id, ".lock")
+            age = self._claim_age(unit.unit_id)
+            if age is not None:
+                if age < self.lease:
+                    continue
+                # Abandoned: only the worker whose rename succeeds may take it over
+                try:
+                    os.rename(lock_path, f"{lock_path}.{_safe(owner)}.stale")
+                except FileNotFoundError:
+                    continue
+                print(f"♻️ Taking over abandoned unit {unit.unit_id}")
+            if self._create_exclusive(lock_path, json.dumps(dict(owner=owner, time=time.time()))):
+                if self.is_done(unit.unit_id):
+                    self.release(unit, owner)
+                    continue
+                return unit
+        return None
+
+    def claim_owner(self, unit_id: str) -> Optional[str]:
+        """Owner of the unit's claim, or None if it is not claimed."""
+        try:
+            with open(self._path("claims", unit_id, ".lock"), 'r') as f:
+                return json.load(f).get("owner")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def heartbeat(self, unit: WorkUnit, owner: str):
+        if self.claim_owner(unit.unit_id) != owner:
+            return
+        try:
+            os.utime(self._path("claims", unit.unit_id, ".lock"))
+        except FileNotFoundError:
+            pass
+
+    def release(self, unit: WorkUnit, owner: str):
+        """Drops the claim if `owner` still holds it; a claim taken over meanwhile belongs to its new owner."""
+        if self.claim_owner(unit.unit_id) != owner:
+            return
+        try:
+            os.remove(self._path("claims", unit.unit_id, ".lock"))
+        except FileNotFoundError:
+            pass
+
+    def withdraw(self, unit_id: str):
+        """Takes a unit that is not done out of the queue; a worker running it finishes, but nobody claims it again."""
+        try:
+            os.remove(self._path("units", unit_id, ".json"))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, unit: WorkUnit, owner: str, seconds: float):
+        with open(self._path("done", unit.unit_id, ".json"), 'w') as f:
+            json.dump(dict(owner=owner, finished=time.time(), seconds=seconds), f)
+        self.release(unit, owner)
+
+    def status(self) -> str:
+        unit_ids = self._unit_ids()
+        done = sum(self.is_done(u) for u in unit_ids)
+        claimed = sum(1 for u in unit_ids if not self.is_done(u) and (self._claim_age(u) or self.lease) < self.lease)
+        return f"📋 Queue {self.queue_dir}: {len(unit_ids)} units, {done} done, {claimed} running, {len(unit_ids) - done - claimed} open"
+
+
+# --- 3. Scheduler ---
+
+class MatrixScheduler:
+    """
+    Runs queued units on a pool of async workers. Each (provider, model) gets one player, so its key pool
+    and rate limits are shared by all games of that model; each provider runs at most `max_games` units at once.
+    """
+    def __init__(self, matrix: RunMatrix, queue: WorkQueue, workers: int = 4, idle_poll: float = 10.0):
+        self.matrix = matrix
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.idle_poll = idle_poll
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.players = {}
+        self.active = {}
+        # Units that ended without a complete output; left to other workers instead of being retried here
+        self.tried = set()
+        self.verification = VerificationStats() if matrix.verify else None
+        self.metrics = MetricsRecorder(matrix.metrics_path)
+
+    def player(self, unit: WorkUnit):
+        key = (unit.provider, unit.model)
+        if key not in self.players:
+            if unit.provider == ROUTED_PROVIDER:
+                player = create_routed_player(unit.model, self.matrix.routes[unit.model], backend_options=self._backend_options)
+            else:
+                player = create_player(unit.provider, unit.model, **self._backend_options(unit.provider))
+            player.streaming = self.matrix.stream
+            player.compact_gdl = self.matrix.compact_gdl
+            player.adaptive_budgets = self.matrix.completion_budget == "adaptive"
+            player.escalate_truncated = self.matrix.escalate_truncated
+            player.output_format = self.matrix.output_format
+            player.retry_policy = self.matrix.retry
+            player.verification = self.verification
+            player.metrics = self.metrics
+            self.players[key] = player
+        return self.players[key]
+
+    def _backend_options(self, provider: str) -> dict:
+        limits = self.matrix.limits(provider)
+        return dict(api_key=limits.api_key, max_concurrency=limits.concurrency, rpm=limits.rpm, tpm=limits.tpm, base_url=limits.base_url)
+
+    def _can_start(self, unit: WorkUnit) -> bool:
+        if unit.unit_id in self.tried:
+            return False
+        return self.active.get(unit.provider, 0) < self.matrix.limits(unit.provider).max_games
+
+    async def _heartbeat(self, unit: WorkUnit):
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            self.queue.heartbeat(unit, self.owner)
+
+    async def run_unit(self, unit: WorkUnit):
+        print(f"🚀 [{self.owner}] {unit.unit_id}")
+        self.active[unit.provider] = self.active.get(unit.provider, 0) + 1
+        heartbeat = asyncio.create_task(self._heartbeat(unit))
+        start = time.time()
+        complete = False
+        try:
+            await process_game_file_async(player=self.player(unit), **unit.job)
+            manifest = RunManifest(unit.job["output_dir"], unit.model, unit.experiment, unit.n_moves)
+            complete = manifest.is_complete(unit.game)
+        except Exception as e:
+            print(f"❌ {unit.unit_id} failed: {e}")
+        finally:
+            heartbeat.cancel()
+            self.active[unit.provider] -= 1
+
+        if complete:
+            self.queue.complete(unit, self.owner, time.time() - start)
+            print(f"🏁 {unit.unit_id} done in {time.time() - start:.0f}s")
+        else:
+            self.tried.add(unit.unit_id)
+            self.queue.release(unit, self.owner)
+            print(f"⚠️ {unit.unit_id} incomplete, released for another worker")
+
+    async def worker(self):
+        while True:
+            unit = self.queue.claim(self.owner, self._can_start)
+            if unit is not None:
+                await self.run_unit(unit)
+                continue
+            # Nothing startable: wait for provider slots or abandoned claims, stop when nothing is left for us
+            if not self.queue.open_units(lambda u: u.unit_id not in self.tried) and not any(self.active.values()):
+                return
+            await asyncio.sleep(self.idle_poll)
+
+    async def run(self):
+        await asyncio.gather(*(self.worker() for _ in range(self.workers)))
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Run a matrix of models x experiments x n_moves through a shared work queue")
+    parser.add_argument("matrix", type=str, help="Run matrix JSON file")
+    parser.add_argument("--queue_dir", type=str, required=True, help="Shared work queue directory (may be used by several machines)")
+    parser.add_argument("--workers", type=int, default=4, help="Units processed at the same time by this process")
+    parser.add_argument("--lease", type=float, default=900, help="Seconds without heartbeat after which a claim is considered abandoned")
+    parser.add_argument("--no_enqueue", action="store_true", help="Only work on units already in the queue")
+    parser.add_argument("--enqueue_only", action="store_true", help="Expand the matrix into the queue and exit")
+    parser.add_argument("--status", action="store_true", help="Print queue progress and exit")
+    parser.add_argument("--trace", type=str, help="Write a Chrome / Perfetto trace of this process's work to this JSON file")
+    parser.add_argument("--profile", type=str, help="Attach a sampling profiler and write its folded stacks to this file")
+    parser.add_argument("--profile_interval", type=float, default=0.005, help="Seconds between profiler samples")
+    args = parser.parse_args()
+
+    with open(args.matrix, 'r') as f:
+        matrix = RunMatrix.model_validate_json(f.read())
+    queue = WorkQueue(args.queue_dir, lease=args.lease)
+
+    if args.status:
+        print(queue.status())
+        return
+
+    if not args.no_enqueue:
+        units = expand_matrix(matrix)
+        print(f"🧮 Matrix expanded into {len(units)} units, {queue.enqueue(units)} newly queued")
+        if args.enqueue_only:
+            print(queue.status())
+            return
+
+    scheduler = MatrixScheduler(matrix, queue, workers=args.workers)
+    with tracing_session(args.trace, args.profile, args.profile_interval):
+        asyncio.run(scheduler.run())
+
+    for (provider, model), player in scheduler.players.items():
+        print(player.usage.summary(f"{provider}/{model}"))
+        if isinstance(player, RoutedGamePlayer):
+            print(player.routing_summary())
+    if scheduler.verification is not None:
+        print(scheduler.verification.summary())
+    print(scheduler.metrics.summary())
+    if matrix.prometheus_path:
+        scheduler.metrics.write_prometheus(matrix.prometheus_path)
+    print(queue.status())
+
+
+if __name__ == "__main__":
+    main()
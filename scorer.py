@@ -0,0 +1,413 @@
+import os
+import re
+import json
+import time
+import argparse
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from gdl_engine import GDLError, GDLGame, format_term, parse_joint_move, parse_terms
+from result_store import META_FILE, PARTITION_PREFIX, ROWS_FILE, ResultPartition, decode_value, is_partition
+
+# Metric columns of the result matrix
+METRICS = ["exact", "precision", "recall", "jaccard"]
+# Bumped whenever the counts of a file would change, so cached scores of older versions are recomputed
+SCORING_VERSION = 2
+
+
+# --- 1. Fact Interning ---
+
+class FactVocabulary:
+    """
+    Maps canonical GDL facts to integer IDs. Raw lines are canonicalized once (lowercase, single spaces,
+    `true`/`legal`/`does` wrappers removed) and memoized, so repeated states cost a dict lookup per line.
+    """
+    _SPLIT_RE = re.compile(r"\)\s*\(")
+
+    def __init__(self):
+        self.ids = {}
+        self._lines = {}
+
+    def _canonical(self, line: str) -> Tuple[str, ...]:
+        try:
+            terms = parse_terms(line)
+        except GDLError:
+            return (" ".join(line.lower().split()),)
+        if terms and all(isinstance(t, str) for t in terms) and len(terms) > 1:
+            # A bare line such as `cell 1 1 b`
+            terms = [tuple(terms)]
+        facts = []
+        for term in terms:
+            if isinstance(term, tuple) and term[0] in ("true", "legal", "does") and len(term) >= 2:
+                term = term[1] if len(term) == 2 else term[1:]
+            facts.append(format_term(term))
+        return tuple(facts)
+
+    def intern_text(self, text: str) -> List[int]:
+        """IDs of the facts in a newline-separated state or move list (duplicates removed)."""
+        text = self._SPLIT_RE.sub(")\n(", text.replace("[", "(").replace("]", ")"))
+        ids = set()
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            facts = self._lines.get(line)
+            if facts is None:
+                facts = self._lines[line] = self._canonical(line)
+            for fact in facts:
+                fact_id = self.ids.get(fact)
+                if fact_id is None:
+                    fact_id = self.ids[fact] = len(self.ids)
+                ids.add(fact_id)
+        return sorted(ids)
+
+    def intern_state(self, state: frozenset) -> List[int]:
+        return self.intern_text("\n".join(format_term(fact) for fact in state))
+
+
+class FactMatrix:
+    """Sparse CSR rows of fact IDs: one row per scored state or move list."""
+    def __init__(self):
+        self.indices = []
+        self.indptr = [0]
+
+    def add(self, ids: List[int]):
+        self.indices.extend(ids)
+        self.indptr.append(len(self.indices))
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.asarray(self.indices, dtype=np.int64), np.asarray(self.indptr, dtype=np.int64)
+
+
+# --- 2. Vectorized Scoring ---
+
+def overlap_counts(predicted: FactMatrix, truth: FactMatrix, vocabulary_size: int) -> np.ndarray:
+    """
+    Per-row (predicted size, truth size, common facts) as an (n, 3) int array.
+    Each (row, fact) pair is encoded as one int64 key, so the intersection of all rows is a single np.intersect1d.
+    """
+    width = max(vocabulary_size, 1)
+    rows = len(predicted.indptr) - 1
+    keys = []
+    for matrix in (predicted, truth):
+        indices, indptr = matrix.arrays()
+        row_of = np.repeat(np.arange(rows, dtype=np.int64), np.diff(indptr))
+        keys.append(row_of * width + indices)
+    common = np.intersect1d(keys[0], keys[1], assume_unique=True) // width
+    return np.stack([
+        np.diff(predicted.arrays()[1]),
+        np.diff(truth.arrays()[1]),
+        np.bincount(common, minlength=rows)
+    ], axis=1)
+
+
+def sample_metrics(counts: np.ndarray, invalid: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Exact match, precision, recall and Jaccard per row. Two empty sets count as a perfect match, as in the C# verifier.
+    Rows flagged in `invalid` (a generated move sequence the rules reject) score 0 on every metric.
+    """
+    counts = counts.astype(np.float64)
+    predicted, truth, common = counts[:, 0], counts[:, 1], counts[:, 2]
+    both_empty = (predicted == 0) & (truth == 0)
+    union = predicted + truth - common
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, common / predicted, both_empty.astype(np.float64))
+        recall = np.where(truth > 0, common / truth, 1.0)
+        jaccard = np.where(union > 0, common / union, 1.0)
+    exact = ((common == predicted) & (common == truth)).astype(np.float64)
+    metrics = dict(exact=exact, precision=precision, recall=recall, jaccard=jaccard)
+    if invalid is not None and invalid.any():
+        metrics = {name: np.where(invalid, 0.0, values) for name, values in metrics.items()}
+    return metrics
+
+
+def aggregate(groups: np.ndarray, metrics: Dict[str, np.ndarray], n_groups: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Sample counts and mean metrics per group ID."""
+    sizes = np.bincount(groups, minlength=n_groups)
+    safe = np.maximum(sizes, 1)
+    return sizes, {name: np.bincount(groups, weights=values, minlength=n_groups) / safe for name, values in metrics.items()}
+
+
+# --- 3. Output Files ---
+
+class GroundTruthEngine:
+    """Replays multi-step move sequences with the GDL engine; those output files carry no ground truth of their own."""
+    def __init__(self, gdl_dir: Optional[str]):
+        self.gdl_dir = gdl_dir
+        self.games = {}
+
+    def game(self, game_name: str) -> Optional[GDLGame]:
+        if not self.gdl_dir:
+            return None
+        if game_name not in self.games:
+            self.games[game_name] = None
+            for extension in (".kif", ".gdl"):
+                path = os.path.join(self.gdl_dir, game_name + extension)
+                if os.path.exists(path):
+                    try:
+                        self.games[game_name] = GDLGame.from_file(path)
+                    except GDLError as e:
+                        print(f"⚠️ Cannot compile {path}: {e}")
+                    break
+        return self.games[game_name]
+
+
+def _complete_partitions(root: str, dirs: List[str]) -> Dict[str, str]:
+    """Game name -> path of the finished result store partitions among the subdirectories of root."""
+    found = {}
+    for d in dirs:
+        path = os.path.join(root, d)
+        if d.startswith(PARTITION_PREFIX) and is_partition(path) and ResultPartition(path).meta.get("complete"):
+            found[d[len(PARTITION_PREFIX):]] = path
+    return found
+
+
+def find_output_files(results_dir: str) -> List[str]:
+    """Output JSON files and finished result store partitions. A game with a partition is not read again from its exported JSON."""
+    found = []
+    for root, dirs, files in os.walk(results_dir):
+        partitions = _complete_partitions(root, dirs)
+        found.extend(partitions.values())
+        for f in files:
+            # output_<game>_<date>_<time>.json
+            if f.startswith("output_") and f.endswith(".json") and f[len("output_"):].rsplit("_", 2)[0] not in partitions:
+                found.append(os.path.join(root, f))
+    return sorted(found)
+
+
+class ScoredFile:
+    """Per-sample predicted and ground-truth fact rows of one output file or partition."""
+    def __init__(self, experiment: str, model: str, game: str):
+        self.experiment = experiment
+        self.model = model
+        self.game = game
+        self.predicted = FactMatrix()
+        self.truth = FactMatrix()
+        # Rows of generated move sequences the rules reject: they score 0 on every metric
+        self.invalid = []
+        # Multi-step samples without ground truth: no GDL file, or dataset moves the engine rejects
+        self.no_gdl = 0
+        self.unreplayable = 0
+
+    def report(self, path: str):
+        if self.no_gdl:
+            print(f"⚠️ {path}: {self.no_gdl} multi-step samples skipped (no GDL file, pass --gdl_dir)")
+        if self.unreplayable:
+            print(f"⚠️ {path}: {self.unreplayable} multi-step samples skipped (the engine rejects their moves)")
+
+
+def score_sample(
+    scored: ScoredFile,
+    has: Callable[[str], bool],
+    facts: Callable[[str], List[int]],
+    moves: Callable[[], list],
+    vocabulary: FactVocabulary,
+    engine: GroundTruthEngine
+):
+    """
+    Adds one sample to `scored`. The sample is seen through accessors, so JSON samples and partition rows share
+    this code: `has(field)`, the fact IDs of a text field with `facts(field)` and the decoded move list with `moves()`.
+    """
+    if has("next_state"):
+        scored.predicted.add(facts("llm_state"))
+        scored.truth.add(facts("next_state"))
+    elif has("legal_moves"):
+        scored.predicted.add(facts("llm_legal_moves"))
+        scored.truth.add(facts("legal_moves"))
+    elif has("moves"):
+        game = engine.game(scored.game)
+        if game is None:
+            scored.no_gdl += 1
+            return
+        try:
+            state = vocabulary.intern_state(game.play([parse_joint_move(m["joint_move"], game.roles) for m in moves()]))
+        except Exception:
+            # Illegal or unparsable moves: a generated sequence fails outright, a given one has no ground truth
+            if "generation" not in scored.experiment:
+                scored.unreplayable += 1
+                return
+            scored.invalid.append(len(scored.predicted.indptr) - 1)
+            state = []
+        scored.predicted.add(facts("llm_state"))
+        scored.truth.add(state)
+
+
+def score_partition(path: str, vocabulary: FactVocabulary, engine: GroundTruthEngine) -> ScoredFile:
+    """
+    score_file for a result store partition. Only the columns being scored are decoded: every distinct line
+    is canonicalized once and every distinct text is interned once, however many samples share it.
+    """
+    partition = ResultPartition(path)
+    lines, texts = partition.lines(), partition.texts()
+    column = {name: i + 1 for i, name in enumerate(partition.columns)}
+    line_facts, text_facts = {}, {}
+
+    def text_ids(text_id: int) -> List[int]:
+        if text_id < 0 or text_id >= len(texts):
+            return []
+        ids = text_facts.get(text_id)
+        if ids is None:
+            union = set()
+            for line_id in texts[text_id]:
+                if line_id not in line_facts:
+                    line_facts[line_id] = vocabulary.intern_text(lines[line_id])
+                union.update(line_facts[line_id])
+            ids = text_facts[text_id] = sorted(union)
+        return ids
+
+    scored = ScoredFile(partition.meta["experiment_type"], partition.meta["llm_model"], partition.meta["game_name"])
+    for row in partition.rows():
+        score_sample(
+            scored,
+            has=lambda name: name in column,
+            facts=lambda name: text_ids(row[column[name]]) if name in column else [],
+            moves=lambda: decode_value([lines[i] for i in texts[row[column["moves"]]]], "list"),
+            vocabulary=vocabulary,
+            engine=engine
+        )
+    scored.report(path)
+    return scored
+
+
+def score_file(path: str, vocabulary: FactVocabulary, engine: GroundTruthEngine) -> ScoredFile:
+    """Interns the states of one output file and returns its per-sample fact rows with the group it belongs to."""
+    if os.path.isdir(path):
+        return score_partition(path, vocabulary, engine)
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    experiment_type = data.get("experiment_type") or os.path.basename(os.path.dirname(os.path.dirname(path)))
+    scored = ScoredFile(experiment_type, data.get("llm_model", ""), data.get("game_name", ""))
+    for sample in data.get("samples", []):
+        score_sample(
+            scored,
+            has=lambda name: name in sample,
+            facts=lambda name: vocabulary.intern_text(sample.get(name, "")),
+            moves=lambda: sample["moves"],
+            vocabulary=vocabulary,
+            engine=engine
+        )
+    scored.report(path)
+    return scored
+
+
+class ScoreCache:
+    """
+    JSON file with the overlap counts of every scored output file, keyed by path and invalidated by size and mtime.
+    Re-aggregating a sweep then only reads the files that changed.
+    """
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Ignoring unreadable score cache {path}: {e}")
+
+    @staticmethod
+    def signature(path: str) -> list:
+        if os.path.isdir(path):
+            # Partitions grow by appending rows; the directory itself does not change
+            rows = os.path.join(path, ROWS_FILE)
+            path = rows if os.path.exists(rows) else os.path.join(path, META_FILE)
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def get(self, path: str) -> Optional[dict]:
+        entry = self.entries.get(path)
+        if entry is not None and entry.get("version") == SCORING_VERSION and entry["signature"] == self.signature(path):
+            return entry
+        return None
+
+    def put(self, path: str, group: dict, counts: np.ndarray, invalid: List[int]):
+        self.entries[path] = dict(signature=self.signature(path), version=SCORING_VERSION, counts=counts.tolist(), invalid=invalid, **group)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+# --- 4. Result Matrix ---
+
+def score_results(results_dir: str, gdl_dir: Optional[str] = None, cache_path: Optional[str] = None) -> List[dict]:
+    """Scores every output file under results_dir. Returns one row per (experiment, model, game)."""
+    cache = ScoreCache(cache_path)
+    engine = GroundTruthEngine(gdl_dir)
+    vocabulary = FactVocabulary()
+    group_ids = {}
+    all_counts, all_groups, all_invalid = [], [], []
+    read = 0
+
+    for path in find_output_files(results_dir):
+        entry = cache.get(path)
+        if entry is None:
+            try:
+                scored = score_file(path, vocabulary, engine)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Skipping {path}: {e}")
+                continue
+            read += 1
+            counts = overlap_counts(scored.predicted, scored.truth, len(vocabulary.ids))
+            group = dict(experiment=scored.experiment, model=scored.model, game=scored.game)
+            cache.put(path, group, counts, scored.invalid)
+            entry = cache.entries[path]
+
+        counts = np.asarray(entry["counts"], dtype=np.int64).reshape(-1, 3)
+        key = (entry["experiment"], entry["model"], entry["game"])
+        group_id = group_ids.setdefault(key, len(group_ids))
+        invalid = np.zeros(len(counts), dtype=bool)
+        invalid[entry["invalid"]] = True
+        all_counts.append(counts)
+        all_groups.append(np.full(len(counts), group_id, dtype=np.int64))
+        all_invalid.append(invalid)
+
+    cache.save()
+    print(f"📂 Scored {len(cache.entries)} output files ({read} read, {len(cache.entries) - read} from cache), "
+          f"{len(vocabulary.ids)} distinct facts interned")
+    if not all_counts:
+        return []
+
+    metrics = sample_metrics(np.concatenate(all_counts), np.concatenate(all_invalid))
+    sizes, means = aggregate(np.concatenate(all_groups), metrics, len(group_ids))
+    rows = []
+    for (experiment, model, game), group_id in sorted(group_ids.items()):
+        row = dict(experiment=experiment, model=model, game=game, samples=int(sizes[group_id]))
+        row.update({name: float(means[name][group_id]) for name in METRICS})
+        rows.append(row)
+    return rows
+
+
+def write_matrix(rows: List[dict], path: str):
+    columns = ["experiment", "model", "game", "samples"] + METRICS
+    with open(path, 'w') as f:
+        f.write("\t".join(columns) + "\n")
+        for row in rows:
+            f.write("\t".join(f"{row[c]:.4f}" if isinstance(row[c], float) else str(row[c]) for c in columns) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score LLM output files (exact match, precision, recall, Jaccard)")
+    parser.add_argument("results_dir", type=str, help="Directory searched recursively for output_<game>_<id>.json files and result store partitions")
+    parser.add_argument("--gdl_dir", type=str, help="GDL files used to compute ground truth of multi-step outputs")
+    parser.add_argument("--out", type=str, help="TSV result matrix (default: <results_dir>/results_matrix.tsv)")
+    parser.add_argument("--cache", type=str, help="Score cache file (default: <results_dir>/.score_cache.json)")
+    parser.add_argument("--no_cache", action="store_true", help="Rescore every file")
+    args = parser.parse_args()
+
+    start = time.time()
+    cache_path = None if args.no_cache else (args.cache or os.path.join(args.results_dir, ".score_cache.json"))
+    rows = score_results(args.results_dir, args.gdl_dir, cache_path)
+
+    out_path = args.out or os.path.join(args.results_dir, "results_matrix.tsv")
+    write_matrix(rows, out_path)
+    print(f"💾 {len(rows)} (experiment, model, game) rows saved to {out_path} in {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
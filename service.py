@@ -0,0 +1,650 @@
+import os
+import json
+import time
+import socket
+import argparse
+import asyncio
+import threading
+import socketserver
+import concurrent.futures
+import http.client
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+from pydantic import BaseModel, Field, ValidationError
+from dotenv import load_dotenv
+
+from llm_runner import SAMPLE_LISTENER
+from scheduler import MatrixRun, MatrixScheduler, RunMatrix, WorkQueue, WorkUnit, expand_matrix
+
+T = TypeVar("T")
+
+
+# --- 1. Jobs ---
+
+class JobRequest(BaseModel):
+    """One evaluation submitted to the service: a model on one experiment, optionally limited to some games."""
+    provider: str
+    model: str
+    experiment: str
+    # Defaults to the games of the service matrix (TARGET_GAMES if it names none)
+    games: Optional[List[str]] = None
+    # Used by the multi-step experiments only
+    n_moves: Optional[int] = None
+    # Defaults to max_samples of the service matrix
+    max_samples: Optional[int] = None
+    # Overrides the samples directory of the service matrix
+    samples_dir: Optional[str] = None
+
+
+# Job states after which nothing more happens
+FINAL_STATES = ("done", "incomplete", "cancelled")
+
+
+class JobRecord(BaseModel):
+    job_id: str
+    request: JobRequest
+    submitted: float = Field(default_factory=time.time)
+    # "queued", "running", "done", "incomplete" (some games ended without a complete output) or "cancelled"
+    state: str = "queued"
+    # unit id -> "queued", "running", "done", "incomplete" or "cancelled" (withdrawn from the queue before it started)
+    units: Dict[str, str] = Field(default_factory=dict)
+    samples_ok: int = 0
+    samples_failed: int = 0
+    finished: Optional[float] = None
+
+    def settle(self):
+        """Moves the job to its final state once every unit has ended."""
+        if self.state in FINAL_STATES or any(state in ("queued", "running") for state in self.units.values()):
+            return
+        self.state = "incomplete" if "incomplete" in self.units.values() else "done"
+        self.finished = time.time()
+
+
+class JobStore:
+    """
+    Jobs of the service in <queue_dir>/jobs, next to the work units they were expanded into:
+      <id>.json          - the job record, rewritten atomically on every change of state
+      <id>.events.jsonl  - append-only progress events; clients follow it from any line on
+    Units belong to the job whose id prefixes theirs, so a restarted service picks its jobs up where they were.
+    """
+    def __init__(self, queue_dir: str):
+        self.jobs_dir = os.path.join(queue_dir, "jobs")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self.records = {}
+        for filename in sorted(os.listdir(self.jobs_dir)):
+            if filename.endswith(".json"):
+                with open(os.path.join(self.jobs_dir, filename), 'r') as f:
+                    record = JobRecord.model_validate_json(f.read())
+                self.records[record.job_id] = record
+
+    @staticmethod
+    def job_id_of(unit_id: str) -> str:
+        return unit_id.split("__", 1)[0]
+
+    def events_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.events.jsonl")
+
+    def new_job_id(self) -> str:
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            record = self.records.get(job_id)
+            return record.model_copy(deep=True) if record is not None else None
+
+    def all(self) -> List[JobRecord]:
+        with self._lock:
+            return [record.model_copy(deep=True) for record in self.records.values()]
+
+    def save(self, record: JobRecord):
+        with self._lock:
+            self.records[record.job_id] = record
+            path = os.path.join(self.jobs_dir, f"{record.job_id}.json")
+            with open(path + ".tmp", 'w') as f:
+                f.write(record.model_dump_json(indent=2))
+            os.replace(path + ".tmp", path)
+
+    def update(self, job_id: str, change: Callable[[JobRecord], None], persist: bool = True) -> Optional[JobRecord]:
+        """Applies `change` to the job and settles its state. Returns the updated record."""
+        with self._lock:
+            record = self.records.get(job_id)
+            if record is None:
+                return None
+            was = record.state
+            change(record)
+            record.settle()
+            if persist or record.state != was:
+                self.save(record)
+            if record.state != was and record.state in FINAL_STATES:
+                self.event(job_id, "job_finished", state=record.state, samples_ok=record.samples_ok, samples_failed=record.samples_failed)
+            return record
+
+    def event(self, job_id: str, kind: str, **fields):
+        with self._lock:
+            with open(self.events_path(job_id), 'a') as f:
+                f.write(json.dumps(dict(time=time.time(), event=kind, **fields)) + "\n")
+
+    def sample_counts(self, job_id: str) -> Tuple[int, int]:
+        """(ok, failed) samples of the job counted from its event log, which is written with every sample."""
+        ok = failed = 0
+        if not os.path.exists(self.events_path(job_id)):
+            return ok, failed
+        with open(self.events_path(job_id), 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # The last line of a crashed service may be cut off
+                    continue
+                if event.get("event") == "sample":
+                    if event.get("status") == "ok":
+                        ok += 1
+                    else:
+                        failed += 1
+        return ok, failed
+
+    def recover(self, queue: WorkQueue):
+        """
+        After a restart: units that were running are queued again, and units finished meanwhile are marked done.
+        Units of cancelled jobs still in the queue are withdrawn. Sample counts are only saved with changes of
+        state, so they are rebuilt from the event log.
+        """
+        for record in self.all():
+            if record.state == "cancelled":
+                for unit_id in record.units:
+                    if not queue.is_done(unit_id):
+                        queue.withdraw(unit_id)
+            if record.state in FINAL_STATES:
+                continue
+
+            def reconcile(r: JobRecord):
+                for unit_id, state in r.units.items():
+                    if queue.is_done(unit_id):
+                        r.units[unit_id] = "done"
+                    elif state == "running":
+                        r.units[unit_id] = "queued"
+                if r.state == "running":
+                    r.state = "queued"
+                r.samples_ok, r.samples_failed = self.sample_counts(r.job_id)
+            self.update(record.job_id, reconcile)
+
+
+# --- 2. Service Scheduler ---
+
+class ServiceScheduler(MatrixScheduler):
+    """
+    MatrixScheduler that never runs out of work: idle workers wait for the next job instead of exiting, so players,
+    their API clients and their key pools stay warm and are shared by every job of the same (provider, model).
+    Progress is written to the job's event log as units start, samples finish and units end.
+    """
+    def __init__(self, matrix: RunMatrix, queue: WorkQueue, jobs: JobStore, workers: int = 4, idle_poll: float = 10.0):
+        super().__init__(matrix, queue, workers=workers, idle_poll=idle_poll)
+        self.jobs = jobs
+        self.stopping = False
+        # (provider, model, experiment, n_moves, game) of running units: two jobs must not share a journal
+        self.running_targets = set()
+        self._loop = None
+        self._wakeup = None
+
+    @staticmethod
+    def _target(unit: WorkUnit) -> tuple:
+        return unit.provider, unit.model, unit.experiment, unit.n_moves, unit.game
+
+    def _can_start(self, unit: WorkUnit) -> bool:
+        record = self.jobs.get(self.jobs.job_id_of(unit.unit_id))
+        if record is None or record.state == "cancelled" or record.units.get(unit.unit_id) == "incomplete":
+            return False
+        if self._target(unit) in self.running_targets:
+            return False
+        return super()._can_start(unit)
+
+    def wake(self):
+        """Makes idle workers look at the queue now; callable from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self):
+        self.stopping = True
+        self.wake()
+
+    async def run_unit(self, unit: WorkUnit):
+        job_id = self.jobs.job_id_of(unit.unit_id)
+        started = time.time()
+        self.running_targets.add(self._target(unit))
+
+        def on_sample(sample: dict):
+            def count(record: JobRecord):
+                if sample["status"] == "ok":
+                    record.samples_ok += 1
+                else:
+                    record.samples_failed += 1
+            self.jobs.update(job_id, count, persist=False)
+            self.jobs.event(job_id, "sample", unit=unit.unit_id, **sample)
+
+        def set_unit_state(state: str) -> Callable[[JobRecord], None]:
+            def change(record: JobRecord):
+                record.units[unit.unit_id] = state
+                if state == "running" and record.state == "queued":
+                    record.state = "running"
+            return change
+
+        self.jobs.update(job_id, set_unit_state("running"))
+        self.jobs.event(job_id, "unit_started", unit=unit.unit_id, game=unit.game)
+        listener = SAMPLE_LISTENER.set(on_sample)
+        try:
+            await super().run_unit(unit)
+        except asyncio.CancelledError:
+            # Shutting down: the journal keeps the samples, the next start resumes the unit
+            self.queue.release(unit, self.owner)
+            raise
+        finally:
+            SAMPLE_LISTENER.reset(listener)
+            self.running_targets.discard(self._target(unit))
+        state = "done" if self.queue.is_done(unit.unit_id) else "incomplete"
+        if state == "incomplete" and self.jobs.get(job_id).state == "cancelled":
+            # Cancelled while it ran: nothing will pick it up again
+            self.queue.withdraw(unit.unit_id)
+        self.jobs.event(job_id, "unit_finished", unit=unit.unit_id, game=unit.game, state=state, seconds=round(time.time() - started, 1))
+        self.jobs.update(job_id, set_unit_state(state))
+
+    async def worker(self):
+        while not self.stopping:
+            unit = self.queue.claim(self.owner, self._can_start)
+            if unit is not None:
+                await self.run_unit(unit)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.idle_poll)
+            except asyncio.TimeoutError:
+                pass
+
+    def on_loop(self, call: Callable[[], T], timeout: float = 10.0) -> T:
+        """Runs `call` on the scheduler's event loop and returns its result, so other threads see a consistent state."""
+        if self._loop is None or not self._loop.is_running():
+            return call()
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(call())
+            except Exception as e:
+                future.set_exception(e)
+        self._loop.call_soon_threadsafe(run)
+        return future.result(timeout)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await super().run()
+
+
+# --- 3. Service ---
+
+class EvaluationService:
+    """Accepts jobs, expands them against the service matrix into the durable work queue and reports on them."""
+    def __init__(self, matrix: RunMatrix, queue: WorkQueue, jobs: JobStore, scheduler: ServiceScheduler):
+        self.matrix = matrix
+        self.queue = queue
+        self.jobs = jobs
+        self.scheduler = scheduler
+        self.started = time.time()
+
+    def submit(self, request: JobRequest) -> JobRecord:
+        """Raises ValueError / FileNotFoundError for jobs that do not fit the matrix (unknown provider, missing directory)."""
+        run = MatrixRun(
+            provider=request.provider,
+            models=[request.model],
+            experiments=[request.experiment],
+            n_moves=[request.n_moves] if request.n_moves else [],
+            samples_dir=request.samples_dir
+        )
+        update = dict(runs=[run])
+        if request.games:
+            update["games"] = request.games
+        if request.max_samples:
+            update["max_samples"] = request.max_samples
+        units = expand_matrix(self.matrix.model_copy(update=update))
+
+        record = JobRecord(job_id=self.jobs.new_job_id(), request=request)
+        units = [unit.model_copy(update=dict(unit_id=f"{record.job_id}__{unit.unit_id}")) for unit in units]
+        record.units = {unit.unit_id: "queued" for unit in units}
+        self.jobs.save(record)
+        self.jobs.event(record.job_id, "submitted", games=[unit.game for unit in units], **request.model_dump(exclude_none=True))
+        self.queue.enqueue(units)
+        # A job without units (every game already has its output) is done right away
+        self.jobs.update(record.job_id, lambda r: None)
+        self.scheduler.wake()
+        print(f"📥 Job {record.job_id}: {request.provider}/{request.model} {request.experiment}, {len(units)} games")
+        return self.jobs.get(record.job_id)
+
+    def cancel(self, job_id: str) -> Optional[JobRecord]:
+        """Queued games of the job are withdrawn from the work queue; running ones finish."""
+        def change(record: JobRecord):
+            if record.state in FINAL_STATES:
+                return
+            record.state = "cancelled"
+            record.finished = time.time()
+            for unit_id, state in record.units.items():
+                if state == "queued":
+                    self.queue.withdraw(unit_id)
+                    record.units[unit_id] = "cancelled"
+        return self.jobs.update(job_id, change)
+
+    def _scheduler_status(self) -> dict:
+        """Players and their statistics; they belong to the event loop, so this runs there."""
+        scheduler = self.scheduler
+        return dict(
+            players=[player.usage.summary(f"{provider}/{model}") for (provider, model), player in scheduler.players.items()],
+            verification=scheduler.verification.summary() if scheduler.verification is not None else None,
+            metrics=scheduler.metrics.summary()
+        )
+
+    def status(self) -> dict:
+        states = {}
+        records = self.jobs.all()
+        for record in records:
+            states[record.state] = states.get(record.state, 0) + 1
+        return dict(
+            uptime=round(time.time() - self.started, 1),
+            queue=self.queue.status(),
+            jobs=states,
+            running=sorted(unit_id for record in records for unit_id, state in record.units.items() if state == "running"),
+            **self.scheduler.on_loop(self._scheduler_status)
+        )
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_handler(service: EvaluationService, poll_interval: float = 0.25):
+    """
+    HTTP API of the service:
+      POST   /jobs              submit a JobRequest, answers with the job record
+      GET    /jobs              all job records
+      GET    /jobs/<id>         one job record
+      GET    /jobs/<id>/events  progress as JSON lines, from line ?since=N on; follows the job until it ends unless ?follow=0
+      DELETE /jobs/<id>         cancel the games of the job that have not started
+      GET    /status            queue, jobs, players (token usage), verification and request metrics
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status: int, body):
+            data = json.dumps(body, indent=1).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _error(self, status: int, message: str):
+            self._json(status, {"error": message})
+
+        def _route(self) -> tuple:
+            url = urllib.parse.urlsplit(self.path)
+            return [part for part in url.path.split("/") if part], urllib.parse.parse_qs(url.query)
+
+        def do_GET(self):
+            parts, query = self._route()
+            if parts == ["status"]:
+                return self._json(200, service.status())
+            if parts == ["jobs"]:
+                return self._json(200, [record.model_dump() for record in service.jobs.all()])
+            if len(parts) in (2, 3) and parts[0] == "jobs":
+                record = service.jobs.get(parts[1])
+                if record is None:
+                    return self._error(404, f"No job {parts[1]}")
+                if len(parts) == 2:
+                    return self._json(200, record.model_dump())
+                if parts[2] == "events":
+                    since = query.get("since", ["0"])[0]
+                    if not since.isdigit():
+                        return self._error(400, f"since must be a line number, not {since!r}")
+                    return self._events(record.job_id, int(since), query.get("follow", ["1"])[0] != "0")
+            self._error(404, f"Unknown path {self.path}")
+
+        def do_POST(self):
+            parts, _ = self._route()
+            if parts != ["jobs"]:
+                return self._error(404, f"Unknown path {self.path}")
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = JobRequest.model_validate_json(self.rfile.read(length) or b"{}")
+                record = service.submit(request)
+            except (ValidationError, ValueError, FileNotFoundError) as e:
+                return self._error(400, str(e))
+            self._json(201, record.model_dump())
+
+        def do_DELETE(self):
+            parts, _ = self._route()
+            if len(parts) != 2 or parts[0] != "jobs":
+                return self._error(404, f"Unknown path {self.path}")
+            record = service.cancel(parts[1])
+            if record is None:
+                return self._error(404, f"No job {parts[1]}")
+            self._json(200, record.model_dump())
+
+        def _events(self, job_id: str, since: int, follow: bool):
+            """Sends the event log as chunked JSON lines, tailing it while the job is still going."""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            path = service.jobs.events_path(job_id)
+            sent = 0
+            # A last line still being written; sent with the rest of it on the next read
+            partial = ""
+            try:
+                with open(path, 'r') as f:
+                    while True:
+                        # Checked before reading, so the lines of a job that just ended are still all sent
+                        ended = service.jobs.get(job_id).state in FINAL_STATES
+                        lines = (partial + f.read()).splitlines(keepends=True)
+                        partial = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+                        fresh = lines[max(0, since - sent):]
+                        sent += len(lines)
+                        if fresh:
+                            data = "".join(fresh).encode()
+                            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                            self.wfile.flush()
+                        if ended or not follow:
+                            break
+                        time.sleep(poll_interval)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped following
+                pass
+
+    return Handler
+
+
+def serve(service: EvaluationService, port: Optional[int], socket_path: Optional[str]) -> socketserver.BaseServer:
+    """Starts the HTTP API in a background thread, on localhost:port or on a Unix socket."""
+    handler = make_handler(service)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        httpd = ThreadingUnixHTTPServer(socket_path, handler)
+        where = f"unix:{socket_path}"
+    else:
+        httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        httpd.daemon_threads = True
+        where = f"http://127.0.0.1:{httpd.server_address[1]}"
+    threading.Thread(target=httpd.serve_forever, name="service-api", daemon=True).start()
+    print(f"🛰️ Evaluation service listening on {where}")
+    return httpd
+
+
+# --- 4. Client ---
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient:
+    """Talks to a running service over TCP (`url`) or a Unix socket (`socket_path`)."""
+    def __init__(self, url: Optional[str] = None, socket_path: Optional[str] = None):
+        self.url = urllib.parse.urlsplit(url or "http://127.0.0.1:8765")
+        self.socket_path = socket_path
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port)
+
+    def request(self, method: str, path: str, body: Optional[dict] = None):
+        connection = self._connection()
+        try:
+            data = json.dumps(body).encode() if body is not None else None
+            connection.request(method, path, body=data, headers={"Content-Type": "application/json"} if data else {})
+            response = connection.getresponse()
+            payload = json.loads(response.read() or b"null")
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path}: {response.status} {payload.get('error') if isinstance(payload, dict) else payload}")
+        return payload
+
+    def submit(self, request: JobRequest) -> dict:
+        return self.request("POST", "/jobs", request.model_dump(exclude_none=True))
+
+    def events(self, job_id: str, since: int = 0, follow: bool = True):
+        """Yields the job's progress events as they happen."""
+        connection = self._connection()
+        try:
+            connection.request("GET", f"/jobs/{job_id}/events?since={since}&follow={int(follow)}")
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise RuntimeError(f"Events of {job_id}: {response.status} {response.read().decode()}")
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+
+def format_event(job_id: str, event: dict) -> str:
+    kind = event["event"]
+    if kind == "submitted":
+        return f"📥 [{job_id}] {event['provider']}/{event['model']} {event['experiment']}: {len(event['games'])} games"
+    if kind == "unit_started":
+        return f"🚀 [{job_id}] {event['game']} started"
+    if kind == "sample":
+        verdict = f" (exact: {event['exact']})" if "exact" in event else ""
+        mark = "✅" if event["status"] == "ok" else f"❌ {event.get('error', '')}"
+        return f"   [{job_id}] {event['game']} sample {event['index'] + 1} {mark}{verdict}"
+    if kind == "unit_finished":
+        return f"🏁 [{job_id}] {event['game']} {event['state']} in {event['seconds']:.0f}s"
+    if kind == "job_finished":
+        return f"🎯 [{job_id}] Job {event['state']}: {event['samples_ok']} samples ok, {event['samples_failed']} failed"
+    return f"   [{job_id}] {json.dumps(event)}"
+
+
+# --- 5. Main Execution ---
+
+def run_service(args):
+    with open(args.matrix, 'r') as f:
+        matrix = RunMatrix.model_validate_json(f.read())
+    queue = WorkQueue(args.queue_dir, lease=args.lease)
+    jobs = JobStore(args.queue_dir)
+    jobs.recover(queue)
+    scheduler = ServiceScheduler(matrix, queue, jobs, workers=args.workers, idle_poll=args.idle_poll)
+    service = EvaluationService(matrix, queue, jobs, scheduler)
+    httpd = serve(service, args.port, args.socket)
+    print(queue.status())
+    try:
+        asyncio.run(scheduler.run())
+    except KeyboardInterrupt:
+        print("🛑 Stopping; unfinished games resume on the next start")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Long-lived evaluation service: warm players, a durable job queue and progress streaming")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8765", help="Service address (client commands)")
+    parser.add_argument("--socket", type=str, help="Unix socket to serve on / connect to instead of TCP")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Run the service")
+    serve_parser.add_argument("matrix", type=str,
+                              help="Run matrix JSON with the service defaults (gdl_dir, samples_dir, providers, routes, ...); its runs are ignored")
+    serve_parser.add_argument("--queue_dir", type=str, required=True, help="Directory of the durable job and work queue")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port on 127.0.0.1 (unless --socket is given)")
+    serve_parser.add_argument("--workers", type=int, default=4, help="Games processed at the same time")
+    serve_parser.add_argument("--lease", type=float, default=120, help="Seconds without heartbeat after which a claimed game is taken over")
+    serve_parser.add_argument("--idle_poll", type=float, default=10.0, help="Seconds between queue scans while idle")
+
+    submit_parser = commands.add_parser("submit", help="Submit a job")
+    submit_parser.add_argument("--provider", type=str, required=True)
+    submit_parser.add_argument("--model", type=str, required=True)
+    submit_parser.add_argument("--experiment", type=str, required=True)
+    submit_parser.add_argument("--games", type=str, help="Comma-separated games (default: those of the service matrix)")
+    submit_parser.add_argument("--n_moves", type=int)
+    submit_parser.add_argument("--max_samples", type=int)
+    submit_parser.add_argument("--samples_dir", type=str)
+    submit_parser.add_argument("--follow", action="store_true", help="Stream the job's progress until it ends")
+
+    follow_parser = commands.add_parser("follow", help="Stream the progress of a job")
+    follow_parser.add_argument("job_id", type=str)
+    cancel_parser = commands.add_parser("cancel", help="Cancel the games of a job that have not started")
+    cancel_parser.add_argument("job_id", type=str)
+    commands.add_parser("status", help="Print the service status")
+    commands.add_parser("jobs", help="List jobs")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        return run_service(args)
+
+    client = ServiceClient(args.url, args.socket)
+    try:
+        run_client_command(client, args)
+    except (OSError, RuntimeError) as e:
+        raise SystemExit(f"❌ {e}")
+
+
+def run_client_command(client: ServiceClient, args):
+    if args.command == "submit":
+        request = JobRequest(
+            provider=args.provider, model=args.model, experiment=args.experiment,
+            games=args.games.split(",") if args.games else None,
+            n_moves=args.n_moves, max_samples=args.max_samples, samples_dir=args.samples_dir
+        )
+        record = client.submit(request)
+        print(f"📥 Job {record['job_id']}: {len(record['units'])} games, {record['state']}")
+        if args.follow:
+            for event in client.events(record["job_id"]):
+                print(format_event(record["job_id"], event))
+    elif args.command == "follow":
+        for event in client.events(args.job_id):
+            print(format_event(args.job_id, event))
+    elif args.command == "cancel":
+        print(f"🛑 Job {args.job_id}: {client.request('DELETE', f'/jobs/{args.job_id}')['state']}")
+    elif args.command == "jobs":
+        for record in client.request("GET", "/jobs"):
+            print(f"{record['job_id']}  {record['state']:<10} {record['request']['provider']}/{record['request']['model']} "
+                  f"{record['request']['experiment']}  {record['samples_ok']} ok, {record['samples_failed']} failed")
+    else:
+        print(json.dumps(client.request("GET", "/status"), indent=1))
+
+
+if __name__ == "__main__":
+    main()
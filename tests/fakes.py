@@ -0,0 +1,67 @@
+import json
+import os
+
+from llm_runner import BaseGamePlayer, Completion
+
+from conftest import DATA_DIR
+
+TICTACTOE_GDL = os.path.join(DATA_DIR, "tictactoe.kif")
+ANSWER = json.dumps({"llm_state": "(cell 1 1 x)"})
+
+
+class FakePlayer(BaseGamePlayer):
+    """Answers every request at once with answer(prompt); `fail` makes it raise instead."""
+    provider_name = "fake"
+    sampling_params = dict(max_completion_tokens=28192, temperature=0.2)
+    completion_limit_param = "max_completion_tokens"
+
+    def __init__(self, model_name: str = "model", tpm=None, max_concurrency: int = 4, fail: Exception = None, answer=None):
+        # A base URL of its own keeps the circuit breaker of every player separate
+        super().__init__(model_name, ["key"], max_concurrency, tpm=tpm, base_url=f"http://{model_name}.test")
+        self.fail = fail
+        self.answer = answer or (lambda prompt: ANSWER)
+        self.entered = 0
+        self.sent = 0
+        # (prompt, response model, sampling parameters) of every request sent
+        self.requests = []
+
+    def _reply(self, prompt, response_model) -> Completion:
+        self.sent += 1
+        self.requests.append((prompt, response_model, self._request_sampling_params()))
+        if self.fail is not None:
+            raise self.fail
+        return Completion(text=self.answer(prompt), prompt_tokens=10, completion_tokens=10)
+
+    def _complete(self, prompt, key_index, response_model=None) -> Completion:
+        return self._reply(prompt, response_model)
+
+    async def _acomplete(self, prompt, key_index, response_model=None) -> Completion:
+        return self._reply(prompt, response_model)
+
+    def _generate_json(self, prompt, response_model):
+        self.entered += 1
+        return super()._generate_json(prompt, response_model)
+
+    async def _agenerate_json(self, prompt, response_model):
+        self.entered += 1
+        return await super()._agenerate_json(prompt, response_model)
+
+
+def next_state_sample(i: int) -> dict:
+    return dict(game_state=f"(cell 1 1 b)\n(step {i})", move="(mark 1 1)", next_state=f"(cell 1 1 x)\n(step {i + 1})")
+
+
+def write_samples(directory: str, samples: list, game_name: str = "tictactoe") -> str:
+    """Writes a samples file and returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{game_name}.json")
+    with open(path, 'w') as f:
+        json.dump({"game_name": game_name, "samples": samples}, f)
+    return path
+
+
+def read_output(output_dir: str, game_name: str = "tictactoe") -> list:
+    """Samples of the output JSON file of a game."""
+    [name] = [name for name in os.listdir(output_dir) if name.startswith(f"output_{game_name}_")]
+    with open(os.path.join(output_dir, name), 'r') as f:
+        return json.load(f)["samples"]
@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+
+from llm_runner import (
+    BatchJobFailed, LLMNextStateResponse, LocalBatchBackend, _write_job_status, fulfil_local_batch_jobs, run_batch_experiment
+)
+
+from fakes import TICTACTOE_GDL, FakePlayer, next_state_sample, read_output, write_samples
+
+
+class ServedLocalBackend(LocalBatchBackend):
+    """Local backend whose jobs are served by a batch worker as soon as they are submitted."""
+    def __init__(self, batch_dir: str, worker: FakePlayer):
+        super().__init__(batch_dir)
+        self.worker = worker
+
+    def submit(self, requests, player, batch_file):
+        job_id = super().submit(requests, player, batch_file)
+        fulfil_local_batch_jobs(self.batch_dir, self.worker)
+        return job_id
+
+
+def batch_jobs(tmp_path, samples: int = 3, max_samples: int = 3) -> list:
+    samples_file = write_samples(str(tmp_path / "samples"), [next_state_sample(i) for i in range(samples)])
+    return [dict(gdl_file_path=TICTACTOE_GDL, samples_file_path=samples_file, experiment_type="next_state", max_samples=max_samples)]
+
+
+def json_player(**kwargs) -> FakePlayer:
+    player = FakePlayer(**kwargs)
+    player.output_format = "json"
+    return player
+
+
+def test_local_batch_round_trip(tmp_path):
+    output_dir = str(tmp_path / "out")
+    worker = FakePlayer()
+    backend = ServedLocalBackend(str(tmp_path / "batches"), worker)
+    run_batch_experiment(batch_jobs(tmp_path), json_player(), backend, output_dir, spare=0)
+
+    samples = read_output(output_dir)
+    assert [s["game_state"] for s in samples] == [next_state_sample(i)["game_state"] for i in range(3)]
+    assert all(s["llm_state"] == "(cell 1 1 x)" for s in samples)
+    assert not os.path.exists(os.path.join(output_dir, "batch_state.json"))
+
+
+def test_worker_sends_schema_and_sampling_params_of_the_line(tmp_path):
+    submitter = json_player(model_name="submitter")
+    submitter.sampling_params = dict(max_completion_tokens=512, temperature=0.7)
+    worker = FakePlayer(model_name="worker")
+    backend = ServedLocalBackend(str(tmp_path / "batches"), worker)
+    run_batch_experiment(batch_jobs(tmp_path, 1, 1), submitter, backend, str(tmp_path / "out"), spare=0)
+
+    [(prompt, response_model, sampling_params)] = worker.requests
+    assert response_model is LLMNextStateResponse
+    assert sampling_params == dict(max_completion_tokens=512, temperature=0.7)
+
+
+def test_failed_answers_are_journaled(tmp_path):
+    output_dir = str(tmp_path / "out")
+    backend = ServedLocalBackend(str(tmp_path / "batches"), FakePlayer(fail=RuntimeError("server error")))
+    run_batch_experiment(batch_jobs(tmp_path, 2, 2), json_player(), backend, output_dir, spare=0)
+
+    with open(os.path.join(output_dir, "journal_tictactoe.jsonl"), 'r') as f:
+        entries = [json.loads(line) for line in f]
+    assert [e["status"] for e in entries] == ["failed", "failed"]
+
+
+class FailingLocalBackend(LocalBatchBackend):
+    """Local backend whose jobs fail as soon as they are submitted."""
+    def submit(self, requests, player, batch_file):
+        job_id = super().submit(requests, player, batch_file)
+        _write_job_status(self._job_dir(job_id), "failed")
+        return job_id
+
+
+def test_failed_job_is_not_reattached_on_resume(tmp_path):
+    output_dir = str(tmp_path / "out")
+    batch_dir = str(tmp_path / "batches")
+    jobs = batch_jobs(tmp_path)
+    with pytest.raises(BatchJobFailed):
+        run_batch_experiment(jobs, json_player(), FailingLocalBackend(batch_dir), output_dir, spare=0)
+    assert not os.path.exists(os.path.join(output_dir, "batch_state.json"))
+
+    # The resumed run submits the samples again instead of waiting on the dead job
+    run_batch_experiment(jobs, json_player(), ServedLocalBackend(batch_dir, FakePlayer()), output_dir, resume=True, spare=0)
+    assert len(read_output(output_dir)) == 3
+
+
+def test_resume_skips_a_failed_job_left_by_an_older_run(tmp_path):
+    output_dir = str(tmp_path / "out")
+    batch_dir = str(tmp_path / "batches")
+    jobs = batch_jobs(tmp_path)
+    backend = FailingLocalBackend(batch_dir)
+    with pytest.raises(BatchJobFailed):
+        run_batch_experiment(jobs, json_player(), backend, output_dir, spare=0)
+    # A state file kept by a run that was killed while the job was failing
+    [job_id] = os.listdir(batch_dir)
+    with open(os.path.join(output_dir, "batch_state.json"), 'w') as f:
+        json.dump({"backend": "local", "job_id": job_id, "custom_ids": []}, f)
+
+    run_batch_experiment(jobs, json_player(), ServedLocalBackend(batch_dir, FakePlayer()), output_dir, resume=True, spare=0)
+    assert len(read_output(output_dir)) == 3
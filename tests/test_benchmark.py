@@ -0,0 +1,96 @@
+import argparse
+import json
+
+import pytest
+
+from benchmark import MockLLMServer, MockProfile, mock_answer, run_scenario, write_synthetic_inputs
+from llm_runner import build_legal_moves_prompt, build_multi_step_generation_prompt, build_next_state_prompt
+
+STATE = "(cell 1 1 b)\n(control xplayer)"
+MOVE = "(xplayer (mark 1 1)) (oplayer noop)"
+
+
+def test_mock_answer_fits_each_experiment():
+    gdl = "(role xplayer)\n(role oplayer)\n"
+    assert mock_answer(build_next_state_prompt(gdl, STATE, MOVE)) == {"llm_state": STATE}
+    assert set(mock_answer(build_legal_moves_prompt(gdl, STATE))) == {"llm_legal_moves"}
+    answer = mock_answer(build_multi_step_generation_prompt(gdl, 2, MOVE))
+    assert set(answer) == {"moves", "llm_state"}
+    assert answer["moves"][0]["joint_move"] == MOVE
+
+
+def test_bursts_of_rate_limits():
+    server = MockLLMServer(MockProfile(burst_probability=1.0, burst_length=3, seed=1))
+    try:
+        fates = [server._draw() for _ in range(4)]
+    finally:
+        server.httpd.server_close()
+    assert [fate["id"] for fate in fates] == [1, 2, 3, 4]
+    # With a burst probability of 1, the next burst starts as soon as one ends
+    assert all(fate["rate_limited"] for fate in fates)
+
+    server = MockLLMServer(MockProfile(truncated_rate=1.0, seed=1))
+    try:
+        fate = server._draw()
+    finally:
+        server.httpd.server_close()
+    assert (fate["rate_limited"], fate["fault"]) == (False, "truncated")
+    assert fate["latency"] > 0
+
+
+def test_answers_are_cut_off_at_max_tokens():
+    server = MockLLMServer(MockProfile(reasoning_tokens=10))
+    try:
+        prompt = build_next_state_prompt("(role xplayer)\n", STATE, MOVE)
+        text, finish, tokens = server._render(prompt, None)
+        assert (json.loads(text), finish, tokens) == ({"llm_state": STATE}, "stop", 10 + len(text) // 4)
+
+        text, finish, tokens = server._render(prompt, None, max_tokens=12)
+        assert (text, finish, tokens) == (json.dumps({"llm_state": STATE})[:8], "length", 12)
+        # Reasoning alone can use up the budget
+        assert server._render(prompt, None, max_tokens=5) == ("", "length", 5)
+        assert server.stats.snapshot()["over_budget"] == 2
+
+        text, finish, _ = server._render(prompt, "fenced")
+        assert text.startswith("```json\n") and finish == "stop"
+        assert server._render(prompt, "truncated")[1] == "length"
+    finally:
+        server.httpd.server_close()
+
+
+def test_synthetic_inputs_have_the_requested_size(tmp_path):
+    gdl_path, samples_path = write_synthetic_inputs(str(tmp_path), "next_state", 4, 3)
+    with open(samples_path, 'r') as f:
+        samples = json.load(f)["samples"]
+    assert len(samples) == 4
+    assert samples[0]["game_state"].count("(cell ") == 9
+    with open(gdl_path, 'r') as f:
+        assert "(init (cell 3 3 b))" in f.read()
+
+
+def scenario_args(**overrides) -> argparse.Namespace:
+    args = dict(
+        experiment="next_state", n_moves=5, samples=6, board=3, mode="sync", concurrency=4, keys=2, rpm=1e9, tpm=1e12,
+        cooldown=0.0, stream=False, pack_size=1, compact_gdl=None, attempt_timeout=10.0, completion_budget="adaptive",
+        escalate_truncated=False, hedge_quantile=None, seed=0, quiet=True
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize("mode, stream", [("sync", False), ("async", True)])
+def test_scenario_runs_end_to_end(tmp_path, mode, stream):
+    pytest.importorskip("openai")
+    profile = MockProfile(latency_median=0.01, latency_sigma=0.1, burst_probability=0.5, burst_length=1, fenced_rate=0.3, seed=3)
+    server = MockLLMServer(profile).start()
+    try:
+        result = run_scenario(server, "local", str(tmp_path), scenario_args(mode=mode, stream=stream))
+    finally:
+        server.stop()
+    assert (result.samples_ok, result.samples_failed) == (6, 0)
+    assert result.server["rate_limited"] > 0
+    # Every 429 is a call whose answer was not used
+    assert result.server_requests == 6 + result.wasted_calls
+    assert result.wasted_calls >= result.server["rate_limited"]
+    assert result.streaming == stream and result.server["streamed"] == (result.server["answered"] if stream else 0)
+    assert 0 < result.latency_p50 <= result.latency_p99
@@ -0,0 +1,155 @@
+import pytest
+
+from llm_runner import (
+    Completion, CompletionBudgets, LLMNextStateResponse, MultiStepInputSample, expected_answer_size, initial_state_size,
+    prepare_sample_task
+)
+
+from fakes import ANSWER, TICTACTOE_GDL, FakePlayer
+
+KEY = ("tictactoe", "next_state")
+
+
+def test_ceiling_until_enough_answers_were_seen():
+    budgets = CompletionBudgets(min_history=3)
+    for tokens in (400, 500):
+        budgets.record(KEY, tokens, None)
+    assert budgets.estimate(KEY, None, 28192) == 28192
+    budgets.record(KEY, 600, None)
+    assert budgets.estimate(KEY, None, 28192) == 780
+    # Other games learn on their own
+    assert budgets.estimate(("chess", "next_state"), None, 28192) == 28192
+
+
+def test_cold_start_is_sized_from_the_expected_answer():
+    budgets = CompletionBudgets(margin=1.3, floor=256)
+    assert budgets.estimate(KEY, 4000, 28192) == 1300
+    assert budgets.estimate(KEY, 100, 28192) == 256
+    assert budgets.estimate(KEY, 400000, 28192) == 28192
+
+
+def test_estimate_stays_between_floor_and_ceiling():
+    budgets = CompletionBudgets(floor=256)
+    for _ in range(3):
+        budgets.record(KEY, 10, None)
+    assert budgets.estimate(KEY, None, 28192) == 256
+    for _ in range(3):
+        budgets.record(KEY, 5000, None)
+    assert budgets.estimate(KEY, None, 4096) == 4096
+
+
+def test_budget_follows_the_expected_answer_size():
+    budgets = CompletionBudgets(margin=1.0, floor=1)
+    for size in (100, 200, 300, 400):
+        budgets.record(KEY, 2 * size + 50, size)
+    assert budgets.estimate(KEY, 1000, 28192) == 2050
+    assert budgets.estimate(KEY, 50, 28192) == 150
+
+
+def test_fit_covers_every_observed_answer():
+    sized = [(100, 300), (200, 320), (300, 700), (400, 500)]
+    for size, tokens in sized:
+        assert CompletionBudgets._fit(sized, size) >= tokens
+    # Equal sizes scale the largest answer
+    assert CompletionBudgets._fit([(100, 200), (100, 300)], 200) == pytest.approx(600)
+
+
+def test_old_answers_leave_the_window():
+    budgets = CompletionBudgets(margin=1.0, floor=1, window=3)
+    budgets.record(KEY, 5000, None)
+    for _ in range(3):
+        budgets.record(KEY, 100, None)
+    assert budgets.estimate(KEY, None, 28192) == 100
+
+
+class BudgetPlayer(FakePlayer):
+    """Every answer takes `needed(prompt)` completion tokens and is cut off at the budget it was sent with."""
+    def __init__(self, model_name: str, needed):
+        super().__init__(model_name)
+        self.needed = needed
+        self.budgets = []
+
+    def _reply(self, prompt, response_model) -> Completion:
+        budget = self._request_sampling_params()[self.completion_limit_param]
+        self.sent += 1
+        self.budgets.append(budget)
+        tokens = self.needed(prompt)
+        return Completion(text=ANSWER, prompt_tokens=10, completion_tokens=min(tokens, budget), truncated=tokens > budget)
+
+
+def test_requests_are_sent_with_the_learned_budget():
+    player = BudgetPlayer("budget-learned", lambda prompt: 1000)
+    for _ in range(4):
+        player._generate_json("prompt", LLMNextStateResponse)
+    assert player.budgets == [28192, 28192, 28192, 1300]
+
+
+def test_answer_size_sizes_the_budget():
+    player = BudgetPlayer("budget-sized", lambda prompt: 2 * int(prompt))
+    for size in (100, 200, 300):
+        with expected_answer_size(size):
+            player._generate_json(str(size), LLMNextStateResponse)
+    with expected_answer_size(1000):
+        player._generate_json("1000", LLMNextStateResponse)
+    assert player.budgets[-1] == 2600
+
+
+def test_budget_is_planned_within_the_fixed_limit():
+    player = BudgetPlayer("budget-planned", lambda prompt: 1000)
+    player.sampling_params = dict(player.sampling_params, max_completion_tokens=4096)
+    player.max_completion_tokens = 16384
+    player._generate_json("prompt", LLMNextStateResponse)
+    assert player.budgets == [4096]
+
+
+def test_cold_start_answer_that_needs_more_is_escalated():
+    player = BudgetPlayer("budget-seeded", lambda prompt: 2000)
+    with expected_answer_size(4000):
+        player._generate_json("prompt", LLMNextStateResponse)
+    assert player.budgets == [1300, 2600]
+
+
+def test_multi_step_tasks_expect_a_full_state():
+    with open(TICTACTOE_GDL, 'r') as f:
+        gdl = f.read()
+    sample = MultiStepInputSample(moves=[{"step": "1", "joint_move": "(mark 1 1)"}, {"step": "2", "joint_move": "noop"}])
+    state_size = initial_state_size(gdl)
+    assert state_size
+    assert prepare_sample_task(0, sample, gdl, "multi_step_prediction", n_moves=2).answer_size == state_size
+    assert prepare_sample_task(0, sample, gdl, "multi_step_generation", n_moves=2).answer_size > state_size
+
+
+def test_cut_off_answer_is_retried_with_twice_the_budget():
+    player = BudgetPlayer("budget-escalate", lambda prompt: 400 if prompt == "short" else 3000)
+    player.max_attempts = 1
+    for _ in range(3):
+        player._generate_json("short", LLMNextStateResponse)
+    assert player._generate_json("long", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    # Escalation does not use up the only attempt
+    assert player.budgets[3:] == [520, 1040, 2080, 4160]
+    assert player.usage.truncations == 3
+
+
+def test_escalation_stops_at_the_fixed_limit_unless_enabled():
+    player = BudgetPlayer("budget-capped", lambda prompt: 400 if prompt == "short" else 50000)
+    for _ in range(3):
+        player._generate_json("short", LLMNextStateResponse)
+    player._generate_json("long", LLMNextStateResponse)
+    assert player.budgets[-1] == 28192
+    assert player.sent == 3 + 7
+
+    player = BudgetPlayer("budget-uncapped", lambda prompt: 400 if prompt == "short" else 50000)
+    player.escalate_truncated = True
+    player.max_completion_tokens = 65536
+    for _ in range(3):
+        player._generate_json("short", LLMNextStateResponse)
+    player._generate_json("long", LLMNextStateResponse)
+    assert player.budgets[3:] == [520, 1040, 2080, 4160, 8320, 16640, 33280, 65536]
+
+
+def test_fixed_budgets_send_the_limit_of_sampling_params():
+    player = BudgetPlayer("budget-fixed", lambda prompt: 100)
+    player.adaptive_budgets = False
+    for _ in range(4):
+        player._generate_json("prompt", LLMNextStateResponse)
+    assert player.budgets == [28192] * 4
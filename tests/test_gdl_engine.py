@@ -0,0 +1,184 @@
+import os
+
+import pytest
+
+from conftest import DATA_DIR
+from gdl_engine import (
+    GDLError, GDLGame, IllegalMoveError, SymbolMap, compact_gdl, format_state, jaccard,
+    parse_joint_move, parse_moves, parse_state
+)
+
+
+@pytest.fixture(scope="module")
+def tictactoe() -> GDLGame:
+    return GDLGame.from_file(os.path.join(DATA_DIR, "tictactoe.kif"))
+
+
+def moves(game: GDLGame, *texts: str) -> list:
+    return [parse_joint_move(text, game.roles) for text in texts]
+
+
+def board(rows: str, control: str) -> frozenset:
+    """State from three rows such as "xob", read top to bottom."""
+    cells = [f"(cell {r + 1} {c + 1} {mark})" for r, row in enumerate(rows.split()) for c, mark in enumerate(row)]
+    return parse_state("\n".join(cells + [f"(control {control})"]))
+
+
+# --- Rules ---
+
+def test_initial_state_and_roles(tictactoe):
+    assert tictactoe.roles == ["xplayer", "oplayer"]
+    assert tictactoe.initial_state() == board("bbb bbb bbb", "xplayer")
+
+
+def test_legal_moves_follow_control(tictactoe):
+    legal = tictactoe.legal_moves(board("xbb bbb bbb", "oplayer"))
+    assert legal["xplayer"] == ["noop"]
+    assert sorted(legal["oplayer"]) == sorted(("mark", str(r), str(c)) for r in "123" for c in "123" if (r, c) != ("1", "1"))
+
+
+def test_next_state_uses_distinct_and_or(tictactoe):
+    # Marked cells keep their mark (distinct ?w b), the other blank cells stay blank (or (distinct ?m ?j) (distinct ?n ?k))
+    state = tictactoe.next_state(board("xbb bbb bbb", "oplayer"), moves(tictactoe, "(xplayer noop) (oplayer (mark 2 2))")[0])
+    assert state == board("xbb bob bbb", "xplayer")
+
+
+def test_play_to_a_win(tictactoe):
+    state = tictactoe.play(moves(
+        tictactoe,
+        "(xplayer (mark 1 1)) (oplayer noop)",
+        "(xplayer noop) (oplayer (mark 2 1))",
+        "(xplayer (mark 1 2)) (oplayer noop)",
+        "(xplayer noop) (oplayer (mark 2 2))",
+        "(xplayer (mark 1 3)) (oplayer noop)",
+    ))
+    assert state == board("xxx oob bbb", "oplayer")
+    assert tictactoe.is_terminal(state)
+    assert tictactoe.goals(state) == {"xplayer": 100, "oplayer": 0}
+
+
+def test_negation_over_derived_relations(tictactoe):
+    # A full board without a line: terminal through (not open), a draw through (not (line x)) (not (line o))
+    draw = board("xox xoo oxx", "oplayer")
+    assert tictactoe.is_terminal(draw)
+    assert tictactoe.goals(draw) == {"xplayer": 50, "oplayer": 50}
+    assert not tictactoe.is_terminal(board("xob bbb bbb", "xplayer"))
+
+
+def test_illegal_moves_are_rejected(tictactoe):
+    with pytest.raises(IllegalMoveError) as error:
+        tictactoe.play(moves(tictactoe, "(xplayer (mark 1 1)) (oplayer noop)", "(xplayer noop) (oplayer (mark 1 1))"))
+    assert error.value.step == 1 and error.value.role == "oplayer"
+    # Out of turn
+    with pytest.raises(IllegalMoveError):
+        tictactoe.play(moves(tictactoe, "(xplayer noop) (oplayer (mark 1 1))"))
+
+
+RECURSIVE_GAME = """
+(role walker)
+(init (at a))
+(edge a b) (edge b c) (edge c d) (edge x y)
+(node a) (node b) (node c) (node d) (node x) (node y)
+(<= (reach ?x ?y) (edge ?x ?y))
+(<= (reach ?x ?z) (edge ?x ?y) (reach ?y ?z))
+(<= (legal walker (go ?y)) (true (at ?x)) (reach ?x ?y))
+(<= (next (at ?y)) (does walker (go ?y)))
+(<= (legal walker (jump ?y)) (node ?y) (true (at ?x)) (distinct ?x ?y) (not (reach ?x ?y)))
+(<= terminal (true (at d)))
+(<= (goal walker 100) (true (at d)))
+(<= (goal walker 0) (not (true (at d))))
+"""
+
+
+def test_recursion_and_negation_of_a_recursive_relation():
+    game = GDLGame(RECURSIVE_GAME)
+    start = game.initial_state()
+    # go: reachable through the transitive closure; jump: every other node, through (not (reach ?x ?y))
+    assert sorted(game.legal_moves(start)["walker"]) == [
+        ("go", "b"), ("go", "c"), ("go", "d"), ("jump", "x"), ("jump", "y")
+    ]
+    assert not game.is_terminal(start)
+    end = game.play(moves(game, "(walker (go c))", "(walker (go d))"))
+    assert end == parse_state("(at d)")
+    assert game.is_terminal(end)
+    assert game.goals(end) == {"walker": 100}
+
+
+def test_negation_inside_recursion_is_rejected():
+    with pytest.raises(GDLError):
+        GDLGame("(role r) (<= (p ?x) (q ?x) (not (p ?x))) (<= (q ?x) (p ?x))")
+
+
+def test_missing_roles_are_rejected():
+    with pytest.raises(GDLError):
+        GDLGame("(init (cell 1))")
+
+
+# --- Text formats ---
+
+@pytest.mark.parametrize("text", [
+    "(cell 1 1 x)\n(control oplayer)",
+    "(true (cell 1 1 x)) (true (control oplayer))",
+    "[cell 1 1 x]\n[control oplayer]",
+    "cell 1 1 x\ncontrol oplayer",
+])
+def test_parse_state_layouts(text):
+    assert parse_state(text) == {("cell", "1", "1", "x"), ("control", "oplayer")}
+
+
+def test_parse_joint_move_layouts(tictactoe):
+    expected = {"xplayer": ("mark", "1", "2"), "oplayer": "noop"}
+    assert parse_joint_move("(does xplayer (mark 1 2)) (does oplayer noop)", tictactoe.roles) == expected
+    assert parse_joint_move("xplayer (mark 1 2), oplayer noop", tictactoe.roles) == expected
+    with pytest.raises(GDLError):
+        parse_joint_move("(mark 1 2)", tictactoe.roles)
+
+
+def test_parse_moves_and_jaccard():
+    predicted = frozenset(parse_moves("(legal xplayer (mark 1 1))\n(xplayer (mark 1 2))"))
+    truth = frozenset(parse_moves("(xplayer (mark 1 1)) (xplayer (mark 2 2))"))
+    assert jaccard(predicted, truth) == pytest.approx(1 / 3)
+    assert jaccard(frozenset(), frozenset()) == 1.0
+
+
+def test_compaction_and_symbols_keep_the_rules(tictactoe):
+    with open(os.path.join(DATA_DIR, "tictactoe.kif"), 'r') as f:
+        text = f.read()
+    compact = compact_gdl(text)
+    assert ";" not in compact and len(compact) < len(text)
+    symbols = SymbolMap.for_rules(compact)
+    renamed = GDLGame(symbols.encode_text(compact))
+
+    state = board("xbb bob bbb", "xplayer")
+    encoded = renamed.next_state(
+        parse_state(symbols.encode_text(format_state(state))),
+        parse_joint_move(symbols.encode_text("(xplayer (mark 3 3)) (oplayer noop)"), renamed.roles)
+    )
+    assert parse_state(symbols.decode_text(format_state(encoded))) == board("xbb bob bbx", "oplayer")
+    with pytest.raises(GDLError):
+        compact_gdl("(role x))")
+
+
+# --- Verification of answers ---
+
+def test_game_verifier(tictactoe):
+    from llm_runner import GameVerifier, MoveStep, OutputSampleMultiStepGen, OutputSampleNextState, VerificationStats
+
+    stats = VerificationStats()
+    verifier = GameVerifier(tictactoe, "tictactoe", "next_state", stats)
+    verdict = verifier.check(0, OutputSampleNextState(
+        game_state=format_state(board("bbb bbb bbb", "xplayer")),
+        move="(xplayer (mark 2 2)) (oplayer noop)",
+        next_state="",
+        llm_state=format_state(board("bbb bxb bbb", "oplayer"))
+    ))
+    assert verdict.exact
+
+    verifier = GameVerifier(tictactoe, "tictactoe", "multi_step_generation", stats)
+    verdict = verifier.check(1, OutputSampleMultiStepGen(
+        moves=[MoveStep(step="1", joint_move="(xplayer (mark 1 1)) (oplayer noop)"),
+               MoveStep(step="2", joint_move="(xplayer (mark 1 2)) (oplayer noop)")],
+        llm_state=""
+    ))
+    assert verdict.legal is False and verdict.jaccard == 0.0
+    assert stats.game("tictactoe") == dict(checked=2, exact=1, jaccard=1.0, illegal=1, errors=0)
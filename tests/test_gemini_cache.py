@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from llm_runner import GeminiGamePlayer, build_next_state_prompt
+
+DEFINITION = "(role x)\n" * 600
+
+
+def response(text: str = '{"llm_state": "(cell 1 1 x)"}'):
+    usage = SimpleNamespace(prompt_token_count=10, candidates_token_count=5, cached_content_token_count=0)
+    return SimpleNamespace(text=text, usage_metadata=usage, candidates=[])
+
+
+class FakeGenAI:
+    """Context caches and generate_content of one key; requests naming a cache in `dead` fail like an expired cache."""
+    def __init__(self):
+        self.names = (f"cachedContents/{i}" for i in itertools.count())
+        self.created, self.updated, self.dead, self.sent = [], [], set(), []
+        self.caches = SimpleNamespace(create=self.create, update=self.update, delete=lambda name: None)
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+        self.aio = SimpleNamespace(
+            caches=SimpleNamespace(create=self._async(self.create), update=self._async(self.update)),
+            models=SimpleNamespace(generate_content=self._async(self.generate_content))
+        )
+
+    @staticmethod
+    def _async(call):
+        async def run(**kwargs):
+            return call(**kwargs)
+        return run
+
+    def create(self, model, config):
+        self.created.append(next(self.names))
+        return SimpleNamespace(name=self.created[-1])
+
+    def update(self, name, config):
+        if name in self.dead:
+            raise RuntimeError("404 NOT_FOUND. CachedContent not found (or permission denied)")
+        self.updated.append(name)
+
+    def generate_content(self, model, contents, config):
+        self.sent.append(config.cached_content)
+        if config.cached_content in self.dead:
+            raise RuntimeError("403 PERMISSION_DENIED. CachedContent not found (or permission denied)")
+        return response()
+
+
+@pytest.fixture
+def gemini():
+    player = GeminiGamePlayer("gemini-test", ["key"])
+    player.clients = [FakeGenAI()]
+    return player
+
+
+def prompt(i: int = 0):
+    return build_next_state_prompt(DEFINITION, f"(step {i})", "(mark 1 1)")
+
+
+def test_prefix_cache_is_created_once_per_game(gemini):
+    client = gemini.clients[0]
+    for i in range(3):
+        gemini._complete(prompt(i), 0)
+    assert client.created == ["cachedContents/0"]
+    assert client.sent == ["cachedContents/0"] * 3
+
+
+def test_rejected_cache_is_resent_in_full_and_recreated(gemini):
+    client = gemini.clients[0]
+    gemini._complete(prompt(0), 0)
+    client.dead.add("cachedContents/0")
+
+    completion = gemini._complete(prompt(1), 0)
+    assert completion.text
+    # Resent without the cache, then the next request creates a new one
+    assert client.sent[1:] == ["cachedContents/0", None]
+    gemini._complete(prompt(2), 0)
+    assert client.created == ["cachedContents/0", "cachedContents/1"]
+    assert client.sent[-1] == "cachedContents/1"
+
+
+def test_rejected_cache_async(gemini):
+    client = gemini.clients[0]
+
+    async def run():
+        await gemini._acomplete(prompt(0), 0)
+        client.dead.add("cachedContents/0")
+        await gemini._acomplete(prompt(1), 0)
+        await gemini._acomplete(prompt(2), 0)
+
+    asyncio.run(run())
+    assert client.sent == ["cachedContents/0", "cachedContents/0", None, "cachedContents/1"]
+
+
+def test_other_errors_are_not_taken_for_a_dead_cache(gemini):
+    gemini._complete(prompt(0), 0)
+
+    def server_error(**request):
+        raise RuntimeError("500 INTERNAL")
+
+    gemini.clients[0].models.generate_content = server_error
+    with pytest.raises(RuntimeError, match="500"):
+        gemini._complete(prompt(1), 0)
+    assert gemini._get_prefix_cache(prompt(2), 0) == "cachedContents/0"
+
+
+def test_cache_ttl_is_extended_in_long_games(gemini):
+    client = gemini.clients[0]
+    gemini._complete(prompt(0), 0)
+    slot = gemini._cache_slot(prompt(0), 0)
+    game, name, expires = gemini._prefix_caches[slot]
+    # Close to expiry: the next request extends the cache instead of letting it lapse
+    gemini._prefix_caches[slot] = (game, name, expires - gemini.cache_ttl + gemini.cache_refresh_margin / 2)
+    gemini._complete(prompt(1), 0)
+    assert client.updated == ["cachedContents/0"]
+    assert gemini._prefix_caches[slot][2] > expires - 1
+
+
+def test_cache_that_cannot_be_extended_is_recreated(gemini):
+    client = gemini.clients[0]
+    gemini._complete(prompt(0), 0)
+    slot = gemini._cache_slot(prompt(0), 0)
+    game, name, expires = gemini._prefix_caches[slot]
+    gemini._prefix_caches[slot] = (game, name, expires - gemini.cache_ttl + 1)
+    client.dead.add(name)
+    gemini._complete(prompt(1), 0)
+    assert client.created == ["cachedContents/0", "cachedContents/1"]
+    assert client.sent[-1] == "cachedContents/1"
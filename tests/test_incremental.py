@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from llm_runner import ConversationPrompt, chat_messages, process_game_file_incremental, process_game_file_incremental_async
+
+from fakes import TICTACTOE_GDL, FakePlayer, read_output, write_samples
+
+
+def moves_sample(i: int, length: int = 3) -> dict:
+    return {"moves": [{"step": str(k + 1), "joint_move": f"(mark {i} {k})"} for k in range(length)]}
+
+
+def step_player(model_name: str, fail_at: int = None) -> FakePlayer:
+    """Answers each turn with the number of moves played so far; a reply to step `fail_at` is garbage."""
+    def answer(prompt: str) -> str:
+        step = prompt.count("[user]")
+        return "not json" if step == fail_at else json.dumps({"llm_state": f"(after {step})"})
+
+    player = FakePlayer(model_name, answer=answer)
+    player.output_format = "json"
+    player.max_attempts = 1
+    return player
+
+
+def run(tmp_path, player: FakePlayer, samples: list, n_max: int = 3, resume: bool = False, asynchronous: bool = False) -> dict:
+    samples_file = write_samples(str(tmp_path / "samples"), samples)
+    output_dirs = {n: str(tmp_path / f"n{n}") for n in range(1, n_max + 1)}
+    job = dict(
+        gdl_file_path=TICTACTOE_GDL, samples_file_path=samples_file, player=player, output_dirs=output_dirs,
+        max_samples=len(samples), resume=resume
+    )
+    if asynchronous:
+        asyncio.run(process_game_file_incremental_async(**job))
+    else:
+        process_game_file_incremental(**job)
+    return output_dirs
+
+
+def test_one_pass_yields_every_n(tmp_path):
+    player = step_player("incremental-pass")
+    output_dirs = run(tmp_path, player, [moves_sample(0), moves_sample(1)])
+    assert player.sent == 2 * 3
+    for n, output_dir in output_dirs.items():
+        samples = read_output(output_dir)
+        assert [s["llm_state"] for s in samples] == [f"(after {n})"] * 2
+        assert [len(s["moves"]) for s in samples] == [n, n]
+
+
+def test_each_turn_extends_the_previous_prompt(tmp_path):
+    player = step_player("incremental-prefix")
+    run(tmp_path, player, [moves_sample(0)])
+    prompts = [prompt for prompt, _, _ in player.requests]
+    assert all(isinstance(prompt, ConversationPrompt) for prompt in prompts)
+    assert all(later.startswith(earlier) for earlier, later in zip(prompts, prompts[1:]))
+    assert len({prompt.prefix for prompt in prompts}) == 1
+    # Earlier answers go back to the model as assistant turns
+    roles = [message["role"] for message in chat_messages(prompts[-1])]
+    assert roles == ["system", "user", "assistant", "user", "assistant", "user"]
+
+
+def test_short_sequences_fill_the_larger_n(tmp_path):
+    player = step_player("incremental-short")
+    output_dirs = run(tmp_path, player, [moves_sample(0, length=2)], n_max=4)
+    assert player.sent == 2
+    assert [read_output(output_dirs[n])[0]["llm_state"] for n in (1, 2, 3, 4)] == ["(after 1)", "(after 2)", "(after 2)", "(after 2)"]
+
+
+def test_failed_step_fails_every_later_n(tmp_path):
+    output_dirs = run(tmp_path, step_player("incremental-fail", fail_at=2), [moves_sample(0)])
+    assert read_output(output_dirs[1])[0]["llm_state"] == "(after 1)"
+    for n in (2, 3):
+        with open(f"{output_dirs[n]}/journal_tictactoe.jsonl", 'r') as f:
+            assert [json.loads(line)["status"] for line in f] == ["failed"]
+
+
+def test_resume_replays_journaled_steps(tmp_path):
+    run(tmp_path, step_player("incremental-resume", fail_at=3), [moves_sample(0), moves_sample(1)])
+    player = step_player("incremental-resume")
+    output_dirs = run(tmp_path, player, [moves_sample(0), moves_sample(1)], resume=True)
+
+    # Only the last step is asked again, in a conversation rebuilt from the journaled answers
+    assert player.sent == 2
+    [first, _] = [prompt for prompt, _, _ in player.requests]
+    assert [turn for turn in first.turns if turn[0] == "assistant"] == [
+        ("assistant", json.dumps({"llm_state": "(after 1)"}, separators=(",", ":"))),
+        ("assistant", json.dumps({"llm_state": "(after 2)"}, separators=(",", ":"))),
+    ]
+    assert [s["llm_state"] for s in read_output(output_dirs[3])] == ["(after 3)", "(after 3)"]
+
+
+def test_async_samples_run_their_steps_in_order(tmp_path):
+    player = step_player("incremental-async")
+    output_dirs = run(tmp_path, player, [moves_sample(i) for i in range(3)], asynchronous=True)
+    assert player.sent == 3 * 3
+    assert [s["llm_state"] for s in read_output(output_dirs[3])] == ["(after 3)"] * 3
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+from llm_runner import GameJournal, RunManifest, process_game_file, process_game_file_async
+
+from fakes import ANSWER, TICTACTOE_GDL, FakePlayer, next_state_sample, read_output, write_samples
+
+
+def json_player(model_name: str, broken: set = frozenset()) -> FakePlayer:
+    """Writes JSON output files and answers garbage to the samples whose step is in `broken`, in one attempt."""
+    player = FakePlayer(model_name, answer=lambda prompt: "not json" if any(f"(step {i})" in prompt for i in broken) else ANSWER)
+    player.output_format = "json"
+    player.max_attempts = 1
+    return player
+
+
+def run(tmp_path, player: FakePlayer, resume: bool = False, asynchronous: bool = False, samples: int = 4):
+    samples_file = write_samples(str(tmp_path / "samples"), [next_state_sample(i) for i in range(samples)])
+    job = dict(
+        gdl_file_path=TICTACTOE_GDL, samples_file_path=samples_file, player=player, output_dir=str(tmp_path / "out"),
+        max_samples=samples, experiment_type="next_state", resume=resume
+    )
+    if asynchronous:
+        asyncio.run(process_game_file_async(**job))
+    else:
+        process_game_file(**job)
+    return str(tmp_path / "out")
+
+
+def journal_entries(output_dir: str) -> list:
+    with open(os.path.join(output_dir, "journal_tictactoe.jsonl"), 'r') as f:
+        return [json.loads(line) for line in f]
+
+
+def output_files(output_dir: str, prefix: str) -> list:
+    return [name for name in os.listdir(output_dir) if name.startswith(prefix)]
+
+
+def test_short_run_is_saved_as_partial(tmp_path):
+    output_dir = run(tmp_path, json_player("journal-partial", {1}))
+    assert sorted((e["index"], e["status"]) for e in journal_entries(output_dir)) == [(0, "ok"), (1, "failed"), (2, "ok"), (3, "ok")]
+    assert output_files(output_dir, "output_") == []
+    [partial] = output_files(output_dir, "partial_tictactoe_")
+    with open(os.path.join(output_dir, partial), 'r') as f:
+        assert len(json.load(f)["samples"]) == 3
+
+    manifest = RunManifest(output_dir, "journal-partial", "next_state")
+    entry = manifest.entry("tictactoe")
+    assert (entry.samples_ok, entry.failed_indices, entry.complete) == (3, [1], False)
+    assert not manifest.is_complete("tictactoe")
+
+
+def test_resume_only_reissues_failed_samples(tmp_path):
+    run(tmp_path, json_player("journal-resume", {1, 3}))
+    player = json_player("journal-resume")
+    output_dir = run(tmp_path, player, resume=True)
+
+    assert player.sent == 2
+    assert all("(step 1)" in prompt or "(step 3)" in prompt for prompt, _, _ in player.requests)
+    assert [s["game_state"] for s in read_output(output_dir)] == [next_state_sample(i)["game_state"] for i in range(4)]
+    # The complete output supersedes the partial file
+    assert output_files(output_dir, "partial_") == []
+    assert RunManifest(output_dir, "journal-resume", "next_state").is_complete("tictactoe")
+
+
+def test_async_resume_only_reissues_failed_samples(tmp_path):
+    run(tmp_path, json_player("journal-async", {0}), asynchronous=True)
+    player = json_player("journal-async")
+    output_dir = run(tmp_path, player, resume=True, asynchronous=True)
+    assert player.sent == 1
+    assert len(read_output(output_dir)) == 4
+
+
+def test_without_resume_the_journal_starts_over(tmp_path):
+    run(tmp_path, json_player("journal-fresh", {1}))
+    player = json_player("journal-fresh")
+    output_dir = run(tmp_path, player)
+    assert player.sent == 4
+    assert len(journal_entries(output_dir)) == 4
+
+
+def test_store_run_resumes_from_the_store(tmp_path):
+    broken = json_player("journal-store", {2})
+    broken.output_format = "store"
+    run(tmp_path, broken)
+    player = FakePlayer("journal-store")
+    output_dir = run(tmp_path, player, resume=True)
+    assert player.sent == 1
+    # The journal only keeps the status; the samples come back from the store
+    assert all(e.get("sample") is None for e in journal_entries(output_dir))
+    assert RunManifest(output_dir, "journal-store", "next_state").is_complete("tictactoe")
+
+
+def test_journal_skips_a_line_cut_off_by_an_interruption(tmp_path):
+    output_dir = run(tmp_path, json_player("journal-cut", {2}))
+    with open(os.path.join(output_dir, "journal_tictactoe.jsonl"), 'a') as f:
+        f.write('{"index": 2, "status": "ok", "sam')
+
+    journal = GameJournal(output_dir, "tictactoe", "next_state", resume=True)
+    assert sorted(journal.completed) == [0, 1, 3]
+    assert journal.failed == {2}
+
+
+def test_later_success_clears_an_earlier_failure(tmp_path):
+    output_dir = str(tmp_path / "out")
+    journal = GameJournal(output_dir, "tictactoe", "next_state")
+    journal.record_failure(0, RuntimeError("timeout"))
+    reopened = GameJournal(output_dir, "tictactoe", "next_state", resume=True)
+    assert reopened.failed == {0}
+
+    sample = next_state_sample(0)
+    reopened.record_success(0, reopened.sample_model(**sample, llm_state="(cell 1 1 x)"))
+    journal = GameJournal(output_dir, "tictactoe", "next_state", resume=True)
+    assert (sorted(journal.completed), journal.failed) == ([0], set())
+
+
+WRITER = """
+import sys
+sys.path.insert(0, {root!r})
+from llm_runner import GameJournal, RunManifest
+for i in range({count}):
+    game = "{prefix}%d" % i
+    journal = GameJournal({output_dir!r}, game, "next_state")
+    RunManifest({output_dir!r}, "model", "next_state").update(game, journal, game + ".json", 0)
+"""
+
+
+def test_manifest_updates_from_several_processes_are_all_kept(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = str(tmp_path / "out")
+    writers = [
+        subprocess.Popen([sys.executable, "-c", WRITER.format(root=root, count=60, prefix=prefix, output_dir=output_dir)],
+                         stdout=subprocess.DEVNULL)
+        for prefix in ("a", "b")
+    ]
+    assert [writer.wait(120) for writer in writers] == [0, 0]
+
+    manifest = RunManifest(output_dir, "model", "next_state")
+    assert len(manifest.data.games) == 120
+    assert all(manifest.entry(game).complete for game in manifest.data.games)
+    assert [name for name in os.listdir(output_dir) if name.startswith("run_manifest.json.")] == []
@@ -0,0 +1,101 @@
+import re
+import json
+
+import pytest
+
+from llm_runner import IncrementalJSONValidator, LLMMultiStepGenResponse, StreamAborted, repair_json
+
+# --- repair_json ---
+
+REPAIR_CASES = [
+    # (answer, parsed repaired answer, repairs)
+    ('{"a": "x"}', {"a": "x"}, []),
+    ('```json\n{"a": "x"}\n```', {"a": "x"}, []),
+    ('Sure! Here it is: {"a": "x"} Hope this helps.', {"a": "x"},
+     ["extracted from surrounding text", "dropped text after the object"]),
+    ('{"a": "line 1\nline 2\tend"}', {"a": "line 1\nline 2\tend"}, ["escaped control characters"]),
+    ('{"a": "quote \\" and {brace} [bracket]"}', {"a": 'quote " and {brace} [bracket]'}, []),
+    ('{"a": [1, 2,], }', {"a": [1, 2]}, ["removed trailing comma"]),
+    ('{"a": [1, 2}', {"a": [1, 2]}, ["closed mismatched bracket"]),
+    ('{"a": 1]}', {"a": 1}, ["dropped stray bracket"]),
+    ('{"a": {"b": [1, {"c": 2}]}}', {"a": {"b": [1, {"c": 2}]}}, []),
+    # Cut off inside a value: complete facts are kept, the half-written one is dropped
+    ('{"llm_state": "(cell 1 1 x)\n(cell 1 2', {"llm_state": "(cell 1 1 x)"},
+     ["escaped control characters", "closed truncated output", "dropped a partial fact"]),
+    ('{"llm_state": "(cell 1 1 (mark x))', {"llm_state": "(cell 1 1 (mark x))"}, ["closed truncated output"]),
+    # A value without a complete fact goes with its key
+    ('{"a": "x", "llm_state": "(cell 1', {"a": "x"}, ["closed truncated output", "dropped a partial fact"]),
+    # Dangling keys, with and without the colon, and inside a cut-off key
+    ('{"a": "x", "b":', {"a": "x"}, ["closed truncated output"]),
+    ('{"a": "x", "b"', {"a": "x"}, ["closed truncated output"]),
+    ('{"a": "x", "be', {"a": "x"}, ["closed truncated output"]),
+    ('{"a": "x",', {"a": "x"}, ["closed truncated output"]),
+    # A backslash cut off at the very end
+    ('{"a": "abc\\', {"a": "abc"}, ["closed truncated output"]),
+    ('{"moves": [{"step": "1", "joint_move": "(a noop)"}, {"step": "2"',
+     {"moves": [{"step": "1", "joint_move": "(a noop)"}, {"step": "2"}]}, ["closed truncated output"]),
+    ('{"moves": [', {"moves": []}, ["closed truncated output"]),
+]
+
+
+@pytest.mark.parametrize("text, expected, repairs", REPAIR_CASES)
+def test_repair_json(text, expected, repairs):
+    repaired, made = repair_json(text)
+    assert json.loads(repaired) == expected
+    assert made == repairs
+
+
+def test_repair_json_without_object():
+    assert repair_json("no json here") == ("no json here", [])
+
+
+def test_repaired_answers_validate():
+    text = '{"moves": [{"step": "1", "joint_move": "(a noop)"}], "llm_state": "(cell 1 1 x)\n(cell 1'
+    repaired, _ = repair_json(text)
+    answer = LLMMultiStepGenResponse.model_validate_json(repaired)
+    assert answer.llm_state == "(cell 1 1 x)"
+
+
+# --- IncrementalJSONValidator ---
+
+VALID_STREAMS = [
+    '{"moves": [], "llm_state": "x"}',
+    '```json\n{"llm_state": "x", "moves": [{"step": "1", "joint_move": "(a noop)"}]}\n```',
+    '  {"llm_state": "a \\"moves\\": {b}", "moves": []}',
+    '{"llm_state": "{\\"not\\": a key}"} trailing text is left to repair_json',
+    # Cut off: nothing is known to be wrong yet
+    '{"moves": [{"step": "1", "joint_',
+]
+
+INVALID_STREAMS = [
+    ("Here is the answer: {", "Prose before the opening brace"),
+    ('{"reasoning": "first', "Unknown key 'reasoning'"),
+    ('{"moves": "(a noop)"', "should start with ["),
+    ('{"llm_state": ["x"]', "should start with \""),
+    ('{moves: []}', "where a key was expected"),
+]
+
+
+def feed(text: str, chunk_size: int) -> IncrementalJSONValidator:
+    validator = IncrementalJSONValidator(LLMMultiStepGenResponse)
+    for i in range(0, len(text), chunk_size):
+        validator.feed(text[i:i + chunk_size])
+    return validator
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+@pytest.mark.parametrize("text", VALID_STREAMS)
+def test_validator_accepts(text, chunk_size):
+    feed(text, chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+@pytest.mark.parametrize("text, reason", INVALID_STREAMS)
+def test_validator_aborts(text, reason, chunk_size):
+    with pytest.raises(StreamAborted, match=re.escape(reason)):
+        feed(text, chunk_size)
+
+
+def test_validator_stops_at_the_closing_brace():
+    validator = feed('{"llm_state": "x"} {"unknown": 1}', 1)
+    assert validator.finished
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from llm_runner import MAX_QUOTA_WAIT, KeyPool, QuotaWaitExceeded, TokenBucket
+
+
+def test_bucket_refills_continuously_up_to_capacity():
+    bucket = TokenBucket(600)
+    start = bucket.updated
+    bucket.consume(600, now=start)
+    assert bucket.wait_time(300, now=start) == pytest.approx(30.0)
+    # 10 tokens per second
+    assert bucket.wait_time(300, now=start + 10) == pytest.approx(20.0)
+    assert bucket.wait_time(300, now=start + 60) == 0.0
+    # Amounts above capacity only wait for a full bucket
+    assert bucket.wait_time(10_000, now=start + 600) == 0.0
+    assert bucket.level == 600
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(None)
+    bucket.consume(10 ** 9, now=bucket.updated)
+    assert bucket.wait_time(10 ** 9, now=bucket.updated) == 0.0
+
+
+def test_requests_spread_over_keys(clock):
+    pool = KeyPool(["k1", "k2", "k3"], rpm=60)
+    assert [pool.reserve(1)[0] for _ in range(3)] == [0, 1, 2]
+    # Every key has served one request of its 60 per minute
+    assert pool.wait_time(1) == 0.0
+
+
+def test_request_goes_to_the_key_with_quota(clock):
+    pool = KeyPool(["k1", "k2"], tpm=6000)
+    assert pool.reserve(6000) == (0, 0.0)
+    # k1 is empty, k2 is full
+    assert pool.reserve(3000) == (1, 0.0)
+    key_index, delay = pool.reserve(6000)
+    assert key_index == 1
+    assert delay == pytest.approx(30.0)
+
+
+def test_wait_time_follows_the_refill(clock):
+    pool = KeyPool(["k1"], tpm=6000)
+    pool.reserve(6000)
+    assert pool.wait_time(3000) == pytest.approx(30.0)
+    clock.now += 20
+    assert pool.wait_time(3000) == pytest.approx(10.0)
+    clock.now += 10
+    assert pool.wait_time(3000) == 0.0
+
+
+def test_settle_returns_unused_tokens(clock):
+    pool = KeyPool(["k1"], tpm=6000)
+    key_index, _ = pool.reserve(6000)
+    pool.settle(key_index, 6000, 1500)
+    assert pool.wait_time(4500) == 0.0
+    assert pool.wait_time(6000) > 0
+
+
+def test_blocked_key_is_left_out(clock):
+    pool = KeyPool(["k1", "k2"], rpm=60)
+    pool.block(0, 30)
+    assert [pool.reserve(1)[0] for _ in range(2)] == [1, 1]
+    clock.now += 30
+    assert pool.reserve(1)[0] == 0
+
+
+def test_quota_wait_beyond_the_cap_raises_and_returns_the_booking(clock):
+    pool = KeyPool(["k1"], tpm=6000)
+    pool.reserve(6000)
+    token = MAX_QUOTA_WAIT.set(5.0)
+    try:
+        with pytest.raises(QuotaWaitExceeded):
+            pool.acquire(3000)
+    finally:
+        MAX_QUOTA_WAIT.reset(token)
+    # The cancelled booking does not push back the next request
+    assert pool.wait_time(3000) == pytest.approx(30.0)
+
+
+def test_quota_wait_within_the_cap_waits(clock, monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+    pool = KeyPool(["k1"], tpm=6000)
+    pool.reserve(6000)
+    token = MAX_QUOTA_WAIT.set(60.0)
+    try:
+        assert pool.acquire(3000) == 0
+    finally:
+        MAX_QUOTA_WAIT.reset(token)
+    assert slept == [pytest.approx(30.0)]
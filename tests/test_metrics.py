@@ -0,0 +1,115 @@
+import contextvars
+import json
+
+from llm_runner import Completion, LLMNextStateResponse, MetricsRecorder, RequestMetrics, RetryPolicy, percentile, set_request_context
+
+from fakes import ANSWER, FakePlayer
+
+
+class TimedPlayer(FakePlayer):
+    """Answers like a stream whose first token came after a quarter of a second."""
+    def _reply(self, prompt, response_model) -> Completion:
+        completion = super()._reply(prompt, response_model)
+        completion.ttft = 0.25
+        return completion
+
+
+def record(provider="p", game="g", outcome="ok", latency=1.0, **fields) -> RequestMetrics:
+    return RequestMetrics(provider=provider, model="m", game=game, experiment="e", outcome=outcome, latency=latency, **fields)
+
+
+def test_every_call_is_one_jsonl_line(tmp_path):
+    path = str(tmp_path / "metrics" / "requests.jsonl")
+    answers = iter(["not json", ANSWER, ANSWER])
+    player = TimedPlayer("metrics-lines", answer=lambda prompt: next(answers))
+    player.retry_policy = RetryPolicy(base_delay=0.0)
+    player.metrics = MetricsRecorder(path)
+
+    def run():
+        set_request_context("tictactoe", "next_state")
+        player._generate_json("prompt", LLMNextStateResponse)
+        player.fail = ConnectionError("connection reset")
+        player.max_attempts = 1
+        player._generate_json("prompt", LLMNextStateResponse)
+    contextvars.copy_context().run(run)
+
+    with open(path, 'r') as f:
+        retried, failed = [json.loads(line) for line in f]
+    assert (retried["provider"], retried["model"], retried["game"], retried["experiment"]) == ("fake", "metrics-lines", "tictactoe", "next_state")
+    assert (retried["outcome"], retried["attempts"], retried["failure_class"], retried["key_index"]) == ("ok", 2, "parse", 0)
+    assert retried["ttft"] == 0.25
+    assert (retried["prompt_tokens"], retried["completion_tokens"]) == (20, 20)
+    assert retried["latency"] >= 0
+    assert (failed["outcome"], failed["failure_class"], failed["ttft"]) == ("failed", "ConnectionError", None)
+    assert [r.outcome for r in player.metrics.records] == ["ok", "failed"]
+
+
+def test_percentiles_are_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert [percentile(values, q) for q in (50, 95, 99, 100)] == [50.0, 95.0, 99.0, 100.0]
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summary_reports_quantiles_and_throughput():
+    recorder = MetricsRecorder()
+    for latency in range(1, 101):
+        recorder.record(record(latency=float(latency), completion_tokens=101))
+    recorder.record(record(outcome="failed", latency=500.0, completion_tokens=1000, attempts=3, failure_class="timeout"))
+    recorder.record(record(outcome="cache_hit", latency=0.0))
+    recorder.record(record(provider="q", game=None, latency=2.0, completion_tokens=100, attempts=2, rate_limited=1))
+
+    lines = recorder.summary().splitlines()
+    # 100 answered calls plus the failed one; tokens/s only counts the calls that were answered
+    assert lines[1] == ("   p: 102 requests, p50/p95/p99 51.00s / 96.00s / 100.00s, 2 tok/s, "
+                        "1 failed, 2 retries, 0 rate limited, 1 cache hits")
+    assert lines[2].startswith("      g: 102 requests")
+    assert lines[3] == "   q: 1 requests, p50/p95/p99 2.00s / 2.00s / 2.00s, 50 tok/s, 0 failed, 1 retries, 1 rate limited, 0 cache hits"
+    assert lines[4].startswith("      -: 1 requests")
+    assert lines[5] == "   Failure classes: timeout=1"
+    assert MetricsRecorder().summary() == "⏱️ No requests recorded"
+
+
+def test_prometheus_text_format(tmp_path):
+    recorder = MetricsRecorder()
+    recorder.record(record(latency=1.0, ttft=0.5, prompt_tokens=10, completion_tokens=5, cached_tokens=4))
+    recorder.record(record(latency=3.0, attempts=2, failure_class="rate_limit", prompt_tokens=20, completion_tokens=7))
+    recorder.record(record(outcome="cache_hit", latency=0.0))
+    recorder.record(record(game='say "hi"\n', latency=2.0))
+
+    text = recorder.prometheus_text()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    labels = 'provider="p",model="m",game="g",experiment="e"'
+    for line in (
+        "# HELP llm_requests_total Generation calls by outcome.",
+        "# TYPE llm_requests_total counter",
+        f'llm_requests_total{{{labels},outcome="cache_hit"}} 1',
+        f'llm_requests_total{{{labels},outcome="ok"}} 2',
+        f'llm_tokens_total{{{labels},kind="prompt"}} 30',
+        f'llm_tokens_total{{{labels},kind="completion"}} 12',
+        f'llm_tokens_total{{{labels},kind="cached"}} 4',
+        f'llm_retries_total{{{labels}}} 1',
+        f'llm_failures_total{{{labels},failure_class="rate_limit"}} 1',
+        "# TYPE llm_request_latency_seconds summary",
+        # Cache hits are left out of the latencies
+        f'llm_request_latency_seconds{{{labels},quantile="0.5"}} 1.0000',
+        f'llm_request_latency_seconds{{{labels},quantile="0.99"}} 3.0000',
+        f'llm_request_latency_seconds_sum{{{labels}}} 4.0000',
+        f'llm_request_latency_seconds_count{{{labels}}} 2',
+        f'llm_time_to_first_token_seconds_count{{{labels}}} 1',
+        # Label values are escaped
+        'llm_requests_total{provider="p",model="m",game="say \\"hi\\"\\n",experiment="e",outcome="ok"} 1',
+    ):
+        assert line in lines
+    # Every sample line is a metric name, labels and a number
+    for line in lines:
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            float(value)
+            assert name.startswith("llm_") and name.endswith("}")
+
+    path = str(tmp_path / "llm.prom")
+    recorder.write_prometheus(path)
+    with open(path, 'r') as f:
+        assert f.read() == text
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import re
+
+from llm_runner import (
+    EvalSample, build_packed_prompt, prepare_sample_task, process_game_file, process_game_file_async, supports_packing
+)
+
+from fakes import TICTACTOE_GDL, FakePlayer, next_state_sample, read_output, write_samples
+
+
+def packing_player(model_name: str, drop=(), malformed=(), fail_packed: bool = False) -> FakePlayer:
+    """
+    Answers every case with the state of its own sample, so a mixed-up answer shows in the output.
+    Cases in `drop` are left out of packed answers and the ones in `malformed` lack their state.
+    """
+    def answer(prompt: str) -> str:
+        ids = re.findall(r"--- CASE (s\d+) ---", prompt)
+        if not ids:
+            step = re.search(r"\(step (\d+)\)", prompt).group(1)
+            return json.dumps({"llm_state": f"(answered alone {step})"})
+        if fail_packed:
+            return "not json"
+        results = [
+            {"sample_id": sample_id} if sample_id in malformed else {"sample_id": sample_id, "llm_state": f"(answered {sample_id})"}
+            for sample_id in ids if sample_id not in drop
+        ]
+        return json.dumps({"results": results})
+
+    player = FakePlayer(model_name, answer=answer)
+    player.output_format = "json"
+    player.max_attempts = 1
+    return player
+
+
+def run(tmp_path, player: FakePlayer, pack_size: int, samples: int = 4, max_samples: int = 4, asynchronous: bool = False) -> list:
+    samples_file = write_samples(str(tmp_path / "samples"), [next_state_sample(i) for i in range(samples)])
+    job = dict(
+        gdl_file_path=TICTACTOE_GDL, samples_file_path=samples_file, player=player, output_dir=str(tmp_path / "out"),
+        max_samples=max_samples, experiment_type="next_state", pack_size=pack_size
+    )
+    if asynchronous:
+        asyncio.run(process_game_file_async(**job))
+    else:
+        process_game_file(**job)
+    return [s["llm_state"] for s in read_output(str(tmp_path / "out"))]
+
+
+def cases(prompt: str) -> list:
+    return re.findall(r"--- CASE (s\d+) ---", prompt)
+
+
+def test_samples_are_packed_and_answers_matched_by_id(tmp_path):
+    player = packing_player("pack-basic")
+    assert run(tmp_path, player, pack_size=2) == [f"(answered s{i})" for i in range(4)]
+    assert [cases(prompt) for prompt, _, _ in player.requests] == [["s0", "s1"], ["s2", "s3"]]
+
+
+def test_async_packs_are_matched_by_id(tmp_path):
+    player = packing_player("pack-async")
+    assert run(tmp_path, player, pack_size=3, asynchronous=True) == [f"(answered s{i})" for i in range(4)]
+    assert sorted(len(cases(prompt)) for prompt, _, _ in player.requests) == [1, 3]
+
+
+def test_last_pack_only_holds_the_missing_samples(tmp_path):
+    player = packing_player("pack-short")
+    assert len(run(tmp_path, player, pack_size=2, samples=5, max_samples=3)) == 3
+    assert [cases(prompt) for prompt, _, _ in player.requests] == [["s0", "s1"], ["s2"]]
+
+
+def test_missing_and_malformed_items_are_retried_alone(tmp_path):
+    player = packing_player("pack-leftovers", drop={"s1"}, malformed={"s2"})
+    assert run(tmp_path, player, pack_size=4) == ["(answered s0)", "(answered alone 1)", "(answered alone 2)", "(answered s3)"]
+    assert player.sent == 3
+
+
+def test_failed_packed_request_falls_back_to_single_samples(tmp_path):
+    player = packing_player("pack-failed", fail_packed=True)
+    assert run(tmp_path, player, pack_size=2, asynchronous=True) == [f"(answered alone {i})" for i in range(4)]
+    assert player.sent == 2 + 4
+
+
+def test_packing_is_limited_to_single_answer_experiments():
+    assert supports_packing("next_state") and supports_packing("legal_moves")
+    assert not supports_packing("multi_step_prediction")
+
+
+def test_packed_prompt_lists_every_case_once():
+    tasks = [
+        prepare_sample_task(i, EvalSample(**next_state_sample(i)), "(role x)", "next_state") for i in (3, 7)
+    ]
+    prompt = build_packed_prompt("(role x)", "next_state", tasks)
+    assert cases(prompt) == ["s3", "s7"]
+    assert prompt.count("(role x)") == 1
+    assert "(step 3)" in prompt and "(step 7)" in prompt
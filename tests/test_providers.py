@@ -0,0 +1,68 @@
+import importlib.metadata
+import os
+import subprocess
+import sys
+
+import pytest
+
+from llm_runner import (
+    PLAYERS, PROVIDER_ENTRY_POINT_GROUP, BaseGamePlayer, _plugin_entry_points, available_providers, create_player, player_class
+)
+
+
+class PluginPlayer(BaseGamePlayer):
+    """Stands in for a player an installed package registers under the entry point group."""
+    provider_name = "myprovider"
+    api_key_required = False
+
+
+@pytest.fixture
+def plugins(monkeypatch):
+    """Registers entry points given as {name: "module:attribute"}."""
+    registered = {}
+
+    def entry_points(group=None):
+        return [importlib.metadata.EntryPoint(name, value, PROVIDER_ENTRY_POINT_GROUP) for name, value in registered.items()
+                if group == PROVIDER_ENTRY_POINT_GROUP]
+
+    monkeypatch.setattr(importlib.metadata, "entry_points", entry_points)
+    _plugin_entry_points.cache_clear()
+    yield registered
+    _plugin_entry_points.cache_clear()
+
+
+def test_importing_the_runner_leaves_provider_sdks_unloaded():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = (
+        "import sys; import llm_runner; "
+        "print(','.join(m for m in ('openai', 'google.genai', 'cerebras', 'cerebras.cloud.sdk') if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+
+def test_built_in_providers_come_first(plugins):
+    plugins.update(zzz="test_providers:PluginPlayer", gemini="test_providers:PluginPlayer", aaa="test_providers:PluginPlayer")
+    assert available_providers() == list(PLAYERS) + ["aaa", "zzz"]
+    # A plugin cannot replace a built-in player
+    assert player_class("gemini") is PLAYERS["gemini"]
+
+
+def test_plugin_resolves_to_its_player(plugins):
+    plugins["myprovider"] = "test_providers:PluginPlayer"
+    assert player_class("myprovider") is PluginPlayer
+    player = create_player("myprovider", "model", base_url="http://plugin.test")
+    assert isinstance(player, PluginPlayer)
+    assert player.model_name == "model"
+
+
+def test_plugin_that_is_not_a_player_is_rejected(plugins):
+    plugins["broken"] = "fakes:next_state_sample"
+    with pytest.raises(ValueError, match="not a BaseGamePlayer subclass"):
+        player_class("broken")
+
+
+def test_unknown_provider_is_rejected(plugins):
+    with pytest.raises(ValueError, match="Unknown provider"):
+        player_class("nope")
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_runner import CacheMissError, Completion, LLMLegalMovesResponse, LLMNextStateResponse, ResponseCache
+
+from fakes import ANSWER, FakePlayer
+
+
+def cached_player(tmp_path, mode: str = "readwrite", **kwargs) -> FakePlayer:
+    player = FakePlayer(**kwargs)
+    player.response_cache = ResponseCache(str(tmp_path / "cache.sqlite"), mode)
+    return player
+
+
+def completion(text: str = ANSWER) -> Completion:
+    return Completion(text=text, prompt_tokens=10, completion_tokens=10)
+
+
+def test_key_covers_provider_model_sampling_params_and_prompt():
+    base = ("fake", "model", dict(temperature=0.2), "prompt")
+    key = ResponseCache.make_key(*base)
+    assert ResponseCache.make_key("fake", "model", dict(temperature=0.2), "prompt") == key
+    variants = [
+        ("other", "model", dict(temperature=0.2), "prompt"),
+        ("fake", "other", dict(temperature=0.2), "prompt"),
+        ("fake", "model", dict(temperature=0.7), "prompt"),
+        ("fake", "model", dict(temperature=0.2), "prompt 2"),
+    ]
+    assert len({ResponseCache.make_key(*variant) for variant in variants} | {key}) == 5
+
+
+def test_key_ignores_the_order_of_sampling_params():
+    assert (ResponseCache.make_key("fake", "model", dict(temperature=0.2, top_p=0.9), "prompt")
+            == ResponseCache.make_key("fake", "model", dict(top_p=0.9, temperature=0.2), "prompt"))
+
+
+def test_repeated_prompt_is_answered_from_the_cache(tmp_path):
+    player = cached_player(tmp_path)
+    first = player._generate_json("prompt", LLMNextStateResponse)
+    second = player._generate_json("prompt", LLMNextStateResponse)
+    assert player.sent == 1
+    assert first.llm_state == second.llm_state == "(cell 1 1 x)"
+    player._generate_json("another prompt", LLMNextStateResponse)
+    assert player.sent == 2
+    assert (player.response_cache.hits, player.response_cache.misses) == (1, 2)
+
+
+def test_async_requests_share_the_cache(tmp_path):
+    player = cached_player(tmp_path)
+    player._generate_json("prompt", LLMNextStateResponse)
+    answer = asyncio.run(player._agenerate_json("prompt", LLMNextStateResponse))
+    assert answer.llm_state == "(cell 1 1 x)"
+    assert player.sent == 1
+
+
+def test_other_sampling_params_miss(tmp_path):
+    player = cached_player(tmp_path)
+    player._generate_json("prompt", LLMNextStateResponse)
+    player.sampling_params = dict(player.sampling_params, temperature=0.7)
+    player._generate_json("prompt", LLMNextStateResponse)
+    assert player.sent == 2
+
+
+def test_answer_of_another_model_is_discarded(tmp_path):
+    player = cached_player(tmp_path)
+    player._generate_json("prompt", LLMNextStateResponse)
+    player.answer = lambda prompt: '{"llm_legal_moves": "(mark 1 1)"}'
+    # The stored answer does not parse as legal moves, so the request goes out and replaces it
+    assert player._generate_json("prompt", LLMLegalMovesResponse).llm_legal_moves == "(mark 1 1)"
+    assert player.sent == 2
+    assert player._generate_json("prompt", LLMLegalMovesResponse).llm_legal_moves == "(mark 1 1)"
+    assert player.sent == 2
+
+
+def test_replay_serves_stored_answers_and_never_calls_the_provider(tmp_path):
+    cached_player(tmp_path)._generate_json("prompt", LLMNextStateResponse)
+    player = cached_player(tmp_path, mode="replay", fail=RuntimeError("provider called"))
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    with pytest.raises(CacheMissError):
+        player._generate_json("another prompt", LLMNextStateResponse)
+    assert player.sent == 0
+
+
+def test_replay_needs_an_existing_cache(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ResponseCache(str(tmp_path / "missing.sqlite"), "replay")
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ResponseCache(str(tmp_path / "cache.sqlite"), "write-only")
+
+
+def test_least_recently_used_entries_go_first(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=2 * len(ANSWER))
+    for key in ("a", "b", "c"):
+        cache.put(key, completion())
+        time.sleep(0.01)
+    cache.get("a")
+    cache.evict()
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_entries_past_the_age_limit_are_dropped_on_open(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path)
+    cache.put("old", completion())
+    cache.conn.execute("UPDATE responses SET created = ?", (time.time() - 3 * 86400,))
+    cache.conn.commit()
+    cache.put("new", completion())
+    cache.conn.close()
+
+    reopened = ResponseCache(path, max_age_days=1)
+    assert reopened.get("old") is None
+    assert reopened.get("new") is not None
@@ -0,0 +1,124 @@
+import os
+import json
+
+import pytest
+
+from result_store import (
+    LINE_ENDS_FILE, LINES_FILE, ROWS_FILE, TEXT_ENDS_FILE, TEXTS_FILE, ResultPartition, partition_path
+)
+
+COLUMNS = {"game_state": "str", "next_state": "str", "llm_state": "str"}
+
+
+def sample(i: int, llm_state: str = None) -> dict:
+    state = f"(cell 1 1 b)\n(step {i})"
+    return dict(game_state=state, next_state=f"(cell 1 1 x)\n(step {i + 1})", llm_state=llm_state or f"(step {i + 1})")
+
+
+def create(tmp_path, columns=COLUMNS, resume=False) -> ResultPartition:
+    return ResultPartition.create(partition_path(str(tmp_path), "game"), "game", "model", "next_state", columns, resume=resume)
+
+
+def test_round_trip_shares_lines_and_texts(tmp_path):
+    partition = create(tmp_path)
+    for i in range(3):
+        partition.append(i, sample(i))
+    partition.append(3, dict(game_state="(cell 1 1 b)\n(step 3)", next_state="(cell 1 1 x)\n(step 4)", llm_state=None))
+
+    reader = ResultPartition(partition.path)
+    samples = dict(reader.samples())
+    assert samples[1] == sample(1)
+    # Missing values are left out, as in the JSON output
+    assert samples[3] == dict(game_state="(cell 1 1 b)\n(step 3)", next_state="(cell 1 1 x)\n(step 4)")
+    # (cell 1 1 b), (cell 1 1 x) and (step 0..4) once each
+    assert len(reader.lines()) == 7
+
+
+def test_list_columns(tmp_path):
+    partition = create(tmp_path, {"moves": "list", "llm_state": "str"})
+    moves = [{"step": "1", "joint_move": "(a noop)"}, {"step": "2", "joint_move": "(a noop)"}]
+    partition.append(0, dict(moves=moves, llm_state=""))
+    assert list(ResultPartition(partition.path).samples()) == [(0, dict(moves=moves, llm_state=""))]
+
+
+def test_latest_record_wins(tmp_path):
+    partition = create(tmp_path)
+    partition.append(0, sample(0))
+    partition.append(1, sample(1, "(first answer)"))
+    partition.append(1, sample(1, "(second answer)"))
+
+    reader = ResultPartition(partition.path)
+    assert [row[0] for row in reader.rows()] == [0, 1]
+    assert dict(reader.samples())[1]["llm_state"] == "(second answer)"
+
+    arrays = reader.arrays()
+    # The raw log keeps the superseded record; `latest` selects what rows() returns
+    assert list(arrays["rows"]["index"]) == [0, 1, 1]
+    assert list(arrays["latest"]) == [0, 2]
+    assert [tuple(record) for record in arrays["rows"][arrays["latest"]]] == reader.rows()
+
+
+def _append_bytes(partition: ResultPartition, name: str, data: bytes):
+    with open(os.path.join(partition.path, name), 'ab') as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize("torn", [
+    # Cut off in the middle of a row record
+    {ROWS_FILE: b"\x05\x00"},
+    # Line bytes written, their end offset not
+    {LINES_FILE: b"(half a line"},
+    # An end offset pointing past the line bytes
+    {LINE_ENDS_FILE: (10_000).to_bytes(8, "little")},
+    # A text whose line IDs were only partly written
+    {TEXTS_FILE: b"\x01\x00\x00\x00", TEXT_ENDS_FILE: (10_000).to_bytes(8, "little")},
+])
+def test_recovery_from_an_interrupted_append(tmp_path, torn):
+    partition = create(tmp_path)
+    for i in range(2):
+        partition.append(i, sample(i))
+    for name, data in torn.items():
+        _append_bytes(partition, name, data)
+
+    # Readers ignore the partial data
+    assert dict(ResultPartition(partition.path).samples()) == {0: sample(0), 1: sample(1)}
+
+    # A resumed writer truncates it and appends cleanly after the last whole entry
+    resumed = create(tmp_path, resume=True)
+    resumed.append(2, sample(2, "(step 1)\n(new line)"))
+    assert dict(ResultPartition(partition.path).samples()) == {0: sample(0), 1: sample(1), 2: sample(2, "(step 1)\n(new line)")}
+
+
+def test_add_columns_widens_stored_rows(tmp_path):
+    partition = create(tmp_path, {"game_state": "str", "llm_state": "str"})
+    partition.append(0, dict(game_state="(a)", llm_state="(b)"))
+
+    widened = create(tmp_path, {"game_state": "str", "llm_state": "str", "repaired": "str"}, resume=True)
+    widened.append(1, dict(game_state="(a)", llm_state="(c)", repaired="closed 1 bracket"))
+
+    reader = ResultPartition(partition.path)
+    assert reader.columns == {"game_state": "str", "llm_state": "str", "repaired": "str"}
+    assert dict(reader.samples()) == {
+        0: dict(game_state="(a)", llm_state="(b)"),
+        1: dict(game_state="(a)", llm_state="(c)", repaired="closed 1 bracket")
+    }
+
+
+def test_changed_columns_start_over(tmp_path):
+    partition = create(tmp_path)
+    partition.append(0, sample(0))
+    restarted = create(tmp_path, {"game_state": "list", "llm_state": "str"}, resume=True)
+    assert list(restarted.samples()) == []
+
+
+def test_export_json(tmp_path):
+    partition = create(tmp_path)
+    partition.append(1, sample(1))
+    partition.append(0, sample(0))
+    partition.mark_complete(2)
+
+    path = ResultPartition(partition.path).export_json()
+    with open(path, 'r') as f:
+        data = json.load(f)
+    assert os.path.basename(path) == f"output_game_{partition.meta['experiment_id']}.json"
+    assert data == dict(game_name="game", llm_model="model", experiment_type="next_state", samples=[sample(0), sample(1)])
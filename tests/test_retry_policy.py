@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_runner import (
+    CircuitBreaker, CircuitOpenError, LLMNextStateResponse, QuotaWaitExceeded, RetryPolicy, is_endpoint_failure
+)
+
+from fakes import FakePlayer
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_backoff_is_jittered_below_the_exponential_cap():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for attempt in range(6):
+        delays = [policy.backoff(attempt) for _ in range(50)]
+        assert all(0 <= delay <= min(5.0, 2 ** attempt) for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_only_endpoint_failures_count():
+    assert is_endpoint_failure(ConnectionError("reset by peer"))
+    assert is_endpoint_failure(StatusError(503))
+    assert not is_endpoint_failure(StatusError(400))
+    assert not is_endpoint_failure(StatusError(429))
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("endpoint", threshold=3, cooldown=30)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_half_open_circuit_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("endpoint", threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert not breaker.is_open()
+    breaker.check()
+    # Everyone else waits for the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    # A failed probe opens the circuit for twice as long
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.is_open()
+    clock.now += 30
+    breaker.check()
+    breaker.record_success()
+    assert not breaker.is_open()
+    assert breaker.cooldown == 30
+
+
+def test_open_circuit_fails_fast_without_sending(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    player = FakePlayer("breaker-player", fail=ConnectionError("connection refused"))
+    player.retry_policy = RetryPolicy(breaker_threshold=2, breaker_cooldown=60)
+    player.max_attempts = 5
+    with pytest.raises(CircuitOpenError):
+        player._generate_json("prompt", LLMNextStateResponse)
+    assert player.sent == 2
+
+
+def test_bad_answers_keep_the_circuit_closed(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    player = FakePlayer("breaker-answers", answer=lambda prompt: "not json")
+    player.retry_policy = RetryPolicy(breaker_threshold=2)
+    player.max_attempts = 4
+    assert player._generate_json("prompt", LLMNextStateResponse) == ""
+    assert player.sent == 4
+    assert not player._circuit_breaker().is_open()
+
+
+class StallingPlayer(FakePlayer):
+    """The first request stalls until released (sync) or for a minute (async); later ones answer at once."""
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        self.retry_policy = RetryPolicy(hedge_quantile=0.5, hedge_min_samples=3)
+        self._latencies.extend([0.05] * 3)
+        self.release = threading.Event()
+        self.cancelled = False
+
+    def _complete(self, prompt, key_index, response_model=None):
+        self.sent += 1
+        if self.sent == 1:
+            self.release.wait(10)
+        return self._reply(prompt, response_model)
+
+    async def _acomplete(self, prompt, key_index, response_model=None):
+        self.sent += 1
+        if self.sent == 1:
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+        return self._reply(prompt, response_model)
+
+
+def test_stalled_request_is_hedged():
+    player = StallingPlayer("hedge-sync")
+    try:
+        started = time.monotonic()
+        assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+        assert time.monotonic() - started < 5
+        assert (player.usage.hedged, player.usage.hedge_wins) == (1, 1)
+    finally:
+        player.release.set()
+
+
+def test_stalled_async_request_is_hedged_and_cancelled():
+    player = StallingPlayer("hedge-async")
+
+    async def run():
+        return await asyncio.wait_for(player._agenerate_json("prompt", LLMNextStateResponse), 5)
+
+    assert asyncio.run(run()).llm_state == "(cell 1 1 x)"
+    assert (player.usage.hedged, player.usage.hedge_wins) == (1, 1)
+    assert player.cancelled
+
+
+def test_no_hedging_until_latencies_are_known():
+    player = FakePlayer("hedge-learning")
+    player.retry_policy = RetryPolicy(hedge_quantile=0.95, hedge_min_samples=3)
+    for _ in range(3):
+        assert player._hedge_delay() is None
+        player._generate_json("prompt", LLMNextStateResponse)
+    assert player._hedge_delay() is not None
+    assert player.usage.hedged == 0
+
+
+def half_open(player: FakePlayer) -> CircuitBreaker:
+    """Opens the player's circuit and lets its cooldown pass, so the next request is the probe."""
+    breaker = player._circuit_breaker()
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.cooldown
+    return breaker
+
+
+def test_probe_without_a_key_is_given_back(monkeypatch):
+    player = FakePlayer("probe-quota")
+    breaker = half_open(player)
+
+    def no_quota(tokens):
+        raise QuotaWaitExceeded("no key within the allowed wait")
+
+    monkeypatch.setattr(player.key_pool, "acquire", no_quota)
+    with pytest.raises(QuotaWaitExceeded):
+        player._generate_json("prompt", LLMNextStateResponse)
+    assert not breaker.probing
+
+    monkeypatch.undo()
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    assert player.sent == 1
+    assert not breaker.is_open()
+
+
+def test_cancelled_probe_is_given_back():
+    player = StallingPlayer("probe-cancelled")
+    player.retry_policy = RetryPolicy()
+    breaker = half_open(player)
+
+    async def run():
+        probe = asyncio.ensure_future(player._agenerate_json("prompt", LLMNextStateResponse))
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert not breaker.probing
+        return await player._agenerate_json("prompt", LLMNextStateResponse)
+
+    assert asyncio.run(run()).llm_state == "(cell 1 1 x)"
+    assert player.cancelled
+    assert not breaker.is_open()
+
+
+def test_probe_that_never_reports_is_given_up(clock):
+    breaker = CircuitBreaker("endpoint", threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.check()
+    clock.now += 10
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    clock.now += 20
+    assert breaker.check()
@@ -0,0 +1,109 @@
+import asyncio
+from types import SimpleNamespace
+
+from llm_runner import (
+    MAX_QUOTA_WAIT, LLMNextStateResponse, NvidiaGamePlayer, QuotaWaitExceeded, RetryPolicy, RoutedGamePlayer, parse_route
+)
+
+from fakes import FakePlayer
+
+PROMPT = "Predict the next state. " * 20
+
+
+def quota_player(name: str, refill_seconds: float) -> FakePlayer:
+    """A player whose one key has no quota left and gets enough for one planned request every `refill_seconds`."""
+    probe = FakePlayer(name)
+    player = FakePlayer(name, tpm=probe.planned_reservation(PROMPT) * 60 / refill_seconds)
+    player.key_pool.token_buckets[0].level = 0.0
+    return player
+
+
+def router(*backends) -> RoutedGamePlayer:
+    routed = RoutedGamePlayer("logical", list(backends))
+    routed.retry_policy = RetryPolicy(base_delay=0.0)
+    # The wait a backend showed when routed to is all it gets
+    routed.quota_wait_slack = 0.0
+    return routed
+
+
+def test_quota_wait_counts_the_planned_completion_budget():
+    backend = FakePlayer("a", tpm=60000)
+    # With no answers seen yet, requests are planned with the ceiling of 28192 completion tokens
+    assert backend.planned_reservation(PROMPT) > 28192
+    backend.key_pool.reserve(backend.planned_reservation(PROMPT))
+    backend.key_pool.reserve(backend.planned_reservation(PROMPT))
+    # Two reservations drained the bucket: the third has to wait for most of what it books to refill
+    assert RoutedGamePlayer._quota_wait(backend, PROMPT) > 20
+
+
+def test_budget_above_quota_waits_instead_of_rerouting():
+    backend = quota_player("a", refill_seconds=0.1)
+    response = router(backend)._generate_json(PROMPT, LLMNextStateResponse)
+    assert response.llm_state == "(cell 1 1 x)"
+    assert backend.entered == 1
+    assert backend.sent == 1
+
+
+def test_concurrent_requests_over_quota_do_not_spin():
+    backend = quota_player("a", refill_seconds=0.05)
+    routed = router(backend)
+
+    async def run():
+        return await asyncio.gather(*(routed._agenerate_json(PROMPT, LLMNextStateResponse) for _ in range(4)))
+
+    responses = asyncio.run(run())
+    assert [r.llm_state for r in responses] == ["(cell 1 1 x)"] * 4
+    # Each request is routed once, plus at most a few reroutes when another one took the quota first
+    assert backend.entered <= 4 + 4 * routed.max_quota_reroutes
+    assert backend.sent == 4
+
+
+def test_quota_reroutes_are_bounded():
+    backend = FakePlayer("a")
+    generate = backend._generate_json
+    capped = []
+
+    def generate_json(prompt, response_model):
+        # Never has quota within the wait it is allowed
+        capped.append(MAX_QUOTA_WAIT.get())
+        if MAX_QUOTA_WAIT.get() is not None:
+            raise QuotaWaitExceeded("no quota")
+        return generate(prompt, response_model)
+
+    backend._generate_json = generate_json
+    routed = router(backend)
+    response = routed._generate_json(PROMPT, LLMNextStateResponse)
+    assert response.llm_state == "(cell 1 1 x)"
+    # Routed anew max_quota_reroutes times, then sent without a cap on the wait
+    assert len(capped) == routed.max_quota_reroutes + 1
+    assert capped[-1] is None
+    # Lack of quota is not held against the backend
+    assert routed.stats["fake/a"].failed == 0
+
+
+def test_failed_attempt_is_routed_to_another_backend():
+    broken = FakePlayer("a", fail=ConnectionError("connection reset"))
+    healthy = FakePlayer("b")
+    routed = router(broken, healthy)
+    response = routed._generate_json(PROMPT, LLMNextStateResponse)
+    assert response._backend == "fake/b"
+    assert routed.stats["fake/a"].failed == 1
+    assert routed.stats["fake/b"].rerouted == 1
+
+
+def test_router_shares_settings_and_usage_with_backends():
+    a, b = FakePlayer("a"), FakePlayer("b")
+    routed = router(a, b)
+    routed.streaming = True
+    assert a.streaming and b.streaming
+    assert a.usage is routed.usage and b.usage is routed.usage
+    assert a.max_attempts == 1 and a.max_rate_limit_retries == 0
+    assert routed.max_concurrency == a.max_concurrency + b.max_concurrency
+    assert routed.api_keys == []
+
+
+def test_route_spec_names_the_nvidia_model_as_sent():
+    provider, model = parse_route("nvidia:meta/llama-3.3-70b-instruct", "llama-3.3-70b")
+    assert (provider, model) == ("nvidia", "meta/llama-3.3-70b-instruct")
+    assert NvidiaGamePlayer._model_id(SimpleNamespace(model_name=model)) == "meta/llama-3.3-70b-instruct"
+    assert NvidiaGamePlayer._model_id(SimpleNamespace(model_name="gpt-oss-120b")) == "openai/gpt-oss-120b"
@@ -0,0 +1,117 @@
+import io
+import json
+import os
+
+import pytest
+
+from llm_runner import JSONStream, LazyEvalData, SampleFileIndex, iter_raw_samples, load_game_inputs, scan_samples_file
+
+from fakes import TICTACTOE_GDL, next_state_sample, write_samples
+
+
+class CountingReader(io.StringIO):
+    """Text file that remembers how many characters were read from it."""
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.read_chars = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.read_chars += len(chunk)
+        return chunk
+
+
+DOCUMENT = {"game_name": "tictactoe", "samples": [next_state_sample(i) for i in range(200)], "score": 12345678}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 16])
+def test_values_match_json_load_at_any_chunk_size(chunk_size):
+    stream = JSONStream(io.StringIO(json.dumps(DOCUMENT, indent=2)), chunk_size=chunk_size)
+    read = {}
+    for key, value_stream in stream.object_items():
+        read[key] = list(value_stream.array_values()) if key == "samples" else value_stream.value()
+    assert read == DOCUMENT
+
+
+def test_reading_stops_with_the_caller():
+    text = json.dumps(DOCUMENT)
+    f = CountingReader(text)
+    for key, stream in JSONStream(f, chunk_size=256).object_items():
+        assert key == "game_name"
+        stream.value()
+        break
+    assert f.read_chars < len(text) / 10
+
+    f = CountingReader(text)
+    samples = []
+    for key, stream in JSONStream(f, chunk_size=256).object_items():
+        if key == "samples":
+            for sample in stream.array_values():
+                samples.append(sample)
+                if len(samples) == 3:
+                    break
+            break
+        stream.value()
+    assert samples == DOCUMENT["samples"][:3]
+    assert f.read_chars < len(text) / 10
+
+
+@pytest.mark.parametrize("text", ['["samples"]', '{"samples": [1, 2', '{"samples" [1]}', '{"samples": [1 2]}', ''])
+def test_malformed_documents_are_rejected(text):
+    with pytest.raises(ValueError):
+        for _, stream in JSONStream(io.StringIO(text), chunk_size=4).object_items():
+            list(stream.array_values())
+
+
+def test_samples_may_come_before_the_game_name(tmp_path):
+    path = str(tmp_path / "late_name.json")
+    with open(path, 'w') as f:
+        json.dump({"samples": [next_state_sample(0)], "game_name": "tictactoe"}, f)
+    assert list(iter_raw_samples(path)) == [next_state_sample(0)]
+    info = scan_samples_file(path)
+    assert (info.game_name, info.sample_count, info.sample_kind) == ("tictactoe", 1, "standard")
+
+
+def test_scan_reports_kind_count_and_errors(tmp_path):
+    path = write_samples(str(tmp_path), [dict(game_state="(cell 1 1 b)", moves=[])] * 3)
+    info = scan_samples_file(path)
+    assert (info.sample_count, info.sample_kind, info.error) == (3, "multi_step", None)
+
+    broken = str(tmp_path / "broken.json")
+    with open(broken, 'w') as f:
+        f.write('{"game_name": "tictactoe", "samples": [{"game_state": ')
+    assert scan_samples_file(broken).error
+    assert load_game_inputs(TICTACTOE_GDL, broken) is None
+
+
+def test_invalid_samples_are_skipped_keeping_file_indices(tmp_path):
+    path = write_samples(str(tmp_path), [next_state_sample(0), {"move": "(noop)"}, next_state_sample(2)])
+    eval_data = LazyEvalData(path, scan_samples_file(path))
+    assert [i for i, _ in eval_data.indexed_samples()] == [0, 2]
+
+
+def test_index_rescans_only_changed_files(tmp_path, monkeypatch):
+    samples_dir = str(tmp_path)
+    path = write_samples(samples_dir, [next_state_sample(0)])
+    SampleFileIndex(samples_dir).refresh(["tictactoe.json"])
+
+    scanned = []
+    monkeypatch.setattr("llm_runner.scan_samples_file", lambda p: scanned.append(p) or scan_samples_file(p))
+    index = SampleFileIndex(samples_dir)
+    assert index.info("tictactoe.json").sample_count == 1
+    assert scanned == []
+
+    # Touched but unchanged: rescanned once, and the stored entry is kept
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert index.info("tictactoe.json").sample_count == 1
+    write_samples(samples_dir, [next_state_sample(0), next_state_sample(1)])
+    assert index.info("tictactoe.json").sample_count == 2
+    assert len(scanned) == 2
+
+
+def test_index_drops_files_that_are_gone(tmp_path):
+    write_samples(str(tmp_path), [next_state_sample(0)])
+    write_samples(str(tmp_path), [next_state_sample(0)], game_name="other")
+    SampleFileIndex(str(tmp_path)).refresh(["tictactoe.json", "other.json"])
+    SampleFileIndex(str(tmp_path)).refresh(["other.json"])
+    assert list(SampleFileIndex(str(tmp_path)).entries) == ["other.json"]
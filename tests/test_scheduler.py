@@ -0,0 +1,111 @@
+import os
+import time
+
+import pytest
+
+from scheduler import MatrixRun, MatrixScheduler, ProviderLimits, RunMatrix, WorkQueue, WorkUnit, expand_matrix
+
+from conftest import DATA_DIR
+from fakes import next_state_sample, write_samples
+
+
+def unit(name: str) -> WorkUnit:
+    return WorkUnit(unit_id=name, provider="local", model="model", experiment="next_state", game=name, job={})
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue"), lease=60)
+    queue.enqueue([unit("a"), unit("b")])
+    return queue
+
+
+def expire_claim(queue: WorkQueue, unit_id: str):
+    """Ages the claim's heartbeat past the lease."""
+    old = time.time() - 2 * queue.lease
+    os.utime(os.path.join(queue.queue_dir, "claims", unit_id + ".lock"), (old, old))
+
+
+def test_units_are_claimed_once(queue):
+    first = queue.claim("w1")
+    second = queue.claim("w2")
+    assert {first.unit_id, second.unit_id} == {"a", "b"}
+    assert queue.claim("w3") is None
+    assert queue.claim_owner(first.unit_id) == "w1"
+
+
+def test_enqueue_skips_queued_and_done_units(queue):
+    queue.complete(queue.claim("w1", lambda u: u.unit_id == "a"), "w1", 1.0)
+    assert queue.enqueue([unit("a"), unit("b"), unit("c")]) == 1
+    assert [u.unit_id for u in queue.open_units()] == ["b", "c"]
+
+
+def test_done_units_are_not_claimed_again(queue):
+    claimed = queue.claim("w1")
+    queue.complete(claimed, "w1", 1.0)
+    assert queue.claim_owner(claimed.unit_id) is None
+    assert queue.claim("w2").unit_id != claimed.unit_id
+    assert queue.claim("w2") is None
+
+
+def test_abandoned_claim_is_taken_over(queue):
+    claimed = queue.claim("w1", lambda u: u.unit_id == "a")
+    assert queue.claim("w2", lambda u: u.unit_id == "a") is None
+    expire_claim(queue, "a")
+    taken = queue.claim("w2", lambda u: u.unit_id == "a")
+    assert taken.unit_id == claimed.unit_id
+    assert queue.claim_owner("a") == "w2"
+
+
+def test_heartbeat_keeps_the_claim(queue):
+    queue.claim("w1", lambda u: u.unit_id == "a")
+    expire_claim(queue, "a")
+    queue.heartbeat(unit("a"), "w1")
+    assert queue.claim("w2", lambda u: u.unit_id == "a") is None
+
+
+def test_stale_owner_does_not_touch_the_new_claim(queue):
+    queue.claim("w1", lambda u: u.unit_id == "a")
+    expire_claim(queue, "a")
+    queue.claim("w2", lambda u: u.unit_id == "a")
+    expire_claim(queue, "a")
+
+    # The worker that lost the unit neither keeps the claim alive nor drops it
+    queue.heartbeat(unit("a"), "w1")
+    queue.release(unit("a"), "w1")
+    assert queue.claim_owner("a") == "w2"
+    assert queue.claim("w3", lambda u: u.unit_id == "a").unit_id == "a"
+
+
+def test_release_reopens_the_unit(queue):
+    claimed = queue.claim("w1")
+    queue.release(claimed, "w1")
+    assert claimed.unit_id in [u.unit_id for u in queue.open_units()]
+
+
+def test_withdrawn_units_are_not_claimed(queue):
+    queue.withdraw("a")
+    assert [u.unit_id for u in queue.open_units()] == ["b"]
+
+
+def test_expand_matrix_makes_one_unit_per_game_and_configuration(tmp_path):
+    samples_dir = str(tmp_path / "data" / "next_state" / "samples")
+    write_samples(samples_dir, [next_state_sample(0)])
+    matrix = RunMatrix(
+        gdl_dir=DATA_DIR, samples_dir=samples_dir, games=["tictactoe"],
+        runs=[MatrixRun(provider="local", models=["m1", "m2"], experiments=["next_state"])]
+    )
+    units = expand_matrix(matrix)
+    assert [u.unit_id for u in units] == ["local__m1__next_state__tictactoe", "local__m2__next_state__tictactoe"]
+    assert units[0].job["output_dir"] != units[1].job["output_dir"]
+
+
+def test_provider_limits_reach_the_player(tmp_path):
+    matrix = RunMatrix(
+        gdl_dir=DATA_DIR, runs=[],
+        providers={"local": ProviderLimits(concurrency=3, rpm=60, base_url="http://10.0.0.5:8080/v1")}
+    )
+    scheduler = MatrixScheduler(matrix, WorkQueue(str(tmp_path / "queue")))
+    options = scheduler._backend_options("local")
+    assert options["base_url"] == "http://10.0.0.5:8080/v1"
+    assert (options["max_concurrency"], options["rpm"]) == (3, 60)
@@ -0,0 +1,112 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from conftest import DATA_DIR
+from result_store import ResultPartition, partition_path
+from scorer import score_results, sample_metrics
+
+EMPTY = "(cell 1 1 b)\n(cell 1 2 b)\n(control xplayer)"
+AFTER_MARK = "(cell 1 1 x)\n(cell 1 2 b)\n(control oplayer)"
+
+NEXT_STATE_SAMPLES = [
+    # Exact, in another order and with `true` wrappers
+    dict(game_state=EMPTY, move="(xplayer (mark 1 1)) (oplayer noop)", next_state=AFTER_MARK,
+         llm_state="(true (control oplayer))\n(true (cell 1 2 b))\n(true (cell 1 1 x))"),
+    # 2 of 3 facts, one wrong
+    dict(game_state=EMPTY, move="(xplayer (mark 1 1)) (oplayer noop)", next_state=AFTER_MARK,
+         llm_state="(cell 1 1 x)\n(cell 1 2 b)\n(control xplayer)"),
+]
+
+GENERATION_SAMPLES = [
+    # Legal, and the predicted state is right
+    dict(moves=[{"step": "1", "joint_move": "(xplayer (mark 1 1)) (oplayer noop)"}],
+         llm_state="(cell 1 1 x)\n(cell 1 2 b)\n(cell 1 3 b)\n(cell 2 1 b)\n(cell 2 2 b)\n(cell 2 3 b)\n"
+                   "(cell 3 1 b)\n(cell 3 2 b)\n(cell 3 3 b)\n(control oplayer)"),
+    # oplayer moves out of turn: fails outright, however the state is predicted
+    dict(moves=[{"step": "1", "joint_move": "(xplayer noop) (oplayer (mark 1 1))"}], llm_state=""),
+]
+
+
+def write_output(results_dir: str, experiment: str, game: str, samples: list) -> str:
+    output_dir = os.path.join(results_dir, experiment, "model")
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"output_{game}_2025-01-01_000000.json")
+    with open(path, 'w') as f:
+        json.dump(dict(game_name=game, llm_model="model", experiment_type=experiment, samples=samples), f)
+    return path
+
+
+def write_partition(results_dir: str, experiment: str, game: str, samples: list, columns: dict):
+    output_dir = os.path.join(results_dir, experiment, "model")
+    partition = ResultPartition.create(partition_path(output_dir, game), game, "model", experiment, columns)
+    for i, sample in enumerate(samples):
+        partition.append(i, sample)
+    partition.mark_complete(len(samples))
+
+
+def metrics_of(rows: list) -> dict:
+    return {(row["experiment"], row["game"]): {name: round(row[name], 4) for name in ("samples", "exact", "precision", "recall", "jaccard")} for row in rows}
+
+
+def test_sample_metrics_edge_cases():
+    # (predicted size, truth size, common)
+    counts = np.array([[0, 0, 0], [2, 0, 0], [0, 2, 0], [2, 2, 2], [2, 2, 1]])
+    metrics = sample_metrics(counts, invalid=np.array([False, False, False, False, True]))
+    assert list(metrics["exact"]) == [1, 0, 0, 1, 0]
+    assert list(metrics["precision"]) == [1, 0, 0, 1, 0]
+    assert list(metrics["recall"]) == [1, 1, 0, 1, 0]
+    assert list(metrics["jaccard"]) == [1, 0, 0, 1, 0]
+
+
+def test_next_state_scores(tmp_path):
+    write_output(str(tmp_path), "next_state", "game", NEXT_STATE_SAMPLES)
+    rows = score_results(str(tmp_path), cache_path=None)
+    assert metrics_of(rows) == {("next_state", "game"): dict(samples=2, exact=0.5, precision=0.8333, recall=0.8333, jaccard=0.75)}
+
+
+def test_partitions_score_like_json_files(tmp_path):
+    json_dir, store_dir = str(tmp_path / "json"), str(tmp_path / "store")
+    legal = [dict(game_state=EMPTY, legal_moves="(xplayer (mark 1 1))\n(xplayer (mark 1 2))\n(oplayer noop)",
+                  llm_legal_moves="(legal xplayer (mark 1 1))\n(oplayer noop)")]
+    write_output(json_dir, "next_state", "game", NEXT_STATE_SAMPLES)
+    write_output(json_dir, "legal_moves", "game", legal)
+    write_output(json_dir, "multi_step_generation", "tictactoe", GENERATION_SAMPLES)
+    write_partition(store_dir, "next_state", "game", NEXT_STATE_SAMPLES, {"game_state": "str", "move": "str", "next_state": "str", "llm_state": "str"})
+    write_partition(store_dir, "legal_moves", "game", legal, {"game_state": "str", "legal_moves": "str", "llm_legal_moves": "str"})
+    write_partition(store_dir, "multi_step_generation", "tictactoe", GENERATION_SAMPLES, {"moves": "list", "llm_state": "str"})
+
+    from_json = metrics_of(score_results(json_dir, DATA_DIR, cache_path=None))
+    from_store = metrics_of(score_results(store_dir, DATA_DIR, cache_path=None))
+    assert from_json == from_store
+    assert from_json[("legal_moves", "game")]["recall"] == pytest.approx(0.6667)
+
+
+def test_illegal_generated_moves_score_zero(tmp_path):
+    write_output(str(tmp_path), "multi_step_generation", "tictactoe", GENERATION_SAMPLES)
+    rows = score_results(str(tmp_path), DATA_DIR, cache_path=None)
+    assert metrics_of(rows) == {("multi_step_generation", "tictactoe"): dict(samples=2, exact=0.5, precision=0.5, recall=0.5, jaccard=0.5)}
+
+
+def test_unreplayable_dataset_moves_are_dropped(tmp_path):
+    write_output(str(tmp_path), "multi_step_prediction", "tictactoe", GENERATION_SAMPLES)
+    rows = score_results(str(tmp_path), DATA_DIR, cache_path=None)
+    # The rejected sequence has no ground truth and is not counted
+    assert metrics_of(rows) == {("multi_step_prediction", "tictactoe"): dict(samples=1, exact=1.0, precision=1.0, recall=1.0, jaccard=1.0)}
+
+
+def test_multi_step_without_gdl_is_skipped(tmp_path):
+    write_output(str(tmp_path), "multi_step_generation", "tictactoe", GENERATION_SAMPLES)
+    assert score_results(str(tmp_path), None, cache_path=None)[0]["samples"] == 0
+
+
+def test_score_cache_keeps_invalid_rows(tmp_path):
+    results_dir = str(tmp_path / "results")
+    write_output(results_dir, "multi_step_generation", "tictactoe", GENERATION_SAMPLES)
+    cache_path = str(tmp_path / "cache.json")
+    first = score_results(results_dir, DATA_DIR, cache_path)
+    # The second run reads the cache only: the rules are not even needed
+    second = score_results(results_dir, None, cache_path)
+    assert first == second
@@ -0,0 +1,141 @@
+import asyncio
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+from scheduler import RunMatrix, WorkQueue
+from service import EvaluationService, JobRequest, JobStore, ServiceClient, ServiceScheduler, serve
+
+from conftest import DATA_DIR
+from fakes import next_state_sample, write_samples
+
+
+@pytest.fixture
+def service(tmp_path):
+    write_samples(str(tmp_path / "data" / "next_state" / "samples"), [next_state_sample(i) for i in range(2)])
+    write_samples(str(tmp_path / "data" / "next_state" / "samples"), [next_state_sample(i) for i in range(2)], game_name="other")
+    matrix = RunMatrix(gdl_dir=DATA_DIR, samples_dir=str(tmp_path / "data" / "next_state" / "samples"), games=["tictactoe"], runs=[])
+    queue = WorkQueue(str(tmp_path / "queue"), lease=60)
+    jobs = JobStore(str(tmp_path / "queue"))
+    return EvaluationService(matrix, queue, jobs, ServiceScheduler(matrix, queue, jobs))
+
+
+@pytest.fixture
+def api(service):
+    httpd = serve(service, 0, None)
+    yield ServiceClient(f"http://127.0.0.1:{httpd.server_address[1]}")
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def submit(service) -> str:
+    return service.submit(JobRequest(provider="local", model="model", experiment="next_state")).job_id
+
+
+def test_submit_queues_one_unit_per_game(service):
+    record = service.jobs.get(submit(service))
+    assert record.state == "queued"
+    [unit_id] = record.units
+    assert unit_id.startswith(record.job_id) and unit_id.endswith("tictactoe")
+    assert [unit.unit_id for unit in service.queue.open_units()] == [unit_id]
+
+
+def test_cancel_withdraws_queued_units(service):
+    job_id = submit(service)
+    record = service.cancel(job_id)
+    assert record.state == "cancelled"
+    assert set(record.units.values()) == {"cancelled"}
+    assert service.queue.open_units() == []
+    # Cancelling again changes nothing
+    assert service.cancel(job_id).state == "cancelled"
+
+
+def test_recover_withdraws_units_of_jobs_cancelled_earlier(service, tmp_path):
+    job_id = submit(service)
+    # Cancelled by a service that still left the units in the queue
+    service.jobs.update(job_id, lambda record: setattr(record, "state", "cancelled"))
+    assert service.queue.open_units()
+
+    JobStore(str(tmp_path / "queue")).recover(service.queue)
+    assert service.queue.open_units() == []
+
+
+def test_recover_requeues_running_units(service, tmp_path):
+    job_id = submit(service)
+    [unit_id] = service.jobs.get(job_id).units
+
+    def start(record):
+        record.state = "running"
+        record.units[unit_id] = "running"
+    service.jobs.update(job_id, start)
+
+    jobs = JobStore(str(tmp_path / "queue"))
+    jobs.recover(service.queue)
+    record = jobs.get(job_id)
+    assert record.state == "queued"
+    assert record.units[unit_id] == "queued"
+
+
+def test_recover_counts_samples_from_the_event_log(service, tmp_path):
+    job_id = submit(service)
+    service.jobs.update(job_id, lambda record: setattr(record, "state", "running"))
+    # A unit reported three samples, but the service stopped before their counts were saved
+    for index, status in enumerate(["ok", "ok", "failed"]):
+        service.jobs.event(job_id, "sample", game="tictactoe", index=index, status=status)
+    with open(service.jobs.events_path(job_id), 'a') as f:
+        f.write('{"event": "sample", "status": "o')
+
+    jobs = JobStore(str(tmp_path / "queue"))
+    assert jobs.get(job_id).samples_ok == 0
+    jobs.recover(service.queue)
+    record = jobs.get(job_id)
+    assert (record.samples_ok, record.samples_failed) == (2, 1)
+    assert JobStore(str(tmp_path / "queue")).get(job_id).samples_ok == 2
+
+
+def test_events_wait_for_a_line_being_written(service, api):
+    job_id = submit(service)
+    path = service.jobs.events_path(job_id)
+    with open(path, 'a') as f:
+        f.write('{"event": "unit_started", "game": "tict')
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(api.events(job_id, since=1)))
+    reader.start()
+    time.sleep(0.4)
+    with open(path, 'a') as f:
+        f.write('actoe"}\n')
+    time.sleep(0.4)
+    service.cancel(job_id)
+    reader.join(5)
+
+    assert [event["event"] for event in received] == ["unit_started", "job_finished"]
+    assert received[0]["game"] == "tictactoe"
+
+
+def test_malformed_since_is_a_bad_request(service, api):
+    job_id = submit(service)
+    connection = http.client.HTTPConnection(api.url.hostname, api.url.port)
+    connection.request("GET", f"/jobs/{job_id}/events?since=abc&follow=0")
+    response = connection.getresponse()
+    assert response.status == 400
+    assert "since" in json.loads(response.read())["error"]
+    connection.close()
+    assert [event["event"] for event in api.events(job_id, since=0, follow=False)] == ["submitted"]
+
+
+def test_status_reads_players_on_the_event_loop(service):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        service.scheduler._loop = loop
+        assert service.scheduler.on_loop(threading.current_thread) is thread
+        status = service.status()
+        assert status["players"] == [] and status["jobs"] == {}
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
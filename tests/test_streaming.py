@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from llm_runner import Completion, LLMNextStateResponse, RetryPolicy
+
+from fakes import ANSWER, FakePlayer
+
+GOOD_CHUNKS = ['{"llm_', 'state": "(cell', ' 1 1 x)"', '}']
+
+
+class StreamingPlayer(FakePlayer):
+    """Streams its answers in the given chunks; usage comes with the last one."""
+    def __init__(self, model_name: str, streams: list):
+        super().__init__(model_name)
+        self.streaming = True
+        self.retry_policy = RetryPolicy(base_delay=0.0)
+        self.streams = list(streams)
+        self.pulled = []
+        self.closed = 0
+
+    def _chunks(self):
+        chunks = self.streams.pop(0)
+        self.pulled.append(0)
+        try:
+            for i, text in enumerate(chunks):
+                self.pulled[-1] += 1
+                last = i == len(chunks) - 1
+                yield Completion(text=text, prompt_tokens=10 if last else 0, completion_tokens=len(chunks) if last else 0)
+        finally:
+            self.closed += 1
+
+    def _stream_chunks(self, prompt, key_index, response_model=None):
+        self.sent += 1
+        return self._chunks()
+
+    async def _astream_chunks(self, prompt, key_index, response_model=None):
+        self.sent += 1
+        for chunk in self._chunks():
+            yield chunk
+
+
+def test_streamed_answer_is_parsed():
+    player = StreamingPlayer("stream-ok", [GOOD_CHUNKS])
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    assert player.pulled == [4]
+    assert player.usage.aborted_streams == 0
+
+
+def test_prose_stops_the_stream_at_the_first_chunk():
+    prose = ["Sure! Here is", " the next state:", " " + ANSWER]
+    player = StreamingPlayer("stream-prose", [prose, GOOD_CHUNKS])
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    # The rest of the rejected stream was never read, and the generator was closed
+    assert player.pulled == [1, 4]
+    assert player.closed == 2
+    assert player.usage.aborted_streams == 1
+
+
+def test_unknown_key_and_wrong_value_kind_abort_early():
+    unknown_key = ['{"next_', 'state": "(cell 1 1 x)"}']
+    wrong_kind = ['{"llm_state": ', '["(cell 1 1 x)"]', '}']
+    player = StreamingPlayer("stream-schema", [unknown_key, wrong_kind, GOOD_CHUNKS])
+    player.max_attempts = 3
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    assert player.pulled == [2, 2, 4]
+    assert player.usage.aborted_streams == 2
+
+
+def test_aborted_streams_do_not_open_the_circuit():
+    prose = ["I think", " " + ANSWER]
+    player = StreamingPlayer("stream-breaker", [prose] * 6 + [GOOD_CHUNKS])
+    player.retry_policy = RetryPolicy(base_delay=0.0, breaker_threshold=2)
+    player.max_attempts = 7
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    assert not player._circuit_breaker().is_open()
+
+
+def test_async_stream_is_aborted_and_retried():
+    fenced = ["```json\n", '{"llm_state": "(cell 1 1 x)"}', "\n```"]
+    player = StreamingPlayer("stream-async", [["Answer:", json.dumps({"llm_state": "x"})], fenced])
+
+    answer = asyncio.run(player._agenerate_json("prompt", LLMNextStateResponse))
+    assert answer.llm_state == "(cell 1 1 x)"
+    assert player.pulled == [1, 3]
+    assert player.closed == 2
+    assert player.usage.aborted_streams == 1
@@ -0,0 +1,143 @@
+import asyncio
+import json
+from typing import Dict, List
+
+import pytest
+from pydantic import BaseModel
+
+from llm_runner import (
+    Completion, LLMMultiStepGenResponse, LLMNextStateResponse, RetryPolicy, classify_failure, is_endpoint_failure,
+    is_structured_output_rejected, structured_output_schema
+)
+
+from fakes import ANSWER, FakePlayer
+
+SCHEMA_ERROR = "Error code: 400 - {'error': {'message': \"Invalid parameter: 'response_format' of type 'json_schema' is not supported\"}}"
+
+
+class FreeFormResponse(BaseModel):
+    llm_state: str
+    scores: Dict[str, int]
+
+
+class NestedResponse(BaseModel):
+    moves: List[LLMNextStateResponse]
+
+
+def test_declared_objects_are_closed():
+    schema, strict = structured_output_schema(LLMMultiStepGenResponse)
+    assert strict
+    assert schema["additionalProperties"] is False
+    # Nested models are closed as well
+    assert all(definition["additionalProperties"] is False for definition in schema["$defs"].values())
+    assert set(schema["required"]) == {"moves", "llm_state"}
+
+    schema, strict = structured_output_schema(NestedResponse)
+    assert strict and schema["$defs"]["LLMNextStateResponse"]["additionalProperties"] is False
+
+
+def test_free_form_objects_rule_out_strict_mode():
+    schema, strict = structured_output_schema(FreeFormResponse)
+    assert not strict
+    assert schema["additionalProperties"] is False
+    # The free-form object keeps its value schema
+    assert schema["properties"]["scores"]["additionalProperties"] == {"type": "integer"}
+
+
+def test_schema_is_built_once_per_model():
+    assert structured_output_schema(LLMNextStateResponse) is structured_output_schema(LLMNextStateResponse)
+
+
+def test_response_format_carries_the_schema():
+    player = FakePlayer("schema-format")
+    body = player.batch_body("prompt", LLMNextStateResponse)
+    assert body["response_format"]["type"] == "json_schema"
+    assert body["response_format"]["json_schema"] == {
+        "name": "LLMNextStateResponse", "schema": structured_output_schema(LLMNextStateResponse)[0], "strict": True
+    }
+    assert not player.batch_body("prompt", FreeFormResponse)["response_format"]["json_schema"]["strict"]
+
+    player.structured_output = False
+    assert "response_format" not in player.batch_body("prompt", LLMNextStateResponse)
+
+
+def test_chat_completions_requests_send_the_response_format():
+    pytest.importorskip("openai")
+    from llm_runner import OpenAICompatibleGamePlayer
+
+    player = OpenAICompatibleGamePlayer("model", [], base_url="http://schema-params.test/v1")
+    params = player._request_params("prompt", response_model=LLMNextStateResponse)
+    assert params["response_format"]["json_schema"]["name"] == "LLMNextStateResponse"
+    assert "response_format" not in player._request_params("prompt")
+
+
+def test_schema_rejections_are_recognized():
+    assert is_structured_output_rejected(Exception(SCHEMA_ERROR))
+    assert is_structured_output_rejected(Exception("400 Bad Request: response_schema is not supported for this model"))
+    assert not is_structured_output_rejected(Exception("400 Bad Request: messages must not be empty"))
+    assert classify_failure(Exception(SCHEMA_ERROR)) == "schema_rejected"
+    # The endpoint itself is fine
+    assert not is_endpoint_failure(Exception(SCHEMA_ERROR))
+
+
+class SchemaRejectingPlayer(FakePlayer):
+    """Rejects requests with a response schema; without one, answers inside a markdown fence."""
+    def __init__(self, model_name: str):
+        super().__init__(model_name, answer=lambda prompt: f"```json\n{ANSWER}\n```")
+        self.retry_policy = RetryPolicy(base_delay=0.0)
+        self.max_attempts = 1
+        self.with_schema = 0
+
+    def _reply(self, prompt, response_model) -> Completion:
+        if self.structured_output:
+            self.with_schema += 1
+            self.sent += 1
+            raise Exception(SCHEMA_ERROR)
+        return super()._reply(prompt, response_model)
+
+
+def test_rejected_schema_falls_back_to_prompt_only_json():
+    player = SchemaRejectingPlayer("schema-rejected")
+    # The fallback does not use up the only attempt, and the fenced answer is cleaned before parsing
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    assert not player.structured_output
+    assert player._generate_json("prompt", LLMNextStateResponse).llm_state == "(cell 1 1 x)"
+    assert (player.with_schema, player.sent) == (1, 3)
+    assert player.usage.parse_failures == 0
+
+
+def test_async_rejected_schema_falls_back_to_prompt_only_json():
+    player = SchemaRejectingPlayer("schema-rejected-async")
+    assert asyncio.run(player._agenerate_json("prompt", LLMNextStateResponse)).llm_state == "(cell 1 1 x)"
+    assert not player.structured_output
+
+
+def test_other_bad_requests_keep_the_schema():
+    player = FakePlayer("schema-kept", fail=Exception("400 Bad Request: messages must not be empty"))
+    player.max_attempts = 1
+    assert player._generate_json("prompt", LLMNextStateResponse) == ""
+    assert player.structured_output
+
+
+def test_parse_failures_are_counted_per_player():
+    answers = iter(["Sure, here it is", '{"llm_state": "(cell 1 1 x)",}', ANSWER])
+    flaky = FakePlayer("parse-flaky", answer=lambda prompt: next(answers))
+    flaky.retry_policy = RetryPolicy(base_delay=0.0)
+    flaky.max_attempts = 2
+    steady = FakePlayer("parse-steady")
+    for _ in range(2):
+        flaky._generate_json("prompt", LLMNextStateResponse)
+        steady._generate_json("prompt", LLMNextStateResponse)
+
+    # Prose fails; the trailing comma is repaired; the last answer parses as it is
+    assert (flaky.usage.parsed, flaky.usage.parse_failures, flaky.usage.repaired) == (3, 1, 1)
+    assert (steady.usage.parsed, steady.usage.parse_failures, steady.usage.repaired) == (2, 0, 0)
+    assert "Parse failures: 1/3 completions (33.3%), 1 repaired" in flaky.usage.summary("fake")
+
+
+def test_multi_step_answer_fits_its_schema():
+    answer = json.dumps({"moves": [{"step": "1", "joint_move": "(mark 1 1)"}], "llm_state": "(cell 1 1 x)"})
+    player = FakePlayer("schema-multi-step", answer=lambda prompt: answer)
+    response = player._generate_json("prompt", LLMMultiStepGenResponse)
+    assert response.moves[0].joint_move == "(mark 1 1)"
+    assert player.requests[0][1] is LLMMultiStepGenResponse
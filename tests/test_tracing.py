@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import tracing
+from tracing import SamplingProfiler, Tracer, load_trace, phase_table, span, tags, tracing_session
+
+
+@pytest.fixture(autouse=True)
+def no_tags():
+    """Tags set by earlier tests stay on the main thread; each test starts without any."""
+    token = tracing._TAGS.set({})
+    yield
+    tracing._TAGS.reset(token)
+
+
+def spans(events: list) -> list:
+    return [event for event in events if event["ph"] == "X"]
+
+
+def test_spans_are_chrome_complete_events(tmp_path):
+    path = str(tmp_path / "trace.json")
+    with tracing_session(path) as tracer:
+        with span("request", model="m"):
+            with span("validate"):
+                time.sleep(0.01)
+    assert tracing.current() is None
+    assert tracer.totals["request"][0] == 1
+
+    events = load_trace(path)
+    [lane] = [event for event in events if event["ph"] == "M"]
+    assert lane["name"] == "thread_name" and lane["args"]["name"] == threading.current_thread().name
+    validate, request = spans(events)
+    assert set(request) == {"name", "ph", "pid", "tid", "ts", "dur", "args"}
+    assert (request["name"], request["args"], request["tid"]) == ("request", {"model": "m"}, lane["tid"])
+    # The inner span ends first and lies within the outer one
+    assert request["ts"] <= validate["ts"] and validate["ts"] + validate["dur"] <= request["ts"] + request["dur"]
+    assert validate["dur"] >= 10000
+
+
+def test_every_task_and_thread_gets_its_own_lane(tmp_path):
+    path = str(tmp_path / "trace.json")
+
+    async def step(i: int):
+        with span("step", i=i):
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(asyncio.create_task(step(i), name=f"sample-{i}") for i in range(3)))
+
+    def work():
+        with span("work"):
+            pass
+
+    with tracing_session(path):
+        asyncio.run(run())
+        threads = [threading.Thread(target=work, name=f"worker-{i}") for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    events = load_trace(path)
+    names = {event["tid"]: event["args"]["name"] for event in events if event["ph"] == "M"}
+    lanes = {(event["name"], event["args"].get("i")): names[event["tid"]] for event in spans(events)}
+    assert lanes[("step", 0)] == "sample-0" and lanes[("step", 2)] == "sample-2"
+    assert sorted(names[event["tid"]] for event in spans(events) if event["name"] == "work") == ["worker-0", "worker-1"]
+    assert len(names) == 5
+
+
+def test_tags_reach_spans_of_tasks_started_under_them(tmp_path):
+    path = str(tmp_path / "trace.json")
+
+    async def sample(i: int):
+        tracing.set_tags(sample=i)
+        with span("request"):
+            pass
+
+    async def run():
+        with tags(game="tictactoe"):
+            await asyncio.gather(sample(0), sample(1))
+        with span("after"):
+            pass
+
+    with tracing_session(path):
+        asyncio.run(run())
+        with pytest.raises(KeyError):
+            with tags(game="chess"), span("failing", model="m"):
+                raise KeyError("x")
+
+    args = {(event["name"], event["args"].get("sample")): event["args"] for event in spans(load_trace(path))}
+    assert args[("request", 0)] == {"game": "tictactoe", "sample": 0}
+    assert args[("request", 1)] == {"game": "tictactoe", "sample": 1}
+    assert args[("after", None)] == {}
+    # Span arguments win over tags, and a failure is recorded on the span
+    assert args[("failing", None)] == {"game": "chess", "model": "m", "error": "KeyError"}
+
+
+def test_interrupted_trace_is_still_readable(tmp_path):
+    path = str(tmp_path / "trace.json")
+    tracer = Tracer(path)
+    for i in range(3):
+        tracer.complete("step", 1, tracer.timestamp(), tracer.timestamp(), {"i": i})
+    tracer._file.flush()
+    assert [event["args"]["i"] for event in load_trace(path)] == [0, 1, 2]
+    tracer.close()
+
+    with open(path, 'r') as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text.rstrip().rstrip("]").rstrip() + ",")
+    assert len(load_trace(path)) == 3
+
+
+def test_span_open_when_the_session_ends_is_dropped(tmp_path):
+    path = str(tmp_path / "trace.json")
+    with tracing_session(path):
+        late = span("late")
+        late.__enter__()
+        with span("done"):
+            pass
+    late.__exit__(None, None, None)
+    tracing.instant("failover")
+    assert [event["name"] for event in spans(load_trace(path))] == ["done"]
+
+
+def test_phase_table_groups_by_tag():
+    events = [
+        {"name": "request", "ph": "X", "dur": 2e6, "args": {"game": "a"}},
+        {"name": "request", "ph": "X", "dur": 1e6, "args": {"game": "b"}},
+        {"name": "thread_name", "ph": "M", "args": {"name": "main"}},
+    ]
+    assert phase_table(events).splitlines()[1].split() == ["request", "2", "3.00", "1500.00"]
+    rows = [line.split() for line in phase_table(events, "game").splitlines()[1:]]
+    assert rows == [["a", "/", "request", "1", "2.00", "2000.00"], ["b", "/", "request", "1", "1.00", "1000.00"]]
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_writes_folded_stacks(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    profiler = SamplingProfiler(interval=0.001).start()
+    worker.start()
+    time.sleep(0.2)
+    stop.set()
+    worker.join()
+    profiler.stop()
+
+    path = str(tmp_path / "profile.folded")
+    profiler.write_folded(path)
+    with open(path, 'r') as f:
+        lines = [line.rstrip("\n").rsplit(" ", 1) for line in f]
+    assert sum(int(count) for _, count in lines) == sum(profiler.stacks.values())
+    # Root first, one frame per ";", the thread name at the root
+    busy = [stack.split(";") for stack, _ in lines if stack.startswith("busy;")]
+    assert busy and any(frame.startswith("busy_loop (test_tracing.py:") for stack in busy for frame in stack)
+    assert all(stack[-1] != "busy" for stack in busy)
+    counts = [int(count) for _, count in lines]
+    assert counts == sorted(counts, reverse=True)
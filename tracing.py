@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import weakref
+import argparse
+import functools
+import threading
+import contextvars
+import contextlib
+import collections
+from typing import Callable, Dict, Optional
+
+# --- 1. Spans ---
+
+# Tags of the current game / sample / request, added to every span opened under them
+_TAGS = contextvars.ContextVar("trace_tags", default={})
+# The installed Tracer; None keeps span() down to one global lookup
+_TRACER = None
+
+
+class Tracer:
+    """
+    Records spans as Chrome trace events (the JSON array format read by chrome://tracing and ui.perfetto.dev).
+    Events are written as they end, so memory stays flat and an interrupted run still leaves a readable trace.
+    Every thread and every asyncio task gets its own lane: coroutines interleave on one thread, but the spans
+    of one task nest like those of a thread.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'w')
+        self._file.write("[")
+        self._first = True
+        self._pid = os.getpid()
+        self._origin = time.perf_counter_ns()
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._lanes_lock = threading.Lock()
+        self._task_lanes = weakref.WeakKeyDictionary()
+        self._thread_lanes = {}
+        self._lane_count = 0
+        # phase -> [count, total ns]
+        self.totals = collections.defaultdict(lambda: [0, 0])
+
+    def _write(self, event: dict):
+        line = json.dumps(event, separators=(",", ":"), default=str)
+        with self._lock:
+            # Spans still open when the session ends (a task cancelled late, a daemon thread) are dropped
+            if self._file.closed:
+                return
+            self._file.write(("\n" if self._first else ",\n") + line)
+            self._first = False
+
+    def _new_lane(self, lanes, key, name: str) -> int:
+        with self._lanes_lock:
+            if key not in lanes:
+                self._lane_count += 1
+                lanes[key] = self._lane_count
+                self._write({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": lanes[key], "args": {"name": name}})
+            return lanes[key]
+
+    def lane(self) -> int:
+        """Lane of the running asyncio task, or of the current thread outside of one."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return self._task_lanes.get(task) or self._new_lane(self._task_lanes, task, task.get_name())
+        ident = threading.get_ident()
+        return self._thread_lanes.get(ident) or self._new_lane(self._thread_lanes, ident, threading.current_thread().name)
+
+    def timestamp(self) -> int:
+        return time.perf_counter_ns()
+
+    def complete(self, name: str, lane: int, start_ns: int, end_ns: int, args: dict):
+        with self._lock:
+            total = self.totals[name]
+            total[0] += 1
+            total[1] += end_ns - start_ns
+        self._write({
+            "name": name, "ph": "X", "pid": self._pid, "tid": lane,
+            "ts": (start_ns - self._origin) / 1000, "dur": (end_ns - start_ns) / 1000, "args": args
+        })
+
+    def instant(self, name: str, args: dict):
+        self._write({"name": name, "ph": "i", "s": "t", "pid": self._pid, "tid": self.lane(), "ts": (self.timestamp() - self._origin) / 1000, "args": args})
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write("\n]\n")
+                self._file.close()
+
+    def summary(self) -> str:
+        """Time per phase. Phases nest and overlap across tasks, so the shares are of summed span time, not of the wall."""
+        wall = time.monotonic() - self._started
+        busy = sum(ns for _, ns in self.totals.values()) or 1
+        lines = [f"🧵 Trace: {wall:.1f}s wall, written to {self.path}"]
+        for name, (count, ns) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"   {name:<16} {count:>7} spans {ns / 1e9:>10.2f}s  {ns / busy:>6.1%}  mean {ns / count / 1e6:.2f}ms")
+        return "\n".join(lines)
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "lane", "start")
+
+    def __init__(self, tracer: Tracer, name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.lane = self.tracer.lane()
+        self.start = self.tracer.timestamp()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        args = {**_TAGS.get(), **self.args}
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+        self.tracer.complete(self.name, self.lane, self.start, self.tracer.timestamp(), args)
+        return False
+
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def install(tracer: Optional[Tracer]):
+    """Makes `tracer` receive every span; None switches tracing off."""
+    global _TRACER
+    _TRACER = tracer
+
+
+def current() -> Optional[Tracer]:
+    return _TRACER
+
+
+def span(name: str, **args):
+    """Context manager timing one phase, e.g. `with span("validate", model="X"):`. A no-op while no tracer is installed."""
+    if _TRACER is None:
+        return _NO_SPAN
+    return _Span(_TRACER, name, args)
+
+
+def instant(name: str, **args):
+    """A point event, e.g. a failover or a circuit opening."""
+    if _TRACER is not None:
+        _TRACER.instant(name, {**_TAGS.get(), **args})
+
+
+@contextlib.contextmanager
+def tags(**values):
+    """Adds tags (game, sample, ...) to every span opened inside the block, including in tasks it starts."""
+    token = _TAGS.set({**_TAGS.get(), **values})
+    try:
+        yield
+    finally:
+        _TAGS.reset(token)
+
+
+def set_tags(**values):
+    """Sets tags for the rest of the current task or thread, like set_request_context does for the request context."""
+    _TAGS.set({**_TAGS.get(), **values})
+
+
+def traced(name: str) -> Callable:
+    """Decorator running a (sync) function inside a span."""
+    def decorate(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- 2. Sampling Profiler ---
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of every thread at a fixed interval from a daemon thread and counts identical stacks.
+    Writes them in the folded format ("a;b;c 12" per line) read by speedscope, flamegraph.pl and inferno.
+    Coroutines show up under the event loop thread that runs them. Overhead is one stack walk per thread and sample.
+    """
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_folded(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_functions(self, n: int = 10) -> Dict[str, int]:
+        """Samples with each function on top of the stack, most frequent first."""
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return dict(leaves.most_common(n))
+
+    def summary(self) -> str:
+        lines = [f"🔥 Profile: {self.samples} samples every {self.interval * 1000:g}ms, top of stack:"]
+        total = sum(self.stacks.values()) or 1
+        for function, count in self.top_functions().items():
+            lines.append(f"   {count / total:>6.1%}  {function}")
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def tracing_session(trace_path: Optional[str] = None, profile_path: Optional[str] = None, profile_interval: float = 0.005):
+    """Installs a tracer and/or a sampling profiler for the duration of the block and writes their output at the end."""
+    tracer = Tracer(trace_path) if trace_path else None
+    profiler = SamplingProfiler(profile_interval).start() if profile_path else None
+    install(tracer)
+    try:
+        yield tracer
+    finally:
+        install(None)
+        if tracer is not None:
+            tracer.close()
+            print(tracer.summary())
+        if profiler is not None:
+            profiler.stop()
+            profiler.write_folded(profile_path)
+            print(profiler.summary())
+            print(f"🔥 Folded stacks written to {profile_path}")
+
+
+# --- 3. Trace Summary ---
+
+def load_trace(path: str) -> list:
+    """Events of a trace file, also one cut off by an interrupted run."""
+    with open(path, 'r') as f:
+        text = f.read().rstrip()
+    if not text.endswith("]"):
+        text = text.rstrip(",") + "]"
+    return json.loads(text)
+
+
+def phase_table(events: list, group_by: Optional[str] = None) -> str:
+    """Summed span time per phase, optionally split by a tag such as game."""
+    totals = collections.defaultdict(lambda: [0, 0.0])
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        key = event["name"] if group_by is None else f"{event.get('args', {}).get(group_by)} / {event['name']}"
+        totals[key][0] += 1
+        totals[key][1] += event["dur"] / 1e6
+    lines = [f"{'phase':<40} {'spans':>7} {'total s':>10} {'mean ms':>9}"]
+    for key, (count, seconds) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{key:<40} {count:>7} {seconds:>10.2f} {seconds / count * 1000:>9.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a trace written with --trace")
+    parser.add_argument("trace", type=str, help="Trace JSON file")
+    parser.add_argument("--group_by", type=str, help="Split phases by a tag, e.g. game or provider")
+    args = parser.parse_args()
+    print(phase_table(load_trace(args.trace), args.group_by))
+
+
+if __name__ == "__main__":
+    main()